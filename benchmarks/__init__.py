@@ -0,0 +1,12 @@
+"""Benchmarks and load tests for the Verleih database.
+
+- daten.py: synthetic test databases with realistic loans
+- suite.py: the app's hot paths at several sizes, compared with baseline.json
+- index_benchmark.py: lookups before and after the index migration
+- last_test.py: many branches against the server and the shared file
+- stress_test.py: many processes lending the same bottles from the shared file
+- sicherung_test.py: backup and restore of a large database while branches lend
+
+Every module runs as a script from the repository root, e.g.
+``python benchmarks/suite.py``.
+"""
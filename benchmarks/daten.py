@@ -0,0 +1,168 @@
+"""Fill a Verleih database with synthetic but realistic loans.
+
+    python benchmarks/daten.py test.db [--flaschen 100000] [--jahre 3] [--rueckgabequote 0.9] [--seed 1]
+
+The database is created with init_db() and filled through
+Datenbank.vorgaenge_importieren(), so it has the real schema, triggers,
+counters and event log. ``--flaschen`` counts lent bottles (verleih rows).
+
+- Customers: about one per 20 bottles, a few large ones and a long tail.
+- Deliveries: one to ten bottles, mostly one or two.
+- Branches, sizes, pressures and suppliers are weighted as in the shops.
+- Loans are spread evenly over the last ``--jahre`` years.
+- Bottles are reused: a returned bottle goes back to the shelf of its
+  branch, size and pressure and is lent again later under the same number.
+- Bottles lent before the last 60 days are back with probability
+  ``--rueckgabequote``; younger loans are back less often.
+
+The same seed gives the same database.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verleih_db import DRUECKE, FILIALEN, GROESSEN, LIEFERANTEN, Datenbank, Verleihvorgang, init_db
+
+FILIALE_GEWICHT = [35, 20, 15, 15, 15]
+GROESSE_GEWICHT = [25, 30, 45]
+DRUCK_GEWICHT = [70, 30]
+LIEFERANT_GEWICHT = [50, 30, 20]
+FLASCHEN_JE_VORGANG = {1: 45, 2: 25, 3: 12, 4: 8, 5: 4, 6: 3, 8: 2, 10: 1}
+FLASCHEN_JE_KUNDE = 20
+# Loans younger than this are less likely to be back already.
+RUECKGABE_TAGE = 60
+# Share of its own stock a cell keeps on the shelf on top of what is out.
+RESERVE = 0.3
+
+NACHNAMEN = [
+    "Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker", "Schulz", "Hoffmann",
+    "Schäfer", "Koch", "Bauer", "Richter", "Klein", "Wolf", "Schröder", "Neumann", "Schwarz", "Zimmermann",
+]
+BRANCHEN = ["Schweißtechnik", "Getränke", "Metallbau", "Installateur", "Labor", "Gastro", "Bau", "Kfz"]
+RECHTSFORMEN = ["GmbH", "KG", "e.K.", "GmbH & Co. KG", ""]
+STRASSEN = ["Hauptstraße", "Bahnhofstraße", "Industriestraße", "Gewerbepark", "Am Hafen", "Lindenweg"]
+ORTE = ["90402 Nürnberg", "97070 Würzburg", "81825 München", "80995 München", "91052 Erlangen", "90762 Fürth"]
+
+
+def _kunden(rnd, anzahl):
+    kunden = []
+    for i in range(anzahl):
+        nachname = rnd.choice(NACHNAMEN)
+        name = f"{nachname} {rnd.choice(BRANCHEN)} {rnd.choice(RECHTSFORMEN)}".strip()
+        kunden.append((
+            f"{name} {i}", f"0{rnd.randint(800, 999)} {rnd.randint(100000, 9999999)}",
+            f"{rnd.choice(STRASSEN)} {rnd.randint(1, 120)}, {rnd.choice(ORTE)}",
+            f"{rnd.choice(['Herr', 'Frau'])} {rnd.choice(NACHNAMEN)}",
+        ))
+    # Zipf-like: the first customers take most of the bottles. Cumulative,
+    # or choices() would add them up again on every call.
+    return kunden, list(itertools.accumulate(1 / (rang + 1) ** 0.8 for rang in range(anzahl)))
+
+
+def vorgaenge(flaschen, jahre=3, rueckgabequote=0.9, seed=1, jetzt=None):
+    """Yield Verleihvorgang tuples in loan order until ``flaschen`` bottles are lent."""
+    rnd = random.Random(seed)
+    jetzt = jetzt or datetime.now().replace(microsecond=0)
+    beginn = jetzt - timedelta(days=365 * jahre)
+    kunden, kunden_gewichte = _kunden(rnd, max(flaschen // FLASCHEN_JE_KUNDE, 10))
+    groessen = list(FLASCHEN_JE_VORGANG)
+    groessen_gewichte = list(FLASCHEN_JE_VORGANG.values())
+    spanne = (jetzt - beginn).total_seconds()
+    # Bottles on the shelf per cell, and (zurueck_am, zelle, nummer) of
+    # returned bottles that are still with the customer at ``zeit``.
+    frei = {}
+    unterwegs = []
+    naechste_nummer = 0
+    bisher = 0
+    referenz = 0
+    while bisher < flaschen:
+        anzahl = min(rnd.choices(groessen, groessen_gewichte)[0], flaschen - bisher)
+        # Somewhere in this delivery's share of the time span, so the loans
+        # stay in order and end before ``jetzt``.
+        zeit = beginn + timedelta(seconds=spanne * (bisher + rnd.random() * anzahl) / flaschen)
+        while unterwegs and unterwegs[0][0] <= zeit:
+            _, zelle, nummer = heapq.heappop(unterwegs)
+            frei[zelle].append(nummer)
+        zelle = (
+            rnd.choices(FILIALEN, FILIALE_GEWICHT)[0], rnd.choices(GROESSEN, GROESSE_GEWICHT)[0],
+            rnd.choices(DRUECKE, DRUCK_GEWICHT)[0],
+        )
+        pool = frei.setdefault(zelle, [])
+        nummern = []
+        for _ in range(anzahl):
+            if pool:
+                i = rnd.randrange(len(pool))
+                pool[i], pool[-1] = pool[-1], pool[i]
+                nummern.append(pool.pop())
+            else:
+                naechste_nummer += 1
+                nummern.append(f"{zelle[0][0]}{naechste_nummer:07d}")
+        alter = (jetzt - zeit).days
+        quote = rueckgabequote * min(alter / RUECKGABE_TAGE, 1)
+        zurueck = set()
+        for nummer in nummern:
+            if rnd.random() < quote:
+                zurueck.add(nummer)
+                # Back after a few days to a few months.
+                dauer = timedelta(days=rnd.lognormvariate(3, 0.8))
+                heapq.heappush(unterwegs, (min(zeit + dauer, jetzt), zelle, nummer))
+        kunde = rnd.choices(kunden, cum_weights=kunden_gewichte)[0]
+        referenz += 1
+        filiale, groesse, druck = zelle
+        yield Verleihvorgang(
+            *kunde, f"L{zeit:%y%m}-{referenz}", groesse, druck, rnd.choices(LIEFERANTEN, LIEFERANT_GEWICHT)[0],
+            filiale, f"{zeit:%Y-%m-%d %H:%M:%S}", tuple(nummern), frozenset(zurueck),
+        )
+        bisher += anzahl
+
+
+def erzeugen(db_path, flaschen, jahre=3, rueckgabequote=0.9, seed=1, blockgroesse=50_000):
+    """Create ``db_path`` and fill it with ``flaschen`` lent bottles; returns the open bottles."""
+    init_db(db_path)
+    db = Datenbank(db_path)
+    try:
+        block, im_block = [], 0
+        for v in vorgaenge(flaschen, jahre, rueckgabequote, seed):
+            block.append(v)
+            im_block += len(v.flaschennummern)
+            if im_block >= blockgroesse:
+                db.vorgaenge_importieren(block)
+                block, im_block = [], 0
+        if block:
+            db.vorgaenge_importieren(block)
+        offen = 0
+        for _, filiale, groesse, druck, _, verliehen, _ in db.bestand_liste():
+            # Enough stock on the shelf that no cell is overdrawn.
+            db.bestand_setzen(filiale, groesse, druck, int(verliehen * RESERVE) + 10)
+            offen += verliehen
+    finally:
+        db.close()
+    return offen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db")
+    parser.add_argument("--flaschen", type=int, default=100_000)
+    parser.add_argument("--jahre", type=float, default=3)
+    parser.add_argument("--rueckgabequote", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} existiert bereits")
+
+    start = time.perf_counter()
+    offen = erzeugen(args.db, args.flaschen, args.jahre, args.rueckgabequote, args.seed)
+    print(f"{args.flaschen} Flaschen, davon {offen} offen, in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
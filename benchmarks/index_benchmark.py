@@ -0,0 +1,106 @@
+"""Lookup latency on the verleih/bestand tables before and after the index migration.
+
+    python benchmarks/index_benchmark.py [--zeilen 10000 100000 1000000]
+
+For every row count a temporary database is filled at schema version 1 (the
+original, unindexed tables), the hot lookups are timed, the database is
+migrated to the current version and the same lookups are timed again.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verleih_schema import SCHEMA_VERSION, migrate
+
+FILIALEN = ["Zentrale", "Nürnberg", "Würzburg", "Trudering", "Moosach"]
+GROESSEN = ["10l", "20l", "50l"]
+DRUECKE = ["200 bar", "300 bar"]
+
+
+def fuellen(conn, zeilen):
+    flaschen = max(zeilen // 5, 1)
+    aktiv_ab = zeilen - flaschen
+
+    def rows():
+        for i in range(zeilen):
+            status = "verliehen" if i >= aktiv_ab and i % 10 == 0 else "zurückgegeben"
+            yield (
+                f"Kunde {i % 5000}", "0911 123456", "Hauptstraße 1", "Herr Muster", f"R{i // 3}",
+                f"F{i % flaschen:07d}", GROESSEN[i % 3], DRUECKE[i % 2], "Linde", FILIALEN[i % 5],
+                1, f"2024-01-01 00:00:{i:09d}", status,
+            )
+
+    conn.executemany("""
+        INSERT INTO verleih (
+            name, telefon, adresse, ansprechpartner, referenznummer,
+            flaschennummer, flaschengroesse, flaschendruck,
+            flasche_von, filiale, anzahl, verliehen_am, status
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows())
+    for f in FILIALEN:
+        for g in GROESSEN:
+            for d in DRUECKE:
+                conn.execute(
+                    "INSERT INTO bestand (filiale, flaschengroesse, flaschendruck, bestand) VALUES (?, ?, ?, 0)",
+                    (f, g, d),
+                )
+    conn.commit()
+    return flaschen
+
+
+def messen(conn, flaschen, wiederholungen):
+    rnd = random.Random(1)
+    nummern = [f"F{rnd.randrange(flaschen):07d}" for _ in range(wiederholungen)]
+    abfragen = {
+        "flaschennummer =": lambda n: conn.execute(
+            "SELECT filiale, flaschengroesse, flaschendruck FROM verleih WHERE flaschennummer=?", (n,)
+        ).fetchall(),
+        "flaschennummer IN (10)": lambda n: conn.execute(
+            f"SELECT flaschennummer FROM verleih WHERE flaschennummer IN ({','.join('?' * 10)}) AND status = 'verliehen'",
+            [n] + nummern[:9],
+        ).fetchall(),
+        "bestand (filiale, groesse, druck)": lambda n: conn.execute(
+            "SELECT bestand FROM bestand WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?",
+            ("Moosach", "50l", "300 bar"),
+        ).fetchall(),
+    }
+    ergebnis = {}
+    for name, abfrage in abfragen.items():
+        zeiten = []
+        for n in nummern:
+            start = time.perf_counter()
+            abfrage(n)
+            zeiten.append(time.perf_counter() - start)
+        ergebnis[name] = statistics.median(zeiten) * 1000
+    return ergebnis
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--zeilen", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--wiederholungen", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'Zeilen':>10}  {'Abfrage':<36}{'vorher ms':>12}{'nachher ms':>12}")
+    for zeilen in args.zeilen:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+            migrate(conn, ziel=1)
+            flaschen = fuellen(conn, zeilen)
+            vorher = messen(conn, flaschen, args.wiederholungen)
+            migrate(conn, ziel=SCHEMA_VERSION)
+            nachher = messen(conn, flaschen, args.wiederholungen)
+            conn.close()
+        for name in vorher:
+            print(f"{zeilen:>10}  {name:<36}{vorher[name]:>12.3f}{nachher[name]:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Throughput of N simulated branches against verleih_server.py and against the shared file.
+
+    python benchmarks/last_test.py [--filialen 1 5 20] [--sekunden 10] [--vorbelegung 100000]
+
+Every branch is its own process and runs the counter's mix in a loop: loans
+of one to four new bottles, returns of its own bottles, a page of the open
+list, a search and the change poll. In ``server`` mode all branches talk to
+one verleih_server.py over HTTP; in ``datei`` mode each opens the SQLite file
+itself, as every Tk app did before. The table shows operations and writes
+per second, latency percentiles, errors and, for the server, how many
+writes shared one commit.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verleih_client import VerleihClient
+from verleih_db import DRUECKE, FILIALEN, GROESSEN, Datenbank, FlaschenBereitsVerliehen, Verleihvorgang, init_db
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "verleih_server.py")
+MISCHUNG = {"verleihen": 20, "zurueckgeben": 15, "seite": 40, "suche": 10, "aenderungen": 15}
+SCHREIBEND = {"verleihen", "zurueckgeben"}
+SUCHBEGRIFFE = ["Kunde 1", "Hauptstraße", "R12", "Muster", "F00042"]
+
+
+def vorbelegen(db_path, flaschen):
+    init_db(db_path)
+    db = Datenbank(db_path)
+    jetzt = time.time()
+    vorgaenge = [
+        Verleihvorgang(
+            f"Kunde {i % 5000}", "0911 123456", "Hauptstraße 1", "Herr Muster", f"R{i}",
+            GROESSEN[i % 3], DRUECKE[i % 2], "Linde", FILIALEN[i % 5],
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(jetzt - (flaschen - i) * 60)),
+            (f"F{i:07d}",), frozenset() if i % 10 == 0 else frozenset({f"F{i:07d}"}),
+        )
+        for i in range(flaschen)
+    ]
+    db.vorgaenge_importieren(vorgaenge)
+    db.close()
+
+
+def filiale(modus, ziel, nummer, start, sekunden):
+    db = VerleihClient(ziel) if modus == "server" else Datenbank(ziel)
+    rnd = random.Random(nummer)
+    name = FILIALEN[nummer % len(FILIALEN)]
+    draussen, naechste = [], 0
+    cursor = db.aenderung_stand()[1]
+    zeiten = collections.defaultdict(list)
+    fehler = collections.Counter()
+    ops = list(MISCHUNG)
+    gewichte = list(MISCHUNG.values())
+    time.sleep(max(start - time.time(), 0))
+    ende = time.perf_counter() + sekunden
+    while time.perf_counter() < ende:
+        op = rnd.choices(ops, gewichte)[0]
+        if op == "zurueckgeben" and not draussen:
+            op = "verleihen"
+        t0 = time.perf_counter()
+        try:
+            if op == "verleihen":
+                flaschen = [f"L{nummer}-{naechste + i}" for i in range(rnd.randint(1, 4))]
+                naechste += len(flaschen)
+                db.verleih_anlegen(
+                    [f"Kunde {rnd.randrange(5000)}", "0911 123456", "Hauptstraße 1", "Herr Muster", f"L{naechste}"],
+                    rnd.choice(GROESSEN), rnd.choice(DRUECKE), "Linde", name, flaschen,
+                )
+                draussen.append(flaschen)
+            elif op == "zurueckgeben":
+                db.zurueckgeben(draussen.pop(rnd.randrange(len(draussen))))
+            elif op == "seite":
+                db.verleihvorgaenge(limit=200, status="verliehen")
+            elif op == "suche":
+                db.verleihvorgaenge(limit=200, suche=rnd.choice(SUCHBEGRIFFE))
+            else:
+                aenderungen = db.aenderungen(cursor)
+                if aenderungen is not None:
+                    cursor = aenderungen[0]
+        except FlaschenBereitsVerliehen:
+            fehler["bereits verliehen"] += 1
+            continue
+        except Exception as e:
+            fehler[type(e).__name__ + ": " + str(e)[:40]] += 1
+            continue
+        zeiten[op].append(time.perf_counter() - t0)
+    db.close()
+    return dict(zeiten), fehler
+
+
+def freier_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_starten(db_path):
+    port = freier_port()
+    prozess = subprocess.Popen(
+        [sys.executable, SERVER, "--db", db_path, "--port", str(port)], stdout=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            VerleihClient(url).close()
+            return prozess, url
+        except OSError:
+            time.sleep(0.1)
+    prozess.kill()
+    raise RuntimeError("Server startet nicht")
+
+
+def lauf(modus, db_path, anzahl, sekunden):
+    prozess, ziel = server_starten(db_path) if modus == "server" else (None, db_path)
+    try:
+        start = time.time() + 1
+        with multiprocessing.Pool(anzahl) as pool:
+            ergebnisse = pool.starmap(filiale, [(modus, ziel, i, start, sekunden) for i in range(anzahl)])
+        gruppe = ""
+        if prozess is not None:
+            status = VerleihClient(ziel)._anfrage("GET", "/status")
+            gruppe = f"{status['schreibvorgaenge'] / max(status['gruppen'], 1):.1f}"
+    finally:
+        if prozess is not None:
+            prozess.terminate()
+            prozess.wait()
+    zeiten = collections.defaultdict(list)
+    fehler = collections.Counter()
+    for z, f in ergebnisse:
+        for op, werte in z.items():
+            zeiten[op].extend(werte)
+        fehler.update(f)
+    alle = sorted(t for werte in zeiten.values() for t in werte)
+    schreib = sum(len(zeiten[op]) for op in SCHREIBEND)
+    p = lambda q: alle[int(q * (len(alle) - 1))] * 1000 if alle else float("nan")
+    print(
+        f"{modus:<7}{anzahl:>9}{len(alle) / sekunden:>10.0f}{schreib / sekunden:>10.0f}"
+        f"{p(0.5):>9.1f}{p(0.95):>9.1f}{p(0.99):>9.1f}{sum(fehler.values()):>8}{gruppe:>8}"
+    )
+    for grund, n in fehler.most_common(3):
+        print(f"{'':<16}{n} × {grund}")
+    if zeiten["verleihen"]:
+        print(f"{'':<16}Verleihen median {statistics.median(zeiten['verleihen']) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filialen", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--sekunden", type=float, default=10)
+    parser.add_argument("--vorbelegung", type=int, default=100_000, help="Flaschen in der Datenbank vor dem Lauf")
+    parser.add_argument("--modus", choices=["server", "datei", "beide"], default="beide")
+    args = parser.parse_args()
+
+    modi = ["server", "datei"] if args.modus == "beide" else [args.modus]
+    print(f"{'modus':<7}{'filialen':>9}{'ops/s':>10}{'schreib/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'fehler':>8}{'gruppe':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        vorlage = os.path.join(tmp, "vorlage.db")
+        vorbelegen(vorlage, args.vorbelegung)
+        for anzahl in args.filialen:
+            for modus in modi:
+                # Every run starts from the same data.
+                db_path = os.path.join(tmp, f"{modus}-{anzahl}.db")
+                with open(vorlage, "rb") as quelle, open(db_path, "wb") as kopie:
+                    kopie.write(quelle.read())
+                lauf(modus, db_path, anzahl, args.sekunden)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Back up a large database while branches keep lending, then restore it.
+
+    python benchmarks/sicherung_test.py [DB] [--flaschen 1000000] [--schreiber 4] [--vorlauf 5] [--wiederherstellen]
+
+Without DB a database with --flaschen lent bottles is generated first (see
+daten.py), in a temporary directory. A given DB is changed: the writers lend
+bottles in it and the backups land next to it.
+
+Every writer is its own process on the shared file and lends one new bottle
+after another, or returns one it lent. After --vorlauf seconds the backup
+starts on a connection of its own, as the server's backup thread does;
+with --wiederherstellen the backup is then restored while the writers go on.
+The table shows the writes per second and their latency in each phase; the
+copy should not slow the writers down, the check only shares the disk and
+the CPU with them, and during the restore they wait for the write lock.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.daten import erzeugen
+from verleih_db import DRUECKE, FILIALEN, GROESSEN, Datenbank, archiv_pfad, init_db
+
+RUECKGABE_ANTEIL = 0.4
+NACHLAUF = 3
+
+
+def schreiber(db_path, nummer, ende):
+    db = Datenbank(db_path)
+    rnd = random.Random(nummer)
+    eigene = []
+    schreibvorgaenge = []
+    fehler = collections.Counter()
+    i = 0
+    while not ende.is_set():
+        start = time.time()
+        try:
+            if eigene and rnd.random() < RUECKGABE_ANTEIL:
+                db.zurueckgeben(eigene.pop(rnd.randrange(len(eigene))))
+            else:
+                i += 1
+                nummern = [f"B{nummer}-{i}"]
+                db.verleih_anlegen(
+                    [f"Kunde {nummer}", "0911 123456", "Hauptstraße 1", "Herr Muster", f"B{nummer}"],
+                    GROESSEN[0], DRUECKE[0], "Linde", FILIALEN[nummer % len(FILIALEN)], nummern,
+                )
+                eigene.append(nummern)
+        except Exception as e:
+            fehler[f"{type(e).__name__}: {e}"] += 1
+            continue
+        schreibvorgaenge.append((start, (time.time() - start) * 1000))
+    db.close()
+    return schreibvorgaenge, fehler
+
+
+def _mib(pfad):
+    return os.path.getsize(pfad) / 2**20 if os.path.exists(pfad) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db", nargs="?")
+    parser.add_argument("--flaschen", type=int, default=1_000_000, help="Größe der erzeugten Datenbank")
+    parser.add_argument("--schreiber", type=int, default=4, help="Prozesse, die währenddessen verleihen")
+    parser.add_argument("--vorlauf", type=float, default=5, help="Sekunden Schreiben vor der Sicherung")
+    parser.add_argument("--wiederherstellen", action="store_true", help="die Sicherung danach zurückspielen")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if db_path is None:
+            db_path = os.path.join(tmp, "sicherung.db")
+            start = time.perf_counter()
+            erzeugen(db_path, args.flaschen)
+            print(f"{args.flaschen} Flaschen erzeugt in {time.perf_counter() - start:.0f} s")
+        init_db(db_path)
+        print(f"Datenbank {_mib(db_path):.0f} MiB, Archiv {_mib(archiv_pfad(db_path)):.0f} MiB")
+
+        phasen = []
+        with multiprocessing.Manager() as manager, multiprocessing.Pool(args.schreiber) as pool:
+            ende = manager.Event()
+            laeufe = pool.starmap_async(schreiber, [(db_path, i, ende) for i in range(args.schreiber)])
+            beginn = time.time()
+            time.sleep(args.vorlauf)
+            phasen.append(("vorher", beginn, time.time()))
+            db = Datenbank(db_path)
+            start = time.time()
+            eintrag = db.sichern(behalten=None)
+            kopiert = start + eintrag["sekunden"]
+            phasen.append(("Kopie", start, kopiert))
+            phasen.append(("Prüfung", kopiert, time.time()))
+            if args.wiederherstellen:
+                time.sleep(NACHLAUF)
+                start = time.time()
+                vorher = db.wiederherstellen(eintrag["name"])
+                gesichert = start + vorher["sekunden"] + vorher["pruefung_sekunden"]
+                phasen.append(("Sicherung davor", start, gesichert))
+                phasen.append(("Zurückspielen", gesichert, time.time()))
+            start = time.time()
+            time.sleep(NACHLAUF)
+            phasen.append(("nachher", start, time.time()))
+            db.close()
+            ende.set()
+            ergebnisse = laeufe.get()
+
+    schreibvorgaenge = sorted(s for ergebnis, _ in ergebnisse for s in ergebnis)
+    fehler = collections.Counter()
+    for _, f in ergebnisse:
+        fehler.update(f)
+    mib = eintrag["groesse"] / 2**20
+    sekunden = eintrag["sekunden"]
+    print(
+        f"Sicherung {mib:.0f} MiB: Kopie {sekunden:.1f} s ({mib / max(sekunden, 0.01):.0f} MiB/s), "
+        f"integrity_check {eintrag['pruefung_sekunden']:.1f} s, Archiv {'kopiert' if eintrag['archiv'] else 'keins'}"
+    )
+    print(f"{'Phase':<17}{'Sekunden':>9}{'schreib/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, von, bis in phasen:
+        latenzen = [ms for zeit, ms in schreibvorgaenge if von <= zeit < bis]
+        if not latenzen:
+            print(f"{name:<17}{bis - von:>9.1f}{0:>11}")
+            continue
+        p99 = statistics.quantiles(latenzen, n=100)[98] if len(latenzen) > 1 else latenzen[0]
+        print(
+            f"{name:<17}{bis - von:>9.1f}{len(latenzen) / (bis - von):>11.0f}{statistics.median(latenzen):>9.1f}"
+            f"{p99:>9.1f}{max(latenzen):>9.1f}"
+        )
+    print(f"Fehler: {sum(fehler.values())}")
+    for grund, n in fehler.most_common(3):
+        print(f"    {n} × {grund}")
+    return 1 if fehler else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
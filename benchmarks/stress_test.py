@@ -0,0 +1,126 @@
+"""Many processes lending the same bottles from the shared file at once.
+
+    python benchmarks/stress_test.py [--schreiber 12] [--sekunden 20] [--flaschen 200]
+
+Every writer is its own process with its own connection, as every Tk app on
+a shared file is, and as fast as it can lends one to three bottles drawn
+from one small common pool, or returns bottles it lent itself. With so few
+bottles most loans collide with another writer's, which is the race the
+write lock has to settle. Afterwards the event log is checked for a bottle
+that was lent again before it came back, and the stock counters against the
+loans.
+
+The table shows the writes and the rejected loans of every second. The exit
+status is 1 on a double loan, a wrong counter or any error other than
+"bereits verliehen", such as "database is locked".
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verleih_db import DRUECKE, FILIALEN, GROESSEN, Datenbank, FlaschenBereitsVerliehen, init_db
+from verleih_schema import ENTFERNT, VERLIEHEN, ZURUECK_OHNE_ZEIT, ZURUECKGEGEBEN
+
+RUECKGABE_ANTEIL = 0.4
+# Events per bottle in log order; a running count of 2 means the bottle was
+# lent while it was out.
+SQL_DOPPELT = f"""
+    SELECT COUNT(*) FROM (
+        SELECT SUM(CASE ereignis.art WHEN {VERLIEHEN} THEN 1 ELSE -1 END)
+                   OVER (PARTITION BY verleih_position.flasche_id ORDER BY ereignis.seq) AS draussen
+        FROM ereignis JOIN verleih_position ON verleih_position.id = ereignis.position_id
+        WHERE ereignis.art IN ({VERLIEHEN}, {ZURUECKGEGEBEN}, {ZURUECK_OHNE_ZEIT}, {ENTFERNT})
+    )
+    WHERE draussen > 1
+"""
+
+
+def schreiber(db_path, nummer, start, sekunden, flaschen):
+    db = Datenbank(db_path)
+    rnd = random.Random(nummer)
+    nummern = [f"S{i:05d}" for i in range(flaschen)]
+    eigene = []
+    geschrieben = collections.Counter()
+    abgelehnt = collections.Counter()
+    fehler = collections.Counter()
+    time.sleep(max(start - time.time(), 0))
+    beginn = time.perf_counter()
+    while (jetzt := time.perf_counter()) < beginn + sekunden:
+        sekunde = int(jetzt - beginn)
+        try:
+            if eigene and rnd.random() < RUECKGABE_ANTEIL:
+                db.zurueckgeben(eigene.pop(rnd.randrange(len(eigene))))
+            else:
+                auswahl = rnd.sample(nummern, rnd.randint(1, 3))
+                db.verleih_anlegen(
+                    [f"Kunde {nummer}", "0911 123456", "Hauptstraße 1", "Herr Muster", f"S{nummer}"],
+                    GROESSEN[0], DRUECKE[0], "Linde", FILIALEN[nummer % len(FILIALEN)], auswahl,
+                )
+                eigene.append(auswahl)
+        except FlaschenBereitsVerliehen:
+            abgelehnt[sekunde] += 1
+            continue
+        except Exception as e:
+            fehler[f"{type(e).__name__}: {e}"] += 1
+            continue
+        geschrieben[sekunde] += 1
+    belegt = db.belegt
+    db.close()
+    return geschrieben, abgelehnt, fehler, belegt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schreiber", type=int, default=12, help="Prozesse, die gleichzeitig schreiben")
+    parser.add_argument("--sekunden", type=int, default=20)
+    parser.add_argument("--flaschen", type=int, default=200, help="Flaschen, um die sich alle streiten")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stress.db")
+        init_db(db_path)
+        start = time.time() + 1
+        with multiprocessing.Pool(args.schreiber) as pool:
+            ergebnisse = pool.starmap(schreiber, [
+                (db_path, i, start, args.sekunden, args.flaschen) for i in range(args.schreiber)
+            ])
+        db = Datenbank(db_path)
+        doppelt = db.conn.execute(SQL_DOPPELT).fetchone()[0]
+        abweichungen = db.bestand_pruefen()
+        db.close()
+
+    geschrieben, abgelehnt, fehler = collections.Counter(), collections.Counter(), collections.Counter()
+    belegt = 0
+    for g, a, f, b in ergebnisse:
+        geschrieben.update(g)
+        abgelehnt.update(a)
+        fehler.update(f)
+        belegt += b
+    print(f"{'sekunde':>8}{'schreib/s':>11}{'abgelehnt/s':>13}")
+    for sekunde in range(args.sekunden):
+        print(f"{sekunde:>8}{geschrieben[sekunde]:>11}{abgelehnt[sekunde]:>13}")
+    # The first and the last second are cut short by the start of the
+    # processes and by the end of the run.
+    werte = [geschrieben[sekunde] for sekunde in range(1, args.sekunden - 1)] or [geschrieben[0]]
+    mittel = statistics.mean(werte)
+    streuung = statistics.pstdev(werte) / mittel if mittel else float("nan")
+    print(
+        f"{args.schreiber} Schreiber: {mittel:.0f} Schreibvorgänge/s (min {min(werte)}, Streuung {streuung:.0%}), "
+        f"{sum(abgelehnt.values())} abgelehnt, {belegt} × Schreibsperre belegt"
+    )
+    print(f"Doppelt verliehen: {doppelt}, Zählerabweichungen: {len(abweichungen)}, Fehler: {sum(fehler.values())}")
+    for grund, n in fehler.most_common(3):
+        print(f"    {n} × {grund}")
+    return 1 if doppelt or abweichungen or fehler else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+"""Time the hot paths of the Tk app on synthetic databases and compare with a baseline.
+
+    python benchmarks/suite.py [--flaschen 10000 100000 1000000] [--ausgabe ergebnis.json]
+                               [--baseline benchmarks/baseline.json] [--baseline-schreiben]
+
+For every size a database is generated with benchmarks/daten.py (kept in
+``--cache`` if given, then copied for each run) and these paths are timed
+through the same objects the app uses:
+
+- refresh_all: change cursor, first page of both lists, stock table
+- filter_tree: search for customer, bottle and reference, and the
+  "nur nicht zurückgegeben" filter, each followed by its first page
+- verleihen_pruefung: the check for bottles that are already out
+- verleihen: a whole delivery of two new bottles
+- mark_returned: returning the bottles of one open delivery
+- show_details: the details of one delivery on a cache miss
+- start_fenster, start_bereit: only with a real tree (see below), the Tk
+  app itself started on the database until its window is drawn and until
+  its register of the bottles out is loaded. The window must not wait for
+  the data, so start_fenster has to stay flat as the database grows.
+
+The lists are real ``VirtualTreeview`` objects. They are drawn into a
+``ttk.Treeview`` in a hidden window if a display is available (or with
+``--tk``, e.g. under ``xvfb-run``) and into a stand-in tree otherwise, so the
+suite also runs on machines without a display.
+
+Results are written as JSON with the fastest, median and 95th percentile
+time of every path. Paths whose fastest time is more than ``--toleranz``
+slower than in the baseline are reported as regressions and make the exit
+status 1; the fastest time is used because noise from other processes only
+ever adds to it. Baselines are only comparable on the same machine and tree
+mode; ``kalibrierung_ms`` in the metadata helps to tell a slower machine
+from slower code. A baseline recorded at another schema version is not
+compared at all and has to be recorded again.
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.daten import erzeugen
+from verleih_db import Datenbank
+from verleih_schema import SCHEMA_VERSION
+from virtual_tree import VirtualTreeview
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TOLERANZ = 0.25
+# Differences below this are noise, however large the factor.
+MINDESTENS_MS = 0.2
+SEITENGROESSE = 200
+# App starts per size; each one loads the first pages and the register.
+START_WIEDERHOLUNGEN = 5
+
+
+class BaumAttrappe:
+    """Stand-in for ``ttk.Treeview`` with the calls VirtualTreeview makes."""
+
+    def __init__(self):
+        self._iids = []
+        self._items = {}
+
+    def configure(self, **optionen):
+        pass
+
+    def insert(self, parent, index, iid, values, tags=()):
+        iid = str(iid)
+        if index == "end":
+            self._iids.append(iid)
+        else:
+            self._iids.insert(index, iid)
+        self._items[iid] = {"values": list(values), "tags": list(tags)}
+        return iid
+
+    def item(self, iid, **optionen):
+        if optionen:
+            self._items[iid].update(optionen)
+        return self._items[iid]
+
+    def delete(self, *iids):
+        weg = set(iids)
+        self._iids = [iid for iid in self._iids if iid not in weg]
+        for iid in iids:
+            del self._items[iid]
+
+    def get_children(self, item=""):
+        return tuple(self._iids)
+
+    def exists(self, iid):
+        return iid in self._items
+
+    def index(self, iid):
+        return self._iids.index(iid)
+
+    def yview(self):
+        return (0.0, 1.0)
+
+    def yview_moveto(self, anteil):
+        pass
+
+    def after_idle(self, fn, *args):
+        pass
+
+
+def baum_fabrik(tk_erzwingen):
+    """Return (factory for trees, mode, cleanup) for a real or stand-in tree."""
+    if tk_erzwingen or os.environ.get("DISPLAY"):
+        try:
+            import tkinter as tk
+            from tkinter import ttk
+
+            root = tk.Tk()
+            root.withdraw()
+        except Exception:
+            if tk_erzwingen:
+                raise
+        else:
+            def baum():
+                tree = ttk.Treeview(root, columns=tuple(range(7)), show="headings")
+                tree.pack()
+                return tree
+
+            return baum, "tk", root.destroy
+    return BaumAttrappe, "attrappe", lambda: None
+
+
+def listen(db, baum):
+    """The Rückgabe and Übersicht lists as the app builds them."""
+    from newtest_fix import FlaschenVerleihApp
+
+    schluessel, farbe = FlaschenVerleihApp.vorgang_schluessel, FlaschenVerleihApp.vorgang_farbe
+    rueckgabe = VirtualTreeview(
+        baum(), db.verleihvorgaenge, schluessel, lambda row: (row[7], row[:7], (farbe(row),)),
+        seitengroesse=SEITENGROESSE,
+    )
+    uebersicht = VirtualTreeview(
+        baum(), db.verleihvorgaenge, schluessel,
+        lambda row: (row[7], (row[0], row[1], row[3], row[4], row[6]), (farbe(row),)),
+        seitengroesse=SEITENGROESSE,
+    )
+    return rueckgabe, uebersicht
+
+
+def stichprobe(db_path, anzahl, seed):
+    """Inputs for the paths, drawn from the database before anything is timed; the same seed draws the same."""
+    conn = sqlite3.connect(db_path)
+    rnd = random.Random(seed)
+
+    def zufaellig(sql, params=()):
+        return rnd.sample([row[0] for row in conn.execute(sql, params)], anzahl)
+
+    def je_id(sql, tabelle):
+        letzte = conn.execute(f"SELECT MAX(id) FROM {tabelle}").fetchone()[0]
+        return [conn.execute(sql, (rnd.randint(1, letzte),)).fetchone()[0] for _ in range(anzahl)]
+
+    positionen = "SELECT flaschennummer FROM verleih_position JOIN flasche ON flasche.id = flasche_id WHERE "
+    offen = [row[0] for row in conn.execute(positionen + "status = 'verliehen'")]
+    vorgaenge = [
+        [row[0] for row in conn.execute(positionen + "vorgang_id = ? AND status = 'verliehen'", (vid,))]
+        for vid in zufaellig("SELECT id FROM verleihvorgang WHERE offen > 0")
+    ]
+    details = je_id(positionen + "verleih_position.id >= ? LIMIT 1", "verleih_position")
+    referenzen = je_id("SELECT referenznummer FROM verleihvorgang WHERE id >= ? LIMIT 1", "verleihvorgang")
+    details_vorgaenge = je_id("SELECT id FROM verleihvorgang WHERE id >= ? LIMIT 1", "verleihvorgang")
+    kunden = [name.split()[0] for name in zufaellig("SELECT name FROM kunde")]
+    conn.close()
+    return {
+        # Two bottles that are out and two that are probably back.
+        "pruefen": [rnd.sample(offen, 2) + rnd.sample(details, 2) for _ in range(anzahl)],
+        "vorgaenge": vorgaenge,
+        "details": [[vorgang_id] for vorgang_id in details_vorgaenge],
+        "suchen": [
+            (begriff, status)
+            for begriffe in zip(kunden, referenzen, details)
+            for begriff in begriffe
+            for status in ("", "verliehen")
+        ][:anzahl],
+    }
+
+
+def kalibrieren(runden=15):
+    """Time a fixed SQLite and Python workload; the fastest round is the machine's current speed."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (a INTEGER, b TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", ((i * 7919 % 10007, f"x{i}") for i in range(20_000)))
+    zeiten = []
+    for _ in range(runden):
+        start = time.perf_counter()
+        conn.execute("SELECT b FROM t ORDER BY a LIMIT 200").fetchall()
+        sorted(str(i) for i in range(20_000))
+        zeiten.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    return round(min(zeiten), 3)
+
+
+def messen(fn, eingaben):
+    # The first call warms the caches and is not counted. Like timeit, the
+    # garbage collector is off while the clock runs.
+    fn(eingaben[0])
+    zeiten = []
+    gc.collect()
+    gc.disable()
+    try:
+        for eingabe in eingaben[1:]:
+            start = time.perf_counter()
+            fn(eingabe)
+            zeiten.append((time.perf_counter() - start) * 1000)
+    finally:
+        gc.enable()
+    return auswerten(zeiten)
+
+
+def auswerten(zeiten):
+    zeiten = sorted(zeiten)
+    return {
+        "min_ms": round(zeiten[0], 3),
+        "median_ms": round(statistics.median(zeiten), 3),
+        "p95_ms": round(zeiten[int(0.95 * (len(zeiten) - 1))], 3),
+        "n": len(zeiten),
+    }
+
+
+def start(db_path, wiederholungen=START_WIEDERHOLUNGEN):
+    """Start the Tk app on ``db_path`` and time its window and its register, as the app measures them itself."""
+    import tkinter as tk
+    from newtest_fix import FlaschenVerleihApp
+
+    zeiten = {"start_fenster": [], "start_bereit": []}
+    # The first start warms the page cache and is not counted.
+    for runde in range(wiederholungen + 1):
+        gestartet = time.perf_counter()
+        root = tk.Tk()
+        app = FlaschenVerleihApp(root, db_path=db_path, gestartet=gestartet)
+        try:
+            while len(app.startzeiten) < len(zeiten):
+                root.update()
+                time.sleep(0.001)
+        finally:
+            app.beenden()
+        if runde:
+            for name, liste in zeiten.items():
+                liste.append(app.startzeiten[name])
+    return {name: auswerten(liste) for name, liste in zeiten.items()}
+
+
+def lauf(db_path, wiederholungen, baum, seed, mit_start=False):
+    proben = stichprobe(db_path, wiederholungen + 1, seed)
+    db = Datenbank(db_path)
+    rueckgabe, uebersicht = listen(db, baum)
+    bestand = baum()
+
+    def refresh_all(_):
+        db.aenderung_stand()
+        rueckgabe.neu_laden()
+        uebersicht.neu_laden()
+        bestand.delete(*bestand.get_children())
+        for row in db.bestand_liste():
+            bestand.insert("", "end", iid=row[0], values=row[1:])
+
+    def filter_tree(suche):
+        begriff, status = suche
+        rueckgabe.filtern(suche=begriff, status=status)
+
+    neue = itertools.count()
+
+    def verleihen(_):
+        n = next(neue)
+        db.verleih_anlegen(
+            ["Benchmark GmbH", "0911 1", "Teststraße 1", "Herr Test", f"B{n}"], "50l", "200 bar", "Linde", "Zentrale",
+            [f"BENCH{n}a", f"BENCH{n}b"],
+        )
+
+    try:
+        ergebnis = {
+            "refresh_all": messen(refresh_all, range(wiederholungen + 1)),
+            "filter_tree": messen(filter_tree, proben["suchen"]),
+            "verleihen_pruefung": messen(db.aktive_flaschen, proben["pruefen"]),
+            "verleihen": messen(verleihen, range(wiederholungen + 1)),
+            "mark_returned": messen(db.zurueckgeben, proben["vorgaenge"]),
+            "show_details": messen(db.vorgang_details, proben["details"]),
+        }
+    finally:
+        db.close()
+    if mit_start:
+        ergebnis.update(start(db_path))
+    return ergebnis
+
+
+def vorlage(cache, flaschen, seed):
+    """Path of a generated database with ``flaschen`` bottles, made on first use."""
+    pfad = os.path.join(cache, f"verleih-{flaschen}-s{seed}-v{SCHEMA_VERSION}.db")
+    if not os.path.exists(pfad):
+        start = time.perf_counter()
+        erzeugen(pfad + ".neu", flaschen, seed=seed)
+        os.replace(pfad + ".neu", pfad)
+        print(f"{flaschen} Flaschen erzeugt in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    return pfad
+
+
+def vergleichen(ergebnis, baseline, toleranz):
+    """Print every path next to its baseline and return the regressions."""
+    regressionen = []
+    if baseline["meta"].get("baum") != ergebnis["meta"]["baum"]:
+        print(f"Achtung: Baseline mit Baum {baseline['meta'].get('baum')}, dieser Lauf mit {ergebnis['meta']['baum']}")
+    print(f"{'flaschen':>9}  {'pfad':<20}{'min ms':>9}{'median ms':>11}{'p95 ms':>10}{'baseline':>10}{'faktor':>8}")
+    for flaschen, pfade in ergebnis["laeufe"].items():
+        for pfad, werte in pfade.items():
+            alt = baseline["laeufe"].get(flaschen, {}).get(pfad)
+            zeile = f"{flaschen:>9}  {pfad:<20}{werte['min_ms']:>9.3f}{werte['median_ms']:>11.3f}{werte['p95_ms']:>10.3f}"
+            if alt is None:
+                print(zeile)
+                continue
+            faktor = werte["min_ms"] / alt["min_ms"] if alt["min_ms"] else float("inf")
+            schlechter = faktor > 1 + toleranz and werte["min_ms"] - alt["min_ms"] > MINDESTENS_MS
+            print(f"{zeile}{alt['min_ms']:>10.3f}{faktor:>8.2f}{'  REGRESSION' if schlechter else ''}")
+            if schlechter:
+                regressionen.append((flaschen, pfad, faktor))
+    return regressionen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flaschen", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--wiederholungen", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cache", help="Verzeichnis für die erzeugten Datenbanken (Standard: temporär)")
+    parser.add_argument("--ausgabe", help="Ergebnis als JSON hierhin schreiben")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--baseline-schreiben", action="store_true", help="Ergebnis als neue Baseline speichern")
+    parser.add_argument("--toleranz", type=float, default=TOLERANZ, help="erlaubter Anteil langsamer als die Baseline")
+    parser.add_argument("--tk", action="store_true", help="echten ttk.Treeview verwenden (braucht ein Display)")
+    args = parser.parse_args()
+
+    baum, modus, aufraeumen = baum_fabrik(args.tk)
+    ergebnis = {
+        "meta": {
+            "datum": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version, "plattform": platform.platform(), "schema": SCHEMA_VERSION,
+            "baum": modus, "seed": args.seed, "wiederholungen": args.wiederholungen,
+            "kalibrierung_ms": kalibrieren(),
+        },
+        "laeufe": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = args.cache or tmp
+        os.makedirs(cache, exist_ok=True)
+        try:
+            for flaschen in args.flaschen:
+                # Every run starts from the same data; the writes change it.
+                db_path = os.path.join(tmp, "lauf.db")
+                shutil.copyfile(vorlage(cache, flaschen, args.seed), db_path)
+                ergebnis["laeufe"][str(flaschen)] = lauf(
+                    db_path, args.wiederholungen, baum, args.seed, mit_start=modus == "tk",
+                )
+                os.remove(db_path)
+        finally:
+            aufraeumen()
+
+    for pfad in filter(None, [args.ausgabe, args.baseline if args.baseline_schreiben else None]):
+        with open(pfad, "w", encoding="utf-8") as f:
+            json.dump(ergebnis, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+    if args.baseline_schreiben or not os.path.exists(args.baseline):
+        vergleichen(ergebnis, {"meta": ergebnis["meta"], "laeufe": {}}, args.toleranz)
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("schema") != SCHEMA_VERSION:
+        # Other tables and indexes: the numbers say nothing about this code.
+        vergleichen(ergebnis, {"meta": ergebnis["meta"], "laeufe": {}}, args.toleranz)
+        print(
+            f"Baseline mit Schema {baseline['meta'].get('schema')}, dieser Stand hat Schema {SCHEMA_VERSION}; "
+            "mit --baseline-schreiben neu aufnehmen", file=sys.stderr,
+        )
+        return 1
+    regressionen = vergleichen(ergebnis, baseline, args.toleranz)
+    for flaschen, pfad, faktor in regressionen:
+        print(f"{pfad} bei {flaschen} Flaschen {faktor:.2f}× langsamer als die Baseline", file=sys.stderr)
+    return 1 if regressionen else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""Check the stock counters against the loan table.
+
+    python bestand_pruefen.py [--db flaschen_verleih.db] [--reparieren]
+
+The verliehen counter of every bestand cell is maintained by triggers. This
+recounts the open bottles of all cells in one pass and lists every cell
+whose counter drifted; with --reparieren the counters are corrected. The
+exit status is 1 if drift was found and left in place.
+"""
+import argparse
+import sys
+import time
+
+from verleih_db import DB_PATH, Datenbank
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--reparieren", action="store_true", help="Zähler auf den nachgezählten Wert setzen")
+    args = parser.parse_args()
+
+    db = Datenbank(args.db)
+    start = time.perf_counter()
+    abweichungen = db.bestand_pruefen(reparieren=args.reparieren)
+    dauer = (time.perf_counter() - start) * 1000
+    db.close()
+
+    for a in abweichungen:
+        print(
+            f"{a.filiale:<10} {a.flaschengroesse:>4} {a.flaschendruck:>8}: "
+            f"verliehen {a.gezaehlt}, tatsächlich {a.tatsaechlich} ({a.tatsaechlich - a.gezaehlt:+d})"
+        )
+    if not abweichungen:
+        print(f"Bestand stimmt ({dauer:.1f} ms).")
+    elif args.reparieren:
+        print(f"{len(abweichungen)} Zelle(n) korrigiert ({dauer:.1f} ms).")
+    else:
+        print(f"{len(abweichungen)} Zelle(n) weichen ab; mit --reparieren korrigieren ({dauer:.1f} ms).")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Runs all database work on one worker thread so the Tk mainloop never blocks.
+
+``DBExecutor`` owns the worker and the ``Datenbank`` it uses; the connection
+is opened on the worker thread, so calling its methods from the UI thread
+fails loudly instead of silently blocking. Jobs run in submission order and
+return ``concurrent.futures.Future`` objects. ``TkRueckmeldung`` polls those
+futures with ``root.after`` and runs the callbacks on the Tk thread.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+
+_ENDE = object()
+
+
+class DBExecutor:
+    def __init__(self, db_factory):
+        self._auftraege = queue.Queue()
+        self._bereit = threading.Event()
+        self._start_fehler = None
+        self.db = None
+        self._thread = threading.Thread(target=self._arbeiten, args=(db_factory,), name="db-executor", daemon=True)
+        self._thread.start()
+        self._bereit.wait()
+        if self._start_fehler is not None:
+            raise self._start_fehler
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._auftraege.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self):
+        self._auftraege.put(_ENDE)
+        self._thread.join()
+
+    def _arbeiten(self, db_factory):
+        try:
+            self.db = db_factory()
+        except Exception as e:
+            self._start_fehler = e
+            self._bereit.set()
+            return
+        self._bereit.set()
+        while True:
+            auftrag = self._auftraege.get()
+            if auftrag is _ENDE:
+                break
+            future, fn, args, kwargs = auftrag
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+        self.db.close()
+
+
+class TkRueckmeldung:
+    """Delivers finished futures to callbacks on the Tk thread."""
+
+    def __init__(self, root, intervall_ms=15):
+        self.root = root
+        self.intervall_ms = intervall_ms
+        self._offen = []
+        self._after_id = None
+
+    @property
+    def beschaeftigt(self):
+        return bool(self._offen)
+
+    def wenn_fertig(self, future, callback, fehler):
+        self._offen.append((future, callback, fehler))
+        if self._after_id is None:
+            self._after_id = self.root.after(self.intervall_ms, self._abholen)
+
+    def _abholen(self):
+        self._after_id = None
+        # One look per future: one that finished between two passes over
+        # the list would end up in neither and its callback never run.
+        fertig, offen = [], []
+        for eintrag in self._offen:
+            (fertig if eintrag[0].done() else offen).append(eintrag)
+        self._offen = offen
+        for future, callback, fehler in fertig:
+            e = future.exception()
+            if e is not None:
+                fehler(e)
+            elif callback is not None:
+                callback(future.result())
+        if self._offen and self._after_id is None:
+            self._after_id = self.root.after(self.intervall_ms, self._abholen)
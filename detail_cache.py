@@ -0,0 +1,59 @@
+"""Bounded cache of the loan details behind the detail pop-up.
+
+``DetailCache`` holds the rows of ``Datenbank.vorgang_details()`` keyed by
+delivery id, the identity the lists show, so a bottle number that was lent
+again can never bring up an older loan. It keeps the ``groesse`` deliveries
+used last and drops the least recently used beyond that.
+
+The app fills it ahead of time with the deliveries around the selected row
+and drops exactly the deliveries its own returns and the change log touch;
+a full reload of the lists empties it. Like ``FlaschenRegister`` it is
+only used on the Tk thread.
+"""
+import collections
+
+GROESSE = 500
+
+
+class DetailCache:
+    def __init__(self, groesse=GROESSE):
+        self.groesse = groesse
+        self._details = collections.OrderedDict()
+        # For the Diagnose tab.
+        self.treffer = 0
+        self.fehlgriffe = 0
+
+    def __len__(self):
+        return len(self._details)
+
+    def __contains__(self, vorgang_id):
+        return vorgang_id in self._details
+
+    def get(self, vorgang_id):
+        """The details of the delivery in the column order of ``Datenbank.vorgang_details()``, or None."""
+        details = self._details.get(vorgang_id)
+        if details is None:
+            self.fehlgriffe += 1
+            return None
+        self._details.move_to_end(vorgang_id)
+        self.treffer += 1
+        return details
+
+    def eintragen(self, rows):
+        """Add ``(vorgang_id, *details)`` rows as the most recently used."""
+        for vorgang_id, *details in rows:
+            self._details[vorgang_id] = tuple(details)
+            self._details.move_to_end(vorgang_id)
+        while len(self._details) > self.groesse:
+            self._details.popitem(last=False)
+
+    def fehlende(self, vorgang_ids):
+        """The given ids that are not cached, without counting as a use."""
+        return [vorgang_id for vorgang_id in vorgang_ids if vorgang_id not in self._details]
+
+    def verwerfen(self, vorgang_ids):
+        for vorgang_id in vorgang_ids:
+            self._details.pop(vorgang_id, None)
+
+    def leeren(self):
+        self._details.clear()
@@ -0,0 +1,407 @@
+"""Timing and counters for the hot paths of the Tk app.
+
+``Diagnose`` keeps, per operation, a latency histogram and the SQL
+statements, rows and tree items that went with it. The histogram has fixed
+log-scale buckets, so memory and cost per call stay constant however long
+the app runs. Operations are measured as spans:
+
+- ``messen(name)`` is a context manager.
+- ``gemessen`` decorates a method of an object with a ``diagnose`` attribute.
+- ``auftrag(fn)`` measures work handed to the database thread.
+
+Spans nest per thread. A job submitted from inside a span becomes its
+child, and so does the callback that hands the result back to the Tk thread,
+so the whole chain one click sets off is one tree (an action). Finished
+actions that took longer than ``langsam_ms`` are kept for the Diagnose tab.
+Time spent in modal dialogs (see ``Modal``) is not counted, and callbacks
+that the dialog's nested event loop runs meanwhile start actions of their
+own.
+
+SQL statements are counted through ``sqlite3.Connection.set_trace_callback``;
+with ``sql_mitschneiden`` the statements themselves are kept as well. Export
+to a rotating log file is off until ``exportieren()`` is called; until then
+nothing is formatted or written.
+"""
+import collections
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import math
+import threading
+import time
+
+LANGSAM_MS = 200
+SQL_MITSCHNITT = 200
+LOG_BYTES = 1_000_000
+LOG_DATEIEN = 3
+
+_lokal = threading.local()
+
+
+def _stapel():
+    try:
+        return _lokal.stapel
+    except AttributeError:
+        _lokal.stapel = []
+        return _lokal.stapel
+
+
+def _name(fn):
+    """Short name of a function, bound method or partial for the tables."""
+    fn = getattr(fn, "func", fn)
+    name = getattr(fn, "__qualname__", None) or type(fn).__name__
+    teile = name.replace(".<locals>", "").split(".")
+    if len(teile) > 1 and teile[0][:1].isupper():
+        # Class names are clear from the prefix.
+        teile = teile[1:]
+    return ".".join(teile)
+
+
+class Histogramm:
+    """Latencies in buckets that grow by 2**(1/4) from 10 µs; quantiles are within about 10 %."""
+
+    UNTEN_MS = 0.01
+    STUFEN = 4
+    FAECHER = 110
+
+    __slots__ = ("faecher", "anzahl", "summe", "maximum")
+
+    def __init__(self):
+        self.faecher = [0] * self.FAECHER
+        self.anzahl = 0
+        self.summe = 0.0
+        self.maximum = 0.0
+
+    def eintragen(self, ms):
+        if ms <= self.UNTEN_MS:
+            i = 0
+        else:
+            i = min(int(math.log2(ms / self.UNTEN_MS) * self.STUFEN) + 1, self.FAECHER - 1)
+        self.faecher[i] += 1
+        self.anzahl += 1
+        self.summe += ms
+        if ms > self.maximum:
+            self.maximum = ms
+
+    def quantil(self, q):
+        if not self.anzahl:
+            return 0.0
+        ziel = q * self.anzahl
+        kumuliert = 0
+        for i, n in enumerate(self.faecher):
+            kumuliert += n
+            if n and kumuliert >= ziel:
+                # Geometric middle of the bucket.
+                return min(self.UNTEN_MS * 2 ** ((i - 0.5) / self.STUFEN), self.maximum)
+        return self.maximum
+
+
+class Kennzahlen:
+    __slots__ = ("zeiten", "sql", "zeilen", "eintraege")
+
+    def __init__(self):
+        self.zeiten = Histogramm()
+        self.sql = 0
+        self.zeilen = 0
+        self.eintraege = 0
+
+
+class Spanne:
+    """One measured piece of work; the root of a tree is an action."""
+
+    __slots__ = (
+        "name", "wurzel", "kinder", "start", "dauer", "pause", "warten", "sql", "zeilen", "eintraege",
+        "offen", "ende", "gesamtpause",
+    )
+
+    def __init__(self, name, eltern):
+        self.name = name
+        self.kinder = []
+        self.start = time.perf_counter()
+        self.dauer = 0.0
+        self.pause = 0.0
+        self.warten = 0.0
+        self.sql = self.zeilen = self.eintraege = 0
+        if eltern is None:
+            self.wurzel = self
+            # Open until the span itself and every job submitted under it
+            # have finished.
+            self.offen = 1
+            self.ende = self.start
+            self.gesamtpause = 0.0
+        else:
+            self.wurzel = eltern.wurzel
+            eltern.kinder.append(self)
+
+    def summe(self, feld):
+        return getattr(self, feld) + sum(kind.summe(feld) for kind in self.kinder)
+
+
+@contextlib.contextmanager
+def unterbrechen():
+    """Run something that waits for the clerk, such as a modal dialog.
+
+    The time does not count for the spans open on this thread, and what runs
+    meanwhile (a dialog runs a nested event loop) is not adopted by them.
+    """
+    stapel = _stapel()
+    _lokal.stapel = []
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        pause = time.perf_counter() - start
+        _lokal.stapel = stapel
+        for spanne in stapel:
+            spanne.pause += pause
+        for wurzel in {id(s.wurzel): s.wurzel for s in stapel}.values():
+            wurzel.gesamtpause += pause
+
+
+class Modal:
+    """Wraps a dialog module such as ``tkinter.messagebox`` so its dialogs run in ``unterbrechen()``."""
+
+    def __init__(self, modul):
+        self._modul = modul
+
+    def __getattr__(self, name):
+        fn = getattr(self._modul, name)
+        if not callable(fn):
+            return fn
+
+        @functools.wraps(fn)
+        def aufrufen(*args, **kwargs):
+            with unterbrechen():
+                return fn(*args, **kwargs)
+
+        return aufrufen
+
+
+def gemessen(methode):
+    """Measure every call of ``methode`` as span ``ui:<name>`` of ``self.diagnose``."""
+    name = "ui:" + methode.__name__
+
+    @functools.wraps(methode)
+    def aufrufen(self, *args, **kwargs):
+        with self.diagnose.messen(name):
+            return methode(self, *args, **kwargs)
+
+    return aufrufen
+
+
+class Auftrag:
+    """A job for the database thread, measured as a child of the span it was submitted from."""
+
+    def __init__(self, diagnose, fn):
+        self.diagnose = diagnose
+        self.name = "db:" + _name(fn)
+        stapel = _stapel()
+        self.eltern = stapel[-1] if stapel else None
+        self.eingereicht = time.perf_counter()
+        self.spanne = None
+        self.fertig = None
+        if self.eltern is not None:
+            with diagnose._lock:
+                self.eltern.wurzel.offen += 1
+
+    def ausfuehren(self, fn, *args):
+        # Runs on the database thread.
+        with self.diagnose.messen(self.name, self.eltern) as spanne:
+            if self.eltern is None:
+                # The job is an action of its own, open until the callback ran.
+                spanne.offen += 1
+            spanne.warten = spanne.start - self.eingereicht
+            self.spanne = spanne
+            try:
+                ergebnis = fn(*args)
+            finally:
+                self.fertig = time.perf_counter()
+            if isinstance(ergebnis, list):
+                spanne.zeilen += len(ergebnis)
+            elif isinstance(ergebnis, tuple):
+                spanne.zeilen += 1
+            return ergebnis
+
+    def rueckmeldung(self, handler):
+        """Wrap ``handler`` (or nothing) to run as a child span and close the action afterwards."""
+        name = "ui:" + (_name(handler) if handler is not None else "rueckmeldung")
+
+        def aufrufen(wert):
+            spanne = self.spanne
+            if spanne is None:
+                # The job never ran; nothing to attach to.
+                if self.eltern is not None:
+                    self.diagnose._freigeben(self.eltern.wurzel)
+                if handler is not None:
+                    handler(wert)
+                return
+            self.diagnose.eintragen("zustellung", (time.perf_counter() - self.fertig) * 1000)
+            try:
+                if handler is not None:
+                    with self.diagnose.messen(name, spanne):
+                        handler(wert)
+            finally:
+                self.diagnose._freigeben(spanne.wurzel)
+
+        return aufrufen
+
+
+class Diagnose:
+    def __init__(self, langsam_ms=LANGSAM_MS):
+        self.langsam_ms = langsam_ms
+        self.sql_mitschneiden = False
+        self.sql = collections.deque(maxlen=SQL_MITSCHNITT)
+        self.letzte_langsame = None
+        self._kennzahlen = collections.defaultdict(Kennzahlen)
+        self._lock = threading.Lock()
+        self._log = None
+
+    @contextlib.contextmanager
+    def messen(self, name, eltern=None):
+        """Measure the block as span ``name``, a child of ``eltern`` or of the span open on this thread."""
+        stapel = _stapel()
+        if eltern is None and stapel:
+            eltern = stapel[-1]
+        spanne = Spanne(name, eltern)
+        stapel.append(spanne)
+        try:
+            yield spanne
+        finally:
+            ende = time.perf_counter()
+            stapel.pop()
+            spanne.dauer = ende - spanne.start - spanne.pause
+            wurzel = spanne.wurzel
+            with self._lock:
+                if ende > wurzel.ende:
+                    wurzel.ende = ende
+                kennzahlen = self._kennzahlen[name]
+                kennzahlen.zeiten.eintragen(spanne.dauer * 1000)
+                kennzahlen.sql += spanne.sql
+                kennzahlen.zeilen += spanne.zeilen
+                kennzahlen.eintraege += spanne.eintraege
+                if spanne.warten:
+                    self._kennzahlen["warteschlange"].zeiten.eintragen(spanne.warten * 1000)
+            if spanne is wurzel:
+                self._freigeben(wurzel)
+
+    def auftrag(self, fn):
+        return Auftrag(self, fn)
+
+    def eintragen(self, name, ms):
+        """Record a time measured outside a span, such as one across the event loop."""
+        with self._lock:
+            self._kennzahlen[name].zeiten.eintragen(ms)
+
+    def _freigeben(self, wurzel):
+        with self._lock:
+            wurzel.offen -= 1
+            if wurzel.offen:
+                return
+            gesamt = (wurzel.ende - wurzel.start - wurzel.gesamtpause) * 1000
+            kennzahlen = self._kennzahlen["aktion " + wurzel.name]
+            kennzahlen.zeiten.eintragen(gesamt)
+            for feld in ("sql", "zeilen", "eintraege"):
+                setattr(kennzahlen, feld, getattr(kennzahlen, feld) + wurzel.summe(feld))
+            langsam = gesamt >= self.langsam_ms
+            if langsam:
+                self.letzte_langsame = (gesamt, wurzel)
+        if self._log is not None:
+            eintrag = {"aktion": wurzel.name, "ms": round(gesamt, 3), "sql": wurzel.summe("sql")}
+            if langsam:
+                eintrag["verlauf"] = self._als_dict(wurzel)
+            self._log.info(json.dumps(eintrag, ensure_ascii=False))
+
+    def _als_dict(self, spanne):
+        return {
+            "name": spanne.name, "ms": round(spanne.dauer * 1000, 3), "warten_ms": round(spanne.warten * 1000, 3),
+            "sql": spanne.sql, "zeilen": spanne.zeilen, "eintraege": spanne.eintraege,
+            "kinder": [self._als_dict(kind) for kind in spanne.kinder],
+        }
+
+    def verbinden(self, db):
+        """Count the SQL statements of ``db`` (a Datenbank; anything without ``conn`` is left alone)."""
+        conn = getattr(db, "conn", None)
+        if conn is not None:
+            conn.set_trace_callback(self._statement)
+        return db
+
+    def _statement(self, sql):
+        stapel = _stapel()
+        if stapel:
+            stapel[-1].sql += 1
+        if self.sql_mitschneiden:
+            name = stapel[-1].name if stapel else ""
+            self.sql.append((time.strftime("%H:%M:%S"), name, " ".join(sql.split())))
+            if self._log is not None:
+                self._log.debug("%s %s", name, " ".join(sql.split()))
+
+    def beobachten(self, tree):
+        """Count the items inserted into ``tree`` for the span open at the time."""
+        einfuegen = tree.insert
+
+        def insert(*args, **kwargs):
+            stapel = _stapel()
+            if stapel:
+                stapel[-1].eintraege += 1
+            return einfuegen(*args, **kwargs)
+
+        tree.insert = insert
+        return tree
+
+    def exportieren(self, pfad, max_bytes=LOG_BYTES, dateien=LOG_DATEIEN):
+        """Append every finished action as a JSON line to ``pfad``, rotating at ``max_bytes``."""
+        log = logging.getLogger("verleih.diagnose")
+        log.setLevel(logging.DEBUG)
+        log.propagate = False
+        handler = logging.handlers.RotatingFileHandler(pfad, maxBytes=max_bytes, backupCount=dateien, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        log.addHandler(handler)
+        self._log = log
+
+    def zuruecksetzen(self):
+        with self._lock:
+            self._kennzahlen.clear()
+            self.letzte_langsame = None
+        self.sql.clear()
+
+    def tabelle(self):
+        """(name, calls, p50, p95, p99, max, SQL, rows and items per call) per operation, slowest total first."""
+        with self._lock:
+            kennzahlen = [(name, k.zeiten.summe, k) for name, k in self._kennzahlen.items()]
+            zeilen = []
+            for name, _, k in sorted(kennzahlen, key=lambda e: -e[1]):
+                h = k.zeiten
+                zeilen.append((
+                    name, h.anzahl, h.quantil(0.5), h.quantil(0.95), h.quantil(0.99), h.maximum,
+                    k.sql / h.anzahl, k.zeilen / h.anzahl, k.eintraege / h.anzahl,
+                ))
+        return zeilen
+
+    def flamme(self, breite=40):
+        """The last slow action as indented lines with bars proportional to the time of each span."""
+        if self.letzte_langsame is None:
+            return []
+        gesamt, wurzel = self.letzte_langsame
+        zeilen = [f"{wurzel.name}: {gesamt:.1f} ms"]
+
+        def ausgeben(spanne, tiefe):
+            ms = spanne.dauer * 1000
+            balken = "█" * max(round(breite * ms / gesamt), 1) if gesamt else ""
+            zusatz = [f"{spanne.sql} SQL"] if spanne.sql else []
+            if spanne.zeilen:
+                zusatz.append(f"{spanne.zeilen} Zeilen")
+            if spanne.eintraege:
+                zusatz.append(f"{spanne.eintraege} Einträge")
+            if spanne.warten >= 0.0005:
+                zusatz.append(f"{spanne.warten * 1000:.1f} ms gewartet")
+            zeilen.append(
+                f"{'  ' * tiefe}{balken:<{breite}} {ms:8.1f} ms  {spanne.name}"
+                + (f"  ({', '.join(zusatz)})" if zusatz else "")
+            )
+            for kind in spanne.kinder:
+                ausgeben(kind, tiefe + 1)
+
+        ausgeben(wurzel, 0)
+        return zeilen
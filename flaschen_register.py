@@ -0,0 +1,160 @@
+"""In-memory index of the bottles that are out, for checks without SQL.
+
+``FlaschenRegister`` answers "is bottle X out, at which customer, since
+when" with one dict lookup, and lists the bottles out at a branch without
+touching the database. It holds one record per open delivery and maps each
+bottle number that is out to its delivery. Numbers and the few distinct
+branch, size, pressure and supplier names are interned, and customers are
+shared between their deliveries.
+
+The register is filled from ``Datenbank.flaschen_register()`` and kept
+coherent in two ways: the app writes its own loans and returns through to
+it as soon as the database confirms them, and deliveries changed by other
+clients are replaced with ``abgleichen()`` from the change log. It is a
+cache: the database still decides when a delivery is saved.
+"""
+import sys
+
+
+def _intern(wert):
+    # Columns migrated from old rows can be NULL.
+    return sys.intern(wert) if isinstance(wert, str) else wert
+
+
+class Kunde:
+    __slots__ = ("name", "telefon", "adresse", "ansprechpartner")
+
+    def __init__(self, name, telefon, adresse, ansprechpartner):
+        self.name = name
+        self.telefon = telefon
+        self.adresse = adresse
+        self.ansprechpartner = ansprechpartner
+
+
+class Vorgang:
+    """An open delivery and the numbers of its bottles that are still out."""
+
+    __slots__ = (
+        "id", "kunde", "referenznummer", "flaschengroesse", "flaschendruck", "flasche_von", "filiale", "anzahl",
+        "verliehen_am", "flaschen",
+    )
+
+    def __init__(
+        self, id, kunde, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am,
+    ):
+        self.id = id
+        self.kunde = kunde
+        self.referenznummer = referenznummer
+        self.flaschengroesse = _intern(flaschengroesse)
+        self.flaschendruck = _intern(flaschendruck)
+        self.flasche_von = _intern(flasche_von)
+        self.filiale = _intern(filiale)
+        self.anzahl = anzahl
+        self.verliehen_am = verliehen_am
+        self.flaschen = set()
+
+    def details(self):
+        """The delivery in the column order of ``Datenbank.vorgang_details()``, without the id."""
+        k = self.kunde
+        return (
+            k.name, k.telefon, k.adresse, k.ansprechpartner, self.referenznummer, self.flaschengroesse,
+            self.flaschendruck, self.flasche_von, self.filiale, self.anzahl, self.verliehen_am, "verliehen", None,
+        )
+
+
+class FlaschenRegister:
+    def __init__(self):
+        self._flaschen = {}
+        self._vorgaenge = {}
+        self._kunden = {}
+        self._filialen = {}
+        # False until the first laden(); an empty register knows nothing yet.
+        self.geladen = False
+
+    def __len__(self):
+        return len(self._flaschen)
+
+    def __contains__(self, flaschennummer):
+        return flaschennummer in self._flaschen
+
+    def laden(self, daten):
+        """Replace the contents with ``(vorgaenge, flaschen)`` from ``Datenbank.flaschen_register()``."""
+        self._flaschen.clear()
+        self._vorgaenge.clear()
+        # Customers without open deliveries are only dropped here.
+        self._kunden.clear()
+        self._filialen.clear()
+        self._einfuegen(*daten)
+        self.geladen = True
+
+    def abgleichen(self, vorgang_ids, daten):
+        """Replace the deliveries ``vorgang_ids`` with their current state ``(vorgaenge, flaschen)``."""
+        for vorgang_id in vorgang_ids:
+            vorgang = self._vorgaenge.get(vorgang_id)
+            if vorgang is not None:
+                self._zurueckgeben(vorgang, list(vorgang.flaschen))
+        self._einfuegen(*daten)
+
+    def verleihen(self, vorgang_id, verliehen_am, daten, dropdown_data, flaschennummern):
+        """Write through a delivery the database has just saved, with the arguments of ``verleih_anlegen()``."""
+        self._einfuegen(
+            [(vorgang_id, *daten, *dropdown_data, len(flaschennummern), verliehen_am)],
+            [(nummer, vorgang_id) for nummer in flaschennummern],
+        )
+
+    def zurueckgeben(self, flaschennummern):
+        """Write through bottles the database has just booked back."""
+        for nummer in flaschennummern:
+            vorgang = self._flaschen.get(nummer)
+            if vorgang is not None:
+                self._zurueckgeben(vorgang, [nummer])
+
+    def vorgang(self, flaschennummer):
+        """The open delivery the bottle is out with, or None if it is not out."""
+        return self._flaschen.get(flaschennummer)
+
+    def verliehene(self, flaschennummern):
+        """The given numbers that are out."""
+        return {nummer for nummer in flaschennummern if nummer in self._flaschen}
+
+    def an_filiale(self, filiale):
+        """Numbers of all bottles out at ``filiale``."""
+        return [nummer for vorgang in self._filialen.get(filiale, ()) for nummer in vorgang.flaschen]
+
+    def _einfuegen(self, vorgaenge, flaschen):
+        neu = []
+        for id, name, telefon, adresse, ansprechpartner, *rest in vorgaenge:
+            kunde_schluessel = (name, telefon, adresse, ansprechpartner)
+            kunde = self._kunden.get(kunde_schluessel)
+            if kunde is None:
+                kunde = self._kunden[kunde_schluessel] = Kunde(*kunde_schluessel)
+            alt = self._vorgaenge.get(id)
+            if alt is not None:
+                self._zurueckgeben(alt, list(alt.flaschen))
+            vorgang = self._vorgaenge[id] = Vorgang(id, kunde, *rest)
+            self._filialen.setdefault(vorgang.filiale, set()).add(vorgang)
+            neu.append(vorgang)
+        for nummer, vorgang_id in flaschen:
+            vorgang = self._vorgaenge.get(vorgang_id)
+            if vorgang is None:
+                # Written between the two queries; the change log brings it.
+                continue
+            nummer = _intern(nummer)
+            alt = self._flaschen.get(nummer)
+            if alt is not None and alt is not vorgang:
+                self._zurueckgeben(alt, [nummer])
+            self._flaschen[nummer] = vorgang
+            vorgang.flaschen.add(nummer)
+        for vorgang in neu:
+            if not vorgang.flaschen:
+                # Returned between the two queries.
+                self._zurueckgeben(vorgang, [])
+
+    def _zurueckgeben(self, vorgang, flaschennummern):
+        for nummer in flaschennummern:
+            vorgang.flaschen.discard(nummer)
+            if self._flaschen.get(nummer) is vorgang:
+                del self._flaschen[nummer]
+        if not vorgang.flaschen and self._vorgaenge.get(vorgang.id) is vorgang:
+            del self._vorgaenge[vorgang.id]
+            self._filialen[vorgang.filiale].discard(vorgang)
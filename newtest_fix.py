@@ -1,68 +1,107 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
-import sqlite3
+import argparse
 from datetime import datetime
-import os
-
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "flaschen_verleih.db")
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS verleih (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            telefon TEXT,
-            adresse TEXT,
-            ansprechpartner TEXT,
-            referenznummer TEXT,
-            flaschennummer TEXT,
-            flaschengroesse TEXT,
-            flaschendruck TEXT,
-            flasche_von TEXT,
-            filiale TEXT,
-            anzahl INTEGER,
-            verliehen_am TEXT,
-            status TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS bestand (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filiale TEXT,
-            flaschengroesse TEXT,
-            flaschendruck TEXT,
-            bestand INTEGER
-        )
-    """)
-    filialen = ["Zentrale", "Nürnberg", "Würzburg", "Trudering", "Moosach"]
-    groessen = ["10l", "20l", "50l"]
-    druecke = ["200 bar", "300 bar"]
-    for f in filialen:
-        for g in groessen:
-            for d in druecke:
-                c.execute(
-                    "SELECT COUNT(*) FROM bestand WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?",
-                    (f, g, d),
-                )
-                if c.fetchone()[0] == 0:
-                    c.execute(
-                        "INSERT INTO bestand (filiale, flaschengroesse, flaschendruck, bestand) VALUES (?, ?, ?, 0)",
-                        (f, g, d),
-                    )
-    conn.commit()
-    conn.close()
+import functools
+import time
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+
+from db_executor import DBExecutor, TkRueckmeldung
+from detail_cache import GROESSE as DETAIL_CACHE_GROESSE, DetailCache
+from diagnose import Diagnose, Modal, gemessen
+from flaschen_register import FlaschenRegister
+from verleih_bericht import exportieren
+from verleih_db import (
+    DB_PATH, DRUECKE, FILIALEN, GROESSEN, LIEFERANTEN, Datenbank, FlaschenAusgemustert, FlaschenBereitsVerliehen,
+    init_db, verleih_fehler, vorgang_richtungen, vorgang_schluessel,
+)
+from verleih_client import VerleihClient
+from virtual_tree import Spaltensortierung, VirtualTreeview
+
+# Dialogs wait for the clerk; that time must not count as slow.
+messagebox = Modal(messagebox)
+filedialog = Modal(filedialog)
+
+# How often other clients' changes to the shared database or server are picked up.
+AENDERUNG_INTERVALL_MS = 2000
+# Delay after the last keystroke before the search runs.
+SUCHE_VERZOEGERUNG_MS = 250
+# Long-running actions only show the progress bar if they take longer than this.
+FORTSCHRITT_VERZOEGERUNG_MS = 300
+# Past this many changed deliveries (a bulk import, say) reloading the lists
+# is cheaper than patching them.
+ABGLEICH_MAX_VORGAENGE = 1000
+DIAGNOSE_INTERVALL_MS = 1000
+# Pause between two tabs built ahead while the app is idle.
+VORBAU_PAUSE_MS = 200
+# Once the selection rests this long, the details of the rows around it
+# are fetched, DETAILS_UMFELD above and below.
+DETAILS_VORLADEN_MS = 150
+DETAILS_UMFELD = 10
+# Headings that sort, with the column names of the database; the database
+# does the sorting.
+VORGANG_SORTIERUNG = {
+    "Name": "name", "Flaschennummer": "flaschennummer", "Flaschengröße": "flaschengroesse", "Filiale": "filiale",
+    "Anzahl": "anzahl", "Verleihdatum": "verliehen_am", "Status": "status",
+}
+# Backups run on a thread and connection of their own, so the lists stay
+# usable while a large database is copied; over the server one may take
+# longer than the client's usual timeout.
+SICHERUNG_TIMEOUT = 3600
+BESTAND_SORTIERUNG = {
+    "Filiale": "filiale", "Flaschengröße": "flaschengroesse", "Flaschendruck": "flaschendruck", "Bestand": "bestand",
+    "Verliehen": "verliehen", "Gesamt": "gesamt",
+}
 
 class FlaschenVerleihApp:
-    def __init__(self, root):
+    def __init__(
+        self, root, db_path=DB_PATH, server=None, diagnose=None, diagnose_zeigen=False, gestartet=None,
+        detail_cache=DETAIL_CACHE_GROESSE,
+    ):
         self.root = root
+        # Start-up times are measured from here; the caller may pass an
+        # earlier perf_counter(), e.g. from before Tk was created.
+        self.gestartet = gestartet or time.perf_counter()
+        self.startzeiten = {}
+        self.diagnose = diagnose or Diagnose()
+        # With a server URL the app is a client of verleih_server.py, which
+        # has the same methods as Datenbank.
+        if server is None:
+            self.db_executor = DBExecutor(lambda: self.diagnose.verbinden(Datenbank(db_path)))
+            self.sicherung_verbinden = lambda: Datenbank(db_path)
+        else:
+            self.db_executor = DBExecutor(lambda: VerleihClient(server))
+            self.sicherung_verbinden = lambda: VerleihClient(server, timeout=SICHERUNG_TIMEOUT)
+        # Started with the Sicherung tab.
+        self.sicherung_executor = None
+        # Methods of self.db must only be called through run_db(): the
+        # connection belongs to the executor's worker thread.
+        self.db = self.db_executor.db
+        self.rueckmeldung = TkRueckmeldung(self.root)
+        self.root.protocol("WM_DELETE_WINDOW", self.beenden)
         self.root.title("Flaschen-Verleih System")
         self.root.geometry("1000x600")
         self.root.configure(bg="white")
 
         self.status_var_rueckgabe = tk.StringVar()
         self.status_var_uebersicht = tk.StringVar()
+        self.archiv_var_uebersicht = tk.BooleanVar(value=False)
+        self.filter_after_id = None
+        self.diagnose_after_id = None
+        self.changes_running = False
+        self.changes_again = False
+        # Set by the first refresh_all(); until then there is nothing to patch.
+        self.aenderung_cursor = None
+        self.laufende_aktionen = 0
+        # The bottles that are out, for checks that need no round trip.
+        # Reloaded with the lists, written through on our own loans and
+        # returns and patched from the change log.
+        self.register = FlaschenRegister()
+        # Details of the deliveries used last, for the detail pop-up.
+        self.details_cache = DetailCache(detail_cache)
+        self.vorladen_after_id = None
+        # Lists and the stock table of the tabs built so far.
+        self.listen = []
+        self.tree_bestand = None
 
         self.style = ttk.Style()
         self.style.theme_use("clam")
@@ -70,10 +109,17 @@ class FlaschenVerleihApp:
         self.style.configure("TLabel", background="white")
         self.style.configure("TEntry", fieldbackground="white")
         self.style.configure("TCombobox", fieldbackground="white")
+        self.style.configure("TCheckbutton", background="white")
         self.style.configure("Treeview.Heading", font=("Segoe UI", 10, "bold"))
         self.style.configure("Treeview", font=("Segoe UI", 10), background="white", fieldbackground="white")
         self.style.configure("White.TFrame", background="white")
 
+        self.statusleiste = ttk.Frame(self.root, style="White.TFrame")
+        self.statusleiste.pack(side="bottom", fill="x", padx=10, pady=(0, 5))
+        self.fortschritt_label = ttk.Label(self.statusleiste, text="")
+        self.fortschritt_label.pack(side="left")
+        self.fortschritt = ttk.Progressbar(self.statusleiste, mode="indeterminate", length=150)
+
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(expand=True, fill="both")
 
@@ -81,17 +127,130 @@ class FlaschenVerleihApp:
         self.rueckgabe_tab = ttk.Frame(self.notebook, style="White.TFrame")
         self.uebersicht_tab = ttk.Frame(self.notebook, style="White.TFrame")
         self.bestand_tab = ttk.Frame(self.notebook, style="White.TFrame")
+        self.flaschen_tab = ttk.Frame(self.notebook, style="White.TFrame")
+        self.berichte_tab = ttk.Frame(self.notebook, style="White.TFrame")
+        self.sicherung_tab = ttk.Frame(self.notebook, style="White.TFrame")
+        self.diagnose_tab = ttk.Frame(self.notebook, style="White.TFrame")
 
         self.notebook.add(self.verleih_tab, text="Verleihen")
         self.notebook.add(self.rueckgabe_tab, text="Rückgabe")
         self.notebook.add(self.uebersicht_tab, text="Übersicht")
         self.notebook.add(self.bestand_tab, text="Bestand")
+        self.notebook.add(self.flaschen_tab, text="Flaschen")
+        self.notebook.add(self.berichte_tab, text="Berichte")
+        self.notebook.add(self.sicherung_tab, text="Sicherung")
+        # Hidden unless asked for; Strg+Umschalt+D shows and hides it.
+        self.notebook.add(self.diagnose_tab, text="Diagnose")
+        if not diagnose_zeigen:
+            self.notebook.hide(self.diagnose_tab)
+        self.root.bind_all("<Control-D>", self.toggle_diagnose)
 
+        # Only the form is built before the window appears. The other tabs
+        # are built the first time they are selected, or ahead of that once
+        # start-up has settled (see tab_vorbauen).
         self.build_verleih_tab()
-        self.build_rueckgabe_tab()
-        self.build_uebersicht_tab()
-        self.build_bestand_tab()
+        self.build_diagnose_tab()
+        self.tab_aufbau = {
+            str(self.rueckgabe_tab): self.build_rueckgabe_tab,
+            str(self.uebersicht_tab): self.build_uebersicht_tab,
+            str(self.bestand_tab): self.build_bestand_tab,
+            str(self.flaschen_tab): self.build_flaschen_tab,
+            str(self.berichte_tab): self.build_berichte_tab,
+            str(self.sicherung_tab): self.build_sicherung_tab,
+        }
+        self.notebook.bind("<<NotebookTabChanged>>", self.tab_gewaehlt, add="+")
+        self.root.bind("<Map>", self.fenster_sichtbar, add="+")
+        # The change cursor and the register first; housekeeping queues
+        # behind them on the database thread.
         self.refresh_all()
+        self.run_db(self.db.aenderungen_kuerzen)
+        self.run_db(self.db.snapshot_anlegen)
+        self.root.after(AENDERUNG_INTERVALL_MS, self.poll_changes)
+
+    def beenden(self):
+        self.db_executor.shutdown()
+        if self.sicherung_executor is not None:
+            # Waits for a backup that is still copying.
+            self.sicherung_executor.shutdown()
+        self.root.destroy()
+
+    def run_db(self, fn, *args, callback=None, fehler=None, beschreibung=None, executor=None):
+        """Run ``fn(*args)`` on the database thread, or on ``executor``, and hand the result to ``callback``.
+
+        Errors go to ``fehler`` or a generic error dialog. Actions with a
+        ``beschreibung`` show it next to a progress bar while they run. The
+        job and its callback are measured as part of the span that called
+        run_db().
+        """
+        auftrag = self.diagnose.auftrag(fn)
+        future = (executor or self.db_executor).submit(auftrag.ausfuehren, fn, *args)
+        callback = auftrag.rueckmeldung(callback)
+        fehler = auftrag.rueckmeldung(fehler or self.show_db_error)
+        if beschreibung is not None:
+            self.laufende_aktionen += 1
+            after_id = self.root.after(FORTSCHRITT_VERZOEGERUNG_MS, self.show_progress, beschreibung)
+
+            def mit_fortschritt(handler):
+                def aufrufen(wert):
+                    self.hide_progress(after_id)
+                    handler(wert)
+                return aufrufen
+
+            callback, fehler = mit_fortschritt(callback), mit_fortschritt(fehler)
+        self.rueckmeldung.wenn_fertig(future, callback, fehler)
+        return future
+
+    def run_page_query(self, abfrage, callback):
+        self.run_db(abfrage, callback=callback)
+
+    def show_progress(self, beschreibung):
+        self.fortschritt_label.configure(text=beschreibung)
+        self.fortschritt.pack(side="left", padx=10)
+        self.fortschritt.start(10)
+
+    def hide_progress(self, after_id):
+        self.root.after_cancel(after_id)
+        self.laufende_aktionen -= 1
+        if self.laufende_aktionen == 0:
+            self.fortschritt.stop()
+            self.fortschritt.pack_forget()
+            self.fortschritt_label.configure(text="")
+
+    def show_db_error(self, e):
+        messagebox.showerror("Datenbankfehler", str(e))
+
+    def start_messen(self, name):
+        if name not in self.startzeiten:
+            ms = (time.perf_counter() - self.gestartet) * 1000
+            self.startzeiten[name] = ms
+            self.diagnose.eintragen(name, ms)
+
+    def fenster_sichtbar(self, event):
+        # The root's bindings also see the Map events of every child.
+        if event.widget is self.root:
+            # Tk draws the window in idle callbacks queued when it was mapped.
+            self.root.after_idle(self.start_messen, "start_fenster")
+
+    def tab_gewaehlt(self, event):
+        tab = self.notebook.select()
+        if tab in self.tab_aufbau:
+            self.tab_bauen(tab)
+
+    @gemessen
+    def tab_bauen(self, tab):
+        self.tab_aufbau.pop(tab)()
+
+    def tab_vorbauen(self):
+        """Build the tabs with data one by one while the database thread has nothing else to do."""
+        offen = [
+            str(tab) for tab in (self.rueckgabe_tab, self.uebersicht_tab, self.bestand_tab)
+            if str(tab) in self.tab_aufbau
+        ]
+        if not offen:
+            return
+        if not self.rueckmeldung.beschaeftigt:
+            self.tab_bauen(offen[0])
+        self.root.after(VORBAU_PAUSE_MS, self.tab_vorbauen)
 
     def build_verleih_tab(self):
         labels = ["Name/Firma", "Telefonnummer", "Adresse des Kunden", "Ansprechpartner", "Referenznummer"]
@@ -117,11 +276,39 @@ class FlaschenVerleihApp:
         self.anzahl_entry.bind("<FocusOut>", self.update_flaschennummer_fields)
         self.anzahl_entry.bind("<Return>", self.update_flaschennummer_fields)
 
+        # Scanner mode: one input for a keyboard-wedge scanner, which types
+        # each number followed by Enter. Anzahl follows the scans.
+        self.scanner_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.verleih_tab, text="Scanner-Modus", variable=self.scanner_var, command=self.toggle_scanner,
+        ).grid(row=len(labels)+1, column=2, padx=10, pady=5, sticky="w")
+        self.scans = []
+        self.scan_set = set()
+        self.scanner_frame = ttk.Frame(self.verleih_tab, style="White.TFrame")
+        self.scanner_frame.grid(row=len(labels), column=1, columnspan=2, padx=10, pady=5, sticky="w")
+        self.scan_entry = ttk.Entry(self.scanner_frame, width=25)
+        self.scan_entry.grid(row=0, column=0, sticky="w")
+        self.scan_entry.bind("<Return>", self.scan_erfassen)
+        self.scan_entry.bind("<KP_Enter>", self.scan_erfassen)
+        self.scan_status = ttk.Label(self.scanner_frame, text="")
+        self.scan_status.grid(row=0, column=1, columnspan=2, padx=10, sticky="w")
+        self.scan_liste = tk.Listbox(self.scanner_frame, height=8, width=25, selectmode="extended")
+        self.scan_liste.grid(row=1, column=0, pady=(5, 0), sticky="nsw")
+        self.scan_liste.bind("<Delete>", self.scan_entfernen)
+        scrollbar = ttk.Scrollbar(self.scanner_frame, orient="vertical", command=self.scan_liste.yview)
+        scrollbar.grid(row=1, column=1, pady=(5, 0), sticky="nsw")
+        self.scan_liste.configure(yscrollcommand=scrollbar.set)
+        buttons = ttk.Frame(self.scanner_frame, style="White.TFrame")
+        buttons.grid(row=1, column=2, padx=10, sticky="n")
+        ttk.Button(buttons, text="Entfernen", command=self.scan_entfernen).pack(pady=(5, 2), fill="x")
+        ttk.Button(buttons, text="Leeren", command=self.scans_leeren).pack(pady=2, fill="x")
+        self.scanner_frame.grid_remove()
+
         dropdown_options = {
-            "Flaschengröße": ["10l", "20l", "50l"],
-            "Flaschendruck": ["200 bar", "300 bar"],
-            "Flasche von": ["Linde", "Air Liquide", "Eigen"],
-            "Filiale": ["Zentrale", "Nürnberg", "Würzburg", "Trudering", "Moosach"]
+            "Flaschengröße": GROESSEN,
+            "Flaschendruck": DRUECKE,
+            "Flasche von": LIEFERANTEN,
+            "Filiale": FILIALEN,
         }
         self.dropdowns = {}
         start_row = len(labels) + 2
@@ -132,25 +319,86 @@ class FlaschenVerleihApp:
             combo.current(0)
             self.dropdowns[label] = combo
 
-        save_btn = ttk.Button(self.verleih_tab, text="Speichern", command=self.verleihen)
-        save_btn.grid(row=start_row + len(dropdown_options), column=1, pady=20)
+        self.save_btn = ttk.Button(self.verleih_tab, text="Speichern", command=self.verleihen)
+        self.save_btn.grid(row=start_row + len(dropdown_options), column=1, pady=20)
 
         self.flaschennummer_entries = []
         self.update_flaschennummer_fields()
 
+    @gemessen
     def update_flaschennummer_fields(self, event=None):
-        for entry in self.flaschennummer_entries:
-            entry.destroy()
-        self.flaschennummer_entries.clear()
+        if self.scanner_var.get():
+            return
         try:
-            anzahl = int(self.anzahl_entry.get())
+            anzahl = max(int(self.anzahl_entry.get()), 0)
         except ValueError:
             anzahl = 0
-        for i in range(anzahl):
+        # Only the difference, so numbers already typed stay where they are.
+        while len(self.flaschennummer_entries) > anzahl:
+            self.flaschennummer_entries.pop().destroy()
+        while len(self.flaschennummer_entries) < anzahl:
             entry = ttk.Entry(self.flaschennummer_frame, width=15)
             entry.pack(pady=2, anchor="w")
             self.flaschennummer_entries.append(entry)
 
+    def set_anzahl(self, anzahl):
+        self.anzahl_entry.state(["!readonly"])
+        self.anzahl_entry.delete(0, tk.END)
+        self.anzahl_entry.insert(0, str(anzahl))
+        if self.scanner_var.get():
+            self.anzahl_entry.state(["readonly"])
+
+    def toggle_scanner(self):
+        if self.scanner_var.get():
+            self.flaschennummer_frame.grid_remove()
+            self.scanner_frame.grid()
+            self.set_anzahl(len(self.scans))
+            self.scan_entry.focus_set()
+        else:
+            self.scanner_frame.grid_remove()
+            self.flaschennummer_frame.grid()
+            self.set_anzahl(len(self.flaschennummer_entries))
+
+    @gemessen
+    def scan_erfassen(self, event=None):
+        # A scan is normally one number; pasted lists are split like in the
+        # return tab.
+        nummern = self.scan_entry.get().replace(",", " ").split()
+        self.scan_entry.delete(0, tk.END)
+        fehler = []
+        for nummer in nummern:
+            if nummer in self.scan_set:
+                fehler.append(f"{nummer} bereits gescannt")
+            elif nummer in self.register:
+                fehler.append(f"{nummer} ist bereits verliehen")
+            else:
+                self.scans.append(nummer)
+                self.scan_set.add(nummer)
+                self.scan_liste.insert(tk.END, nummer)
+        self.scan_liste.see(tk.END)
+        self.set_anzahl(len(self.scans))
+        if fehler:
+            self.root.bell()
+            self.scan_status.configure(text="; ".join(fehler), foreground="#c62828")
+        elif nummern:
+            self.scan_status.configure(text=f"{nummern[-1]} erfasst ({len(self.scans)})", foreground="#2e7d32")
+        return "break"
+
+    def scan_entfernen(self, event=None):
+        for index in reversed(self.scan_liste.curselection()):
+            self.scan_set.discard(self.scans.pop(index))
+            self.scan_liste.delete(index)
+        self.set_anzahl(len(self.scans))
+        self.scan_status.configure(text="")
+
+    def scans_leeren(self):
+        self.scans.clear()
+        self.scan_set.clear()
+        self.scan_liste.delete(0, tk.END)
+        self.set_anzahl(0)
+        self.scan_status.configure(text="")
+
+    @gemessen
     def verleihen(self):
         daten = [self.entries[label].get() for label in ["Name/Firma", "Telefonnummer", "Adresse des Kunden", "Ansprechpartner", "Referenznummer"]]
         dropdown_data = [self.dropdowns[label].get() for label in ["Flaschengröße", "Flaschendruck", "Flasche von", "Filiale"]]
@@ -161,54 +409,66 @@ class FlaschenVerleihApp:
             messagebox.showerror("Fehler", "Anzahl muss eine gültige Zahl sein.")
             return
 
-        flaschennummern = [entry.get() for entry in self.flaschennummer_entries if entry.get()]
-
-        if any(not d for d in daten) or any(not d for d in dropdown_data):
-            messagebox.showerror("Fehler", "Bitte alle Felder ausfüllen.")
-            return
+        if self.scanner_var.get():
+            flaschennummern = list(self.scans)
+        else:
+            flaschennummern = [entry.get() for entry in self.flaschennummer_entries if entry.get()]
 
-        if not flaschennummern:
-            messagebox.showerror("Fehler", "Bitte Flaschennummer(n) eingeben.")
-            return
-        
-        if anzahl != len(flaschennummern):
-            messagebox.showerror("Fehler", f"Anzahl ({anzahl}) stimmt nicht mit der Anzahl der Flaschennummern ({len(flaschennummern)}) überein.")
+        fehler = verleih_fehler(daten, dropdown_data, anzahl, flaschennummern)
+        if fehler:
+            messagebox.showerror("Fehler", fehler)
             return
-
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        placeholders = ",".join("?"*len(flaschennummern))
-        c.execute(f"SELECT flaschennummer FROM verleih WHERE flaschennummer IN ({placeholders}) AND status = 'verliehen'", flaschennummern)
-        existierende = {row[0] for row in c.fetchall()}
-        if existierende:
-            messagebox.showerror("Fehler", f"Diese Flaschennummer(n) sind bereits verliehen: {', '.join(existierende)}")
-            conn.close()
+        # Caught here without a round trip; verleih_anlegen() checks again.
+        belegt = self.register.verliehene(flaschennummern)
+        if belegt:
+            self.bereits_verliehen(belegt)
             return
 
-        for fl_num in flaschennummern:
-            c.execute("""
-                INSERT INTO verleih (
-                    name, telefon, adresse, ansprechpartner, referenznummer,
-                    flaschennummer, flaschengroesse, flaschendruck,
-                    flasche_von, filiale, anzahl, verliehen_am, status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (*daten, fl_num, *dropdown_data, anzahl, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "verliehen"))
-
-        conn.commit()
-        conn.close()
-        self.update_stock(
-            self.dropdowns["Filiale"].get(),
-            self.dropdowns["Flaschengröße"].get(),
-            self.dropdowns["Flaschendruck"].get(),
-            -anzahl,
+        self.save_btn.state(["disabled"])
+        self.run_db(
+            self.db.verleih_anlegen, daten, *dropdown_data, flaschennummern,
+            callback=lambda ergebnis: self.verleihen_fertig(ergebnis, daten, dropdown_data, flaschennummern),
+            fehler=self.verleihen_fehler, beschreibung="Verleih wird gespeichert …",
         )
+
+    def verleihen_fehler(self, e):
+        self.save_btn.state(["!disabled"])
+        if isinstance(e, FlaschenBereitsVerliehen):
+            # Lent by another client since the last change poll.
+            self.apply_changes()
+            self.bereits_verliehen(e.flaschennummern)
+        elif isinstance(e, FlaschenAusgemustert):
+            self.scans_markieren(e.flaschennummern)
+            messagebox.showerror(
+                "Fehler", f"Diese Flaschennummer(n) sind ausgemustert: {', '.join(sorted(e.flaschennummern))}"
+            )
+        else:
+            self.show_db_error(e)
+
+    def bereits_verliehen(self, flaschennummern):
+        self.scans_markieren(flaschennummern)
+        messagebox.showerror("Fehler", f"Diese Flaschennummer(n) sind bereits verliehen: {', '.join(sorted(flaschennummern))}")
+
+    def scans_markieren(self, flaschennummern):
+        for index, nummer in enumerate(self.scans):
+            if nummer in flaschennummern:
+                self.scan_liste.itemconfigure(index, foreground="#c62828")
+
+    def verleihen_fertig(self, ergebnis, daten, dropdown_data, flaschennummern):
+        self.save_btn.state(["!disabled"])
+        self.register.verleihen(*ergebnis, daten, dropdown_data, flaschennummern)
         messagebox.showinfo("Erfolg", "Flasche(n) erfolgreich verliehen.")
-        self.refresh_all()
+        self.apply_changes()
         for entry in self.entries.values():
             entry.delete(0, tk.END)
-        self.anzahl_entry.delete(0, tk.END)
-        self.anzahl_entry.insert(0, "1")
-        self.update_flaschennummer_fields()
+        if self.scanner_var.get():
+            self.scans_leeren()
+            self.scan_entry.focus_set()
+        else:
+            for entry in self.flaschennummer_entries:
+                entry.delete(0, tk.END)
+            self.set_anzahl(1)
+            self.update_flaschennummer_fields()
 
 
     def build_rueckgabe_tab(self):
@@ -217,21 +477,46 @@ class FlaschenVerleihApp:
         ttk.Label(frame, text="Suche:").pack(side="left", padx=(0,5))
         self.search_entry = ttk.Entry(frame)
         self.search_entry.pack(side="left", padx=5, fill="x", expand=True)
-        status_check = ttk.Checkbutton(frame, text="Nur nicht zurückgegeben", variable=self.status_var_rueckgabe, onvalue="verliehen", offvalue="")
+        self.search_entry.bind("<KeyRelease>", lambda event: self.schedule_filter(self.filter_rueckgabe))
+        status_check = ttk.Checkbutton(frame, text="Nur nicht zurückgegeben", variable=self.status_var_rueckgabe, onvalue="verliehen", offvalue="", command=self.filter_rueckgabe)
         status_check.pack(side="left", padx=5)
-        search_btn = ttk.Button(frame, text="Filtern", command=self.filter_rueckgabe)
-        search_btn.pack(side="left")
 
         columns = ("Name", "Flaschennummer", "Flaschengröße", "Filiale", "Anzahl", "Verleihdatum", "Status")
-        self.tree_rueckgabe = ttk.Treeview(self.rueckgabe_tab, columns=columns, show="headings")
+        tree_frame = ttk.Frame(self.rueckgabe_tab, style="White.TFrame")
+        tree_frame.pack(expand=True, fill="both", padx=10, pady=5)
+        self.tree_rueckgabe = ttk.Treeview(tree_frame, columns=columns, show="headings")
         for col in columns:
             self.tree_rueckgabe.heading(col, text=col)
             self.tree_rueckgabe.column(col, anchor="center", width=120)
-        self.tree_rueckgabe.pack(expand=True, fill="both", padx=10, pady=5)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical")
+        scrollbar.pack(side="right", fill="y")
+        self.tree_rueckgabe.pack(side="left", expand=True, fill="both")
+        self.diagnose.beobachten(self.tree_rueckgabe)
         self.tree_rueckgabe.bind("<Double-1>", self.show_details)
+        self.tree_rueckgabe.bind("<<TreeviewSelect>>", self.details_vorladen_planen)
+        self.tree_rueckgabe.tag_configure("green", background="#d4edda")
+        self.tree_rueckgabe.tag_configure("red", background="#f8d7da")
+        self.liste_rueckgabe = VirtualTreeview(
+            self.tree_rueckgabe, self.db.verleihvorgaenge, self.vorgang_schluessel,
+            lambda row: (row[7], row[:7], (self.vorgang_farbe(row),)),
+            scrollbar=scrollbar, ausfuehren=self.run_page_query,
+        )
+        self.sortierung_rueckgabe = Spaltensortierung(
+            self.tree_rueckgabe, {col: VORGANG_SORTIERUNG[col] for col in columns}, self.filter_rueckgabe
+        )
+        self.listen.append(self.liste_rueckgabe)
+        self.liste_rueckgabe.neu_laden()
 
-        btn = ttk.Button(self.rueckgabe_tab, text="Als zurückgegeben markieren", command=self.mark_returned)
-        btn.pack(pady=10)
+        btn_frame = ttk.Frame(self.rueckgabe_tab, style="White.TFrame")
+        btn_frame.pack(pady=10, fill="x", padx=10)
+        btn = ttk.Button(btn_frame, text="Als zurückgegeben markieren", command=self.mark_returned)
+        btn.pack(side="left")
+        ttk.Label(btn_frame, text="Flaschennummer(n):").pack(side="left", padx=(20, 5))
+        self.rueckgabe_nummern_entry = ttk.Entry(btn_frame)
+        self.rueckgabe_nummern_entry.pack(side="left", padx=5, fill="x", expand=True)
+        self.rueckgabe_nummern_entry.bind("<Return>", lambda event: self.return_by_number())
+        nummern_btn = ttk.Button(btn_frame, text="Zurückgeben", command=self.return_by_number)
+        nummern_btn.pack(side="left")
 
     def build_uebersicht_tab(self):
         frame = ttk.Frame(self.uebersicht_tab, style="White.TFrame")
@@ -239,38 +524,59 @@ class FlaschenVerleihApp:
         ttk.Label(frame, text="Suche:").pack(side="left", padx=(0,5))
         self.search_entry_uebersicht = ttk.Entry(frame)
         self.search_entry_uebersicht.pack(side="left", padx=5, fill="x", expand=True)
-        status_check = ttk.Checkbutton(frame, text="Nur nicht zurückgegeben", variable=self.status_var_uebersicht, onvalue="verliehen", offvalue="")
+        self.search_entry_uebersicht.bind("<KeyRelease>", lambda event: self.schedule_filter(self.filter_uebersicht))
+        status_check = ttk.Checkbutton(frame, text="Nur nicht zurückgegeben", variable=self.status_var_uebersicht, onvalue="verliehen", offvalue="", command=self.filter_uebersicht)
         status_check.pack(side="left", padx=5)
-        search_btn = ttk.Button(frame, text="Filtern", command=self.filter_uebersicht)
-        search_btn.pack(side="left")
+        archiv_check = ttk.Checkbutton(frame, text="Mit Archiv", variable=self.archiv_var_uebersicht, command=self.filter_uebersicht)
+        archiv_check.pack(side="left", padx=5)
 
         columns = ("Name", "Flaschennummer", "Filiale", "Anzahl", "Status")
-        self.tree_uebersicht = ttk.Treeview(self.uebersicht_tab, columns=columns, show="headings")
+        tree_frame = ttk.Frame(self.uebersicht_tab, style="White.TFrame")
+        tree_frame.pack(expand=True, fill="both", padx=10, pady=5)
+        self.tree_uebersicht = ttk.Treeview(tree_frame, columns=columns, show="headings")
         for col in columns:
             self.tree_uebersicht.heading(col, text=col)
             self.tree_uebersicht.column(col, anchor="center", width=150)
-        self.tree_uebersicht.pack(expand=True, fill="both", padx=10, pady=5)
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical")
+        scrollbar.pack(side="right", fill="y")
+        self.tree_uebersicht.pack(side="left", expand=True, fill="both")
+        self.diagnose.beobachten(self.tree_uebersicht)
         self.tree_uebersicht.bind("<Double-1>", self.show_details)
+        self.tree_uebersicht.bind("<<TreeviewSelect>>", self.details_vorladen_planen)
+        self.tree_uebersicht.tag_configure("green", background="#d4edda")
+        self.tree_uebersicht.tag_configure("red", background="#f8d7da")
+        self.liste_uebersicht = VirtualTreeview(
+            self.tree_uebersicht, self.db.verleihvorgaenge, self.vorgang_schluessel,
+            lambda row: (row[7], (row[0], row[1], row[3], row[4], row[6]), (self.vorgang_farbe(row),)),
+            scrollbar=scrollbar, ausfuehren=self.run_page_query,
+        )
+        self.sortierung_uebersicht = Spaltensortierung(
+            self.tree_uebersicht, {col: VORGANG_SORTIERUNG[col] for col in columns}, self.filter_uebersicht
+        )
+        self.listen.append(self.liste_uebersicht)
+        self.liste_uebersicht.neu_laden()
+
+    vorgang_schluessel = staticmethod(vorgang_schluessel)
+
+    @staticmethod
+    def vorgang_farbe(row):
+        return "green" if row[6] == "zurückgegeben" else "red"
 
     def build_bestand_tab(self):
         frame = ttk.Frame(self.bestand_tab, style="White.TFrame")
         frame.pack(pady=20, padx=10)
         ttk.Label(frame, text="Filiale:").grid(row=0, column=0, padx=5, pady=5, sticky="e")
-        self.bestand_filiale = ttk.Combobox(
-            frame,
-            values=["Zentrale", "Nürnberg", "Würzburg", "Trudering", "Moosach"],
-            state="readonly",
-        )
+        self.bestand_filiale = ttk.Combobox(frame, values=FILIALEN, state="readonly")
         self.bestand_filiale.grid(row=0, column=1, padx=5, pady=5)
         self.bestand_filiale.current(0)
 
         ttk.Label(frame, text="Flaschengröße:").grid(row=1, column=0, padx=5, pady=5, sticky="e")
-        self.bestand_groesse = ttk.Combobox(frame, values=["10l", "20l", "50l"], state="readonly")
+        self.bestand_groesse = ttk.Combobox(frame, values=GROESSEN, state="readonly")
         self.bestand_groesse.grid(row=1, column=1, padx=5, pady=5)
         self.bestand_groesse.current(0)
 
         ttk.Label(frame, text="Flaschendruck:").grid(row=2, column=0, padx=5, pady=5, sticky="e")
-        self.bestand_druck = ttk.Combobox(frame, values=["200 bar", "300 bar"], state="readonly")
+        self.bestand_druck = ttk.Combobox(frame, values=DRUECKE, state="readonly")
         self.bestand_druck.grid(row=2, column=1, padx=5, pady=5)
         self.bestand_druck.current(0)
 
@@ -280,28 +586,399 @@ class FlaschenVerleihApp:
 
         btn = ttk.Button(frame, text="Bestand setzen", command=self.set_bestand)
         btn.grid(row=4, column=1, pady=10, sticky="e")
+        btn = ttk.Button(frame, text="Gesamt aus Flaschenregister", command=self.bestand_aus_register)
+        btn.grid(row=5, column=1, sticky="e")
 
-        columns = ("Filiale", "Flaschengröße", "Flaschendruck", "Bestand")
+        columns = ("Filiale", "Flaschengröße", "Flaschendruck", "Bestand", "Verliehen", "Gesamt")
         self.tree_bestand = ttk.Treeview(self.bestand_tab, columns=columns, show="headings")
         for col in columns:
             self.tree_bestand.heading(col, text=col)
             self.tree_bestand.column(col, anchor="center")
         self.tree_bestand.pack(expand=True, fill="both", padx=10, pady=10)
+        self.diagnose.beobachten(self.tree_bestand)
+        self.sortierung_bestand = Spaltensortierung(self.tree_bestand, BESTAND_SORTIERUNG, self.refresh_bestand)
         self.refresh_bestand()
 
+    def build_flaschen_tab(self):
+        frame = ttk.Frame(self.flaschen_tab, style="White.TFrame")
+        frame.pack(pady=20, padx=10)
+        ttk.Label(frame, text="Flaschennummer:").grid(row=0, column=0, padx=5, pady=5, sticky="e")
+        self.flasche_entry = ttk.Entry(frame, width=33)
+        self.flasche_entry.grid(row=0, column=1, padx=5, pady=5)
+        self.flasche_entry.bind("<Return>", lambda event: self.flasche_anzeigen())
+        ttk.Button(frame, text="Anzeigen", command=self.flasche_anzeigen).grid(row=0, column=2, padx=5, pady=5)
+
+        # Where the bottle belongs; a new bottle is registered with these.
+        self.flasche_felder = {}
+        felder = [
+            ("Flaschengröße", GROESSEN),
+            ("Flaschendruck", DRUECKE),
+            ("Flasche von", LIEFERANTEN),
+            ("Filiale", FILIALEN),
+        ]
+        for i, (label, values) in enumerate(felder, start=1):
+            ttk.Label(frame, text=f"{label}:").grid(row=i, column=0, padx=5, pady=5, sticky="e")
+            combo = ttk.Combobox(frame, values=values, state="readonly", width=30)
+            combo.grid(row=i, column=1, padx=5, pady=5)
+            combo.current(0)
+            self.flasche_felder[label] = combo
+        ttk.Label(frame, text="Nächste Prüfung (JJJJ-MM-TT):").grid(
+            row=len(felder) + 1, column=0, padx=5, pady=5, sticky="e"
+        )
+        self.flasche_pruefung = ttk.Entry(frame, width=33)
+        self.flasche_pruefung.grid(row=len(felder) + 1, column=1, padx=5, pady=5)
+        self.flasche_status = ttk.Label(frame, text="")
+        self.flasche_status.grid(row=len(felder) + 2, column=1, padx=5, sticky="w")
+
+        buttons = ttk.Frame(frame, style="White.TFrame")
+        buttons.grid(row=len(felder) + 3, column=1, columnspan=2, pady=10, sticky="e")
+        ttk.Button(buttons, text="Speichern", command=self.flasche_speichern).pack(side="left", padx=2)
+        ttk.Button(buttons, text="Prüfung eintragen", command=self.flasche_pruefen).pack(side="left", padx=2)
+        ttk.Button(buttons, text="Ausmustern", command=self.flasche_ausmustern).pack(side="left", padx=2)
+
+        self.flasche_lebenslauf = tk.Text(self.flaschen_tab, height=12, state="disabled", font=("Segoe UI", 10))
+        self.flasche_lebenslauf.pack(expand=True, fill="both", padx=10, pady=10)
+
+    def flasche_nummer(self):
+        nummer = self.flasche_entry.get().strip()
+        if not nummer:
+            messagebox.showerror("Fehler", "Bitte eine Flaschennummer eingeben.")
+        return nummer
+
+    @gemessen
+    def flasche_anzeigen(self):
+        nummer = self.flasche_nummer()
+        if nummer:
+            self.run_db(self.db.flasche, nummer, callback=lambda ergebnis: self.show_flasche(nummer, ergebnis))
+
+    def show_flasche(self, nummer, ergebnis):
+        self.flasche_lebenslauf.configure(state="normal")
+        self.flasche_lebenslauf.delete("1.0", tk.END)
+        if ergebnis is None:
+            self.flasche_status.configure(text="Nicht registriert; Speichern legt sie an.")
+            self.flasche_pruefung.delete(0, tk.END)
+            self.flasche_lebenslauf.configure(state="disabled")
+            return
+        stamm, lebenslauf = ergebnis
+        for label, wert in zip(self.flasche_felder, stamm[1:5]):
+            self.flasche_felder[label].set(wert)
+        self.flasche_pruefung.delete(0, tk.END)
+        self.flasche_pruefung.insert(0, stamm[5] or "")
+        vorgang = self.register.vorgang(nummer)
+        if stamm[6]:
+            status = f"Ausgemustert am {stamm[6]}"
+        elif vorgang is not None:
+            status = f"Verliehen an {vorgang.kunde.name} seit {vorgang.verliehen_am}"
+        else:
+            status = "In Betrieb"
+        self.flasche_status.configure(text=status)
+        for zeit, ereignis, angabe in lebenslauf:
+            self.flasche_lebenslauf.insert(tk.END, f"{zeit}  {ereignis}{f': {angabe}' if angabe else ''}\n")
+        self.flasche_lebenslauf.configure(state="disabled")
+
+    @gemessen
+    def flasche_speichern(self):
+        nummer = self.flasche_nummer()
+        if not nummer:
+            return
+        stammdaten = [combo.get() for combo in self.flasche_felder.values()]
+        self.run_db(self.db.flasche_speichern, nummer, *stammdaten, callback=lambda _: self.flasche_anzeigen())
+
+    @gemessen
+    def flasche_pruefen(self):
+        nummer = self.flasche_nummer()
+        if not nummer:
+            return
+        datum = self.flasche_pruefung.get().strip()
+        try:
+            datetime.strptime(datum, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Fehler", "Nächste Prüfung muss im Format JJJJ-MM-TT sein.")
+            return
+
+        def fertig(geaendert):
+            if not geaendert:
+                messagebox.showerror("Fehler", f"Flasche {nummer} ist nicht registriert.")
+            self.flasche_anzeigen()
+
+        self.run_db(self.db.flasche_pruefen, nummer, datum, callback=fertig)
+
+    @gemessen
+    def flasche_ausmustern(self):
+        nummer = self.flasche_nummer()
+        if not nummer or not messagebox.askyesno(
+            "Ausmustern", f"Flasche {nummer} ausmustern? Sie kann danach nicht mehr verliehen werden."
+        ):
+            return
+
+        def fertig(geaendert):
+            if not geaendert:
+                messagebox.showerror("Fehler", f"Flasche {nummer} ist nicht registriert oder schon ausgemustert.")
+            self.flasche_anzeigen()
+
+        def fehler(e):
+            if isinstance(e, FlaschenBereitsVerliehen):
+                messagebox.showerror("Fehler", f"Flasche {nummer} ist verliehen und muss erst zurückkommen.")
+            else:
+                self.show_db_error(e)
+
+        self.run_db(self.db.flasche_ausmustern, nummer, callback=fertig, fehler=fehler)
+
+    BERICHTE = {
+        "Kunden mit offenen Flaschen": "kunden",
+        "Altersstruktur offener Flaschen": "alter",
+        "Auslastung je Filiale": "auslastung",
+        "Bestand zum Stichtag": "stichtag",
+        "Ereignisprotokoll": "ereignisse",
+        "Gesamter Verlauf": "verlauf",
+        "Prüfung fällig (bis Stichtag)": "pruefung",
+        "Flaschenbestand laut Register": "flaschenbestand",
+    }
+    FORMATE = {"CSV (Excel)": ("csv", ".csv"), "JSON Lines": ("jsonl", ".jsonl")}
+
+    def build_berichte_tab(self):
+        frame = ttk.Frame(self.berichte_tab, style="White.TFrame")
+        frame.pack(pady=20, padx=10)
+        self.bericht_felder = {}
+        felder = [
+            ("Bericht", list(self.BERICHTE)),
+            ("Format", list(self.FORMATE)),
+            ("Filiale", ["", *FILIALEN]),
+            ("Flaschengröße", ["", *GROESSEN]),
+            ("Flaschendruck", ["", *DRUECKE]),
+            ("Flasche von", ["", *LIEFERANTEN]),
+        ]
+        for i, (label, values) in enumerate(felder):
+            ttk.Label(frame, text=f"{label}:").grid(row=i, column=0, padx=5, pady=5, sticky="e")
+            combo = ttk.Combobox(frame, values=values, state="readonly", width=30)
+            combo.grid(row=i, column=1, padx=5, pady=5)
+            combo.current(0)
+            self.bericht_felder[label] = combo
+        ttk.Label(frame, text="Mindestens Tage verliehen:").grid(row=len(felder), column=0, padx=5, pady=5, sticky="e")
+        self.bericht_mindestalter = ttk.Entry(frame, width=33)
+        self.bericht_mindestalter.grid(row=len(felder), column=1, padx=5, pady=5)
+        ttk.Label(frame, text="Stichtag (JJJJ-MM-TT):").grid(row=len(felder) + 1, column=0, padx=5, pady=5, sticky="e")
+        self.bericht_stichtag = ttk.Entry(frame, width=33)
+        self.bericht_stichtag.grid(row=len(felder) + 1, column=1, padx=5, pady=5)
+        ttk.Label(frame, text="Leere Felder filtern nicht.").grid(row=len(felder) + 2, column=1, sticky="w", padx=5)
+        self.export_btn = ttk.Button(frame, text="Exportieren …", command=self.export_bericht)
+        self.export_btn.grid(row=len(felder) + 3, column=1, pady=10, sticky="e")
+
+    @gemessen
+    def export_bericht(self):
+        name = self.BERICHTE[self.bericht_felder["Bericht"].get()]
+        format, endung = self.FORMATE[self.bericht_felder["Format"].get()]
+        mindestalter = self.bericht_mindestalter.get().strip()
+        if mindestalter and not mindestalter.isdigit():
+            messagebox.showerror("Fehler", "Mindestens Tage verliehen muss eine ganze Zahl sein.")
+            return
+        stichtag = self.bericht_stichtag.get().strip()
+        if stichtag:
+            try:
+                datetime.strptime(stichtag, "%Y-%m-%d")
+            except ValueError:
+                messagebox.showerror("Fehler", "Stichtag muss im Format JJJJ-MM-TT sein.")
+                return
+            # The whole day counts.
+            stichtag += " 23:59:59"
+        datei = filedialog.asksaveasfilename(
+            defaultextension=endung, initialfile=f"{name}{endung}", filetypes=[(format.upper(), f"*{endung}")]
+        )
+        if not datei:
+            return
+        filter = {
+            "filiale": self.bericht_felder["Filiale"].get() or None,
+            "flaschengroesse": self.bericht_felder["Flaschengröße"].get() or None,
+            "flaschendruck": self.bericht_felder["Flaschendruck"].get() or None,
+            "flasche_von": self.bericht_felder["Flasche von"].get() or None,
+            "mindestalter": int(mindestalter) if mindestalter else None,
+            "stichtag": stichtag or None,
+        }
+        self.export_btn.state(["disabled"])
+
+        def fertig(anzahl):
+            self.export_btn.state(["!disabled"])
+            messagebox.showinfo("Bericht", f"{anzahl} Zeilen nach {datei} exportiert.")
+
+        def fehler(e):
+            self.export_btn.state(["!disabled"])
+            self.show_db_error(e)
+
+        self.run_db(
+            functools.partial(exportieren, self.db, name, datei, format, **filter),
+            callback=fertig, fehler=fehler, beschreibung="Bericht wird exportiert …",
+        )
+
+    def build_sicherung_tab(self):
+        self.sicherung_executor = DBExecutor(self.sicherung_verbinden)
+        frame = ttk.Frame(self.sicherung_tab, style="White.TFrame")
+        frame.pack(fill="x", padx=10, pady=5)
+        self.sicherung_buttons = [
+            ttk.Button(frame, text="Jetzt sichern", command=self.sicherung_anlegen),
+            ttk.Button(frame, text="Wiederherstellen …", command=self.sicherung_wiederherstellen),
+        ]
+        for btn in self.sicherung_buttons:
+            btn.pack(side="left", padx=(0, 5))
+        ttk.Button(frame, text="Aktualisieren", command=self.refresh_sicherungen).pack(side="left")
+        self.sicherung_status = ttk.Label(frame, text="")
+        self.sicherung_status.pack(side="left", padx=10)
+
+        columns = ("Zeitpunkt", "Größe", "Archiv", "Kopie s", "Prüfung s")
+        self.tree_sicherung = ttk.Treeview(self.sicherung_tab, columns=columns, show="headings", selectmode="browse")
+        for col in columns:
+            self.tree_sicherung.heading(col, text=col)
+            self.tree_sicherung.column(col, anchor="center")
+        self.tree_sicherung.pack(expand=True, fill="both", padx=10, pady=10)
+        self.refresh_sicherungen()
+
+    def refresh_sicherungen(self):
+        db = self.sicherung_executor.db
+        self.run_db(db.sicherungen, callback=self.show_sicherungen, executor=self.sicherung_executor)
+
+    def show_sicherungen(self, eintraege):
+        self.tree_sicherung.delete(*self.tree_sicherung.get_children())
+        for eintrag in eintraege:
+            if eintrag["archiv"] is None:
+                archiv = ""
+            elif eintrag["archiv"] == eintrag["name"] + "-archiv.db":
+                archiv = "kopiert"
+            else:
+                archiv = "unverändert"
+            self.tree_sicherung.insert("", "end", iid=eintrag["name"], values=(
+                eintrag["zeit"], f"{eintrag['groesse'] / 2**20:.0f} MiB", archiv,
+                f"{eintrag['sekunden']:.1f}", f"{eintrag['pruefung_sekunden']:.1f}",
+            ))
+
+    def sicherung_laeuft(self, laeuft):
+        for btn in self.sicherung_buttons:
+            btn.state(["disabled" if laeuft else "!disabled"])
+
+    @gemessen
+    def sicherung_anlegen(self):
+        self.sicherung_laeuft(True)
+
+        def fertig(eintrag):
+            self.sicherung_laeuft(False)
+            self.sicherung_status.configure(text=f"Gesichert: Stand vom {eintrag['zeit']}")
+            self.refresh_sicherungen()
+
+        def fehler(e):
+            self.sicherung_laeuft(False)
+            self.show_db_error(e)
+
+        self.run_db(
+            self.sicherung_executor.db.sichern, callback=fertig, fehler=fehler,
+            beschreibung="Datenbank wird gesichert …", executor=self.sicherung_executor,
+        )
+
+    @gemessen
+    def sicherung_wiederherstellen(self):
+        auswahl = self.tree_sicherung.selection()
+        if not auswahl:
+            messagebox.showinfo("Wiederherstellen", "Bitte zuerst eine Sicherung auswählen.")
+            return
+        zeit = self.tree_sicherung.set(auswahl[0], "Zeitpunkt")
+        if not messagebox.askyesno(
+            "Wiederherstellen",
+            f"Den Stand vom {zeit} wiederherstellen? Was seitdem eingegeben wurde, fehlt danach überall, "
+            "wo mit dieser Datenbank gearbeitet wird. Der jetzige Stand wird vorher gesichert.",
+        ):
+            return
+        self.sicherung_laeuft(True)
+
+        def fertig(vorher):
+            self.sicherung_laeuft(False)
+            self.sicherung_status.configure(
+                text=f"Stand vom {zeit} wiederhergestellt; der vorherige ist als {vorher['zeit']} gesichert."
+            )
+            self.refresh_sicherungen()
+            self.refresh_all()
+
+        def fehler(e):
+            self.sicherung_laeuft(False)
+            self.show_db_error(e)
+
+        self.run_db(
+            self.sicherung_executor.db.wiederherstellen, auswahl[0], callback=fertig, fehler=fehler,
+            beschreibung="Sicherung wird wiederhergestellt …", executor=self.sicherung_executor,
+        )
+
+    def build_diagnose_tab(self):
+        frame = ttk.Frame(self.diagnose_tab, style="White.TFrame")
+        frame.pack(fill="x", padx=10, pady=5)
+        ttk.Button(frame, text="Aktualisieren", command=self.show_diagnose).pack(side="left")
+        ttk.Button(frame, text="Zurücksetzen", command=self.reset_diagnose).pack(side="left", padx=5)
+        self.sql_mitschneiden_var = tk.BooleanVar(value=self.diagnose.sql_mitschneiden)
+        ttk.Checkbutton(
+            frame, text="SQL mitschneiden", variable=self.sql_mitschneiden_var, command=self.toggle_sql_mitschnitt,
+        ).pack(side="left", padx=5)
+
+        columns = ("Vorgang", "Aufrufe", "p50 ms", "p95 ms", "p99 ms", "max ms", "SQL", "Zeilen", "Einträge")
+        self.tree_diagnose = ttk.Treeview(self.diagnose_tab, columns=columns, show="headings", height=12)
+        for col in columns:
+            self.tree_diagnose.heading(col, text=col)
+            self.tree_diagnose.column(col, anchor="e", width=70)
+        self.tree_diagnose.column("Vorgang", anchor="w", width=260)
+        self.tree_diagnose.pack(fill="both", expand=True, padx=10, pady=5)
+
+        ttk.Label(self.diagnose_tab, text="Letzte langsame Aktion (SQL, Zeilen und Einträge oben je Aufruf):").pack(
+            anchor="w", padx=10
+        )
+        self.diagnose_text = tk.Text(self.diagnose_tab, height=12, font=("Courier", 9), wrap="none")
+        self.diagnose_text.pack(fill="both", expand=True, padx=10, pady=5)
+        self.notebook.bind("<<NotebookTabChanged>>", lambda event: self.show_diagnose(), add="+")
+
+    def toggle_diagnose(self, event=None):
+        if self.notebook.tab(self.diagnose_tab, "state") == "hidden":
+            self.notebook.add(self.diagnose_tab)
+            self.notebook.select(self.diagnose_tab)
+        else:
+            self.notebook.hide(self.diagnose_tab)
+
+    def toggle_sql_mitschnitt(self):
+        self.diagnose.sql_mitschneiden = self.sql_mitschneiden_var.get()
+
+    def reset_diagnose(self):
+        self.diagnose.zuruecksetzen()
+        self.show_diagnose()
+
+    def show_diagnose(self):
+        if self.diagnose_after_id is not None:
+            self.root.after_cancel(self.diagnose_after_id)
+            self.diagnose_after_id = None
+        if self.notebook.select() != str(self.diagnose_tab):
+            return
+        self.tree_diagnose.delete(*self.tree_diagnose.get_children())
+        for name, aufrufe, p50, p95, p99, maximum, sql, zeilen, eintraege in self.diagnose.tabelle():
+            self.tree_diagnose.insert("", "end", values=(
+                name, aufrufe, f"{p50:.2f}", f"{p95:.2f}", f"{p99:.2f}", f"{maximum:.2f}",
+                f"{sql:.1f}", f"{zeilen:.1f}", f"{eintraege:.1f}",
+            ))
+        cache = self.details_cache
+        zeilen = [
+            f"Detail-Cache: {len(cache)} von {cache.groesse} Vorgängen, {cache.treffer} Treffer, "
+            f"{cache.fehlgriffe} Fehlgriffe",
+            "",
+        ]
+        zeilen += self.diagnose.flamme() or [f"Noch keine Aktion über {self.diagnose.langsam_ms} ms."]
+        if self.diagnose.sql_mitschneiden:
+            zeilen += ["", "Letzte SQL-Anweisungen:"]
+            zeilen += [f"{zeit}  {name:<30} {sql}" for zeit, name, sql in reversed(self.diagnose.sql)]
+        self.diagnose_text.delete("1.0", tk.END)
+        self.diagnose_text.insert("1.0", "\n".join(zeilen))
+        # Kept current while the tab is in front.
+        self.diagnose_after_id = self.root.after(DIAGNOSE_INTERVALL_MS, self.show_diagnose)
+
     def refresh_bestand(self):
+        self.run_db(self.db.bestand_liste, self.sortierung_bestand.sortierung, callback=self.show_bestand)
+
+    def show_bestand(self, rows):
         for item in self.tree_bestand.get_children():
             self.tree_bestand.delete(item)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute(
-            "SELECT filiale, flaschengroesse, flaschendruck, bestand FROM bestand ORDER BY filiale, flaschengroesse, flaschendruck"
-        )
-        rows = c.fetchall()
-        conn.close()
         for row in rows:
-            self.tree_bestand.insert("", "end", values=row)
+            self.tree_bestand.insert("", "end", values=row[1:], iid=row[0])
 
+    @gemessen
     def set_bestand(self):
         filiale = self.bestand_filiale.get()
         groesse = self.bestand_groesse.get()
@@ -311,121 +988,225 @@ class FlaschenVerleihApp:
         except ValueError:
             messagebox.showerror("Fehler", "Ungültiger Bestandswert. Bitte eine Zahl eingeben.")
             return
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute(
-            "UPDATE bestand SET bestand=? WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?",
-            (menge, filiale, groesse, druck),
-        )
-        conn.commit()
-        conn.close()
         self.bestand_entry.delete(0, tk.END)
-        self.refresh_bestand()
+        self.run_db(self.db.bestand_setzen, filiale, groesse, druck, menge, callback=lambda _: self.apply_changes())
 
-    def update_stock(self, filiale, groesse, druck, delta):
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute(
-            "UPDATE bestand SET bestand = bestand + ? WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?",
-            (delta, filiale, groesse, druck),
-        )
-        conn.commit()
-        conn.close()
-        self.refresh_bestand()
+    @gemessen
+    def bestand_aus_register(self):
+        if not messagebox.askyesno(
+            "Bestand", "Gesamt jeder Zelle auf die registrierten Flaschen in Betrieb setzen, die dort hingehören?"
+        ):
+            return
+
+        def fertig(zellen):
+            self.apply_changes()
+            messagebox.showinfo("Bestand", f"{zellen} Zelle(n) angepasst.")
 
+        self.run_db(self.db.bestand_aus_register, callback=fertig)
+
+    @gemessen
     def refresh_all(self):
-        for tree in [self.tree_rueckgabe, self.tree_uebersicht]:
-            for item in tree.get_children():
-                tree.delete(item)
-
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("""
-            SELECT
-                name,
-                GROUP_CONCAT(flaschennummer, ', ') as flaschennummern,
-                flaschengroesse,
-                filiale,
-                anzahl,
-                verliehen_am,
-                status,
-                id
-            FROM verleih
-            GROUP BY
-                name, flaschengroesse, filiale, anzahl, verliehen_am, status, referenznummer, ansprechpartner, telefon, adresse
-            ORDER BY verliehen_am DESC
-        """)
-        rows = c.fetchall()
+        self.run_db(self.db.aenderung_stand, callback=self.reload_lists)
 
-        for row in rows:
-            color_tag = "green" if row[6] == "zurückgegeben" else "red"
-            values_rueckgabe = (row[0], row[1], row[2], row[3], row[4], row[5], row[6])
-            self.tree_rueckgabe.insert("", "end", values=values_rueckgabe, tags=(color_tag,), iid=row[7])
-            values_uebersicht = (row[0], row[1], row[3], row[4], row[6])
-            self.tree_uebersicht.insert("", "end", values=values_uebersicht, tags=(color_tag,), iid=row[7])
+    def reload_lists(self, stand):
+        self.aenderung_cursor = stand[1]
+        self.details_cache.leeren()
+        for liste in self.listen:
+            liste.neu_laden()
+        if self.tree_bestand is not None:
+            self.refresh_bestand()
+        # After the lists, so their first pages are not held up; until it
+        # arrives the register is not geladen and the SQL paths are used.
+        self.run_db(self.db.flaschen_register, callback=self.register_laden)
 
-        conn.close()
+    def register_laden(self, daten):
+        self.register.laden(daten)
+        if "start_bereit" not in self.startzeiten:
+            self.start_messen("start_bereit")
+            self.root.after(VORBAU_PAUSE_MS, self.tab_vorbauen)
 
-        self.tree_rueckgabe.tag_configure("green", background="#d4edda")
-        self.tree_uebersicht.tag_configure("green", background="#d4edda")
-        self.tree_rueckgabe.tag_configure("red", background="#f8d7da")
-        self.tree_uebersicht.tag_configure("red", background="#f8d7da")
-        self.refresh_bestand()
+    @gemessen
+    def apply_changes(self):
+        if self.aenderung_cursor is None:
+            return
+        if self.changes_running:
+            self.changes_again = True
+            return
+        self.changes_running = True
+        self.run_db(
+            self.read_changes, self.aenderung_cursor, [liste.filter for liste in self.listen],
+            callback=self.show_changes, fehler=self.changes_failed,
+        )
+
+    def read_changes(self, cursor, filter_liste):
+        # Runs on the database thread; must not touch any widget.
+        aenderungen = self.db.aenderungen(cursor)
+        if aenderungen is None:
+            return None
+        cursor, vorgang_ids, bestand_ids = aenderungen
+        if len(vorgang_ids) > ABGLEICH_MAX_VORGAENGE:
+            return None
+        listen_rows = []
+        for filter in filter_liste:
+            if not vorgang_ids or filter.get("suche"):
+                listen_rows.append(None)
+            else:
+                listen_rows.append(self.db.verleihvorgaenge(ids=vorgang_ids, **filter))
+        register = self.db.flaschen_register(vorgang_ids) if vorgang_ids else None
+        return cursor, vorgang_ids, listen_rows, self.db.bestand_zeilen(bestand_ids), register
+
+    def show_changes(self, ergebnis):
+        self.changes_running = False
+        if ergebnis is None:
+            # The log no longer reaches back far enough, or too much changed.
+            self.changes_again = False
+            self.refresh_all()
+            return
+        self.aenderung_cursor, vorgang_ids, listen_rows, bestand_rows, register = ergebnis
+        if vorgang_ids:
+            self.details_cache.verwerfen(vorgang_ids)
+            self.register.abgleichen(vorgang_ids, register)
+            # A list built since the request loaded itself after it and is
+            # not in listen_rows.
+            for liste, rows in zip(self.listen, listen_rows):
+                if rows is None:
+                    # bm25 ranks of every hit shift with each write, so a
+                    # ranked result list cannot be patched in place.
+                    liste.neu_laden()
+                else:
+                    liste.abgleichen(lambda key: key[-1] in vorgang_ids, rows)
+        for row in bestand_rows if self.tree_bestand is not None else ():
+            if not self.tree_bestand.exists(row[0]) or self.sortierung_bestand.sortierung:
+                # A new cell, or one whose new numbers may move it.
+                self.refresh_bestand()
+                break
+            self.tree_bestand.item(row[0], values=row[1:])
+        if self.changes_again:
+            self.changes_again = False
+            self.apply_changes()
+
+    def changes_failed(self, e):
+        self.changes_running = False
+        self.show_db_error(e)
+
+    def poll_changes(self):
+        self.apply_changes()
+        self.root.after(AENDERUNG_INTERVALL_MS, self.poll_changes)
+
+    def schedule_filter(self, filter_funktion):
+        if self.filter_after_id is not None:
+            self.root.after_cancel(self.filter_after_id)
+        self.filter_after_id = self.root.after(SUCHE_VERZOEGERUNG_MS, self.run_filter, filter_funktion)
+
+    def run_filter(self, filter_funktion):
+        self.filter_after_id = None
+        filter_funktion()
 
     def filter_rueckgabe(self):
-        self.filter_tree(self.tree_rueckgabe, self.search_entry.get(), self.status_var_rueckgabe.get())
+        self.filter_tree(
+            self.liste_rueckgabe, self.search_entry.get(), self.status_var_rueckgabe.get(),
+            sortierung=self.sortierung_rueckgabe.sortierung,
+        )
 
     def filter_uebersicht(self):
-        self.filter_tree(self.tree_uebersicht, self.search_entry_uebersicht.get(), self.status_var_uebersicht.get())
-        
-    def filter_tree(self, tree, search_term, status_filter):
-        self.refresh_all() # First, show all items
-        search_term = search_term.lower()
-        for item_id in tree.get_children():
-            item = tree.item(item_id)
-            values = item['values']
-            status = values[-1]
-            
-            # Check for status filter match
-            status_match = (not status_filter) or (status_filter == status)
-            
-            # Check for search term match
-            search_match = search_term in str(values).lower()
-            
-            if not (status_match and search_match):
-                tree.detach(item_id)
+        self.filter_tree(
+            self.liste_uebersicht, self.search_entry_uebersicht.get(), self.status_var_uebersicht.get(),
+            self.archiv_var_uebersicht.get(), self.sortierung_uebersicht.sortierung,
+        )
+
+    @gemessen
+    def filter_tree(self, liste, search_term, status_filter, archiv=False, sortierung=()):
+        neuer_filter = {"suche": search_term, "status": status_filter}
+        if archiv:
+            neuer_filter["archiv"] = True
+        if sortierung:
+            neuer_filter["sortierung"] = list(sortierung)
+        if neuer_filter != liste.filter:
+            liste.absteigend = vorgang_richtungen(sortierung)
+            liste.filtern(**neuer_filter)
 
+    @gemessen
     def mark_returned(self):
-        selected = self.tree_rueckgabe.focus()
+        selected = self.tree_rueckgabe.selection()
         if not selected:
             messagebox.showwarning("Achtung", "Bitte einen Eintrag auswählen.")
             return
-            
-        values = self.tree_rueckgabe.item(selected)["values"]
-        if values[6] == "zurückgegeben":
-            messagebox.showinfo("Info", "Dieser Eintrag ist bereits als zurückgegeben markiert.")
+
+        nummern_liste = []
+        for item_id in selected:
+            values = self.tree_rueckgabe.item(item_id)["values"]
+            nummern = [num.strip() for num in str(values[1]).split(",")]
+            if self.register.geladen:
+                # Only bottles still out with this delivery; a reused number
+                # may be out again with a newer one.
+                vorgang_id = int(item_id)
+                nummern_liste.extend(
+                    nummer for nummer in nummern
+                    if (vorgang := self.register.vorgang(nummer)) is not None and vorgang.id == vorgang_id
+                )
+            elif values[6] != "zurückgegeben":
+                nummern_liste.extend(nummern)
+        if not nummern_liste:
+            messagebox.showinfo("Info", "Die ausgewählten Einträge sind bereits als zurückgegeben markiert.")
             return
+        self.return_bottles(nummern_liste)
 
-        flaschennummern = values[1]
-        nummern_liste = [num.strip() for num in flaschennummern.split(",")]
-        
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        for num in nummern_liste:
-            c.execute(
-                "SELECT filiale, flaschengroesse, flaschendruck FROM verleih WHERE flaschennummer=?",
-                (num,),
+    @gemessen
+    def return_by_number(self):
+        eingabe = self.rueckgabe_nummern_entry.get().replace(",", " ")
+        nummern_liste = list(dict.fromkeys(eingabe.split()))
+        if not nummern_liste:
+            messagebox.showwarning("Achtung", "Bitte Flaschennummer(n) eingeben.")
+            return
+        self.rueckgabe_nummern_entry.delete(0, tk.END)
+        self.return_bottles(nummern_liste)
+
+    def return_bottles(self, nummern_liste):
+        self.run_db(
+            self.db.zurueckgeben, nummern_liste,
+            callback=lambda anzahl: self.return_done(nummern_liste, anzahl),
+            beschreibung=f"{len(nummern_liste)} Flasche(n) werden zurückgebucht …",
+        )
+
+    def return_done(self, nummern_liste, anzahl):
+        # The change log would drop them too, but only after the next poll.
+        self.details_cache.verwerfen(
+            vorgang.id for nummer in nummern_liste if (vorgang := self.register.vorgang(nummer)) is not None
+        )
+        self.register.zurueckgeben(nummern_liste)
+        self.apply_changes()
+        if anzahl < len(nummern_liste):
+            messagebox.showinfo(
+                "Erfolg",
+                f"{anzahl} Flasche(n) als zurückgegeben markiert, "
+                f"{len(nummern_liste) - anzahl} war(en) nicht verliehen.",
             )
-            info = c.fetchone()
-            if info:
-                filiale, groesse, druck = info
-                self.update_stock(filiale, groesse, druck, 1) # Increase stock by 1 for each bottle
-            c.execute("UPDATE verleih SET status='zurückgegeben' WHERE flaschennummer=?", (num,))
-        conn.commit()
-        conn.close()
-        self.refresh_all()
-        messagebox.showinfo("Erfolg", f"{len(nummern_liste)} Flasche(n) als zurückgegeben markiert.")
+        else:
+            messagebox.showinfo("Erfolg", f"{anzahl} Flasche(n) als zurückgegeben markiert.")
+
+    def details_vorladen_planen(self, event):
+        if self.vorladen_after_id is not None:
+            self.root.after_cancel(self.vorladen_after_id)
+        self.vorladen_after_id = self.root.after(DETAILS_VORLADEN_MS, self.details_vorladen, event.widget)
 
+    def details_vorladen(self, tree):
+        """Fetch the details of the rows around the focused one that are not cached yet."""
+        self.vorladen_after_id = None
+        item = tree.focus()
+        if not item or self.rueckmeldung.beschaeftigt:
+            # Prefetching must not hold up what the clerk is waiting for.
+            return
+        umfeld = [item]
+        vorher = nachher = item
+        for _ in range(DETAILS_UMFELD):
+            vorher = vorher and tree.prev(vorher)
+            nachher = nachher and tree.next(nachher)
+            umfeld.extend(i for i in (vorher, nachher) if i)
+        fehlende = self.details_cache.fehlende([int(i) for i in umfeld])
+        if fehlende:
+            self.run_db(self.db.vorgang_details, fehlende, callback=self.details_cache.eintragen)
+
+    @gemessen
     def show_details(self, event):
         selected_tree = event.widget
         selected = selected_tree.focus()
@@ -434,24 +1215,36 @@ class FlaschenVerleihApp:
         
         values = selected_tree.item(selected)["values"]
         flaschennummern_str = values[1]
-        
-        first_flaschennummer = flaschennummern_str.split(',')[0].strip()
+        vorgang_id = int(selected)
+        details = self.details_cache.get(vorgang_id)
+        if details is None:
+            # An open delivery is in the register under any of its bottles.
+            vorgang = self.register.vorgang(str(flaschennummern_str).split(",")[0].strip())
+            if vorgang is not None and vorgang.id == vorgang_id:
+                details = vorgang.details()
+        if details is not None:
+            self.show_details_dialog(flaschennummern_str, vorgang_id, details)
+            return
+        self.run_db(
+            self.db.vorgang_details, [vorgang_id],
+            callback=lambda rows: self.details_geladen(flaschennummern_str, vorgang_id, rows),
+        )
 
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT name, telefon, adresse, ansprechpartner, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am, status FROM verleih WHERE flaschennummer=?", (first_flaschennummer,))
-        details_data = c.fetchone()
-        conn.close()
+    def details_geladen(self, flaschennummern_str, vorgang_id, rows):
+        self.details_cache.eintragen(rows)
+        self.show_details_dialog(flaschennummern_str, vorgang_id, rows[0][1:] if rows else None)
 
+    def show_details_dialog(self, flaschennummern_str, vorgang_id, details_data):
         if not details_data:
-            messagebox.showerror("Fehler", f"Details für Flasche {first_flaschennummer} nicht in der Datenbank gefunden.")
+            messagebox.showerror("Fehler", f"Vorgang {vorgang_id} nicht in der Datenbank gefunden.")
             return
 
         details_map = {
             "Name/Firma": details_data[0], "Telefonnummer": details_data[1], "Adresse des Kunden": details_data[2],
             "Ansprechpartner": details_data[3], "Referenznummer": details_data[4], "Flaschengröße": details_data[5],
             "Flaschendruck": details_data[6], "Flasche von": details_data[7], "Filiale": details_data[8],
-            "Anzahl": details_data[9], "Verliehen am": details_data[10], "Status": details_data[11]
+            "Anzahl": details_data[9], "Verliehen am": details_data[10], "Status": details_data[11],
+            "Zurückgegeben am": details_data[12],
         }
 
         details_string = f"""KUNDENDETAILS
@@ -473,10 +1266,31 @@ Filiale: {details_map['Filiale']}
 Verliehen am: {details_map['Verliehen am']}
 Status: {details_map['Status']}
 """
+        if details_map["Zurückgegeben am"]:
+            details_string += f"Zurückgegeben am: {details_map['Zurückgegeben am']}\n"
         messagebox.showinfo("Details zum Verleih", details_string)
 
 if __name__ == "__main__":
-    init_db()
+    parser = argparse.ArgumentParser(description="Flaschen-Verleih System")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--server", help="URL von verleih_server.py, z. B. http://zentrale:8765; ersetzt --db")
+    parser.add_argument("--diagnose", action="store_true", help="Diagnose-Tab von Anfang an zeigen")
+    parser.add_argument("--diagnose-log", help="Aktionen und Laufzeiten in diese Datei schreiben (rotierend)")
+    parser.add_argument("--sql-log", action="store_true", help="SQL-Anweisungen mitschneiden")
+    parser.add_argument(
+        "--detail-cache", type=int, default=DETAIL_CACHE_GROESSE, help="Vorgänge im Cache für die Detailanzeige",
+    )
+    args = parser.parse_args()
+    gestartet = time.perf_counter()
+    if args.server is None:
+        init_db(args.db)
+    diagnose = Diagnose()
+    diagnose.sql_mitschneiden = args.sql_log
+    if args.diagnose_log:
+        diagnose.exportieren(args.diagnose_log)
     root = tk.Tk()
-    app = FlaschenVerleihApp(root)
+    app = FlaschenVerleihApp(
+        root, db_path=args.db, server=args.server, diagnose=diagnose, diagnose_zeigen=args.diagnose,
+        gestartet=gestartet, detail_cache=args.detail_cache,
+    )
     root.mainloop()
\ No newline at end of file
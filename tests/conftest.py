@@ -0,0 +1,130 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verleih_client import VerleihClient
+from verleih_db import Datenbank, init_db
+from verleih_server import dienen
+
+ZENTRALE = "http://zentrale"
+KUNDE = ["Kunde", "0911 123456", "Hauptstraße 1", "Herr Muster", "R1"]
+
+
+def verleihen(db, *nummern, filiale="Zentrale", groesse="10l", druck="200 bar", kunde=KUNDE):
+    """Lend ``nummern`` as one delivery; returns its id."""
+    return db.verleih_anlegen(kunde, groesse, druck, "Linde", filiale, list(nummern))[0]
+
+
+def ausgangsschema(pfad, verleih, bestand=()):
+    """Create the tables the program had before migrations (user_version 0) and fill them.
+
+    ``verleih`` rows hold name, telefon, adresse, ansprechpartner,
+    referenznummer, flaschennummer, flaschengroesse, flaschendruck,
+    flasche_von, filiale, anzahl, verliehen_am and status; ``bestand`` rows
+    filiale, flaschengroesse, flaschendruck and bestand.
+    """
+    conn = sqlite3.connect(pfad)
+    conn.execute("""
+        CREATE TABLE verleih (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, telefon TEXT, adresse TEXT, ansprechpartner TEXT,
+            referenznummer TEXT, flaschennummer TEXT, flaschengroesse TEXT, flaschendruck TEXT, flasche_von TEXT,
+            filiale TEXT, anzahl INTEGER, verliehen_am TEXT, status TEXT
+        )
+    """)
+    conn.execute(
+        "CREATE TABLE bestand (id INTEGER PRIMARY KEY AUTOINCREMENT, filiale TEXT, flaschengroesse TEXT, "
+        "flaschendruck TEXT, bestand INTEGER)"
+    )
+    conn.executemany(
+        "INSERT INTO verleih (name, telefon, adresse, ansprechpartner, referenznummer, flaschennummer, "
+        "flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am, status) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        verleih,
+    )
+    conn.executemany(
+        "INSERT INTO bestand (filiale, flaschengroesse, flaschendruck, bestand) VALUES (?, ?, ?, ?)", bestand
+    )
+    conn.commit()
+    conn.close()
+
+
+class Gegenstelle:
+    """Stands in for VerleihClient: the server's side of a sync round on a database in the same process."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def sync_senden(self, knoten, zeilen):
+        return self.db.sync_anwenden(knoten, zeilen)
+
+    def sync_holen(self, knoten, seit):
+        return self.db.sync_zeilen(seit, ausser=knoten)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    pfad = str(tmp_path / "verleih.db")
+    init_db(pfad)
+    return pfad
+
+
+@pytest.fixture
+def db(db_path):
+    db = Datenbank(db_path)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def filiale(db, db_path, tmp_path):
+    # A branch starts from a copy of the Zentrale's database.
+    verleihen(db, "Z0")
+    pfad = str(tmp_path / "filiale.db")
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    shutil.copy(db_path, pfad)
+    filiale = Datenbank(pfad)
+    filiale.sync_einrichten(ZENTRALE)
+    yield filiale
+    filiale.close()
+
+
+@pytest.fixture
+def server(db_path):
+    """The URL of a verleih_server on ``db_path``, running in a thread of its own."""
+    loop = asyncio.new_event_loop()
+    bereit = threading.Event()
+    port = []
+
+    def gebunden(p):
+        port.append(p)
+        bereit.set()
+
+    aufgabe = loop.create_task(dienen(db_path, port=0, bereit=gebunden))
+
+    def laufen():
+        try:
+            loop.run_until_complete(aufgabe)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=laufen)
+    thread.start()
+    assert bereit.wait(10)
+    yield f"http://127.0.0.1:{port[0]}"
+    loop.call_soon_threadsafe(aufgabe.cancel)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture
+def client(server):
+    client = VerleihClient(server)
+    yield client
+    client.close()
@@ -0,0 +1,42 @@
+import types
+
+from conftest import verleihen
+from diagnose import Diagnose
+from newtest_fix import FlaschenVerleihApp
+
+
+def test_aenderungen_seit_dem_cursor(db):
+    a = verleihen(db, "A1")
+    cursor = db.aenderung_stand()[1]
+    assert db.aenderungen(cursor) == (cursor, set(), set())
+
+    b = verleihen(db, "B1", filiale="Nürnberg")
+    db.zurueckgeben(["A1"])
+    neu, vorgang_ids, bestand_ids = db.aenderungen(cursor)
+    assert neu > cursor
+    assert vorgang_ids == {a, b}
+    assert {row[1] for row in db.bestand_zeilen(bestand_ids)} == {"Zentrale", "Nürnberg"}
+    assert db.aenderungen(neu) == (neu, set(), set())
+
+
+def test_aenderungen_nach_dem_kuerzen(db):
+    verleihen(db, "A1")
+    cursor = db.aenderung_stand()[1]
+    for i in range(3):
+        verleihen(db, f"B{i}")
+    db.aenderungen_kuerzen(behalten=1)
+    # The log no longer reaches back: the caller reloads everything.
+    assert db.aenderungen(cursor) is None
+    assert db.aenderungen(db.aenderung_stand()[1]) is not None
+
+
+def test_keine_aenderungen_vor_dem_ersten_laden():
+    # Before the first refresh_all() has answered there is no cursor yet.
+    def run_db(*args, **kwargs):
+        raise AssertionError("run_db ohne Cursor")
+
+    app = types.SimpleNamespace(
+        diagnose=Diagnose(), aenderung_cursor=None, changes_running=False, changes_again=False, run_db=run_db,
+    )
+    FlaschenVerleihApp.apply_changes(app)
+    assert not app.changes_running
@@ -0,0 +1,40 @@
+import pytest
+
+from conftest import KUNDE, verleihen
+from verleih_db import Datenbank, Verleihvorgang, archiv_anlegen
+
+
+@pytest.fixture
+def archiv_db(db, db_path):
+    # One delivery closed long ago, which is archived, and one still out.
+    db.vorgaenge_importieren([
+        Verleihvorgang(*KUNDE, "10l", "200 bar", "Linde", "Zentrale", "2020-01-01 10:00:00", ("A1", "A2"),
+                       frozenset({"A1", "A2"})),
+    ])
+    verleihen(db, "B1")
+    archiv_anlegen(db_path)
+    archiv_db = Datenbank(db_path)
+    assert archiv_db.archiv
+    assert archiv_db.archivieren(tage=30) == 1
+    yield archiv_db
+    archiv_db.close()
+
+
+def test_ereignisse_mit_archiv(archiv_db):
+    ereignisse = list(archiv_db.bericht("ereignisse"))
+    nummern = {row[6] for row in ereignisse if row[1] != "Bestand"}
+    assert nummern == {"A1", "A2", "B1"}
+    assert all(row[7] is not None for row in ereignisse if row[1] != "Bestand")
+
+
+def test_verlauf_mit_archiv(archiv_db):
+    verlauf = list(archiv_db.bericht("verlauf"))
+    assert [(row[11], row[12]) for row in verlauf] == [("A1", "zurückgegeben"), ("A2", "zurückgegeben"),
+                                                       ("B1", "verliehen")]
+    assert [row[11] for row in archiv_db.bericht("verlauf", ab="2021-01-01")] == ["B1"]
+
+
+def test_vorgaenge_mit_archiv(archiv_db):
+    assert len(archiv_db.verleihvorgaenge()) == 1
+    assert len(archiv_db.verleihvorgaenge(archiv=True)) == 2
+    assert archiv_db.bestand_pruefen() == []
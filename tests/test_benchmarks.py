@@ -0,0 +1,53 @@
+import json
+import sys
+from datetime import datetime
+
+from benchmarks import suite
+from benchmarks.daten import erzeugen, vorgaenge
+from verleih_db import Datenbank
+from verleih_schema import SCHEMA_VERSION
+
+JETZT = datetime(2024, 6, 1, 12, 0)
+
+
+def test_daten_sind_reproduzierbar():
+    erste = list(vorgaenge(500, seed=3, jetzt=JETZT))
+    assert erste == list(vorgaenge(500, seed=3, jetzt=JETZT))
+    assert erste != list(vorgaenge(500, seed=4, jetzt=JETZT))
+    assert sum(len(v.flaschennummern) for v in erste) == 500
+    assert [v.verliehen_am for v in erste] == sorted(v.verliehen_am for v in erste)
+
+
+def test_erzeugte_datenbank_ist_stimmig(tmp_path):
+    pfad = str(tmp_path / "daten.db")
+    offen = erzeugen(pfad, 2000)
+    db = Datenbank(pfad)
+    try:
+        assert db.bestand_pruefen() == []
+        verliehen = db.conn.execute("SELECT COUNT(*) FROM verleih_position WHERE status = 'verliehen'").fetchone()[0]
+        assert offen == verliehen
+        assert all(bestand >= 0 for *_, bestand, _, _ in db.bestand_liste())
+    finally:
+        db.close()
+
+
+def _ergebnis(min_ms, schema=SCHEMA_VERSION):
+    werte = {"min_ms": min_ms, "median_ms": min_ms, "p95_ms": min_ms, "n": 1}
+    return {"meta": {"baum": "attrappe", "schema": schema}, "laeufe": {"100": {"verleihen": werte}}}
+
+
+def test_vergleichen_meldet_regressionen():
+    assert suite.vergleichen(_ergebnis(1.1), _ergebnis(1.0), 0.25) == []
+    # Too little to tell from noise, however large the factor.
+    assert suite.vergleichen(_ergebnis(0.15), _ergebnis(0.01), 0.25) == []
+    assert suite.vergleichen(_ergebnis(2.0), _ergebnis(1.0), 0.25) == [("100", "verleihen", 2.0)]
+
+
+def test_baseline_eines_anderen_schemas(tmp_path, monkeypatch, capsys):
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps(_ergebnis(1000.0, schema=SCHEMA_VERSION - 1)))
+    monkeypatch.setattr(sys, "argv", [
+        "suite.py", "--flaschen", "200", "--wiederholungen", "2", "--baseline", str(baseline),
+    ])
+    assert suite.main() == 1
+    assert "Schema" in capsys.readouterr().err
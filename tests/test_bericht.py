@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from verleih_bericht import exportieren, zeilen
+from verleih_db import Datenbank, Verleihvorgang, init_db
+from verleih_import import importieren
+
+STICHTAG = "2024-06-01 00:00:00"
+
+
+def _vorgang(name, nummern, verliehen_am, groesse="50l", von="Linde", filiale="Zentrale", zurueck=()):
+    return Verleihvorgang(
+        name, "0911 1", "Weg 1", "Herr K", f"R-{nummern[0]}", groesse, "300 bar", von, filiale, verliehen_am,
+        tuple(nummern), frozenset(zurueck),
+    )
+
+
+@pytest.fixture
+def daten(db):
+    assert db.vorgaenge_importieren([
+        _vorgang("Brauerei", ["A1", "A2", "A3"], "2024-01-10 08:00:00"),
+        _vorgang("Brauerei", ["A4"], "2024-05-20 08:00:00"),
+        _vorgang("Bäckerei", ["B1", "B2"], "2024-02-01 08:00:00", zurueck=["B2"]),
+        _vorgang("Bäckerei", ["B3"], "2024-02-01 08:00:00", von="Air Liquide"),
+        _vorgang("Schlosserei", ["C1"], "2024-01-05 08:00:00", groesse="10l", filiale="Nürnberg"),
+    ]) == []
+    return db
+
+
+def test_kunden_mit_filtern(daten):
+    rows = list(daten.bericht(
+        "kunden", flaschengroesse="50l", flaschendruck="300 bar", flasche_von="Linde", mindestalter=90,
+        stichtag=STICHTAG,
+    ))
+    # Only bottles out for more than 90 days count: A1-A3 and B1.
+    assert [(row[0], row[6], row[10]) for row in rows] == [("Brauerei", 3, 1), ("Bäckerei", 1, 2)]
+    assert sum(row[11] for row in rows) == pytest.approx(100)
+
+
+def test_csv_und_jsonl(daten):
+    csv_zeilen = list(zeilen(daten, "kunden", stichtag=STICHTAG))
+    jsonl = [json.loads(zeile) for zeile in zeilen(daten, "kunden", format="jsonl", stichtag=STICHTAG)]
+    assert csv_zeilen[0].startswith("name;telefon;filiale")
+    assert len(csv_zeilen) == len(jsonl) + 1
+    assert {(z["name"], z["flasche_von"], z["flaschen"]) for z in jsonl} == {
+        ("Brauerei", "Linde", 4), ("Bäckerei", "Linde", 1), ("Bäckerei", "Air Liquide", 1),
+        ("Schlosserei", "Linde", 1),
+    }
+
+
+def test_verlauf_export_import_export(daten, tmp_path):
+    erste = tmp_path / "verlauf.csv"
+    assert exportieren(daten, "verlauf", erste, trennzeichen=",") == 8
+    pfad = str(tmp_path / "neu.db")
+    init_db(pfad)
+    neu = Datenbank(pfad)
+    try:
+        ergebnis = importieren(neu, erste, tmp_path / "abgelehnt.csv")
+        assert (ergebnis.vorgaenge, ergebnis.flaschen, ergebnis.abgelehnt) == (5, 8, 0)
+        zweite = tmp_path / "verlauf2.csv"
+        exportieren(neu, "verlauf", zweite, trennzeichen=",")
+    finally:
+        neu.close()
+    assert zweite.read_bytes() == erste.read_bytes()
+
+
+def test_bericht_ueber_den_server(daten, client):
+    assert list(client.bericht("auslastung")) == [tuple(row) for row in daten.bericht("auslastung")]
+    assert list(client.bericht("kunden", stichtag=STICHTAG, filiale="Nürnberg")) == [
+        tuple(row) for row in daten.bericht("kunden", stichtag=STICHTAG, filiale="Nürnberg")
+    ]
@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import verleihen
+from verleih_db import FlaschenAusgemustert, FlaschenBereitsVerliehen
+
+
+def _zelle(db, filiale, groesse, druck):
+    """(bestand, verliehen, gesamt) of one cell."""
+    return next(tuple(row[4:]) for row in db.bestand_liste() if row[1:4] == (filiale, groesse, druck))
+
+
+def test_verleih_und_rueckgabe_buchen_bestand(db):
+    db.bestand_setzen("Nürnberg", "50l", "300 bar", 10)
+    verleihen(db, "A1", "A2", "A3", filiale="Nürnberg", groesse="50l", druck="300 bar")
+    assert _zelle(db, "Nürnberg", "50l", "300 bar") == (7, 3, 10)
+    assert db.zurueckgeben(["A1", "A2", "X9"]) == 2
+    assert _zelle(db, "Nürnberg", "50l", "300 bar") == (9, 1, 10)
+    # Returning again changes nothing.
+    assert db.zurueckgeben(["A1"]) == 0
+    assert _zelle(db, "Nürnberg", "50l", "300 bar") == (9, 1, 10)
+    assert db.bestand_pruefen() == []
+
+
+def test_doppelt_verliehen_wird_abgelehnt(db):
+    verleihen(db, "A1")
+    with pytest.raises(FlaschenBereitsVerliehen):
+        verleihen(db, "A2", "A1")
+    assert db.aktive_flaschen(["A1", "A2"]) == {"A1"}
+    assert _zelle(db, "Zentrale", "10l", "200 bar")[1] == 1
+    db.zurueckgeben(["A1"])
+    verleihen(db, "A1")
+    assert db.bestand_pruefen() == []
+
+
+def test_ausgemusterte_flasche(db):
+    verleihen(db, "A1")
+    db.zurueckgeben(["A1"])
+    db.flasche_ausmustern("A1")
+    with pytest.raises(FlaschenAusgemustert):
+        verleihen(db, "A1")
+
+
+def test_bestand_pruefen_repariert(db):
+    verleihen(db, "A1", "A2")
+    db.conn.execute("UPDATE bestand SET verliehen = 7 WHERE (filiale, flaschengroesse) = ('Zentrale', '10l')")
+    db.conn.commit()
+    abweichungen = db.bestand_pruefen(reparieren=True)
+    assert [(a.gezaehlt, a.tatsaechlich) for a in abweichungen] == [(7, 2), (7, 0)]
+    assert db.bestand_pruefen() == []
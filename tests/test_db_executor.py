@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import verleihen
+from db_executor import DBExecutor, TkRueckmeldung
+from verleih_db import Datenbank
+
+
+class Wurzel:
+    """Stands in for the Tk root: after() callbacks run when run() is called."""
+
+    def __init__(self):
+        self.geplant = []
+
+    def after(self, ms, fn):
+        self.geplant.append(fn)
+        return len(self.geplant)
+
+    def run(self):
+        while self.geplant:
+            self.geplant.pop(0)()
+
+
+@pytest.fixture
+def executor(db_path):
+    executor = DBExecutor(lambda: Datenbank(db_path))
+    yield executor
+    executor.shutdown()
+
+
+def test_auftraege_laufen_der_reihe_nach_im_worker(executor):
+    threads = []
+
+    def auftrag(i):
+        threads.append(threading.current_thread().name)
+        return verleihen(executor.db, f"A{i}")
+
+    ids = [executor.submit(auftrag, i).result(timeout=10) for i in range(3)]
+    assert ids == sorted(ids)
+    assert set(threads) == {"db-executor"}
+    # The connection belongs to the worker thread.
+    with pytest.raises(sqlite3.ProgrammingError):
+        executor.db.aktive_flaschen(["A0"])
+    assert executor.submit(executor.db.aktive_flaschen, ["A0", "A9"]).result(timeout=10) == {"A0"}
+
+
+def test_fehler_kommen_ueber_den_future(executor):
+    future = executor.submit(executor.db.verleihvorgaenge, sortierung=[("telefon", False)])
+    with pytest.raises(ValueError):
+        future.result(timeout=10)
+    # The worker keeps going.
+    assert executor.submit(executor.db.aktive_flaschen, []).result(timeout=10) == set()
+
+
+def test_startfehler(tmp_path):
+    with pytest.raises(sqlite3.OperationalError):
+        DBExecutor(lambda: Datenbank(str(tmp_path / "fehlt" / "verleih.db")))
+
+
+def test_rueckmeldung_auf_dem_tk_thread(executor):
+    wurzel = Wurzel()
+    rueckmeldung = TkRueckmeldung(wurzel)
+    ergebnisse, fehler = [], []
+    rueckmeldung.wenn_fertig(executor.submit(lambda: 42), ergebnisse.append, fehler.append)
+    rueckmeldung.wenn_fertig(executor.submit(lambda: 1 / 0), ergebnisse.append, fehler.append)
+    assert rueckmeldung.beschaeftigt
+    while rueckmeldung.beschaeftigt:
+        wurzel.run()
+    assert ergebnisse == [42]
+    assert [type(e) for e in fehler] == [ZeroDivisionError]
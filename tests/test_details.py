@@ -0,0 +1,39 @@
+from conftest import verleihen
+from detail_cache import DetailCache
+
+
+def test_details_je_vorgang(db):
+    # The same bottle lent twice: each delivery keeps its own details.
+    alt = verleihen(db, "A1", groesse="20l")
+    db.zurueckgeben(["A1"])
+    neu = verleihen(db, "A1")
+    rows = {row[0]: row[1:] for row in db.vorgang_details([alt, neu, 999])}
+    assert sorted(rows) == [alt, neu]
+    assert (rows[alt][5], rows[alt][11]) == ("20l", "zurückgegeben")
+    assert rows[alt][12] is not None
+    assert (rows[neu][5], rows[neu][11], rows[neu][12]) == ("10l", "verliehen", None)
+
+
+def test_cache_verdraengt_den_aeltesten(db):
+    ids = [verleihen(db, f"A{i}") for i in range(3)]
+    cache = DetailCache(groesse=2)
+    cache.eintragen(db.vorgang_details(ids[:2]))
+    assert cache.get(ids[0])[0] == "Kunde"
+    cache.eintragen(db.vorgang_details(ids[2:]))
+    # ids[1] was used least recently.
+    assert cache.fehlende(ids) == [ids[1]]
+    assert cache.get(ids[1]) is None
+    assert (cache.treffer, cache.fehlgriffe) == (1, 1)
+
+
+def test_cache_verwirft_geaenderte_vorgaenge(db):
+    a, b = verleihen(db, "A1"), verleihen(db, "B1")
+    cache = DetailCache()
+    cache.eintragen(db.vorgang_details([a, b]))
+    cursor = db.aenderung_stand()[1]
+    db.zurueckgeben(["A1"])
+    _, vorgang_ids, _ = db.aenderungen(cursor)
+    cache.verwerfen(vorgang_ids)
+    assert cache.fehlende([a, b]) == [a]
+    cache.eintragen(db.vorgang_details(cache.fehlende([a, b])))
+    assert cache.get(a)[11] == "zurückgegeben"
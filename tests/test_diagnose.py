@@ -0,0 +1,76 @@
+import json
+import logging
+import threading
+
+import pytest
+
+from conftest import verleihen
+from diagnose import Diagnose, Histogramm
+
+
+def _zeile(diagnose, name):
+    return next(row for row in diagnose.tabelle() if row[0] == name)
+
+
+def test_histogramm_quantile():
+    h = Histogramm()
+    for i in range(1, 1001):
+        h.eintragen(i / 10)
+    assert h.anzahl == 1000
+    assert h.quantil(0.5) == pytest.approx(50, rel=0.1)
+    assert h.quantil(0.99) == pytest.approx(99, rel=0.1)
+    assert h.quantil(1) <= h.maximum == 100
+
+
+def test_spannen_zaehlen_sql(db):
+    diagnose = Diagnose()
+    diagnose.verbinden(db)
+    with diagnose.messen("verleihen"):
+        with diagnose.messen("pruefen"):
+            db.aktive_flaschen(["A1"])
+        verleihen(db, "A1")
+    verleihen_zeile, pruefen_zeile = _zeile(diagnose, "verleihen"), _zeile(diagnose, "pruefen")
+    assert verleihen_zeile[1] == pruefen_zeile[1] == 1
+    assert pruefen_zeile[6] == 1
+    assert verleihen_zeile[6] > 1
+    # The outer span is the action, with the SQL of the whole tree.
+    assert _zeile(diagnose, "aktion verleihen")[6] == verleihen_zeile[6] + pruefen_zeile[6]
+
+
+def test_auftrag_und_rueckmeldung_sind_eine_aktion():
+    diagnose = Diagnose(langsam_ms=0)
+    ergebnisse = []
+    with diagnose.messen("ui:klick"):
+        auftrag = diagnose.auftrag(sorted)
+    # The job runs on another thread and the callback back on this one.
+    thread = threading.Thread(target=lambda: ergebnisse.append(auftrag.ausfuehren(sorted, [3, 1, 2])))
+    thread.start()
+    thread.join()
+    # Still open: the callback has not run yet.
+    assert not any(row[0] == "aktion ui:klick" for row in diagnose.tabelle())
+    auftrag.rueckmeldung(ergebnisse.append)(ergebnisse[0])
+    assert ergebnisse == [[1, 2, 3], [1, 2, 3]]
+    assert _zeile(diagnose, "aktion ui:klick")[1] == 1
+    assert _zeile(diagnose, "db:sorted")[7] == 3
+    flamme = diagnose.flamme()
+    assert flamme[0].startswith("ui:klick")
+    assert [zeile.split("ms  ")[1].split()[0] for zeile in flamme[1:]] == ["ui:klick", "db:sorted", "ui:list.append"]
+    assert "(3 Zeilen)" in flamme[2]
+
+
+def test_export_als_json_zeilen(tmp_path):
+    diagnose = Diagnose(langsam_ms=10_000)
+    pfad = tmp_path / "diagnose.log"
+    diagnose.exportieren(str(pfad))
+    try:
+        with diagnose.messen("refresh_all"):
+            pass
+    finally:
+        log = logging.getLogger("verleih.diagnose")
+        for handler in list(log.handlers):
+            handler.close()
+            log.removeHandler(handler)
+    zeile = pfad.read_text(encoding="utf-8").splitlines()[0]
+    eintrag = json.loads(zeile.split(" ", 2)[2])
+    assert eintrag["aktion"] == "refresh_all"
+    assert "verlauf" not in eintrag
@@ -0,0 +1,57 @@
+import sqlite3
+
+import pytest
+
+from conftest import verleihen
+from verleih_db import Verleihvorgang
+
+ZELLE = ("Zentrale", "50l", "300 bar")
+
+
+def _vorgang(nummern, verliehen_am, zurueck=()):
+    return Verleihvorgang(
+        "Kunde", "0911 1", "Weg 1", "Herr K", "R1", "50l", "300 bar", "Linde", "Zentrale", verliehen_am,
+        tuple(nummern), frozenset(zurueck),
+    )
+
+
+def _stand(db, zeitpunkt):
+    """(gesamt, verliehen, verfuegbar) of ZELLE at ``zeitpunkt``; a cell without events is not listed."""
+    return next((tuple(row[4:]) for row in db.stand_zu(zeitpunkt) if tuple(row[1:4]) == ZELLE), (0, 0, 0))
+
+
+def test_stand_zu_einem_zeitpunkt(db):
+    db.bestand_setzen(*ZELLE, 10)
+    assert db.vorgaenge_importieren([
+        _vorgang(["A1", "A2", "A3"], "2024-02-01 10:00:00"),
+        _vorgang(["B1"], "2024-03-01 10:00:00"),
+    ]) == []
+    assert _stand(db, "2024-01-15 00:00:00")[1] == 0
+    assert _stand(db, "2024-02-15 00:00:00")[1] == 3
+    assert _stand(db, "2024-03-15 00:00:00")[1] == 4
+    jetzt = _stand(db, "2999-01-01 00:00:00")
+    assert jetzt[1] == 4
+    # A snapshot changes nothing about the answers.
+    assert db.snapshot_anlegen(abstand=1)
+    assert _stand(db, "2024-02-15 00:00:00")[1] == 3
+    assert _stand(db, "2999-01-01 00:00:00") == jetzt
+
+
+def test_rueckgabe_wird_protokolliert(db):
+    verleihen(db, "A1", "A2", filiale=ZELLE[0], groesse=ZELLE[1], druck=ZELLE[2])
+    db.zurueckgeben(["A1"])
+    arten = db.conn.execute(
+        "SELECT art, COUNT(*) FROM ereignis WHERE position_id IS NOT NULL GROUP BY art ORDER BY art"
+    ).fetchall()
+    assert [anzahl for _, anzahl in arten] == [2, 1]
+    assert _stand(db, "2999-01-01 00:00:00")[1] == 1
+
+
+def test_ereignisse_koennen_nur_ergaenzt_werden(db):
+    verleihen(db, "A1")
+    with pytest.raises(sqlite3.DatabaseError):
+        db.conn.execute("UPDATE ereignis SET menge = 5")
+    with pytest.raises(sqlite3.DatabaseError):
+        db.conn.execute("DELETE FROM ereignis")
+    db.conn.rollback()
+    assert db.conn.execute("SELECT COUNT(*) FROM ereignis").fetchone()[0] > 0
@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import verleihen
+from verleih_db import FlaschenAusgemustert, FlaschenBereitsVerliehen
+
+
+def test_lebenslauf_einer_flasche(db):
+    assert db.flasche("F1") is None
+    db.flasche_speichern("F1", "50l", "300 bar", "Linde", "Zentrale")
+    assert db.flasche_pruefen("F1", "2027-03-01")
+    assert not db.flasche_pruefen("F9", "2027-03-01")
+    verleihen(db, "F1", groesse="50l", druck="300 bar")
+    db.zurueckgeben(["F1"])
+    assert db.flasche_ausmustern("F1")
+    assert not db.flasche_ausmustern("F1")
+
+    stamm, lebenslauf = db.flasche("F1")
+    assert stamm[:6] == ("F1", "50l", "300 bar", "Linde", "Zentrale", "2027-03-01")
+    assert stamm[6] is not None
+    # Within the same second the bottle's own events come before its loans.
+    assert sorted(ereignis for _, ereignis, _ in lebenslauf) == sorted([
+        "angelegt", "Prüfung eingetragen", "verliehen", "zurückgegeben", "ausgemustert",
+    ])
+    assert lebenslauf[0][1] == "angelegt"
+
+
+def test_ausgemusterte_und_verliehene_flaschen(db):
+    verleihen(db, "F1")
+    # A bottle that is out cannot be retired, and a retired one cannot be lent.
+    with pytest.raises(FlaschenBereitsVerliehen):
+        db.flasche_ausmustern("F1")
+    db.flasche_speichern("F2", "10l", "200 bar", "Linde", "Zentrale")
+    db.flasche_ausmustern("F2")
+    with pytest.raises(FlaschenAusgemustert):
+        verleihen(db, "F2", "F3")
+    assert db.aktive_flaschen(["F1", "F2", "F3"]) == {"F1"}
+
+
+def test_pruefung_und_flaschenbestand(db):
+    for nummer, faellig in (("F1", "2027-01-10"), ("F2", "2027-06-01"), ("F3", None)):
+        db.flasche_speichern(nummer, "10l", "200 bar", "Linde", "Zentrale")
+        if faellig:
+            db.flasche_pruefen(nummer, faellig)
+    verleihen(db, "F1")
+    # Four on the shelf by the count, besides the one that is out.
+    db.bestand_setzen("Zentrale", "10l", "200 bar", 4)
+
+    faellig = list(db.bericht("pruefung", stichtag="2027-02-01"))
+    assert [(row[0], row[5], row[7], row[8]) for row in faellig] == [("F1", "2027-01-10", "verliehen", "Kunde")]
+    assert [row[0] for row in db.bericht("pruefung", stichtag="2027-12-31")] == ["F1", "F2"]
+
+    zelle = ("Zentrale", "10l", "200 bar")
+    bestand = {row[:3]: row[3:] for row in db.bericht("flaschenbestand")}
+    assert bestand[zelle] == (5, 3, -2, 1)
+    assert db.bestand_aus_register() >= 1
+    assert {row[:3]: row[3:] for row in db.bericht("flaschenbestand")}[zelle] == (3, 3, 0, 1)
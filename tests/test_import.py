@@ -0,0 +1,78 @@
+import csv
+
+from conftest import verleihen
+from verleih_import import importieren
+
+KOPF = [
+    "name", "telefon", "adresse", "ansprechpartner", "referenznummer", "flaschengroesse", "flaschendruck",
+    "flasche_von", "filiale", "anzahl", "verliehen_am", "flaschennummern", "status",
+]
+KUNDE = ["Kunde", "0911 1", "Weg 1", "Herr K", "R1"]
+
+
+def _schreiben(pfad, zeilen):
+    with open(pfad, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(KOPF)
+        writer.writerows(zeilen)
+
+
+def _abgelehnt(pfad):
+    with open(pfad, newline="", encoding="utf-8") as f:
+        return {int(row["zeile"]): row["fehler"] for row in csv.DictReader(f)}
+
+
+def test_import_lehnt_ungueltige_vorgaenge_ab(db, tmp_path):
+    verleihen(db, "B1")
+    datei, abgelehnt = tmp_path / "alt.csv", tmp_path / "abgelehnt.csv"
+    _schreiben(datei, [
+        [*KUNDE, "10l", "200 bar", "Linde", "Zentrale", 2, "2020-01-01 10:00:00", "A1 A2", ""],
+        [*KUNDE, "10l", "200 bar", "Linde", "Zentrale", 3, "2020-01-02 10:00:00", "A3,A4", ""],
+        [*KUNDE, "10l", "200 bar", "Linde", "", 1, "2020-01-03 10:00:00", "A5", ""],
+        [*KUNDE, "10l", "200 bar", "Linde", "Zentrale", 1, "2020-01-04 10:00:00", "B1", ""],
+        [*KUNDE, "10l", "200 bar", "Linde", "Zentrale", 1, "gestern", "A6", ""],
+        [*KUNDE, "10l", "200 bar", "Linde", "Zentrale", 1, "2020-01-05 10:00:00", "A7", "weg"],
+        [*KUNDE, "20l", "300 bar", "Linde", "Moosach", 1, "2020-01-06 10:00:00", "A8", "zurückgegeben"],
+    ])
+    ergebnis = importieren(db, datei, abgelehnt)
+    assert (ergebnis.vorgaenge, ergebnis.flaschen, ergebnis.abgelehnt) == (2, 3, 5)
+    fehler = _abgelehnt(abgelehnt)
+    assert sorted(fehler) == [3, 4, 5, 6, 7]
+    assert fehler[3].startswith("Anzahl (3)")
+    assert fehler[4] == "Bitte alle Felder ausfüllen."
+    assert fehler[5] == "Bereits verliehen: B1"
+    assert fehler[6] == "Ungültiges Datum: gestern"
+    assert fehler[7] == "Unbekannter Status: weg"
+    assert db.aktive_flaschen(["A1", "A2", "A8"]) == {"A1", "A2"}
+    assert db.bestand_pruefen() == []
+
+
+def test_ohne_ablehnung_keine_datei(db, tmp_path):
+    datei, abgelehnt = tmp_path / "alt.csv", tmp_path / "abgelehnt.csv"
+    _schreiben(datei, [[*KUNDE, "10l", "200 bar", "Linde", "Zentrale", 1, "2020-01-01 10:00:00", "A1", ""]])
+    assert importieren(db, datei, abgelehnt).abgelehnt == 0
+    assert not abgelehnt.exists()
+
+
+def test_import_lehnt_unbekannte_werte_ab(db, tmp_path):
+    datei, abgelehnt = tmp_path / "alt.csv", tmp_path / "abgelehnt.csv"
+    with open(datei, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([*KOPF[:-2], "flaschennummer", "status"])
+        writer.writerows([
+            [*KUNDE, "10L", "200 bar", "Linde", "Zentrale", 1, "2020-01-01 10:00:00", "A1", ""],
+            [*KUNDE, "10l", "250 bar", "Linde", "Zentrale", 1, "2020-01-02 10:00:00", "A2", ""],
+            [*KUNDE, "10l", "200 bar", "Linde", "Filiale A", 2, "2020-01-03 10:00:00", "A3", ""],
+            [*KUNDE, "10l", "200 bar", "Linde", "Filiale A", 2, "2020-01-03 10:00:00", "A4", ""],
+            [*KUNDE, "10l", "200 bar", "SOL", "Würzburg", 1, "2020-01-04 10:00:00", "A5", ""],
+        ])
+    ergebnis = importieren(db, datei, abgelehnt)
+    assert (ergebnis.vorgaenge, ergebnis.abgelehnt) == (1, 3)
+    assert _abgelehnt(abgelehnt) == {
+        2: "Unbekannte Flaschengröße: 10L",
+        3: "Unbekannter Flaschendruck: 250 bar",
+        4: "Unbekannte Filiale: Filiale A",
+        5: "Unbekannte Filiale: Filiale A",
+    }
+    assert db.aktive_flaschen(["A1", "A2", "A3", "A4", "A5"]) == {"A5"}
+    assert db.bestand_pruefen() == []
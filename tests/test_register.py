@@ -0,0 +1,47 @@
+from conftest import KUNDE, ausgangsschema, verleihen
+from flaschen_register import FlaschenRegister
+from verleih_db import Datenbank, init_db
+
+
+def test_register_folgt_der_datenbank(db):
+    a = verleihen(db, "A1", "A2")
+    verleihen(db, "B1", filiale="Nürnberg")
+    register = FlaschenRegister()
+    register.laden(db.flaschen_register())
+    assert len(register) == 3
+    assert register.vorgang("A1").id == a
+    assert register.verliehene(["A1", "B1", "C1"]) == {"A1", "B1"}
+    assert register.an_filiale("Nürnberg") == ["B1"]
+
+    # Written through by the app after the database confirmed it.
+    db.zurueckgeben(["A1"])
+    register.zurueckgeben(["A1"])
+    c, verliehen_am = db.verleih_anlegen(KUNDE, "10l", "200 bar", "Linde", "Zentrale", ["C1"])
+    register.verleihen(c, verliehen_am, KUNDE, ["10l", "200 bar", "Linde", "Zentrale"], ["C1"])
+    # Changed by another client: replaced from the database.
+    db.zurueckgeben(["A2"])
+    register.abgleichen([a], db.flaschen_register([a]))
+
+    frisch = FlaschenRegister()
+    frisch.laden(db.flaschen_register())
+    for r in (register, frisch):
+        assert r.verliehene(["A1", "A2", "B1", "C1"]) == {"B1", "C1"}
+        assert r.vorgang("C1").details() == frisch.vorgang("C1").details()
+
+
+def test_register_mit_leeren_spalten(tmp_path):
+    # Rows from the old table can lack the supplier and the branch.
+    pfad = str(tmp_path / "alt.db")
+    ausgangsschema(pfad, [
+        ("Alt", "089 1", "Weg 2", "Frau Alt", "A1", "F1", "10l", "200 bar", None, None, 1, "2020-01-01 10:00:00",
+         "verliehen"),
+    ])
+    init_db(pfad)
+    db = Datenbank(pfad)
+    try:
+        register = FlaschenRegister()
+        register.laden(db.flaschen_register())
+        assert register.verliehene(["F1"]) == {"F1"}
+        assert register.vorgang("F1").flasche_von is None
+    finally:
+        db.close()
@@ -0,0 +1,33 @@
+from conftest import verleihen
+
+
+def _verliehen(db):
+    return {row[1:4]: row[5] for row in db.bestand_liste()}
+
+
+def test_kiste_ueber_mehrere_vorgaenge_und_zellen(db):
+    nummern = []
+    for i, (filiale, groesse) in enumerate([("Zentrale", "10l"), ("Zentrale", "50l"), ("Nürnberg", "10l")]):
+        vorgang = [f"K{i}-{j}" for j in range(100)]
+        verleihen(db, *vorgang, filiale=filiale, groesse=groesse)
+        nummern.extend(vorgang)
+    vorher = _verliehen(db)
+    # Half of each delivery, plus numbers that are unknown or listed twice.
+    kiste = nummern[::2] + ["X1", nummern[0]]
+    assert db.zurueckgeben(kiste) == 150
+    nachher = _verliehen(db)
+    for zelle in [("Zentrale", "10l", "200 bar"), ("Zentrale", "50l", "200 bar"), ("Nürnberg", "10l", "200 bar")]:
+        assert vorher[zelle] - nachher[zelle] == 50
+    assert db.aktive_flaschen(nummern) == set(nummern[1::2])
+    assert db.bestand_pruefen() == []
+
+
+def test_alte_rueckgabe_bucht_nicht_doppelt(db):
+    verleihen(db, "A1", "A2")
+    db.zurueckgeben(["A1"])
+    verleihen(db, "A1")
+    assert _verliehen(db)[("Zentrale", "10l", "200 bar")] == 2
+    assert db.zurueckgeben(["A1", "A2"]) == 2
+    assert _verliehen(db)[("Zentrale", "10l", "200 bar")] == 0
+    assert db.zurueckgeben(["A1", "A2"]) == 0
+    assert db.bestand_pruefen() == []
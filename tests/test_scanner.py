@@ -0,0 +1,78 @@
+import types
+
+from conftest import KUNDE, verleihen
+from diagnose import Diagnose
+from flaschen_register import FlaschenRegister
+from newtest_fix import FlaschenVerleihApp
+
+
+class Feld:
+    """The scan input and list, without Tk."""
+
+    def __init__(self, text=""):
+        self.text = text
+        self.zeilen = []
+
+    def get(self):
+        return self.text
+
+    def delete(self, anfang, ende=None):
+        self.text = ""
+
+    def insert(self, index, zeile):
+        self.zeilen.append(zeile)
+
+    def see(self, index):
+        pass
+
+
+def _scanner(db):
+    register = FlaschenRegister()
+    register.laden(db.flaschen_register())
+    app = types.SimpleNamespace(
+        diagnose=Diagnose(), register=register, scans=[], scan_set=set(), scan_entry=Feld(), scan_liste=Feld(),
+        glocke=[], status={},
+    )
+    app.root = types.SimpleNamespace(bell=lambda: app.glocke.append(True))
+    app.scan_status = types.SimpleNamespace(configure=app.status.update)
+    app.set_anzahl = lambda anzahl: setattr(app, "anzahl", anzahl)
+    return app
+
+
+def _scannen(app, text):
+    app.scan_entry.text = text
+    return FlaschenVerleihApp.scan_erfassen(app)
+
+
+def test_scans_werden_sofort_geprueft(db):
+    verleihen(db, "A1")
+    app = _scanner(db)
+    assert _scannen(app, "S1") == "break"
+    assert app.anzahl == 1 and app.scan_entry.text == "" and not app.glocke
+
+    # Already scanned, or already out: rejected with the bell.
+    _scannen(app, "S1")
+    _scannen(app, "A1")
+    assert app.scans == ["S1"] and app.anzahl == 1
+    assert len(app.glocke) == 2
+    assert app.status["text"] == "A1 ist bereits verliehen"
+
+    # A pasted list is split like on the return tab.
+    _scannen(app, "S2, S3 S1")
+    assert app.scans == app.scan_liste.zeilen == ["S1", "S2", "S3"]
+    assert app.anzahl == 3
+    assert app.status["text"] == "S1 bereits gescannt"
+
+
+def test_grosse_lieferung_in_einem_aufruf(db):
+    app = _scanner(db)
+    for i in range(200):
+        _scannen(app, f"F{i:03d}")
+    assert app.anzahl == 200
+    vorgang_id, verliehen_am = db.verleih_anlegen(KUNDE, "50l", "300 bar", "Linde", "Zentrale", app.scans)
+    app.register.verleihen(vorgang_id, verliehen_am, KUNDE, ["50l", "300 bar", "Linde", "Zentrale"], app.scans)
+    assert db.aktive_flaschen(app.scans) == set(app.scans)
+
+    neu = _scanner(db)
+    _scannen(neu, "F000 F199 F200")
+    assert neu.scans == ["F200"]
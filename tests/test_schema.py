@@ -0,0 +1,60 @@
+import logging
+import sqlite3
+
+from conftest import ausgangsschema
+from verleih_db import Datenbank, init_db
+from verleih_schema import SCHEMA_VERSION, migrate, schema_version
+
+
+def test_migration_vom_ausgangsschema(tmp_path):
+    pfad = str(tmp_path / "alt.db")
+    kunde = ("Alt", "089 1", "Weg 2", "Frau Alt", "A1")
+    flasche = ("10l", "200 bar", "Linde", "Zentrale", 2)
+    ausgangsschema(pfad, [
+        (*kunde, "F1", *flasche, "2020-01-01 10:00:00", "verliehen"),
+        (*kunde, "F2", *flasche, "2020-01-01 10:00:00", "zurückgegeben"),
+        (*kunde, "F3", *flasche, "2020-02-01 10:00:00", "verliehen"),
+        (*kunde, "F3", *flasche, "2020-03-01 10:00:00", "verliehen"),
+    ], [("Zentrale", "10l", "200 bar", 5)])
+
+    init_db(pfad)
+    db = Datenbank(pfad)
+    try:
+        assert schema_version(db.conn) == SCHEMA_VERSION
+        assert db.bestand_pruefen() == []
+        zelle = next(row for row in db.bestand_liste() if row[1:4] == ("Zentrale", "10l", "200 bar"))
+        # The old available count stays available; F3 is out only once.
+        assert db.conn.execute(
+            "SELECT gesamt, verliehen FROM bestand WHERE id = ?", (zelle[0],)
+        ).fetchone() == (7, 2)
+        assert sorted(db.aktive_flaschen(["F1", "F2", "F3"])) == ["F1", "F3"]
+        assert db.conn.execute("SELECT flaschennummer, verliehen_am FROM doppelt_verliehen").fetchall() == [
+            ("F3", "2020-02-01 10:00:00"),
+        ]
+        # Running it again changes nothing.
+        init_db(pfad)
+        assert schema_version(db.conn) == SCHEMA_VERSION
+    finally:
+        db.close()
+
+
+def test_doppelt_verliehene_werden_gemeldet(tmp_path, caplog):
+    pfad = str(tmp_path / "alt.db")
+    kunde = ("Alt", "089 1", "Weg 2", "Frau Alt", "A1")
+    flasche = ("10l", "200 bar", "Linde", "Zentrale", 1)
+    ausgangsschema(pfad, [
+        (*kunde, "F1", *flasche, "2020-01-01 10:00:00", "verliehen"),
+        (*kunde, "F1", *flasche, "2020-02-01 10:00:00", "verliehen"),
+        (*kunde, "F2", *flasche, "2020-02-01 10:00:00", "verliehen"),
+    ], [("Zentrale", "10l", "200 bar", 5)])
+    conn = sqlite3.connect(pfad)
+    try:
+        with caplog.at_level(logging.WARNING, logger="verleih.schema"):
+            migrate(conn, ziel=2)
+        assert "F1" in caplog.text and "F2" not in caplog.text
+        assert conn.execute("SELECT verleih_id FROM doppelt_verliehen").fetchall() == [(1,)]
+        assert conn.execute("SELECT id FROM verleih WHERE status = 'verliehen'").fetchall() == [(2,), (3,)]
+        # At this version the stock is kept by hand and is not corrected.
+        assert conn.execute("SELECT bestand FROM bestand").fetchall() == [(5,)]
+    finally:
+        conn.close()
@@ -0,0 +1,61 @@
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import KUNDE, verleihen
+from verleih_db import Datenbank, FlaschenBereitsVerliehen
+
+
+def _sperren(db_path):
+    fremd = sqlite3.connect(db_path, timeout=0, check_same_thread=False)
+    fremd.execute("BEGIN IMMEDIATE")
+    return fremd
+
+
+def test_warten_auf_die_schreibsperre(db, db_path):
+    fremd = _sperren(db_path)
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        db.beginnen(timeout=0.1)
+    assert db.belegt > 0
+    assert not db.conn.in_transaction
+
+    # Released while the writer backs off: the loan goes through.
+    threading.Timer(0.2, fremd.rollback).start()
+    verleihen(db, "A1")
+    assert db.aktive_flaschen(["A1"]) == {"A1"}
+    fremd.close()
+
+
+def test_gleichzeitige_verleihe_derselben_flasche(db_path):
+    ergebnisse = []
+    start = threading.Barrier(4)
+
+    def schreiber(nummer):
+        db = Datenbank(db_path)
+        try:
+            start.wait()
+            db.verleih_anlegen(KUNDE, "10l", "200 bar", "Linde", "Zentrale", ["X1", f"Y{nummer}"])
+            ergebnisse.append("ok")
+        except FlaschenBereitsVerliehen as e:
+            ergebnisse.append(e.flaschennummern)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=schreiber, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The check runs under the lock, so exactly one wins and the others see why.
+    assert sorted(ergebnisse, key=str) == ["ok", {"X1"}, {"X1"}, {"X1"}]
+
+
+def test_block_in_fremder_transaktion(db):
+    # In a transaction the caller opened, a failing block undoes only itself.
+    db.beginnen()
+    verleihen(db, "A1")
+    with pytest.raises(FlaschenBereitsVerliehen):
+        verleihen(db, "B1", "A1")
+    db.conn.commit()
+    assert db.aktive_flaschen(["A1", "B1"]) == {"A1"}
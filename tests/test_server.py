@@ -0,0 +1,38 @@
+import socket
+import urllib.parse
+
+import pytest
+
+from conftest import KUNDE
+from verleih_client import ServerFehler
+from verleih_db import FlaschenBereitsVerliehen
+
+
+def _roh(server, anfrage):
+    """Send ``anfrage`` as it is and return the status line of the answer."""
+    teile = urllib.parse.urlsplit(server)
+    with socket.create_connection((teile.hostname, teile.port), timeout=10) as s:
+        s.sendall(anfrage)
+        return s.makefile("rb").readline().decode("latin-1").strip()
+
+
+def test_verleih_und_rueckgabe_ueber_den_server(client):
+    client.verleih_anlegen(KUNDE, "10l", "200 bar", "Linde", "Zentrale", ["S1", "S2"])
+    with pytest.raises(FlaschenBereitsVerliehen) as fehler:
+        client.verleih_anlegen(KUNDE, "10l", "200 bar", "Linde", "Zentrale", ["S2", "S3"])
+    assert fehler.value.flaschennummern == {"S2"}
+    assert [row[:2] + row[6:7] for row in client.verleihvorgaenge()] == [("Kunde", "S1, S2", "verliehen")]
+    assert client.zurueckgeben(["S1", "S2"]) == 2
+    assert [row[6] for row in client.verleihvorgaenge()] == ["zurückgegeben"]
+
+
+def test_unbekannte_filiale(client):
+    with pytest.raises(ServerFehler) as fehler:
+        client.verleih_anlegen(KUNDE, "10l", "200 bar", "Linde", "Atlantis", ["S1"])
+    assert fehler.value.status == 400
+
+
+@pytest.mark.parametrize("laenge", ["abc", "-5"])
+def test_ungueltige_content_length(server, laenge):
+    anfrage = f"POST /rueckgabe HTTP/1.1\r\nHost: x\r\nContent-Length: {laenge}\r\n\r\n{{}}".encode()
+    assert _roh(server, anfrage).startswith("HTTP/1.1 400")
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+
+import pytest
+
+import verleih_db
+from conftest import KUNDE, ZENTRALE, Gegenstelle, verleihen
+from verleih_db import (
+    DRUECKE, FILIALEN, GROESSEN, SYNC_NEUBEGINN, Datenbank, Verleihvorgang, archiv_anlegen, sicherung_pfad,
+)
+from verleih_schema import ARCHIV_VERSION, SCHEMA_VERSION, _sortier_indizes, schema_version
+from verleih_sync import abgleichen
+
+
+def test_sichern_und_wiederherstellen(db, db_path):
+    verleihen(db, "A1")
+    eintrag = db.sichern()
+    assert os.path.exists(os.path.join(sicherung_pfad(db_path), eintrag["name"] + ".db"))
+    verleihen(db, "A2")
+    db.zurueckgeben(["A1"])
+    _, stand = db.aenderung_stand()
+
+    vorher = db.wiederherstellen(eintrag["name"])
+    assert [e["name"] for e in db.sicherungen()] == [vorher["name"], eintrag["name"]]
+    assert db.aktive_flaschen(["A1", "A2"]) == {"A1"}
+    assert db.bestand_pruefen() == []
+    # Clients following the change log reload everything.
+    assert db.aenderungen(stand) is None
+    # Other connections see the restored state.
+    andere = Datenbank(db_path)
+    try:
+        assert andere.aktive_flaschen(["A1", "A2"]) == {"A1"}
+    finally:
+        andere.close()
+
+    db.wiederherstellen(vorher["name"])
+    assert db.aktive_flaschen(["A1", "A2"]) == {"A2"}
+
+
+def test_unbekannte_sicherung(db):
+    with pytest.raises(ValueError):
+        db.wiederherstellen("gibt-es-nicht")
+
+
+def test_sicherungen_rotieren(db):
+    namen = [db.sichern(behalten=2)["name"] for _ in range(3)]
+    assert [e["name"] for e in db.sicherungen()] == namen[:0:-1]
+
+
+def test_sync_nach_wiederherstellen(db):
+    verleihen(db, "A1")
+    eintrag = db.sichern()
+    for nummer in ("A2", "A3", "A4", "A5", "A6"):
+        verleihen(db, nummer)
+    # A branch has pulled everything.
+    cursor, _, mehr = db.sync_zeilen(0)
+    assert not mehr
+    uhr = db.conn.execute("SELECT uhr FROM sync_uhr").fetchone()[0]
+
+    db.wiederherstellen(eintrag["name"])
+    # Versions go on from before the restore.
+    assert db.conn.execute("SELECT uhr FROM sync_uhr").fetchone()[0] >= uhr
+    verleihen(db, "B1")
+    neu, zeilen, _ = db.sync_zeilen(cursor)
+    assert neu > cursor
+    # The restored delivery and the new one.
+    assert {nummer for art, _, daten in zeilen if art == "vorgang" for nummer, _ in daten[-1]} == {"A1", "B1"}
+    assert [art for art, _, _ in zeilen].count(SYNC_NEUBEGINN) == 1
+
+
+def test_filiale_nach_wiederherstellen_der_zentrale(db, filiale):
+    zentrale = Gegenstelle(db)
+    eintrag = db.sichern()
+    verleihen(db, "Z1")
+    verleihen(filiale, "N1", filiale="Nürnberg")
+    abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE)
+    assert db.aktive_flaschen(["Z1", "N1"]) == {"Z1", "N1"}
+
+    # The restore loses Z1 and N1 at the Zentrale; the branch still has them.
+    db.wiederherstellen(eintrag["name"])
+    assert db.aktive_flaschen(["Z1", "N1"]) == set()
+    verleihen(db, "Z2")
+    db.zurueckgeben(["Z0"])
+    # The first round brings the restored state and the neubeginn, the second sends the branch's rows back.
+    abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE)
+    abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE)
+    for seite in (db, filiale):
+        assert seite.aktive_flaschen(["Z0", "Z1", "Z2", "N1"]) == {"Z1", "Z2", "N1"}
+        assert seite.bestand_pruefen() == []
+    assert db.bestand_liste() == filiale.bestand_liste()
+    assert abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE) == (0, 0)
+
+
+@pytest.fixture
+def mit_archiv(db, db_path):
+    # A backup with an archive: A1 archived, B1 out.
+    db.vorgaenge_importieren([
+        Verleihvorgang(*KUNDE, "10l", "200 bar", "Linde", "Zentrale", "2020-01-01 10:00:00", ("A1",), frozenset({"A1"})),
+    ])
+    verleihen(db, "B1")
+    archiv_anlegen(db_path)
+    db = Datenbank(db_path)
+    db.archivieren(tage=30)
+    eintrag = db.sichern()
+    assert eintrag["archiv"]
+    verleihen(db, "B2")
+    yield db, eintrag
+    db.close()
+
+
+def _stand(db):
+    return db.aktive_flaschen(["B1", "B2"]), len(db.verleihvorgaenge(archiv=True)), len(db.sicherungen())
+
+
+def test_beschaedigte_sicherung_wird_nicht_zurueckgespielt(mit_archiv, db_path):
+    db, eintrag = mit_archiv
+    vorher = _stand(db)
+    with open(os.path.join(sicherung_pfad(db_path), eintrag["archiv"]), "r+b") as f:
+        f.seek(4096)
+        f.write(b"\xff" * 4096)
+    with pytest.raises(sqlite3.DatabaseError):
+        db.wiederherstellen(eintrag["name"])
+    assert _stand(db) == vorher
+
+
+def test_fehlendes_archiv(mit_archiv, db_path):
+    db, eintrag = mit_archiv
+    vorher = _stand(db)
+    os.remove(os.path.join(sicherung_pfad(db_path), eintrag["archiv"]))
+    with pytest.raises(ValueError, match="unvollständig"):
+        db.wiederherstellen(eintrag["name"])
+    assert _stand(db) == vorher
+
+
+def test_fehler_beim_archiv_stellt_den_stand_davor_her(mit_archiv, monkeypatch):
+    db, eintrag = mit_archiv
+    vorher = _stand(db)
+    zurueckspielen = Datenbank._zurueckspielen
+    versuche = []
+
+    def archiv_gesperrt(self, schema, pfad):
+        versuche.append(schema)
+        if versuche == ["main", "archiv"]:
+            raise sqlite3.OperationalError("database is locked")
+        zurueckspielen(self, schema, pfad)
+
+    monkeypatch.setattr(Datenbank, "_zurueckspielen", archiv_gesperrt)
+    with pytest.raises(sqlite3.OperationalError):
+        db.wiederherstellen(eintrag["name"])
+    # The main file was written and then got the state from before back.
+    assert versuche == ["main", "archiv", "main"]
+    assert _stand(db)[:2] == vorher[:2]
+    assert db.bestand_pruefen() == []
+
+
+def test_gesperrte_datenbank(db, db_path, monkeypatch):
+    verleihen(db, "A1")
+    eintrag = db.sichern()
+    verleihen(db, "A2")
+    monkeypatch.setattr(verleih_db, "SCHREIB_TIMEOUT", 0.3)
+    andere = Datenbank(db_path)
+    try:
+        andere.conn.execute("BEGIN IMMEDIATE")
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            db.wiederherstellen(eintrag["name"])
+        andere.conn.rollback()
+    finally:
+        andere.close()
+    assert db.aktive_flaschen(["A1", "A2"]) == {"A1", "A2"}
+
+
+def test_wiederherstellen_mit_archiv(mit_archiv):
+    db, eintrag = mit_archiv
+    db.wiederherstellen(eintrag["name"])
+    assert db.aktive_flaschen(["B1", "B2"]) == {"B1"}
+    assert [row[1] for row in db.verleihvorgaenge(archiv=True)] == ["B1", "A1"]
+    assert db.bestand_pruefen() == []
+
+
+def test_alte_sicherung_wird_migriert(db, db_path):
+    verleihen(db, "A1")
+    eintrag = db.sichern()
+    # Replace the copy with a database from before the migrations.
+    pfad = os.path.join(sicherung_pfad(db_path), eintrag["name"] + ".db")
+    os.remove(pfad)
+    alt = sqlite3.connect(pfad)
+    alt.execute("""
+        CREATE TABLE verleih (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, telefon TEXT, adresse TEXT, ansprechpartner TEXT,
+            referenznummer TEXT, flaschennummer TEXT, flaschengroesse TEXT, flaschendruck TEXT, flasche_von TEXT,
+            filiale TEXT, anzahl INTEGER, verliehen_am TEXT, status TEXT
+        )
+    """)
+    alt.execute(
+        "CREATE TABLE bestand (id INTEGER PRIMARY KEY AUTOINCREMENT, filiale TEXT, flaschengroesse TEXT, "
+        "flaschendruck TEXT, bestand INTEGER)"
+    )
+    alt.execute(
+        "INSERT INTO verleih VALUES (NULL, 'Alt', '089 1', 'Weg 2', 'Frau Alt', 'A1', 'X1', '10l', '200 bar', "
+        "'Linde', 'Zentrale', 1, '2020-01-01 10:00:00', 'verliehen')"
+    )
+    alt.commit()
+    alt.close()
+
+    db.wiederherstellen(eintrag["name"])
+    assert schema_version(db.conn) == SCHEMA_VERSION
+    assert db.aktive_flaschen(["A1", "X1"]) == {"X1"}
+    assert len(db.bestand_liste()) == len(FILIALEN) * len(GROESSEN) * len(DRUECKE)
+    assert db.bestand_pruefen() == []
+    verleihen(db, "A2")
+    # The backup itself is left as it was.
+    with sqlite3.connect(pfad) as alt:
+        assert alt.execute("PRAGMA user_version").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("schema", ["main", "archiv"])
+def test_neuere_sicherung_wird_abgelehnt(mit_archiv, db_path, schema):
+    db, eintrag = mit_archiv
+    vorher = _stand(db)
+    datei = eintrag["name"] + ".db" if schema == "main" else eintrag["archiv"]
+    with sqlite3.connect(os.path.join(sicherung_pfad(db_path), datei)) as neu:
+        neu.execute("PRAGMA user_version = 99")
+    with pytest.raises(ValueError, match="neueres Schema"):
+        db.wiederherstellen(eintrag["name"])
+    assert _stand(db) == vorher
+
+
+def test_altes_archiv_wird_migriert(mit_archiv, db_path):
+    db, eintrag = mit_archiv
+    with sqlite3.connect(os.path.join(sicherung_pfad(db_path), eintrag["archiv"])) as alt:
+        # Back to version 1, before the sort indexes.
+        for sql in _sortier_indizes(""):
+            alt.execute(f"DROP INDEX {sql.split()[2]}")
+        alt.execute("ALTER TABLE verleihvorgang DROP COLUMN erste_flasche")
+        alt.execute("PRAGMA user_version = 1")
+    db.wiederherstellen(eintrag["name"])
+    assert db.conn.execute("PRAGMA archiv.user_version").fetchone()[0] == ARCHIV_VERSION
+    assert [row[1] for row in db.verleihvorgaenge(archiv=True)] == ["B1", "A1"]
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from verleih_db import SORTIERBAR, Verleihvorgang, vorgang_richtungen, vorgang_schluessel
+
+SEITE = 7
+SORTIERUNGEN = [()] + [
+    [(spalte, absteigend)] for spalte in [*SORTIERBAR, "verliehen_am"] for absteigend in (False, True)
+] + [
+    [("filiale", False), ("anzahl", True)],
+    [("status", True), ("name", False), ("verliehen_am", False)],
+]
+
+
+@pytest.fixture
+def vorgaenge(db):
+    rnd = random.Random(1)
+    vorgaenge = []
+    for i in range(60):
+        anzahl = rnd.randint(1, 3)
+        nummern = tuple(f"F{rnd.randrange(1000):03d}-{i}-{j}" for j in range(anzahl))
+        vorgaenge.append(Verleihvorgang(
+            f"Kunde {rnd.randrange(8)}", "0911 1", "Weg 1", "Herr K", f"R{i}", rnd.choice(["10l", "20l", "50l"]),
+            "200 bar", "Linde", rnd.choice(["Zentrale", "Nürnberg", "Moosach"]),
+            # Several deliveries share a second, so the id has to break ties.
+            f"2024-01-{rnd.randint(1, 5):02d} 10:00:00", nummern,
+            frozenset(nummern[:rnd.randint(0, anzahl)]),
+        ))
+    assert db.vorgaenge_importieren(vorgaenge) == []
+    return vorgaenge
+
+
+def _davor(a, b, richtungen):
+    for x, y, absteigend in zip(a, b, richtungen):
+        if x != y:
+            return x > y if absteigend else x < y
+    return False
+
+
+@pytest.mark.parametrize("sortierung", SORTIERUNGEN, ids=str)
+def test_seiten_vor_und_zurueck(db, vorgaenge, sortierung):
+    richtungen = vorgang_richtungen(sortierung)
+    alle = db.verleihvorgaenge(sortierung=sortierung)
+    assert len(alle) == len(vorgaenge)
+    schluessel = [vorgang_schluessel(row) for row in alle]
+    assert all(_davor(a, b, richtungen) for a, b in zip(schluessel, schluessel[1:]))
+
+    seiten, nach = [], None
+    while seite := db.verleihvorgaenge(nach=nach, limit=SEITE, sortierung=sortierung):
+        seiten.append(seite)
+        nach = vorgang_schluessel(seite[-1])
+    assert [row for seite in seiten for row in seite] == alle
+
+    # Back up: every page again between the key before it and the first key after it.
+    for i, seite in enumerate(seiten):
+        nach = vorgang_schluessel(seiten[i - 1][-1]) if i else None
+        vor = vorgang_schluessel(seiten[i + 1][0]) if i + 1 < len(seiten) else None
+        assert db.verleihvorgaenge(nach=nach, vor=vor, sortierung=sortierung) == seite
+    assert db.verleihvorgaenge(vor=schluessel[SEITE], sortierung=sortierung) == alle[:SEITE]
+
+
+@pytest.mark.parametrize("sortierung", SORTIERUNGEN[:3], ids=str)
+def test_seiten_nur_offene(db, vorgaenge, sortierung):
+    alle = db.verleihvorgaenge(status="verliehen", sortierung=sortierung)
+    assert len(alle) == sum(len(v.flaschennummern) > len(v.zurueckgegeben) for v in vorgaenge)
+    seiten, nach = [], None
+    while seite := db.verleihvorgaenge(nach=nach, limit=SEITE, status="verliehen", sortierung=sortierung):
+        seiten.extend(seite)
+        nach = vorgang_schluessel(seite[-1])
+    assert seiten == alle
+
+
+def test_unbekannte_spalte(db):
+    with pytest.raises(ValueError):
+        db.verleihvorgaenge(sortierung=[("telefon", False)])
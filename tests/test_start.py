@@ -0,0 +1,68 @@
+import time
+import types
+
+from conftest import verleihen
+from diagnose import Diagnose
+from flaschen_register import FlaschenRegister
+from newtest_fix import VORBAU_PAUSE_MS, FlaschenVerleihApp
+
+
+class Wurzel:
+    """Collects after() calls instead of running a Tk event loop."""
+
+    def __init__(self):
+        self.geplant = []
+
+    def after(self, ms, fn, *args):
+        self.geplant.append((ms, fn, args))
+
+
+def _app(beschaeftigt=False):
+    app = types.SimpleNamespace(
+        diagnose=Diagnose(), gestartet=time.perf_counter(), startzeiten={}, root=Wurzel(),
+        register=FlaschenRegister(), rueckmeldung=types.SimpleNamespace(beschaeftigt=beschaeftigt), gebaut=[],
+        rueckgabe_tab="rueckgabe", uebersicht_tab="uebersicht", bestand_tab="bestand",
+    )
+    app.tab_aufbau = {
+        tab: (lambda tab=tab: app.gebaut.append(tab)) for tab in ("rueckgabe", "uebersicht", "bestand", "berichte")
+    }
+    for name in ("start_messen", "tab_bauen", "tab_vorbauen"):
+        setattr(app, name, getattr(FlaschenVerleihApp, name).__get__(app))
+    return app
+
+
+def _naechster(app):
+    ms, fn, args = app.root.geplant.pop(0)
+    assert ms == VORBAU_PAUSE_MS
+    fn(*args)
+
+
+def test_tabs_werden_erst_bei_der_wahl_gebaut():
+    app = _app()
+    app.notebook = types.SimpleNamespace(select=lambda: "berichte")
+    FlaschenVerleihApp.tab_gewaehlt(app, None)
+    FlaschenVerleihApp.tab_gewaehlt(app, None)
+    assert app.gebaut == ["berichte"]
+    assert next(row for row in app.diagnose.tabelle() if row[0] == "ui:tab_bauen")[1] == 1
+
+
+def test_vorbauen_nach_dem_register(db):
+    verleihen(db, "A1")
+    app = _app()
+    FlaschenVerleihApp.register_laden(app, db.flaschen_register())
+    assert "A1" in app.register
+    assert set(app.startzeiten) == {"start_bereit"}
+    assert any(row[0] == "start_bereit" for row in app.diagnose.tabelle())
+    # Reloading the register later neither measures nor schedules again.
+    FlaschenVerleihApp.register_laden(app, db.flaschen_register())
+    assert len(app.root.geplant) == 1
+
+    # Only the tabs with data, one per pause, and none while the database thread is busy.
+    app.rueckmeldung.beschaeftigt = True
+    _naechster(app)
+    assert app.gebaut == []
+    app.rueckmeldung.beschaeftigt = False
+    while app.root.geplant:
+        _naechster(app)
+    assert app.gebaut == ["rueckgabe", "uebersicht", "bestand"]
+    assert list(app.tab_aufbau) == ["berichte"]
@@ -0,0 +1,44 @@
+from conftest import KUNDE, verleihen
+from verleih_db import suchausdruck, vorgang_schluessel
+
+
+def _kunde(name, referenz="R1"):
+    return [name, *KUNDE[1:4], referenz]
+
+
+def _namen(rows):
+    return [row[0] for row in rows]
+
+
+def test_suche_nach_wortanfaengen(db):
+    verleihen(db, "A1", kunde=_kunde("Brauerei Huber"))
+    verleihen(db, "B1", "B2", kunde=_kunde("Bäckerei Huber", "L-4711"))
+    verleihen(db, "C1", kunde=_kunde("Schlosserei Maier"))
+    assert _namen(db.verleihvorgaenge(suche="brau")) == ["Brauerei Huber"]
+    assert sorted(_namen(db.verleihvorgaenge(suche="Hub"))) == ["Brauerei Huber", "Bäckerei Huber"]
+    # Every word has to match.
+    assert _namen(db.verleihvorgaenge(suche="huber bäck")) == ["Bäckerei Huber"]
+    # A delivery matches if any of its bottles does.
+    assert _namen(db.verleihvorgaenge(suche="B2")) == ["Bäckerei Huber"]
+    assert _namen(db.verleihvorgaenge(suche="4711")) == ["Bäckerei Huber"]
+    assert db.verleihvorgaenge(suche="Zimmerei") == []
+
+
+def test_suche_mit_status_und_seiten(db):
+    for i in range(12):
+        verleihen(db, f"H{i}", kunde=_kunde(f"Huber {i}"))
+    db.zurueckgeben(["H0", "H1"])
+    alle = db.verleihvorgaenge(suche="huber", status="verliehen")
+    assert len(alle) == 10
+    seiten, nach = [], None
+    while seite := db.verleihvorgaenge(nach=nach, limit=4, suche="huber", status="verliehen"):
+        seiten.extend(seite)
+        nach = vorgang_schluessel(seite[-1])
+    assert seiten == alle
+
+
+def test_sonderzeichen_in_der_suche(db):
+    verleihen(db, "A1", kunde=_kunde('Huber "GmbH" & Co'))
+    assert suchausdruck('"*) OR (') == '"OR"*'
+    assert _namen(db.verleihvorgaenge(suche='"GmbH*')) == ['Huber "GmbH" & Co']
+    assert db.verleihvorgaenge(suche="-*()") == db.verleihvorgaenge()
@@ -0,0 +1,58 @@
+import json
+
+from conftest import ZENTRALE, Gegenstelle, verleihen
+from verleih_db import SQL_SYNC_FLASCHEN
+from verleih_sync import abgleichen
+
+
+def test_abgleich_hin_und_zurueck(db, filiale):
+    zentrale = Gegenstelle(db)
+    assert abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE) == (0, 0)
+
+    verleihen(filiale, "N1", "N2", filiale="Nürnberg")
+    filiale.bestand_setzen("Nürnberg", "10l", "200 bar", 5)
+    verleihen(db, "Z1")
+    db.zurueckgeben(["Z0"])
+    gesendet, empfangen = abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE)
+    assert gesendet == 2
+    assert empfangen >= 2
+
+    for seite in (db, filiale):
+        assert seite.aktive_flaschen(["Z0", "Z1", "N1", "N2"]) == {"Z1", "N1", "N2"}
+        assert seite.bestand_pruefen() == []
+    assert db.bestand_liste() == filiale.bestand_liste()
+
+    # The return of a bottle lent at the branch comes back to the Zentrale.
+    filiale.zurueckgeben(["N1"])
+    assert abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE)[0] == 1
+    assert db.aktive_flaschen(["N1", "N2"]) == {"N2"}
+    # Nothing new on either side.
+    assert abgleichen(filiale, zentrale, "Nürnberg", ZENTRALE) == (0, 0)
+
+
+def test_gleiche_flasche_auf_beiden_seiten(db, filiale):
+    # Both lend the same bottle offline; the later loan keeps it everywhere.
+    verleihen(filiale, "X1", filiale="Nürnberg")
+    verleihen(db, "X1")
+    abgleichen(filiale, Gegenstelle(db), "Nürnberg", ZENTRALE)
+    abgleichen(filiale, Gegenstelle(db), "Nürnberg", ZENTRALE)
+    offen = []
+    for seite in (db, filiale):
+        offen.append(seite.conn.execute(
+            "SELECT verleihvorgang.uid FROM verleih_position JOIN flasche ON flasche.id = verleih_position.flasche_id "
+            "JOIN verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id "
+            "WHERE flasche.flaschennummer = 'X1' AND verleih_position.status = 'verliehen'"
+        ).fetchall())
+        assert seite.bestand_pruefen() == []
+    assert len(offen[0]) == 1
+    assert offen[0] == offen[1]
+
+
+def test_flasche_ohne_version(db, filiale):
+    # Bottles from before the sync migration carry no version.
+    db.conn.execute("UPDATE flasche SET version = NULL WHERE flaschennummer = 'Z0'")
+    db.conn.commit()
+    nummer, *daten = db.conn.execute(SQL_SYNC_FLASCHEN, (json.dumps(["Z0"]),)).fetchone()
+    assert daten[-1] is None
+    assert filiale.sync_anwenden(ZENTRALE, [["flasche", nummer, daten]]) == 0
+    assert filiale.aktive_flaschen(["Z0"]) == {"Z0"}
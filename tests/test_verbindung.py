@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import verleihen
+from verleih_db import VerbindungsPool, verbinden
+
+
+def test_verbinden_setzt_die_pragmas(db_path):
+    conn = verbinden(db_path)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        # 1 is NORMAL.
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def test_transaktion_wird_zurueckgerollt(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as c:
+            c.execute("UPDATE bestand SET gesamt = 99")
+            raise RuntimeError
+    assert not db.conn.in_transaction
+    assert db.conn.execute("SELECT COUNT(*) FROM bestand WHERE gesamt = 99").fetchone()[0] == 0
+
+
+def test_block_in_einer_offenen_transaktion(db):
+    # As in a group commit: a failing block undoes only its own writes.
+    db.beginnen()
+    verleihen(db, "A1")
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            verleihen(db, "B1")
+            raise RuntimeError
+    assert db.conn.in_transaction
+    db.conn.commit()
+    assert db.aktive_flaschen(["A1", "B1"]) == {"A1"}
+
+
+def test_pool_gibt_verbindungen_zurueck(db_path):
+    pool = VerbindungsPool(db_path, groesse=2)
+    try:
+        with pool.verbindung() as a, pool.verbindung() as b:
+            assert a is not b
+        with pool.verbindung() as c:
+            # The connection returned last is handed out first.
+            assert c is a
+            assert c.execute("SELECT COUNT(*) FROM bestand").fetchone()[0] > 0
+    finally:
+        pool.close()
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from conftest import KUNDE
+from verleih_db import verleih_fehler
+from verleih_service import UngueltigeAnfrage, VerleihService
+
+GUELTIG = ["10l", "200 bar", "Linde", "Zentrale"]
+
+
+def test_gueltiger_vorgang():
+    assert verleih_fehler(KUNDE, GUELTIG, 2, ["A1", "A2"]) is None
+
+
+@pytest.mark.parametrize("dropdown_data, fehler", [
+    (["10L", "200 bar", "Linde", "Zentrale"], "Unbekannte Flaschengröße: 10L"),
+    (["10l", "250 bar", "Linde", "Zentrale"], "Unbekannter Flaschendruck: 250 bar"),
+    (["10l", "200 bar", "Linde", "Filiale A"], "Unbekannte Filiale: Filiale A"),
+    (["10l", "", "Linde", "Zentrale"], "Bitte alle Felder ausfüllen."),
+])
+def test_unbekannte_werte(dropdown_data, fehler):
+    assert verleih_fehler(KUNDE, dropdown_data, 1, ["A1"]) == fehler
+
+
+def test_lieferant_nicht_geprueft():
+    assert verleih_fehler(KUNDE, ["10l", "200 bar", "SOL", "Zentrale"], 1, ["A1"]) is None
+
+
+@pytest.mark.parametrize("anzahl, nummern, fehler", [
+    (1, [], "Bitte Flaschennummer(n) eingeben."),
+    (3, ["A1", "A2"], "Anzahl (3) stimmt nicht mit der Anzahl der Flaschennummern (2) überein."),
+    (2, ["A1", "A1"], "Eine Flaschennummer wurde mehrfach eingegeben."),
+])
+def test_flaschennummern(anzahl, nummern, fehler):
+    assert verleih_fehler(KUNDE, GUELTIG, anzahl, nummern) == fehler
+
+
+def test_server_lehnt_unbekannte_filiale_ab(db, db_path):
+    async def ablauf():
+        service = VerleihService(db_path)
+        await service.starten()
+        try:
+            with pytest.raises(UngueltigeAnfrage, match="Filiale A"):
+                await service.schreiben("verleih_anlegen", KUNDE, "10l", "200 bar", "Linde", "Filiale A", ["A1"])
+            await service.schreiben("verleih_anlegen", KUNDE, "10l", "200 bar", "Linde", "Nürnberg", ["A2"])
+        finally:
+            await service.beenden()
+
+    asyncio.run(ablauf())
+    assert db.aktive_flaschen(["A1", "A2"]) == {"A2"}
+    assert db.bestand_pruefen() == []
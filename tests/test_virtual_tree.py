@@ -0,0 +1,58 @@
+from benchmarks.suite import BaumAttrappe
+from virtual_tree import VirtualTreeview
+
+
+class Baum(BaumAttrappe):
+    """The stand-in tree, with idle callbacks run right away."""
+
+    def after_idle(self, fn, *args):
+        fn(*args)
+
+
+def _liste(zeilen, **optionen):
+    def abfrage(nach=None, vor=None, limit=None):
+        auswahl = [z for z in sorted(zeilen) if (nach is None or (z,) > nach) and (vor is None or (z,) < vor)]
+        return [(z, f"Zeile {z}") for z in auswahl[:limit]]
+
+    baum = Baum()
+    liste = VirtualTreeview(
+        baum, abfrage, lambda row: (row[0],), lambda row: (row[0], row, ()), seitengroesse=10, max_seiten=3,
+        absteigend=False, **optionen,
+    )
+    return baum, liste
+
+
+def _geladen(baum):
+    return [int(iid) for iid in baum.get_children()]
+
+
+def test_seiten_werden_nachgeladen_und_abgelegt():
+    baum, liste = _liste(range(0, 200, 2))
+    liste.neu_laden()
+    assert _geladen(baum) == list(range(0, 20, 2))
+    for _ in range(3):
+        liste._gescrollt("0.7", "1.0")
+    # Only max_seiten pages stay in the tree.
+    assert _geladen(baum) == list(range(20, 80, 2))
+    liste._gescrollt("0.0", "0.3")
+    assert _geladen(baum) == list(range(0, 60, 2))
+    liste._gescrollt("0.0", "0.3")
+    assert _geladen(baum) == list(range(0, 60, 2))
+
+
+def test_ende_der_liste():
+    baum, liste = _liste(range(15))
+    liste.neu_laden()
+    liste._gescrollt("0.5", "1.0")
+    assert _geladen(baum) == list(range(15))
+    liste._gescrollt("0.5", "1.0")
+    assert _geladen(baum) == list(range(15))
+
+
+def test_abgleichen_im_fenster():
+    baum, liste = _liste(range(0, 40, 2))
+    liste.neu_laden()
+    liste.abgleichen(lambda key: key[0] in (3, 4, 99), [(3, "neu"), (99, "neu")])
+    # 3 is inside the loaded window, 4 is gone and 99 lies beyond the last page.
+    assert _geladen(baum) == [0, 2, 3, 6, 8, 10, 12, 14, 16, 18]
+    assert baum.item("3")["values"] == [3, "neu"]
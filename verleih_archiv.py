@@ -0,0 +1,53 @@
+"""Move closed deliveries into the archive file.
+
+    python verleih_archiv.py [--db flaschen_verleih.db] [--tage 365] [--batch 500] [--pause 0.5]
+
+Deliveries whose bottles all came back more than --tage days ago move from
+the hot tables to flaschen_verleih-archiv.db next to the database, which is
+created on the first run. Every connection opened after that attaches the
+archive: details, the life of a bottle and the verlauf and ereignisse
+reports find archived deliveries, and the overview lists them when asked
+to. The daily lists and the checks of a new loan only see the hot tables.
+
+The deliveries are moved in batches of --batch, each in two short
+transactions, with --pause seconds in between so the running programs get
+the write lock; an interrupted run is simply started again. A server
+started with --archiv-tage does the same in the background.
+"""
+import argparse
+import sys
+import time
+
+from verleih_db import ARCHIV_BATCH, ARCHIV_TAGE, DB_PATH, Datenbank, archiv_anlegen, init_db
+
+PAUSE = 0.5
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--tage", type=int, default=ARCHIV_TAGE, help="abgeschlossen seit mindestens so vielen Tagen")
+    parser.add_argument("--batch", type=int, default=ARCHIV_BATCH, help="Vorgänge je Transaktion")
+    parser.add_argument("--pause", type=float, default=PAUSE, help="Sekunden zwischen zwei Batches")
+    args = parser.parse_args()
+
+    init_db(args.db)
+    archiv_anlegen(args.db)
+    db = Datenbank(args.db)
+    start = time.perf_counter()
+    gesamt = 0
+    try:
+        while anzahl := db.archivieren(args.tage, args.batch):
+            gesamt += anzahl
+            print(f"{gesamt} Vorgänge archiviert", end="\r", flush=True)
+            time.sleep(args.pause)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+    print(f"{gesamt} Vorgänge archiviert ({time.perf_counter() - start:.1f} s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Reports and exports of loans and stock as CSV or JSON Lines.
+
+    python verleih_bericht.py kunden --groesse 50l --druck "300 bar" --von Linde --mindestalter 90
+    python verleih_bericht.py verlauf --format jsonl --ausgabe verlauf.jsonl [--server http://zentrale:8765]
+
+Reports (see verleih_db.BERICHTE):
+
+- alter: open bottles per cell in age classes, with share and running total
+- kunden: open bottles per customer, cell and supplier, ranked per branch
+- auslastung: lent share of every bestand cell and of its branch
+- stichtag: gesamt, verliehen and verfuegbar of every cell at --stichtag
+- ereignisse: the event log between --ab and --bis, oldest first
+- verlauf: every bottle ever lent, in the layout verleih_import.py reads
+- pruefung: bottles in service due for the pressure test by --stichtag, and who has them
+- flaschenbestand: registered bottles in service per cell next to the counted gesamt
+
+The aggregates are computed in SQL. Rows are streamed from the cursor through
+generators into the output, so exporting the full history needs no more
+memory than exporting one row.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+
+from verleih_client import VerleihClient
+from verleih_db import BERICHTE, DB_PATH, Datenbank
+
+FORMATE = ("csv", "jsonl")
+# Excel with German settings splits CSV files on semicolons.
+TRENNZEICHEN = ";"
+
+
+def csv_zeilen(spalten, rows, trennzeichen=TRENNZEICHEN):
+    """Yield the header and every row as one line of CSV text."""
+    puffer = io.StringIO()
+    writer = csv.writer(puffer, delimiter=trennzeichen)
+    for werte in itertools.chain([spalten], rows):
+        writer.writerow(werte)
+        yield puffer.getvalue()
+        puffer.seek(0)
+        puffer.truncate()
+
+
+def jsonl_zeilen(spalten, rows):
+    """Yield every row as one JSON object per line."""
+    for row in rows:
+        yield json.dumps(dict(zip(spalten, row)), ensure_ascii=False) + "\n"
+
+
+def zeilen(db, name, format="csv", trennzeichen=TRENNZEICHEN, **parameter):
+    """Lines of report ``name`` from a Datenbank or VerleihClient."""
+    spalten = BERICHTE[name][1]
+    rows = db.bericht(name, **parameter)
+    if format == "jsonl":
+        return jsonl_zeilen(spalten, rows)
+    return csv_zeilen(spalten, rows, trennzeichen)
+
+
+def exportieren(db, name, datei, format="csv", trennzeichen=TRENNZEICHEN, **parameter):
+    """Write report ``name`` to the file ``datei`` and return the number of rows."""
+    anzahl = -1 if format == "csv" else 0
+    # The BOM makes Excel read the umlauts as UTF-8; verleih_import.py skips it.
+    encoding = "utf-8-sig" if format == "csv" else "utf-8"
+    with open(datei, "w", newline="", encoding=encoding) as f:
+        for zeile in zeilen(db, name, format, trennzeichen, **parameter):
+            f.write(zeile)
+            anzahl += 1
+    return anzahl
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("bericht", choices=sorted(BERICHTE))
+    parser.add_argument("--format", choices=FORMATE, default="csv")
+    parser.add_argument("--ausgabe", help="Zieldatei (Standard: Standardausgabe)")
+    parser.add_argument("--trennzeichen", default=TRENNZEICHEN)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--server", help="URL von verleih_server.py; ersetzt --db")
+    parser.add_argument("--filiale")
+    parser.add_argument("--groesse", dest="flaschengroesse")
+    parser.add_argument("--druck", dest="flaschendruck")
+    parser.add_argument("--von", dest="flasche_von")
+    parser.add_argument("--mindestalter", type=int, help="nur Flaschen, die seit so vielen Tagen draußen sind")
+    parser.add_argument("--stichtag", help="alter, stichtag, pruefung: Zeitpunkt der Auswertung (Standard: jetzt)")
+    parser.add_argument("--ab", help="verlauf, ereignisse: ab diesem Zeitpunkt")
+    parser.add_argument("--bis", help="verlauf, ereignisse: vor diesem Zeitpunkt")
+    args = parser.parse_args()
+
+    parameter = {
+        name: getattr(args, name)
+        for name in ("filiale", "flaschengroesse", "flaschendruck", "flasche_von", "mindestalter", "stichtag", "ab", "bis")
+        if getattr(args, name) is not None
+    }
+    if args.server is not None:
+        db = VerleihClient(args.server)
+    else:
+        db = Datenbank(args.db)
+    try:
+        if args.ausgabe:
+            anzahl = exportieren(db, args.bericht, args.ausgabe, args.format, args.trennzeichen, **parameter)
+            print(f"{anzahl} Zeilen nach {args.ausgabe} geschrieben.", file=sys.stderr)
+        else:
+            sys.stdout.writelines(zeilen(db, args.bericht, args.format, args.trennzeichen, **parameter))
+    except BrokenPipeError:
+        # Output piped into head or similar.
+        pass
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Client for verleih_server.py with the same methods as ``Datenbank``.
+
+The Tk app uses it in place of ``Datenbank`` when it is started with
+``--server``. Like a database connection it belongs to one thread; all
+requests share one keep-alive connection.
+"""
+import gzip
+import http.client
+import json
+import urllib.parse
+
+from verleih_db import FlaschenAusgemustert, FlaschenBereitsVerliehen
+
+TIMEOUT = 30
+# Bodies above this size are sent gzip-compressed.
+GZIP_AB = 1024
+
+
+class ServerFehler(Exception):
+    """The server answered a request with an error."""
+
+    def __init__(self, status, fehler):
+        super().__init__(f"Server: {fehler} ({status})")
+        self.status = status
+
+
+class VerleihClient:
+    def __init__(self, url, timeout=TIMEOUT):
+        teile = urllib.parse.urlsplit(url)
+        self._pfad = teile.path.rstrip("/")
+        self._conn = http.client.HTTPConnection(teile.hostname, teile.port or 80, timeout=timeout)
+        # Fail at startup rather than on the first click if nobody answers.
+        self.aenderung_stand()
+
+    def close(self):
+        self._conn.close()
+
+    def _anfrage(self, methode, pfad, body=None, **query):
+        url = self._pfad + pfad
+        if query:
+            url += "?" + urllib.parse.urlencode(query)
+        daten = None if body is None else json.dumps(body).encode()
+        kopf = {"Accept-Encoding": "gzip"}
+        if daten is not None:
+            kopf["Content-Type"] = "application/json"
+            if len(daten) > GZIP_AB:
+                daten = gzip.compress(daten)
+                kopf["Content-Encoding"] = "gzip"
+        for versuch in range(2):
+            try:
+                self._conn.request(methode, url, daten, kopf)
+                antwort = self._conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server restarted or dropped the idle connection. Only
+                # reads are repeated; a write may already have gone through.
+                self._conn.close()
+                if versuch or methode != "GET":
+                    raise
+        inhalt = antwort.read()
+        if antwort.getheader("Content-Encoding") == "gzip":
+            inhalt = gzip.decompress(inhalt)
+        if antwort.status >= 400:
+            try:
+                fehler = json.loads(inhalt)
+            except ValueError:
+                fehler = {"fehler": antwort.reason}
+            if antwort.status == 409 and "flaschennummern" in fehler:
+                raise FlaschenBereitsVerliehen(set(fehler["flaschennummern"]))
+            if antwort.status == 409 and "ausgemustert" in fehler:
+                raise FlaschenAusgemustert(set(fehler["ausgemustert"]))
+            raise ServerFehler(antwort.status, fehler.get("fehler", antwort.reason))
+        if antwort.getheader("Content-Type", "").startswith("application/x-ndjson"):
+            return [tuple(json.loads(zeile)) for zeile in inhalt.splitlines()]
+        return json.loads(inhalt)
+
+    def verleih_anlegen(self, daten, flaschengroesse, flaschendruck, flasche_von, filiale, flaschennummern):
+        ergebnis = self._anfrage("POST", "/verleih", {
+            "daten": list(daten), "flaschengroesse": flaschengroesse, "flaschendruck": flaschendruck,
+            "flasche_von": flasche_von, "filiale": filiale, "flaschennummern": list(flaschennummern),
+        })
+        return ergebnis["vorgang"], ergebnis["verliehen_am"]
+
+    def bestand_liste(self, sortierung=()):
+        if not sortierung:
+            return self._anfrage("GET", "/bestand")
+        spalten = ",".join(("-" if absteigend else "") + spalte for spalte, absteigend in sortierung)
+        return self._anfrage("GET", "/bestand", sortierung=spalten)
+
+    def bestand_zeilen(self, ids):
+        if not ids:
+            return []
+        return self._anfrage("GET", "/bestand", ids=",".join(str(i) for i in ids))
+
+    def aenderung_stand(self):
+        return tuple(self._anfrage("GET", "/aenderungen/stand"))
+
+    def aenderungen(self, seit):
+        try:
+            ergebnis = self._anfrage("GET", "/aenderungen", seit=seit)
+        except ServerFehler as e:
+            if e.status == 410:
+                return None
+            raise
+        return ergebnis["cursor"], set(ergebnis["vorgaenge"]), set(ergebnis["bestand"])
+
+    def aenderungen_kuerzen(self, behalten=100_000):
+        # The server trims the log itself when it starts.
+        pass
+
+    def snapshot_anlegen(self):
+        # The server writes snapshots on its own schedule.
+        return False
+
+    def bestand_setzen(self, filiale, groesse, druck, menge):
+        self._anfrage("PUT", "/bestand", {
+            "filiale": filiale, "flaschengroesse": groesse, "flaschendruck": druck, "menge": menge,
+        })
+
+    def bestand_aendern(self, filiale, groesse, druck, delta):
+        self._anfrage("POST", "/bestand/aenderung", {
+            "filiale": filiale, "flaschengroesse": groesse, "flaschendruck": druck, "delta": delta,
+        })
+
+    def verleihvorgaenge(
+        self, nach=None, vor=None, limit=None, suche="", status="", ids=None, archiv=False, sortierung=(),
+    ):
+        return self._anfrage("POST", "/vorgaenge", {
+            "nach": nach, "vor": vor, "limit": limit, "suche": suche, "status": status,
+            "ids": None if ids is None else list(ids), "archiv": archiv, "sortierung": [list(s) for s in sortierung],
+        })
+
+    def flaschen_register(self, vorgang_ids=None):
+        ergebnis = self._anfrage("POST", "/flaschen/register", {
+            "vorgaenge": None if vorgang_ids is None else list(vorgang_ids),
+        })
+        return [tuple(v) for v in ergebnis["vorgaenge"]], [tuple(f) for f in ergebnis["flaschen"]]
+
+    def zurueckgeben(self, flaschennummern):
+        return self._anfrage("POST", "/rueckgabe", {"flaschennummern": list(flaschennummern)})["anzahl"]
+
+    def bericht(self, name, **parameter):
+        """Yield the rows of report ``name`` as they arrive from the server."""
+        self._conn.request(
+            "POST", self._pfad + "/bericht", json.dumps({"name": name, "parameter": parameter}).encode(),
+            {"Content-Type": "application/json"},
+        )
+        antwort = self._conn.getresponse()
+        if antwort.status >= 400:
+            fehler = json.loads(antwort.read())
+            raise ServerFehler(antwort.status, fehler.get("fehler", antwort.reason))
+        try:
+            for zeile in antwort:
+                yield tuple(json.loads(zeile))
+        finally:
+            if not antwort.isclosed():
+                # Abandoned halfway; the rest of the body would be read as
+                # the answer to the next request.
+                self._conn.close()
+
+    def vorgang_details(self, vorgang_ids):
+        if not vorgang_ids:
+            return []
+        return [tuple(row) for row in self._anfrage("POST", "/vorgaenge/details", {"ids": list(vorgang_ids)})]
+
+    def flasche(self, flaschennummer):
+        try:
+            ergebnis = self._anfrage("GET", "/flasche", flaschennummer=flaschennummer)
+        except ServerFehler as e:
+            if e.status == 404:
+                return None
+            raise
+        return tuple(ergebnis["stamm"]), [tuple(zeile) for zeile in ergebnis["lebenslauf"]]
+
+    def flasche_speichern(self, flaschennummer, groesse, druck, von, filiale):
+        self._anfrage("PUT", "/flasche", {
+            "flaschennummer": flaschennummer, "flaschengroesse": groesse, "flaschendruck": druck,
+            "flasche_von": von, "filiale": filiale,
+        })
+
+    def flasche_pruefen(self, flaschennummer, pruefung_faellig):
+        return self._anfrage("POST", "/flasche/pruefung", {
+            "flaschennummer": flaschennummer, "pruefung_faellig": pruefung_faellig,
+        })["geaendert"]
+
+    def flasche_ausmustern(self, flaschennummer):
+        return self._anfrage("POST", "/flasche/ausmustern", {"flaschennummer": flaschennummer})["geaendert"]
+
+    def bestand_aus_register(self):
+        return self._anfrage("POST", "/bestand/register")["zellen"]
+
+    def sync_senden(self, knoten, zeilen):
+        return self._anfrage("POST", "/sync", {"knoten": knoten, "zeilen": zeilen})["geaendert"]
+
+    def sync_holen(self, knoten, seit):
+        """(cursor, zeilen, mehr) of the changes on the server after ``seit`` that did not come from ``knoten``."""
+        ergebnis = self._anfrage("GET", "/sync", knoten=knoten, seit=seit)
+        return ergebnis["cursor"], ergebnis["zeilen"], ergebnis["mehr"]
+
+    def sicherungen(self):
+        return self._anfrage("GET", "/sicherungen")
+
+    def sichern(self):
+        # The server keeps as many backups as it is configured to.
+        return self._anfrage("POST", "/sicherung")
+
+    def wiederherstellen(self, name):
+        return self._anfrage("POST", "/sicherung/wiederherstellen", {"name": name})
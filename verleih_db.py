@@ -0,0 +1,1851 @@
+"""Data-access layer for the Flaschen-Verleih database.
+
+``Datenbank`` owns one long-lived connection for the UI; ``VerbindungsPool``
+hands out a few extra connections to background workers. All connections are
+opened through ``verbinden()`` so they share the same pragmas. The SQL texts
+are module constants: sqlite3 caches prepared statements keyed by the exact
+string, so reusing them skips re-parsing on every call.
+"""
+import collections
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from verleih_schema import (
+    ANGELEGT, ARCHIV_VERSION, AUSGEMUSTERT, BESTAND, GEAENDERT, GEPRUEFT, SCHEMA_VERSION, UMGEBUCHT, VERLIEHEN,
+    ZURUECK_OHNE_ZEIT, ZURUECKGEGEBEN, archiv_einrichten, migrate,
+)
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "flaschen_verleih.db")
+STATEMENT_CACHE = 256
+CACHE_SIZE_KIB = 16 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+FILIALEN = ["Zentrale", "Nürnberg", "Würzburg", "Trudering", "Moosach"]
+GROESSEN = ["10l", "20l", "50l"]
+DRUECKE = ["200 bar", "300 bar"]
+# Offered in the forms; older data has other suppliers, so it is not checked.
+LIEFERANTEN = ["Linde", "Air Liquide", "Eigen"]
+# Every write transaction takes the write lock up front with BEGIN
+# IMMEDIATE, so the checks of a loan and its inserts see the same state and
+# a transaction never finds out halfway through that another process wrote
+# first. SQLite's busy handler waits only BUSY_TIMEOUT for the lock; after
+# that BEGIN is retried with exponential backoff and full jitter, so
+# writers in many processes do not retry in lockstep, until SCHREIB_TIMEOUT.
+BUSY_TIMEOUT = 0.05
+SCHREIB_TIMEOUT = 10.0
+BACKOFF_START = 0.002
+BACKOFF_MAX = 0.2
+
+# Bottle lists are bound as one JSON array so a crate of any size is a single
+# statement and never hits SQLite's host-parameter limit.
+SQL_AKTIVE_FLASCHEN = """
+    SELECT flasche.flaschennummer FROM flasche
+    JOIN verleih_position ON verleih_position.flasche_id = flasche.id AND verleih_position.status = 'verliehen'
+    WHERE flasche.flaschennummer IN (SELECT value FROM json_each(?))
+"""
+SQL_AUSGEMUSTERTE_FLASCHEN = """
+    SELECT flaschennummer FROM flasche
+    WHERE ausgemustert_am IS NOT NULL AND flaschennummer IN (SELECT value FROM json_each(?))
+"""
+# The open deliveries and the bottles that are out, for flaschen_register.py.
+# Headers and bottles come separately so the customer is not sent once per
+# bottle; the bottles are read from the partial index on active bottles.
+_SQL_REGISTER_VORGAENGE = """
+    SELECT v.id, k.name, k.telefon, k.adresse, k.ansprechpartner, v.referenznummer, v.flaschengroesse,
+           v.flaschendruck, v.flasche_von, v.filiale, v.anzahl, v.verliehen_am
+    FROM verleihvorgang v JOIN kunde k ON k.id = v.kunde_id
+    WHERE v.offen > 0
+"""
+SQL_REGISTER_VORGAENGE = _SQL_REGISTER_VORGAENGE
+SQL_REGISTER_VORGAENGE_IDS = _SQL_REGISTER_VORGAENGE + " AND v.id IN (SELECT value FROM json_each(?))"
+SQL_REGISTER_FLASCHEN = """
+    SELECT flasche.flaschennummer, verleih_position.vorgang_id
+    FROM verleih_position JOIN flasche ON flasche.id = verleih_position.flasche_id
+    WHERE verleih_position.status = 'verliehen'
+"""
+SQL_REGISTER_FLASCHEN_IDS = SQL_REGISTER_FLASCHEN + " AND verleih_position.vorgang_id IN (SELECT value FROM json_each(?))"
+SQL_KUNDE_EINFUEGEN = "INSERT OR IGNORE INTO kunde (name, telefon, adresse, ansprechpartner) VALUES (?, ?, ?, ?)"
+SQL_KUNDE_ID = "SELECT id FROM kunde WHERE name=? AND telefon=? AND adresse=? AND ansprechpartner=?"
+SQL_VORGANG_EINFUEGEN = """
+    INSERT INTO verleihvorgang (
+        kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# A bottle lent for the first time is registered with the data of its
+# delivery; positions refer to it by id.
+SQL_FLASCHE_EINFUEGEN = """
+    INSERT OR IGNORE INTO flasche (flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_POSITION_EINFUEGEN = """
+    INSERT INTO verleih_position (vorgang_id, flasche_id, status)
+    SELECT ?, id, 'verliehen' FROM flasche WHERE flaschennummer = ?
+"""
+# Bulk imports number their headers themselves so that the positions can go
+# in with one executemany. AUTOINCREMENT never reuses an id, so the next one
+# is above both the sequence and the current maximum.
+SQL_VORGANG_NAECHSTE_ID = """
+    SELECT MAX(
+        IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'verleihvorgang'), 0),
+        IFNULL((SELECT MAX(id) FROM verleihvorgang), 0)
+    ) + 1
+"""
+SQL_VORGANG_IMPORTIEREN = """
+    INSERT INTO verleihvorgang (
+        id, kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am, offen,
+        uid, erste_flasche
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_POSITION_IMPORTIEREN = """
+    INSERT INTO verleih_position (vorgang_id, flasche_id, status)
+    SELECT ?, id, ? FROM flasche WHERE flaschennummer = ?
+"""
+SQL_FTS_IMPORTIEREN = """
+    INSERT INTO verleihvorgang_fts (rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummern)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+# Row triggers whose work a bulk import does set-wise. FTS5 flushes its
+# pending terms on every trigger invocation, which makes trigger-fed inserts
+# more than ten times slower than a plain executemany.
+IMPORT_OHNE_TRIGGER = (
+    "verleihvorgang_fts_insert", "verleih_position_insert", "verleih_position_fts_insert", "bestand_position_insert",
+    "ereignis_position_insert", "ereignis_snapshot", "verleihvorgang_erste_flasche",
+)
+SQL_TRIGGER = "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name IN (SELECT value FROM json_each(?))"
+SQL_BESTAND_VERLIEHEN = (
+    "UPDATE bestand SET verliehen = verliehen + ? WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?"
+)
+SQL_EREIGNIS_STAND = "SELECT IFNULL(MAX(seq), 0) FROM ereignis"
+# The events ereignis_position_insert would write for the imported bottles.
+SQL_EREIGNIS_IMPORTIEREN = f"""
+    INSERT INTO ereignis (zeit, art, zelle, menge, position_id)
+    SELECT zeit, art.art, zelle, art.menge, id
+    FROM (
+        SELECT p.id, p.status, IFNULL(CAST(strftime('%s', v.verliehen_am) AS INTEGER), 0) AS zeit, IFNULL(b.id, 0) AS zelle
+        FROM verleih_position p
+        JOIN verleihvorgang v ON v.id = p.vorgang_id
+        LEFT JOIN bestand b ON (b.filiale, b.flaschengroesse, b.flaschendruck) = (v.filiale, v.flaschengroesse, v.flaschendruck)
+        WHERE p.vorgang_id >= ?
+    )
+    JOIN (SELECT {VERLIEHEN} AS art, 1 AS menge UNION ALL SELECT {ZURUECK_OHNE_ZEIT}, -1) AS art
+        ON art.art = {VERLIEHEN} OR status = 'zurückgegeben'
+    ORDER BY zeit, id, art.art
+"""
+# What ereignis_snapshot does row by row: add every event after seq ? to
+# the snapshots at or after its time, bucketed by the first such snapshot.
+SQL_SNAPSHOT_NACHTRAGEN = f"""
+    WITH neu AS (
+        SELECT (SELECT MIN(zeit) FROM snapshot WHERE zeit >= ereignis.zeit) AS bis, zelle,
+               SUM(CASE WHEN art = {BESTAND} THEN 0 ELSE menge END) AS verliehen,
+               SUM(CASE WHEN art = {BESTAND} THEN menge ELSE 0 END) AS gesamt
+        FROM ereignis WHERE seq > ? GROUP BY bis, zelle
+    )
+    INSERT INTO snapshot_zelle (snapshot_id, zelle, verliehen, gesamt)
+    SELECT snapshot.id, neu.zelle, SUM(neu.verliehen), SUM(neu.gesamt)
+    FROM neu JOIN snapshot ON snapshot.zeit >= neu.bis
+    WHERE true
+    GROUP BY snapshot.id, neu.zelle
+    ON CONFLICT (snapshot_id, zelle) DO UPDATE SET
+        verliehen = verliehen + excluded.verliehen, gesamt = gesamt + excluded.gesamt
+"""
+SQL_BESTAND_LISTE = (
+    "SELECT id, filiale, flaschengroesse, flaschendruck, bestand, verliehen, gesamt FROM bestand"
+    " ORDER BY {ordnung}filiale, flaschengroesse, flaschendruck"
+)
+# The stock list has one row per cell, about 30; SQLite sorts them without
+# an index.
+BESTAND_SORTIERBAR = ("filiale", "flaschengroesse", "flaschendruck", "bestand", "verliehen", "gesamt")
+# bestand is derived as gesamt - verliehen, and verliehen is maintained by
+# triggers on verleih_position. Setting the available stock by hand
+# therefore adjusts the total the branch owns.
+SQL_BESTAND_SETZEN = (
+    "UPDATE bestand SET gesamt = ? + verliehen, version = ? WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?"
+)
+SQL_BESTAND_AENDERN = (
+    "UPDATE bestand SET gesamt = gesamt + ?, version = ? WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?"
+)
+# One pass over the open bottles (the partial index on active bottle
+# numbers) counts every cell; the bestand side is the 30 cells.
+SQL_BESTAND_NACHZAEHLEN = """
+    SELECT verleihvorgang.filiale, verleihvorgang.flaschengroesse, verleihvorgang.flaschendruck, COUNT(*)
+    FROM verleih_position JOIN verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id
+    WHERE verleih_position.status = 'verliehen'
+    GROUP BY verleihvorgang.filiale, verleihvorgang.flaschengroesse, verleihvorgang.flaschendruck
+"""
+SQL_BESTAND_ZAEHLER = "SELECT id, filiale, flaschengroesse, flaschendruck, verliehen FROM bestand"
+SQL_BESTAND_KORRIGIEREN = "UPDATE bestand SET verliehen=? WHERE id=?"
+# Deliveries are listed by relevance (only while searching), then newest
+# first, and paged by the key (relevanz, verliehen_am, id). Each row is one
+# verleihvorgang, so a page is a walk down the verliehen_am index; only the
+# bottle numbers of the rows on the page are looked up. A sorted list puts
+# the sorted columns in front of verliehen_am, appends their values to the
+# row and pages by (relevanz, *values, verliehen_am, id).
+SQL_VERLEIHVORGAENGE = """
+    {mit}
+    SELECT
+        kunde.name,
+        (SELECT GROUP_CONCAT(flasche.flaschennummer, ', ')
+         FROM {position} JOIN flasche ON flasche.id = verleih_position.flasche_id
+         WHERE vorgang_id = verleihvorgang.id {positionen}) as flaschennummern,
+        verleihvorgang.flaschengroesse,
+        verleihvorgang.filiale,
+        verleihvorgang.anzahl,
+        verleihvorgang.verliehen_am,
+        {status} as status,
+        verleihvorgang.id,
+        {relevanz} as relevanz{sortierspalten}
+    FROM {von} JOIN kunde ON kunde.id = verleihvorgang.kunde_id
+    WHERE {where}
+    ORDER BY {ordnung}
+"""
+SQL_VORGANG_STATUS = "CASE WHEN verleihvorgang.offen > 0 THEN 'verliehen' ELSE 'zurückgegeben' END"
+# The columns the lists can be sorted by. Each has an index for both
+# directions of verliehen_am (see _sortierung in verleih_schema), the name
+# walks the customers' unique index. A delivery sorts by bottle number under
+# the number of its first bottle. "verliehen_am" in a sort order only turns
+# around the order of the deliveries that tie on the other columns.
+SORTIERBAR = {
+    "name": "kunde.name",
+    "flaschennummer": "verleihvorgang.erste_flasche",
+    "flaschengroesse": "verleihvorgang.flaschengroesse",
+    "filiale": "verleihvorgang.filiale",
+    "anzahl": "verleihvorgang.anzahl",
+    "status": SQL_VORGANG_STATUS,
+}
+# With the archive, the same query runs once over the hot tables and once
+# over the archived ones under the same names; each part walks its own
+# index up to the limit, and the union only merges the two pages. A
+# delivery that is in both while it is being moved is listed from the hot
+# tables.
+SQL_VORGAENGE_MIT_ARCHIV = """
+    SELECT * FROM ({heiss}) UNION ALL SELECT * FROM ({archiv})
+    ORDER BY {ordnung}
+"""
+TABELLEN_HEISS = {
+    "vorgang": "verleihvorgang", "position": "verleih_position", "fts": "verleihvorgang_fts", "nur_archiv": "1",
+}
+TABELLEN_ARCHIV = {
+    "vorgang": "archiv.verleihvorgang AS verleihvorgang",
+    "position": "archiv.verleih_position AS verleih_position",
+    "fts": "archiv.verleihvorgang_fts",
+    "nur_archiv": "NOT EXISTS (SELECT 1 FROM main.verleihvorgang AS heiss WHERE heiss.id = verleihvorgang.id)",
+}
+# Search hits are deliveries. Only the newest SUCHE_MAX_TREFFER hits are
+# scored and sorted, so a term that matches half the history costs about as
+# much as a bottle number.
+SUCHE_MAX_TREFFER = 2000
+SQL_SUCHE_TREFFER = """
+    WITH treffer AS MATERIALIZED (
+        SELECT rowid AS vorgang_id, rank AS rang
+        FROM {fts} WHERE verleihvorgang_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+    )
+"""
+SQL_SUCHE_VON = "treffer JOIN {vorgang} ON verleihvorgang.id = treffer.vorgang_id"
+SQL_SUCHE_RELEVANZ = "-treffer.rang"
+SQL_AENDERUNGEN = "SELECT tabelle, zeile FROM aenderung WHERE seq > ? AND seq <= ?"
+# Separate subqueries: SQLite only answers a lone MIN() or MAX() from the
+# end of the index; both in one SELECT scan the whole log.
+SQL_AENDERUNG_STAND = """
+    SELECT IFNULL((SELECT MIN(seq) FROM aenderung), 1) - 1, IFNULL((SELECT MAX(seq) FROM aenderung), 0)
+"""
+SQL_AENDERUNGEN_KUERZEN = "DELETE FROM aenderung WHERE seq <= (SELECT MAX(seq) FROM aenderung) - ?"
+SQL_BESTAND_ZEILEN = """
+    SELECT id, filiale, flaschengroesse, flaschendruck, bestand, verliehen, gesamt FROM bestand
+    WHERE id IN (SELECT value FROM json_each(?))
+"""
+SQL_RUECKGABE = """
+    UPDATE verleih_position SET status = 'zurückgegeben'
+    WHERE status = 'verliehen'
+      AND flasche_id IN (SELECT id FROM flasche WHERE flaschennummer IN (SELECT value FROM json_each(?)))
+"""
+# Details of whole deliveries, by id. A delivery counts as returned, with
+# the time its last bottle came back, once none is out.
+_SQL_VORGANG_DETAILS = f"""
+    SELECT verleihvorgang.id, kunde.name, kunde.telefon, kunde.adresse, kunde.ansprechpartner,
+           verleihvorgang.referenznummer, verleihvorgang.flaschengroesse, verleihvorgang.flaschendruck,
+           verleihvorgang.flasche_von, verleihvorgang.filiale, verleihvorgang.anzahl, verleihvorgang.verliehen_am,
+           {SQL_VORGANG_STATUS},
+           CASE WHEN verleihvorgang.offen = 0 THEN (
+               SELECT datetime(MAX(ereignis.zeit), 'unixepoch') FROM {{position}}
+               JOIN ereignis ON ereignis.position_id = verleih_position.id AND ereignis.art = {ZURUECKGEGEBEN}
+               WHERE verleih_position.vorgang_id = verleihvorgang.id
+           ) END
+    FROM {{vorgang}} JOIN kunde ON kunde.id = verleihvorgang.kunde_id
+    WHERE verleihvorgang.id IN (SELECT value FROM json_each(?))
+"""
+SQL_VORGANG_DETAILS = _SQL_VORGANG_DETAILS.format(**TABELLEN_HEISS)
+SQL_VORGANG_DETAILS_ARCHIV = _SQL_VORGANG_DETAILS.format(**TABELLEN_ARCHIV)
+
+# Reports. Every report binds the full set of BERICHT_PARAMETER by name; a
+# filter left at None matches everything. The open bottles come from the
+# offen counter of the delivery headers, so the aggregates walk the partial
+# index over open deliveries and never touch the positions.
+BERICHT_PARAMETER = {
+    "filiale": None, "flaschengroesse": None, "flaschendruck": None, "flasche_von": None,
+    "mindestalter": 0, "stichtag": None, "ab": None, "bis": None,
+}
+_SQL_OFFEN = """
+    WITH offen AS (
+        SELECT kunde_id, filiale, flaschengroesse, flaschendruck, flasche_von, verliehen_am, offen AS flaschen,
+               CAST(julianday(:stichtag) - julianday(verliehen_am) AS INTEGER) AS tage
+        FROM verleihvorgang
+        WHERE offen > 0
+          AND verliehen_am <= datetime(:stichtag, printf('-%d days', :mindestalter))
+          AND (:filiale IS NULL OR filiale = :filiale)
+          AND (:flaschengroesse IS NULL OR flaschengroesse = :flaschengroesse)
+          AND (:flaschendruck IS NULL OR flaschendruck = :flaschendruck)
+          AND (:flasche_von IS NULL OR flasche_von = :flasche_von)
+    )
+"""
+SQL_BERICHT_ALTER = _SQL_OFFEN + """
+    SELECT filiale, flaschengroesse, flaschendruck,
+           CASE klasse WHEN 0 THEN 'unter 30 Tage' WHEN 1 THEN '30-89 Tage' WHEN 2 THEN '90-179 Tage'
+                       WHEN 3 THEN '180-364 Tage' ELSE 'ab 365 Tage' END AS altersklasse,
+           flaschen,
+           ROUND(100.0 * flaschen / SUM(flaschen) OVER zelle, 1) AS anteil_prozent,
+           SUM(flaschen) OVER (zelle ORDER BY klasse DESC) AS mindestens_so_alt
+    FROM (
+        SELECT filiale, flaschengroesse, flaschendruck,
+               CASE WHEN tage < 30 THEN 0 WHEN tage < 90 THEN 1 WHEN tage < 180 THEN 2 WHEN tage < 365 THEN 3 ELSE 4 END
+                   AS klasse,
+               SUM(flaschen) AS flaschen
+        FROM offen GROUP BY filiale, flaschengroesse, flaschendruck, klasse
+    )
+    WINDOW zelle AS (PARTITION BY filiale, flaschengroesse, flaschendruck)
+    ORDER BY filiale, flaschengroesse, flaschendruck, klasse
+"""
+SQL_BERICHT_KUNDEN = _SQL_OFFEN + """
+    SELECT kunde.name, kunde.telefon, offen.filiale, offen.flaschengroesse, offen.flaschendruck, offen.flasche_von,
+           SUM(offen.flaschen) AS flaschen, COUNT(*) AS vorgaenge, MIN(offen.verliehen_am) AS aeltester_verleih,
+           MAX(offen.tage) AS max_tage,
+           RANK() OVER filiale AS rang_in_filiale,
+           ROUND(100.0 * SUM(offen.flaschen) / SUM(SUM(offen.flaschen)) OVER (PARTITION BY offen.filiale), 1)
+               AS anteil_prozent
+    FROM offen JOIN kunde ON kunde.id = offen.kunde_id
+    GROUP BY offen.kunde_id, offen.filiale, offen.flaschengroesse, offen.flaschendruck, offen.flasche_von
+    WINDOW filiale AS (PARTITION BY offen.filiale ORDER BY SUM(offen.flaschen) DESC)
+    ORDER BY offen.filiale, rang_in_filiale, kunde.name
+"""
+# Utilisation needs no loans at all: bestand keeps the verliehen counter.
+SQL_BERICHT_AUSLASTUNG = """
+    SELECT filiale, flaschengroesse, flaschendruck, gesamt, verliehen, bestand AS verfuegbar,
+           ROUND(100.0 * verliehen / NULLIF(gesamt, 0), 1) AS auslastung_prozent,
+           SUM(gesamt) OVER filiale AS filiale_gesamt,
+           SUM(verliehen) OVER filiale AS filiale_verliehen,
+           ROUND(100.0 * SUM(verliehen) OVER filiale / NULLIF(SUM(gesamt) OVER filiale, 0), 1)
+               AS filiale_auslastung_prozent,
+           RANK() OVER (ORDER BY 1.0 * verliehen / NULLIF(gesamt, 0) DESC) AS rang
+    FROM bestand
+    WHERE (:filiale IS NULL OR filiale = :filiale)
+      AND (:flaschengroesse IS NULL OR flaschengroesse = :flaschengroesse)
+      AND (:flaschendruck IS NULL OR flaschendruck = :flaschendruck)
+    WINDOW filiale AS (PARTITION BY filiale)
+    ORDER BY filiale, flaschengroesse, flaschendruck
+"""
+# One row per bottle in id order, in the column layout verleih_import.py
+# reads back. Walks the primary key, so it streams without a sort. {teile}
+# are the hot tables and, with the archive, the archived ones, skipping
+# deliveries that are being moved; the two parts are merged by id.
+_SQL_BERICHT_VERLAUF = """
+    SELECT name, telefon, adresse, ansprechpartner, referenznummer, flaschengroesse, flaschendruck, flasche_von,
+           filiale, anzahl, verliehen_am, flaschennummer, status
+    FROM ({teile}
+    ORDER BY vorgang_id)
+"""
+_SQL_BERICHT_VERLAUF_TEIL = """
+    SELECT kunde.name, kunde.telefon, kunde.adresse, kunde.ansprechpartner, verleihvorgang.referenznummer,
+           verleihvorgang.flaschengroesse, verleihvorgang.flaschendruck, verleihvorgang.flasche_von,
+           verleihvorgang.filiale, verleihvorgang.anzahl, verleihvorgang.verliehen_am,
+           flasche.flaschennummer, verleih_position.status, verleihvorgang.id AS vorgang_id
+    FROM {vorgang}
+    JOIN kunde ON kunde.id = verleihvorgang.kunde_id
+    JOIN {position} ON verleih_position.vorgang_id = verleihvorgang.id
+    JOIN flasche ON flasche.id = verleih_position.flasche_id
+    WHERE {nur_archiv}
+      AND (:ab IS NULL OR verleihvorgang.verliehen_am >= :ab)
+      AND (:bis IS NULL OR verleihvorgang.verliehen_am < :bis)
+      AND (:filiale IS NULL OR verleihvorgang.filiale = :filiale)
+      AND (:flaschengroesse IS NULL OR verleihvorgang.flaschengroesse = :flaschengroesse)
+      AND (:flaschendruck IS NULL OR verleihvorgang.flaschendruck = :flaschendruck)
+      AND (:flasche_von IS NULL OR verleihvorgang.flasche_von = :flasche_von)
+"""
+SQL_BERICHT_VERLAUF = _SQL_BERICHT_VERLAUF.format(teile=_SQL_BERICHT_VERLAUF_TEIL.format(**TABELLEN_HEISS))
+SQL_BERICHT_VERLAUF_ARCHIV = _SQL_BERICHT_VERLAUF.format(teile=(
+    _SQL_BERICHT_VERLAUF_TEIL.format(**TABELLEN_HEISS) + "    UNION ALL"
+    + _SQL_BERICHT_VERLAUF_TEIL.format(**TABELLEN_ARCHIV)
+))
+# State of every bestand cell at a point in time: the newest snapshot at or
+# before :stichtag plus the events since, read from the covering index on
+# ereignis (zeit, zelle, art, menge). Cell 0 collects loans of cells that do
+# not exist in bestand.
+SQL_STAND_ZU = f"""
+    WITH ziel AS (SELECT IFNULL(CAST(strftime('%s', :stichtag) AS INTEGER), 0) AS zeit),
+    basis AS (SELECT id, zeit FROM snapshot WHERE zeit <= (SELECT zeit FROM ziel) ORDER BY zeit DESC LIMIT 1),
+    stand AS (
+        SELECT zelle, verliehen, gesamt FROM snapshot_zelle WHERE snapshot_id = (SELECT id FROM basis)
+        UNION ALL
+        SELECT zelle, SUM(CASE WHEN art = {BESTAND} THEN 0 ELSE menge END), SUM(CASE WHEN art = {BESTAND} THEN menge ELSE 0 END)
+        FROM ereignis WHERE zeit > IFNULL((SELECT zeit FROM basis), -1) AND zeit <= (SELECT zeit FROM ziel)
+        GROUP BY zelle
+    )
+    SELECT stand.zelle, bestand.filiale, bestand.flaschengroesse, bestand.flaschendruck,
+           SUM(stand.gesamt) AS gesamt, SUM(stand.verliehen) AS verliehen,
+           SUM(stand.gesamt) - SUM(stand.verliehen) AS verfuegbar
+    FROM stand LEFT JOIN bestand ON bestand.id = stand.zelle
+    GROUP BY stand.zelle
+    ORDER BY bestand.filiale, bestand.flaschengroesse, bestand.flaschendruck
+"""
+SQL_ZEIT = "SELECT IFNULL(CAST(strftime('%s', ?) AS INTEGER), 0)"
+SQL_SNAPSHOT_LETZTER = "SELECT IFNULL(MAX(zeit), -1) FROM snapshot"
+SQL_EREIGNISSE_SEIT = "SELECT COUNT(*) FROM (SELECT 1 FROM ereignis WHERE zeit > ? LIMIT ?)"
+SQL_SNAPSHOT_ANLEGEN = "INSERT INTO snapshot (zeit) VALUES (?)"
+SQL_SNAPSHOT_ZELLE = "INSERT INTO snapshot_zelle (snapshot_id, zelle, verliehen, gesamt) VALUES (?, ?, ?, ?)"
+# New snapshot once this many events are not covered by the newest one.
+SNAPSHOT_ABSTAND = 20_000
+# The events with their bottle and delivery; {archiv} adds the positions of
+# archived deliveries, which keep their ids.
+_SQL_BERICHT_EREIGNISSE = f"""
+    SELECT datetime(ereignis.zeit, 'unixepoch') AS zeit,
+           CASE ereignis.art WHEN {VERLIEHEN} THEN 'verliehen' WHEN {ZURUECKGEGEBEN} THEN 'zurückgegeben'
+                WHEN {ZURUECK_OHNE_ZEIT} THEN 'zurückgegeben, Zeit unbekannt' WHEN {BESTAND} THEN 'Bestand'
+                WHEN {UMGEBUCHT} THEN 'umgebucht' ELSE 'entfernt' END AS art,
+           bestand.filiale, bestand.flaschengroesse, bestand.flaschendruck, ereignis.menge,
+           flasche.flaschennummer, {{vorgang_id}}
+    FROM ereignis
+    LEFT JOIN bestand ON bestand.id = ereignis.zelle
+    LEFT JOIN verleih_position ON verleih_position.id = ereignis.position_id{{archiv}}
+    LEFT JOIN flasche ON flasche.id = {{flasche_id}}
+    WHERE ereignis.zeit >= IFNULL(CAST(strftime('%s', :ab) AS INTEGER), 0)
+      AND ereignis.zeit < IFNULL(CAST(strftime('%s', :bis) AS INTEGER), 1 << 62)
+      AND (:filiale IS NULL OR bestand.filiale = :filiale)
+      AND (:flaschengroesse IS NULL OR bestand.flaschengroesse = :flaschengroesse)
+      AND (:flaschendruck IS NULL OR bestand.flaschendruck = :flaschendruck)
+    ORDER BY ereignis.zeit
+"""
+SQL_BERICHT_EREIGNISSE = _SQL_BERICHT_EREIGNISSE.format(
+    archiv="", vorgang_id="verleih_position.vorgang_id", flasche_id="verleih_position.flasche_id",
+)
+SQL_BERICHT_EREIGNISSE_ARCHIV = _SQL_BERICHT_EREIGNISSE.format(
+    archiv="""
+    LEFT JOIN archiv.verleih_position AS archiv_position ON archiv_position.id = ereignis.position_id""",
+    vorgang_id="IFNULL(verleih_position.vorgang_id, archiv_position.vorgang_id)",
+    flasche_id="IFNULL(verleih_position.flasche_id, archiv_position.flasche_id)",
+)
+# Bottles in service due for the pressure test by :stichtag, soonest first,
+# from the partial index on the due dates; the ones that are out name the
+# customer who has them. Bottles without a due date are not listed.
+SQL_BERICHT_PRUEFUNG = """
+    SELECT flasche.flaschennummer, flasche.flaschengroesse, flasche.flaschendruck, flasche.flasche_von,
+           flasche.filiale, flasche.pruefung_faellig,
+           CAST(julianday(flasche.pruefung_faellig) - julianday('now', 'localtime', 'start of day') AS INTEGER)
+               AS faellig_in_tagen,
+           IFNULL(verleih_position.status, 'im Lager') AS status, kunde.name, kunde.telefon
+    FROM flasche
+    LEFT JOIN verleih_position ON verleih_position.flasche_id = flasche.id AND verleih_position.status = 'verliehen'
+    LEFT JOIN verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id
+    LEFT JOIN kunde ON kunde.id = verleihvorgang.kunde_id
+    WHERE flasche.ausgemustert_am IS NULL AND flasche.pruefung_faellig <= date(:stichtag)
+      AND (:filiale IS NULL OR flasche.filiale = :filiale)
+      AND (:flaschengroesse IS NULL OR flasche.flaschengroesse = :flaschengroesse)
+      AND (:flaschendruck IS NULL OR flasche.flaschendruck = :flaschendruck)
+      AND (:flasche_von IS NULL OR flasche.flasche_von = :flasche_von)
+    ORDER BY flasche.pruefung_faellig, flasche.flaschennummer
+"""
+# The bottles in service by home cell next to the total counted by hand.
+_SQL_REGISTRIERT = """
+    SELECT COUNT(*) FROM flasche
+    WHERE flasche.ausgemustert_am IS NULL AND flasche.filiale = bestand.filiale
+      AND flasche.flaschengroesse = bestand.flaschengroesse AND flasche.flaschendruck = bestand.flaschendruck
+"""
+SQL_BERICHT_FLASCHENBESTAND = f"""
+    SELECT filiale, flaschengroesse, flaschendruck, gesamt, registriert, registriert - gesamt AS differenz,
+           ohne_pruefdatum
+    FROM (
+        SELECT filiale, flaschengroesse, flaschendruck, gesamt, ({_SQL_REGISTRIERT}) AS registriert,
+               ({_SQL_REGISTRIERT} AND flasche.pruefung_faellig IS NULL) AS ohne_pruefdatum
+        FROM bestand
+        WHERE (:filiale IS NULL OR filiale = :filiale)
+          AND (:flaschengroesse IS NULL OR flaschengroesse = :flaschengroesse)
+          AND (:flaschendruck IS NULL OR flaschendruck = :flaschendruck)
+    )
+    ORDER BY filiale, flaschengroesse, flaschendruck
+"""
+# name -> (SQL, column names)
+BERICHTE = {
+    "alter": (SQL_BERICHT_ALTER, (
+        "filiale", "flaschengroesse", "flaschendruck", "altersklasse", "flaschen", "anteil_prozent",
+        "mindestens_so_alt",
+    )),
+    "kunden": (SQL_BERICHT_KUNDEN, (
+        "name", "telefon", "filiale", "flaschengroesse", "flaschendruck", "flasche_von", "flaschen", "vorgaenge",
+        "aeltester_verleih", "max_tage", "rang_in_filiale", "anteil_prozent",
+    )),
+    "auslastung": (SQL_BERICHT_AUSLASTUNG, (
+        "filiale", "flaschengroesse", "flaschendruck", "gesamt", "verliehen", "verfuegbar", "auslastung_prozent",
+        "filiale_gesamt", "filiale_verliehen", "filiale_auslastung_prozent", "rang",
+    )),
+    "stichtag": (SQL_STAND_ZU, (
+        "zelle", "filiale", "flaschengroesse", "flaschendruck", "gesamt", "verliehen", "verfuegbar",
+    )),
+    "ereignisse": (SQL_BERICHT_EREIGNISSE, (
+        "zeit", "art", "filiale", "flaschengroesse", "flaschendruck", "menge", "flaschennummer", "vorgang",
+    )),
+    "verlauf": (SQL_BERICHT_VERLAUF, (
+        "name", "telefon", "adresse", "ansprechpartner", "referenznummer", "flaschengroesse", "flaschendruck",
+        "flasche_von", "filiale", "anzahl", "verliehen_am", "flaschennummer", "status",
+    )),
+    "pruefung": (SQL_BERICHT_PRUEFUNG, (
+        "flaschennummer", "flaschengroesse", "flaschendruck", "flasche_von", "filiale", "pruefung_faellig",
+        "faellig_in_tagen", "status", "kunde", "telefon",
+    )),
+    "flaschenbestand": (SQL_BERICHT_FLASCHENBESTAND, (
+        "filiale", "flaschengroesse", "flaschendruck", "gesamt", "registriert", "differenz", "ohne_pruefdatum",
+    )),
+}
+# name -> SQL of the reports that also cover the archive when it is attached.
+BERICHTE_ARCHIV = {"ereignisse": SQL_BERICHT_EREIGNISSE_ARCHIV, "verlauf": SQL_BERICHT_VERLAUF_ARCHIV}
+SQL_FLASCHE = """
+    SELECT id, flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale, pruefung_faellig, ausgemustert_am
+    FROM flasche WHERE flaschennummer = ?
+"""
+# A bottle's own events and the loan events of its positions, oldest first;
+# {archiv} adds the positions of archived deliveries.
+_SQL_FLASCHE_LEBENSLAUF = f"""
+    SELECT datetime(zeit, 'unixepoch') AS zeit, ereignis, angabe FROM (
+        SELECT zeit, 0 AS quelle, seq,
+               CASE art WHEN {ANGELEGT} THEN 'angelegt' WHEN {GEAENDERT} THEN 'geändert'
+                        WHEN {GEPRUEFT} THEN 'Prüfung eingetragen' WHEN {AUSGEMUSTERT} THEN 'ausgemustert' END
+                   AS ereignis,
+               angabe
+        FROM flasche_ereignis WHERE flasche_id = :id
+        UNION ALL
+        SELECT ereignis.zeit, 1, ereignis.seq,
+               CASE ereignis.art WHEN {VERLIEHEN} THEN 'verliehen' WHEN {ZURUECKGEGEBEN} THEN 'zurückgegeben'
+                    WHEN {ZURUECK_OHNE_ZEIT} THEN 'zurückgegeben, Zeit unbekannt' WHEN {UMGEBUCHT} THEN 'umgebucht'
+                    ELSE 'entfernt' END,
+               printf('%s, %s, Vorgang %d', kunde.name, verleihvorgang.filiale, verleihvorgang.id)
+        FROM verleih_position
+        JOIN ereignis ON ereignis.position_id = verleih_position.id
+        JOIN verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id
+        JOIN kunde ON kunde.id = verleihvorgang.kunde_id
+        WHERE verleih_position.flasche_id = :id
+        {{archiv}}
+    )
+    ORDER BY zeit, quelle, seq
+"""
+SQL_FLASCHE_LEBENSLAUF = _SQL_FLASCHE_LEBENSLAUF.format(archiv="")
+SQL_FLASCHE_LEBENSLAUF_ARCHIV = _SQL_FLASCHE_LEBENSLAUF.format(archiv=f"""
+        UNION ALL
+        SELECT ereignis.zeit, 1, ereignis.seq,
+               CASE ereignis.art WHEN {VERLIEHEN} THEN 'verliehen' WHEN {ZURUECKGEGEBEN} THEN 'zurückgegeben'
+                    WHEN {ZURUECK_OHNE_ZEIT} THEN 'zurückgegeben, Zeit unbekannt' WHEN {UMGEBUCHT} THEN 'umgebucht'
+                    ELSE 'entfernt' END,
+               printf('%s, %s, Vorgang %d (Archiv)', kunde.name, verleihvorgang.filiale, verleihvorgang.id)
+        FROM archiv.verleih_position AS verleih_position
+        JOIN ereignis ON ereignis.position_id = verleih_position.id
+        JOIN archiv.verleihvorgang AS verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id
+        JOIN kunde ON kunde.id = verleihvorgang.kunde_id
+        WHERE verleih_position.flasche_id = :id
+          AND NOT EXISTS (SELECT 1 FROM main.verleih_position AS heiss WHERE heiss.id = verleih_position.id)""")
+SQL_FLASCHE_SPEICHERN = """
+    INSERT INTO flasche (flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale, version)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (flaschennummer) DO UPDATE SET
+        flaschengroesse = excluded.flaschengroesse, flaschendruck = excluded.flaschendruck,
+        flasche_von = excluded.flasche_von, filiale = excluded.filiale, version = excluded.version
+"""
+SQL_FLASCHE_PRUEFEN = "UPDATE flasche SET pruefung_faellig = ?, version = ? WHERE flaschennummer = ?"
+SQL_FLASCHE_AUSMUSTERN = """
+    UPDATE flasche SET ausgemustert_am = ?, version = ? WHERE flaschennummer = ? AND ausgemustert_am IS NULL
+"""
+# Sets the hand-counted total of every cell to the bottles in service whose
+# home it is; only cells that differ are written.
+SQL_BESTAND_AUS_REGISTER = f"""
+    UPDATE bestand SET gesamt = ({_SQL_REGISTRIERT}), version = ? WHERE gesamt <> ({_SQL_REGISTRIERT})
+"""
+
+# Replication with the Zentrale, see verleih_sync.py. Versions and delivery
+# uids are 16 hex digits of the hybrid logical clock and 8 random ones, so
+# comparing the strings orders them and two nodes never tie.
+SQL_UHR_WEITER = """
+    UPDATE sync_uhr SET uhr = MAX(uhr + ?, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER) << 16)
+    RETURNING uhr
+"""
+SQL_UHR_EMPFANGEN = "UPDATE sync_uhr SET uhr = MAX(uhr, ?)"
+SQL_SYNC_EINTRAGEN = "INSERT OR REPLACE INTO sync_log (art, schluessel, herkunft) VALUES (?, ?, ?)"
+SQL_SYNC_ZELLE_EINTRAGEN = """
+    INSERT OR REPLACE INTO sync_log (art, schluessel, herkunft) VALUES ('bestand', json_array(?, ?, ?), ?)
+"""
+SQL_SYNC_ZELLEN_EINTRAGEN = """
+    INSERT OR REPLACE INTO sync_log (art, schluessel)
+    SELECT 'bestand', json_array(filiale, flaschengroesse, flaschendruck) FROM bestand WHERE version = ?
+"""
+SQL_SYNC_IMPORT_EINTRAGEN = """
+    INSERT OR REPLACE INTO sync_log (art, schluessel) SELECT 'vorgang', uid FROM verleihvorgang WHERE id >= ?
+"""
+SQL_SYNC_RUECKGABE_EINTRAGEN = """
+    INSERT OR REPLACE INTO sync_log (art, schluessel)
+    SELECT DISTINCT 'vorgang', verleihvorgang.uid
+    FROM verleih_position JOIN verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id
+    WHERE verleih_position.status = 'verliehen'
+      AND verleih_position.flasche_id IN (SELECT id FROM flasche WHERE flaschennummer IN (SELECT value FROM json_each(?)))
+"""
+# Changes to send: all after the cursor except those that came from the
+# receiver itself, or only the ones made here.
+SQL_SYNC_LOG = """
+    SELECT seq, art, schluessel FROM sync_log
+    WHERE seq > :seit AND (herkunft IS NULL OR (NOT :nur_lokal AND herkunft IS NOT :ausser))
+    ORDER BY seq LIMIT :limit
+"""
+SQL_SYNC_VORGAENGE = """
+    SELECT v.uid, k.name, k.telefon, k.adresse, k.ansprechpartner, v.referenznummer, v.flaschengroesse,
+           v.flaschendruck, v.flasche_von, v.filiale, v.anzahl, v.verliehen_am,
+           (SELECT json_group_array(json_array(f.flaschennummer, p.status))
+            FROM verleih_position p JOIN flasche f ON f.id = p.flasche_id WHERE p.vorgang_id = v.id)
+    FROM verleihvorgang v JOIN kunde k ON k.id = v.kunde_id
+    WHERE v.uid IN (SELECT value FROM json_each(?))
+"""
+SQL_SYNC_ZELLEN = """
+    SELECT json_array(filiale, flaschengroesse, flaschendruck), gesamt, version FROM bestand
+    WHERE json_array(filiale, flaschengroesse, flaschendruck) IN (SELECT value FROM json_each(?))
+"""
+SQL_SYNC_FLASCHEN = """
+    SELECT flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale, pruefung_faellig, ausgemustert_am,
+           version
+    FROM flasche WHERE flaschennummer IN (SELECT value FROM json_each(?))
+"""
+SQL_VORGANG_UID = "SELECT id FROM verleihvorgang WHERE uid = ?"
+SQL_VORGANG_UEBERNEHMEN = """
+    INSERT INTO verleihvorgang (
+        kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am, uid
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_SYNC_POSITIONEN = """
+    SELECT flasche.flaschennummer, verleih_position.status
+    FROM verleih_position JOIN flasche ON flasche.id = verleih_position.flasche_id
+    WHERE verleih_position.vorgang_id = ?
+"""
+SQL_SYNC_POSITION_ZURUECK = """
+    UPDATE verleih_position SET status = 'zurückgegeben'
+    WHERE vorgang_id = ? AND status = 'verliehen'
+      AND flasche_id IN (SELECT id FROM flasche WHERE flaschennummer IN (SELECT value FROM json_each(?)))
+"""
+# The loan a bottle is out with here, and the uid that decides whether it
+# or a loan received from elsewhere is the newer one.
+SQL_SYNC_AKTIV = """
+    SELECT verleih_position.id, verleihvorgang.uid
+    FROM flasche
+    JOIN verleih_position ON verleih_position.flasche_id = flasche.id AND verleih_position.status = 'verliehen'
+    JOIN verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id
+    WHERE flasche.flaschennummer = ?
+"""
+SQL_POSITION_ZURUECK = "UPDATE verleih_position SET status = 'zurückgegeben' WHERE id = ?"
+SQL_SYNC_ZELLE = "SELECT gesamt, version FROM bestand WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?"
+SQL_SYNC_ZELLE_ANLEGEN = """
+    INSERT INTO bestand (filiale, flaschengroesse, flaschendruck, gesamt, version) VALUES (?, ?, ?, ?, ?)
+"""
+SQL_SYNC_ZELLE_SETZEN = """
+    UPDATE bestand SET gesamt = ?, version = ? WHERE filiale=? AND flaschengroesse=? AND flaschendruck=?
+"""
+SQL_SYNC_FLASCHE = """
+    SELECT flaschengroesse, flaschendruck, flasche_von, filiale, pruefung_faellig, ausgemustert_am, version
+    FROM flasche WHERE flaschennummer = ?
+"""
+SQL_SYNC_FLASCHE_ANLEGEN = """
+    INSERT INTO flasche (
+        flaschengroesse, flaschendruck, flasche_von, filiale, pruefung_faellig, ausgemustert_am, version, flaschennummer
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_SYNC_FLASCHE_SETZEN = """
+    UPDATE flasche SET flaschengroesse = ?, flaschendruck = ?, flasche_von = ?, filiale = ?, ausgemustert_am = ?,
+        version = ?
+    WHERE flaschennummer = ?
+"""
+SQL_SYNC_STAND = "SELECT gesendet, empfangen FROM sync_stand WHERE gegenstelle = ?"
+SQL_SYNC_STAND_SETZEN = """
+    INSERT INTO sync_stand (gegenstelle, gesendet, empfangen) VALUES (?, ?, ?)
+    ON CONFLICT (gegenstelle) DO UPDATE SET gesendet = excluded.gesendet, empfangen = excluded.empfangen
+"""
+SQL_SYNC_NEUESTER = "SELECT IFNULL(MAX(seq), 0) FROM sync_log"
+# A branch only sends its own changes; what it has sent and everything it
+# received is no longer needed in its log.
+SQL_SYNC_LOG_KUERZEN = "DELETE FROM sync_log WHERE seq <= ? OR herkunft IS NOT NULL"
+# A database that was restored sends a "neubeginn" record; the receiver
+# enters all its rows in its log again, so the next round sends them back
+# and nothing the restore rolled back stays only on one side.
+SYNC_NEUBEGINN = "neubeginn"
+SYNC_ARTEN = ("vorgang", "bestand", "flasche", SYNC_NEUBEGINN)
+SQL_SYNC_ALLES_EINTRAGEN = (
+    "INSERT OR REPLACE INTO sync_log (art, schluessel) SELECT 'flasche', flaschennummer FROM flasche",
+    "INSERT OR REPLACE INTO sync_log (art, schluessel) SELECT 'vorgang', uid FROM verleihvorgang",
+    "INSERT OR REPLACE INTO sync_log (art, schluessel)"
+    " SELECT 'bestand', json_array(filiale, flaschengroesse, flaschendruck) FROM bestand",
+)
+SYNC_SEITE = 500
+
+# Archiving. Closed deliveries whose loan and last return both lie before
+# :stichtag move to the archive file, oldest first, a batch at a time. The
+# copy is committed before the hot rows are deleted: a transaction over two
+# WAL files is only atomic per file, and this way a crash in between leaves
+# a delivery in both, which the next batch moves again, instead of in none.
+ARCHIV_TAGE = 365
+ARCHIV_BATCH = 500
+SQL_ARCHIV_KANDIDATEN = """
+    SELECT id FROM verleihvorgang
+    WHERE offen = 0 AND verliehen_am < :stichtag
+      AND NOT EXISTS (
+          SELECT 1 FROM verleih_position JOIN ereignis ON ereignis.position_id = verleih_position.id
+          WHERE verleih_position.vorgang_id = verleihvorgang.id
+            AND ereignis.zeit >= CAST(strftime('%s', :stichtag) AS INTEGER)
+      )
+    ORDER BY verliehen_am, id LIMIT :limit
+"""
+SQL_ARCHIV_VORGAENGE = """
+    INSERT OR REPLACE INTO archiv.verleihvorgang
+        (id, kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am,
+         offen, uid, erste_flasche)
+    SELECT id, kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am,
+           offen, uid, erste_flasche
+    FROM main.verleihvorgang WHERE id IN (SELECT value FROM json_each(?))
+"""
+SQL_ARCHIV_POSITIONEN = """
+    INSERT OR REPLACE INTO archiv.verleih_position (id, vorgang_id, status, flasche_id)
+    SELECT id, vorgang_id, status, flasche_id FROM main.verleih_position
+    WHERE vorgang_id IN (SELECT value FROM json_each(?))
+"""
+SQL_ARCHIV_SUCHTEXT_LOESCHEN = "DELETE FROM archiv.verleihvorgang_fts WHERE rowid IN (SELECT value FROM json_each(?))"
+SQL_ARCHIV_SUCHTEXT = """
+    INSERT INTO archiv.verleihvorgang_fts (rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummern)
+    SELECT rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummern
+    FROM main.verleihvorgang_fts WHERE rowid IN (SELECT value FROM json_each(?))
+"""
+# Headers first: the triggers on the positions then find no header and no
+# search text left to update. The delete triggers of verleihvorgang enter
+# the ids in the change log, so the lists drop the rows.
+SQL_ARCHIV_VORGAENGE_LOESCHEN = """
+    DELETE FROM main.verleihvorgang
+    WHERE offen = 0 AND id IN (SELECT id FROM archiv.verleihvorgang WHERE id IN (SELECT value FROM json_each(?)))
+"""
+SQL_ARCHIV_POSITIONEN_LOESCHEN = """
+    DELETE FROM main.verleih_position
+    WHERE vorgang_id IN (SELECT value FROM json_each(?))
+      AND NOT EXISTS (SELECT 1 FROM main.verleihvorgang WHERE id = verleih_position.vorgang_id)
+"""
+SQL_ARCHIV_UID = "SELECT 1 FROM archiv.verleihvorgang WHERE uid = ?"
+
+# Backups. sichern() copies the database with the online backup API inside
+# one read transaction: in WAL mode that never blocks a writer, and the copy
+# is the state at its start however long it takes; without it every commit
+# of another connection would start the copy over. Until it ends the WAL
+# grows by everything the others write. It goes SICHERUNG_SEITEN
+# pages at a time with SICHERUNG_PAUSE seconds in between, which leaves the
+# disk to the others. The archive only grows, so its size tells whether the
+# last copy of it still holds.
+SICHERUNG_BEHALTEN = 14
+SICHERUNG_SEITEN = 4096
+SICHERUNG_PAUSE = 0.005
+SQL_ARCHIV_UMFANG = """
+    SELECT (SELECT COUNT(*) FROM archiv.verleihvorgang), (SELECT COUNT(*) FROM archiv.verleih_position)
+"""
+SQL_ARCHIV_LEEREN = (
+    "DELETE FROM archiv.verleihvorgang", "DELETE FROM archiv.verleih_position", "DELETE FROM archiv.verleihvorgang_fts",
+)
+# After a restore the change log and the sync log start above every cursor
+# handed out before. Each client finds its cursor outside the change log
+# and reloads. Every row is entered in the sync log anew, followed by a
+# neubeginn record, so the other databases get the restored state after
+# their cursor and send back everything they have. The clock goes on from
+# where it was, so later changes win over everything written before.
+SQL_AENDERUNGEN_LEEREN = "DELETE FROM aenderung"
+SQL_SYNC_LOG_LEEREN = "DELETE FROM sync_log"
+SQL_FOLGE = "SELECT IFNULL(MAX(seq), 0) FROM sqlite_sequence WHERE name = ?"
+SQL_FOLGE_NEUBEGINN = (
+    "UPDATE sqlite_sequence SET seq = MAX(seq, :folge) + 1 WHERE name = :name",
+    "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :folge + 1"
+    " WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)",
+)
+NEUBEGINN_TABELLEN = ("aenderung", "sync_log")
+SQL_UHR = "SELECT uhr FROM sync_uhr"
+
+
+class Abweichung(NamedTuple):
+    """A bestand cell whose verliehen counter differs from the loan table."""
+
+    id: int
+    filiale: str
+    flaschengroesse: str
+    flaschendruck: str
+    gezaehlt: int
+    tatsaechlich: int
+
+
+class Verleihvorgang(NamedTuple):
+    """One delivery as it is entered or imported; bottles in ``zurueckgegeben`` are back."""
+
+    name: str
+    telefon: str
+    adresse: str
+    ansprechpartner: str
+    referenznummer: str
+    flaschengroesse: str
+    flaschendruck: str
+    flasche_von: str
+    filiale: str
+    verliehen_am: str
+    flaschennummern: tuple
+    zurueckgegeben: frozenset = frozenset()
+
+
+class FlaschenBereitsVerliehen(Exception):
+    def __init__(self, flaschennummern):
+        super().__init__(f"Bereits verliehen: {', '.join(sorted(flaschennummern))}")
+        self.flaschennummern = flaschennummern
+
+
+class FlaschenAusgemustert(Exception):
+    def __init__(self, flaschennummern):
+        super().__init__(f"Ausgemustert: {', '.join(sorted(flaschennummern))}")
+        self.flaschennummern = flaschennummern
+
+
+def verleih_fehler(daten, dropdown_data, anzahl, flaschennummern):
+    """Return the first rule a new delivery breaks as a message, or None if it is valid."""
+    if any(not d for d in daten) or any(not d for d in dropdown_data):
+        return "Bitte alle Felder ausfüllen."
+    # A delivery outside the known cells would not be booked in any bestand cell.
+    flaschengroesse, flaschendruck, _, filiale = dropdown_data
+    for wert, erlaubt, fehler in (
+        (flaschengroesse, GROESSEN, "Unbekannte Flaschengröße"), (flaschendruck, DRUECKE, "Unbekannter Flaschendruck"),
+        (filiale, FILIALEN, "Unbekannte Filiale"),
+    ):
+        if wert not in erlaubt:
+            return f"{fehler}: {wert}"
+    if not flaschennummern:
+        return "Bitte Flaschennummer(n) eingeben."
+    if anzahl != len(flaschennummern):
+        return f"Anzahl ({anzahl}) stimmt nicht mit der Anzahl der Flaschennummern ({len(flaschennummern)}) überein."
+    if len(set(flaschennummern)) != len(flaschennummern):
+        return "Eine Flaschennummer wurde mehrfach eingegeben."
+    return None
+
+
+def suchausdruck(suche):
+    """Turn free text into an FTS5 query that matches every word as a prefix."""
+    return " ".join(f'"{wort}"*' for wort in re.findall(r"\w+", suche))
+
+
+def sortierung_pruefen(sortierung):
+    """``sortierung`` as a list of (spalte, absteigend) pairs over SORTIERBAR and "verliehen_am".
+
+    Raises ValueError for an unknown or repeated column.
+    """
+    ergebnis = []
+    for spalte, absteigend in sortierung:
+        if spalte != "verliehen_am" and spalte not in SORTIERBAR:
+            raise ValueError(f"Unbekannte Spalte: {spalte}")
+        if spalte in dict(ergebnis):
+            raise ValueError(f"Spalte mehrfach sortiert: {spalte}")
+        ergebnis.append((spalte, bool(absteigend)))
+    return ergebnis
+
+
+def vorgang_schluessel(row):
+    """The key a row of ``Datenbank.verleihvorgaenge()`` is paged by: (relevanz, *sorted values, verliehen_am, id)."""
+    return (row[8], *row[9:], row[5], row[7])
+
+
+def vorgang_richtungen(sortierung=()):
+    """For every part of ``vorgang_schluessel()``, whether the list runs from its largest value down."""
+    spalten = [absteigend for spalte, absteigend in sortierung if spalte != "verliehen_am"]
+    zeit = dict(sortierung).get("verliehen_am", True)
+    # The id breaks the last ties in the direction of verliehen_am, as the
+    # sort indexes store them.
+    return (True, *spalten, zeit, zeit)
+
+
+def _keyset(teile, werte, nach):
+    """WHERE clause and parameters for the rows after (``nach``) or before key ``werte``.
+
+    ``teile`` are the (expression, absteigend) pairs of the order. Runs of
+    parts in the same direction are compared as one row value; the range
+    on the first part lets SQLite seek into its index.
+    """
+    gruppen = []
+    for (ausdruck, absteigend), wert in zip(teile, werte):
+        vergleich = "<" if absteigend == nach else ">"
+        if gruppen and gruppen[-1][0] == vergleich:
+            gruppen[-1][1].append(ausdruck)
+            gruppen[-1][2].append(wert)
+        else:
+            gruppen.append((vergleich, [ausdruck], [wert]))
+    faelle, params, gleich, gleich_params = [], [], [], []
+    for vergleich, ausdruecke, gruppe in gruppen:
+        links, rechts = ", ".join(ausdruecke), ", ".join("?" * len(ausdruecke))
+        faelle.append(" AND ".join([*gleich, f"({links}) {vergleich} ({rechts})"]))
+        params.extend(gleich_params + gruppe)
+        gleich.append(f"({links}) = ({rechts})")
+        gleich_params.extend(gruppe)
+    sql = f"{teile[0][0]} {gruppen[0][0]}= ? AND ({' OR '.join(f'({fall})' for fall in faelle)})"
+    return sql, [werte[0], *params]
+
+
+def verbinden(db_path, check_same_thread=True):
+    conn = sqlite3.connect(
+        db_path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE, check_same_thread=check_same_thread
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is durable across application crashes in WAL mode; only a power
+    # loss can roll back the last commits.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    archiv = archiv_pfad(db_path)
+    if os.path.exists(archiv):
+        conn.execute("ATTACH DATABASE ? AS archiv", (archiv,))
+        conn.execute("PRAGMA archiv.synchronous=NORMAL")
+    return conn
+
+
+def archiv_pfad(db_path):
+    """The archive file that belongs to database ``db_path``; connections attach it once it exists."""
+    return os.path.splitext(db_path)[0] + "-archiv.db"
+
+
+def sicherung_pfad(db_path):
+    """The directory that holds the backups of database ``db_path``."""
+    return os.path.splitext(db_path)[0] + "-sicherung"
+
+
+def archiv_anlegen(db_path=DB_PATH):
+    """Create the archive file of ``db_path`` or upgrade it; connections opened before it existed do not see it."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("ATTACH DATABASE ? AS archiv", (archiv_pfad(db_path),))
+    conn.execute("PRAGMA archiv.journal_mode=WAL")
+    archiv_einrichten(conn)
+    conn.close()
+
+
+def init_db(db_path=DB_PATH):
+    """Migrate the database and its archive, if any, to the current schema and create the missing bestand cells."""
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    conn.executemany(
+        "INSERT OR IGNORE INTO bestand (filiale, flaschengroesse, flaschendruck) VALUES (?, ?, ?)",
+        [(f, g, d) for f in FILIALEN for g in GROESSEN for d in DRUECKE],
+    )
+    conn.commit()
+    conn.close()
+    if os.path.exists(archiv_pfad(db_path)):
+        archiv_anlegen(db_path)
+
+
+@contextmanager
+def _ohne_trigger(c, namen):
+    """Drop the named triggers inside the current transaction and recreate them afterwards.
+
+    DDL is transactional, so other connections never see the triggers
+    missing, and if the block fails the rollback restores them.
+    """
+    ddl = [row[0] for row in c.execute(SQL_TRIGGER, (json.dumps(namen),)).fetchall()]
+    for name in namen:
+        c.execute(f"DROP TRIGGER IF EXISTS {name}")
+    yield
+    for sql in ddl:
+        c.execute(sql)
+
+
+class VerbindungsPool:
+    """A fixed number of connections for worker threads."""
+
+    def __init__(self, db_path, groesse=2):
+        self._frei = queue.LifoQueue()
+        self._alle = []
+        for _ in range(groesse):
+            conn = verbinden(db_path, check_same_thread=False)
+            self._alle.append(conn)
+            self._frei.put(conn)
+
+    @contextmanager
+    def verbindung(self):
+        conn = self._frei.get()
+        try:
+            yield conn
+        finally:
+            self._frei.put(conn)
+
+    def close(self):
+        for conn in self._alle:
+            conn.close()
+        self._alle.clear()
+
+
+class Datenbank:
+    def __init__(self, db_path, check_same_thread=True):
+        self.db_path = db_path
+        self.conn = verbinden(db_path, check_same_thread)
+        self.archiv = any(row[1] == "archiv" for row in self.conn.execute("PRAGMA database_list"))
+        # How often beginnen() found the write lock taken, for the stress test.
+        self.belegt = 0
+
+    def close(self):
+        self.conn.close()
+
+    def beginnen(self, timeout=SCHREIB_TIMEOUT):
+        """Open a write transaction holding the write lock; raises sqlite3.OperationalError after ``timeout``."""
+        ende = time.monotonic() + timeout
+        backoff = BACKOFF_START
+        while True:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or time.monotonic() >= ende:
+                    raise
+            self.belegt += 1
+            time.sleep(random.uniform(0, backoff))
+            backoff = min(backoff * 2, BACKOFF_MAX)
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor; commit on success, roll back on any exception.
+
+        Inside a transaction the caller already opened (a group commit in
+        the service) the block runs in a savepoint instead, so a failing
+        block undoes only its own writes and the commit is left to the caller.
+        """
+        if not self.conn.in_transaction:
+            self.beginnen()
+            with self.conn:
+                yield self.conn.cursor()
+            return
+        self.conn.execute("SAVEPOINT block")
+        try:
+            yield self.conn.cursor()
+        except BaseException:
+            self.conn.execute("ROLLBACK TO block")
+            self.conn.execute("RELEASE block")
+            raise
+        self.conn.execute("RELEASE block")
+
+    def aktive_flaschen(self, flaschennummern, c=None):
+        c = c or self.conn.cursor()
+        c.execute(SQL_AKTIVE_FLASCHEN, (json.dumps(list(flaschennummern)),))
+        return {row[0] for row in c.fetchall()}
+
+    def ausgemusterte_flaschen(self, flaschennummern, c=None):
+        c = c or self.conn.cursor()
+        c.execute(SQL_AUSGEMUSTERTE_FLASCHEN, (json.dumps(list(flaschennummern)),))
+        return {row[0] for row in c.fetchall()}
+
+    def flaschen_register(self, vorgang_ids=None):
+        """(vorgaenge, flaschen) to fill a FlaschenRegister, or to refresh the given deliveries in it.
+
+        ``vorgaenge`` are the open delivery headers with their customer and
+        ``flaschen`` the (flaschennummer, vorgang_id) pairs of the bottles
+        that are out.
+        """
+        if vorgang_ids is None:
+            return (
+                self.conn.execute(SQL_REGISTER_VORGAENGE).fetchall(),
+                self.conn.execute(SQL_REGISTER_FLASCHEN).fetchall(),
+            )
+        ids = (json.dumps(list(vorgang_ids)),)
+        return (
+            self.conn.execute(SQL_REGISTER_VORGAENGE_IDS, ids).fetchall(),
+            self.conn.execute(SQL_REGISTER_FLASCHEN_IDS, ids).fetchall(),
+        )
+
+    def verleih_anlegen(self, daten, flaschengroesse, flaschendruck, flasche_von, filiale, flaschennummern):
+        """Insert one delivery in a single transaction; the triggers book it out of ``bestand``.
+
+        Bottles lent for the first time are added to the bottle register
+        with the data of the delivery. The checks run under the write lock,
+        so no other process can lend the same bottles in between. Returns the
+        new delivery's id and its ``verliehen_am``.
+        """
+        anzahl = len(flaschennummern)
+        verliehen_am = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction() as c:
+            existierende = self.aktive_flaschen(flaschennummern, c)
+            if existierende:
+                raise FlaschenBereitsVerliehen(existierende)
+            ausgemustert = self.ausgemusterte_flaschen(flaschennummern, c)
+            if ausgemustert:
+                raise FlaschenAusgemustert(ausgemustert)
+            name, telefon, adresse, ansprechpartner, referenznummer = daten
+            kunde = (name, telefon, adresse, ansprechpartner)
+            c.execute(SQL_KUNDE_EINFUEGEN, kunde)
+            kunde_id = c.execute(SQL_KUNDE_ID, kunde).fetchone()[0]
+            c.execute(SQL_VORGANG_EINFUEGEN, (
+                kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am
+            ))
+            vorgang_id = c.lastrowid
+            c.executemany(SQL_FLASCHE_EINFUEGEN, [
+                (fl_num, flaschengroesse, flaschendruck, flasche_von, filiale) for fl_num in flaschennummern
+            ])
+            c.executemany(SQL_POSITION_EINFUEGEN, [(vorgang_id, fl_num) for fl_num in flaschennummern])
+        return vorgang_id, verliehen_am
+
+    def vorgaenge_importieren(self, vorgaenge):
+        """Insert a block of validated deliveries in one transaction.
+
+        Deliveries that would lend a bottle which is already out, in the
+        database or earlier in the block, are skipped and returned as
+        (vorgang, flaschennummern) pairs. Bottles not yet in the register are
+        added with the data of the first delivery that lends them; retired
+        bottles are not checked, as the block is history.
+        """
+        with self.transaction() as c:
+            belegt = self.aktive_flaschen(
+                [n for v in vorgaenge for n in v.flaschennummern if n not in v.zurueckgegeben], c
+            )
+            angenommen, abgelehnt = [], []
+            for v in vorgaenge:
+                offen = set(v.flaschennummern) - v.zurueckgegeben
+                doppelt = belegt & offen
+                if doppelt:
+                    abgelehnt.append((v, doppelt))
+                    continue
+                belegt |= offen
+                angenommen.append(v)
+
+            kunden = dict.fromkeys(v[:4] for v in angenommen)
+            c.executemany(SQL_KUNDE_EINFUEGEN, kunden)
+            for kunde in kunden:
+                kunden[kunde] = c.execute(SQL_KUNDE_ID, kunde).fetchone()[0]
+            erste_id = c.execute(SQL_VORGANG_NAECHSTE_ID).fetchone()[0]
+            uids = self._versionen(c, len(angenommen))
+            zellen = collections.Counter()
+            for v in angenommen:
+                zellen[v.filiale, v.flaschengroesse, v.flaschendruck] += len(v.flaschennummern) - len(v.zurueckgegeben)
+            c.executemany(SQL_FLASCHE_EINFUEGEN, (
+                (nummer, v.flaschengroesse, v.flaschendruck, v.flasche_von, v.filiale)
+                for v in angenommen for nummer in v.flaschennummern
+            ))
+            with _ohne_trigger(c, IMPORT_OHNE_TRIGGER):
+                c.executemany(SQL_VORGANG_IMPORTIEREN, (
+                    (
+                        erste_id + i, kunden[v[:4]], v.referenznummer, v.flaschengroesse, v.flaschendruck,
+                        v.flasche_von, v.filiale, len(v.flaschennummern), v.verliehen_am,
+                        len(v.flaschennummern) - len(v.zurueckgegeben), uids[i], v.flaschennummern[0],
+                    )
+                    for i, v in enumerate(angenommen)
+                ))
+                c.executemany(SQL_POSITION_IMPORTIEREN, (
+                    (erste_id + i, "zurückgegeben" if nummer in v.zurueckgegeben else "verliehen", nummer)
+                    for i, v in enumerate(angenommen) for nummer in v.flaschennummern
+                ))
+                c.executemany(SQL_FTS_IMPORTIEREN, (
+                    (erste_id + i, *v[:5], " ".join(v.flaschennummern)) for i, v in enumerate(angenommen)
+                ))
+                c.executemany(SQL_BESTAND_VERLIEHEN, [(anzahl, *zelle) for zelle, anzahl in zellen.items() if anzahl])
+                ereignis_vorher = c.execute(SQL_EREIGNIS_STAND).fetchone()[0]
+                c.execute(SQL_EREIGNIS_IMPORTIEREN, (erste_id,))
+                c.execute(SQL_SNAPSHOT_NACHTRAGEN, (ereignis_vorher,))
+            c.execute(SQL_SYNC_IMPORT_EINTRAGEN, (erste_id,))
+        return abgelehnt
+
+    def bestand_liste(self, sortierung=()):
+        """All stock cells, sorted by the (spalte, absteigend) pairs of ``sortierung`` over BESTAND_SORTIERBAR first."""
+        for spalte, _ in sortierung:
+            if spalte not in BESTAND_SORTIERBAR:
+                raise ValueError(f"Unbekannte Spalte: {spalte}")
+        ordnung = "".join(f"{spalte}{' DESC' if absteigend else ''}, " for spalte, absteigend in sortierung)
+        return self.conn.execute(SQL_BESTAND_LISTE.format(ordnung=ordnung)).fetchall()
+
+    def bestand_zeilen(self, ids):
+        return self.conn.execute(SQL_BESTAND_ZEILEN, (json.dumps(list(ids)),)).fetchall()
+
+    def aenderung_stand(self):
+        """Return (oldest cursor still covered by the log, newest seq)."""
+        return self.conn.execute(SQL_AENDERUNG_STAND).fetchone()
+
+    def aenderungen(self, seit):
+        """Changes after cursor ``seit`` as (cursor, verleihvorgang ids, bestand ids).
+
+        Returns None if the log no longer reaches back to ``seit``, or
+        starts after it since a restore; the caller then has to reload
+        everything.
+        """
+        aeltester, neuester = self.aenderung_stand()
+        if seit < aeltester or seit > neuester:
+            return None
+        vorgang_ids, bestand_ids = set(), set()
+        for tabelle, zeile in self.conn.execute(SQL_AENDERUNGEN, (seit, neuester)):
+            if tabelle == "verleihvorgang":
+                vorgang_ids.add(zeile)
+            else:
+                bestand_ids.add(zeile)
+        return neuester, vorgang_ids, bestand_ids
+
+    def aenderungen_kuerzen(self, behalten=100_000):
+        with self.transaction() as c:
+            c.execute(SQL_AENDERUNGEN_KUERZEN, (behalten,))
+
+    def bestand_setzen(self, filiale, groesse, druck, menge):
+        with self.transaction() as c:
+            c.execute(SQL_BESTAND_SETZEN, (menge, self._versionen(c)[0], filiale, groesse, druck))
+            if c.rowcount:
+                c.execute(SQL_SYNC_ZELLE_EINTRAGEN, (filiale, groesse, druck, None))
+
+    def bestand_aendern(self, filiale, groesse, druck, delta):
+        with self.transaction() as c:
+            c.execute(SQL_BESTAND_AENDERN, (delta, self._versionen(c)[0], filiale, groesse, druck))
+            if c.rowcount:
+                c.execute(SQL_SYNC_ZELLE_EINTRAGEN, (filiale, groesse, druck, None))
+
+    def bestand_pruefen(self, reparieren=False):
+        """Recount the open bottles of every cell and return the cells that drifted.
+
+        With ``reparieren`` the counters of those cells are set to the recount
+        in the same transaction.
+        """
+        with self.transaction() as c:
+            tatsaechlich = {tuple(row[:3]): row[3] for row in c.execute(SQL_BESTAND_NACHZAEHLEN)}
+            abweichungen = [
+                Abweichung(*row, tatsaechlich.get(tuple(row[1:4]), 0))
+                for row in c.execute(SQL_BESTAND_ZAEHLER).fetchall()
+                if row[4] != tatsaechlich.get(tuple(row[1:4]), 0)
+            ]
+            if reparieren:
+                c.executemany(SQL_BESTAND_KORRIGIEREN, [(a.tatsaechlich, a.id) for a in abweichungen])
+        return abweichungen
+
+    def stand_zu(self, zeitpunkt):
+        """Stock of every cell at ``zeitpunkt`` ('YYYY-MM-DD HH:MM:SS', local time).
+
+        Returns (zelle, filiale, flaschengroesse, flaschendruck, gesamt,
+        verliehen, verfuegbar) rows; only the events since the nearest
+        snapshot are replayed.
+        """
+        return self.conn.execute(SQL_STAND_ZU, {"stichtag": zeitpunkt}).fetchall()
+
+    def snapshot_anlegen(self, abstand=SNAPSHOT_ABSTAND):
+        """Checkpoint the current state once ``abstand`` events have piled up since the last snapshot.
+
+        Returns True if a snapshot was written.
+        """
+        with self.transaction() as c:
+            letzter = c.execute(SQL_SNAPSHOT_LETZTER).fetchone()[0]
+            if c.execute(SQL_EREIGNISSE_SEIT, (letzter, abstand)).fetchone()[0] < abstand:
+                return False
+            jetzt = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            zeit = c.execute(SQL_ZEIT, (jetzt,)).fetchone()[0]
+            if zeit <= letzter:
+                return False
+            stand = c.execute(SQL_STAND_ZU, {"stichtag": jetzt}).fetchall()
+            snapshot_id = c.execute(SQL_SNAPSHOT_ANLEGEN, (zeit,)).lastrowid
+            c.executemany(SQL_SNAPSHOT_ZELLE, [
+                (snapshot_id, row[0], row[5], row[4]) for row in stand if row[4] or row[5]
+            ])
+        return True
+
+    def verleihvorgaenge(
+        self, nach=None, vor=None, limit=None, suche="", status="", ids=None, archiv=False, sortierung=(),
+    ):
+        """One page of deliveries strictly after key ``nach`` and before key ``vor``.
+
+        ``suche`` is matched against the full-text index and orders the result
+        by relevance. ``status`` keeps deliveries with at least one bottle in
+        that state and lists only those bottles. ``ids`` restricts the result
+        to the given verleihvorgang ids, which is how changed rows are
+        reloaded. ``archiv`` adds the archived deliveries, if the archive is
+        attached. ``sortierung`` is a list of (spalte, absteigend) pairs, see
+        SORTIERBAR; it replaces the order by relevance and adds the sorted
+        values to each row and key (see ``vorgang_schluessel()``).
+        """
+        sortierung = sortierung_pruefen(sortierung)
+        ausdruck = suchausdruck(suche)
+        mit, von, relevanz, mit_params = "", "{vorgang}", "0", []
+        positionen, status_spalte, positionen_params = "", SQL_VORGANG_STATUS, []
+        where, params = ["{nur_archiv}"], []
+        if ausdruck:
+            mit, von = SQL_SUCHE_TREFFER, SQL_SUCHE_VON
+            mit_params.extend((ausdruck, SUCHE_MAX_TREFFER))
+            if not sortierung:
+                relevanz = SQL_SUCHE_RELEVANZ
+        spalten = [SORTIERBAR[spalte] for spalte, _ in sortierung if spalte != "verliehen_am"]
+        if ids is not None:
+            where.append("verleihvorgang.id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(ids)))
+        if status:
+            positionen, status_spalte = "AND status = ?", "?"
+            positionen_params.extend((status, status))
+            if status == "verliehen":
+                # Matches the partial index over open deliveries.
+                where.append("verleihvorgang.offen > 0")
+                # Archived deliveries are all closed.
+                archiv = False
+            else:
+                where.append(
+                    "EXISTS (SELECT 1 FROM {position} WHERE vorgang_id = verleihvorgang.id AND status = ?)"
+                )
+                params.append(status)
+        ausdruecke = [relevanz, *spalten, "verleihvorgang.verliehen_am", "verleihvorgang.id"]
+        namen = ["relevanz", *(f"sortierung_{i}" for i in range(len(spalten))), "verliehen_am", "id"]
+        richtungen = vorgang_richtungen(sortierung)
+        # Constant parts of the key stay out of the ORDER BY, or SQLite sorts
+        # instead of walking an index: relevanz outside a search, and the
+        # status when only the open deliveries are listed.
+        teile = [
+            i for i, ausdruck in enumerate(ausdruecke)
+            if ausdruck != "0" and not (status == "verliehen" and ausdruck == SQL_VORGANG_STATUS)
+        ]
+        if nach is None and spalten and spalten[0] == SORTIERBAR["name"]:
+            # Without a range on the name SQLite joins the other way round
+            # and sorts every delivery. Names are never NULL.
+            where.append("kunde.name >= ''")
+        for schluessel, weiter in ((nach, True), (vor, False)):
+            if schluessel is None:
+                continue
+            if len(schluessel) != len(richtungen):
+                raise ValueError("Der Schlüssel passt nicht zur Sortierung")
+            sql, werte = _keyset(
+                [(ausdruecke[i], richtungen[i]) for i in teile], [schluessel[i] for i in teile], weiter
+            )
+            where.append(sql)
+            params.extend(werte)
+        if limit is not None:
+            params.append(limit)
+
+        def ordnung(spalten):
+            return ", ".join(f"{spalten[i]}{' DESC' if richtungen[i] else ''}" for i in teile)
+
+        # The parts still name their tables as {vorgang}, {position} and {fts}.
+        vorlage = SQL_VERLEIHVORGAENGE.format(
+            mit=mit, von=von, position="{position}", positionen=positionen, status=status_spalte,
+            relevanz=relevanz, where=" AND ".join(where), ordnung=ordnung(ausdruecke),
+            sortierspalten="".join(f",\n        {spalte} AS {name}" for spalte, name in zip(spalten, namen[1:])),
+        ) + (" LIMIT ?" if limit is not None else "")
+        params = mit_params + positionen_params + params
+        if not (archiv and self.archiv):
+            return self.conn.execute(vorlage.format(**TABELLEN_HEISS), params).fetchall()
+        sql = SQL_VORGAENGE_MIT_ARCHIV.format(
+            heiss=vorlage.format(**TABELLEN_HEISS), archiv=vorlage.format(**TABELLEN_ARCHIV), ordnung=ordnung(namen),
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+        return self.conn.execute(sql, params + params + ([limit] if limit is not None else [])).fetchall()
+
+    def zurueckgeben(self, flaschennummern):
+        """Return all given bottles in one transaction; returns the number actually returned.
+
+        Bottles that are not out are ignored. The triggers book the stock
+        back in the same transaction.
+        """
+        nummern = json.dumps(list(flaschennummern))
+        with self.transaction() as c:
+            c.execute(SQL_SYNC_RUECKGABE_EINTRAGEN, (nummern,))
+            c.execute(SQL_RUECKGABE, (nummern,))
+            return c.rowcount
+
+    def bericht(self, name, **parameter):
+        """Yield the rows of report ``name`` straight from the cursor, without fetchall().
+
+        See BERICHTE for the reports and BERICHT_PARAMETER for the filters;
+        ``stichtag`` defaults to now. With the archive attached, the history
+        reports include the archived deliveries.
+        """
+        if name not in BERICHTE:
+            raise ValueError(f"Unbekannter Bericht: {name}")
+        unbekannt = set(parameter) - set(BERICHT_PARAMETER)
+        if unbekannt:
+            raise ValueError(f"Unbekannte Parameter: {', '.join(sorted(unbekannt))}")
+        werte = {**BERICHT_PARAMETER, **{k: v for k, v in parameter.items() if v is not None}}
+        if werte["stichtag"] is None:
+            werte["stichtag"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        sql = BERICHTE_ARCHIV.get(name) if self.archiv else None
+        yield from self.conn.execute(sql or BERICHTE[name][0], werte)
+
+    def vorgang_details(self, vorgang_ids):
+        """Details of whole deliveries; unknown ids are left out.
+
+        Each row is (id, name, telefon, adresse, ansprechpartner,
+        referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale,
+        anzahl, verliehen_am, status, zurueckgegeben_am). Deliveries not in
+        the hot tables are looked up in the archive.
+        """
+        rows = self.conn.execute(SQL_VORGANG_DETAILS, (json.dumps(list(vorgang_ids)),)).fetchall()
+        gefunden = {row[0] for row in rows}
+        fehlende = [vorgang_id for vorgang_id in vorgang_ids if vorgang_id not in gefunden]
+        if fehlende and self.archiv:
+            rows += self.conn.execute(SQL_VORGANG_DETAILS_ARCHIV, (json.dumps(fehlende),)).fetchall()
+        return rows
+
+    def flasche(self, flaschennummer):
+        """Master data and life of one bottle as (stamm, lebenslauf), or None if it is not registered.
+
+        ``stamm`` is (flaschennummer, flaschengroesse, flaschendruck,
+        flasche_von, filiale, pruefung_faellig, ausgemustert_am);
+        ``lebenslauf`` the (zeit, ereignis, angabe) rows, oldest first, with
+        its loans and returns in between.
+        """
+        stamm = self.conn.execute(SQL_FLASCHE, (flaschennummer,)).fetchone()
+        if stamm is None:
+            return None
+        sql = SQL_FLASCHE_LEBENSLAUF_ARCHIV if self.archiv else SQL_FLASCHE_LEBENSLAUF
+        return stamm[1:], self.conn.execute(sql, {"id": stamm[0]}).fetchall()
+
+    def flasche_speichern(self, flaschennummer, groesse, druck, von, filiale):
+        """Register a bottle or change its master data; ``filiale`` is where it belongs."""
+        with self.transaction() as c:
+            c.execute(SQL_FLASCHE_SPEICHERN, (flaschennummer, groesse, druck, von, filiale, self._versionen(c)[0]))
+            c.execute(SQL_SYNC_EINTRAGEN, ("flasche", flaschennummer, None))
+
+    def flasche_pruefen(self, flaschennummer, pruefung_faellig):
+        """Record a passed pressure test with the date ('YYYY-MM-DD') the next one is due.
+
+        Returns False if the bottle is not registered.
+        """
+        with self.transaction() as c:
+            c.execute(SQL_FLASCHE_PRUEFEN, (pruefung_faellig, self._versionen(c)[0], flaschennummer))
+            if not c.rowcount:
+                return False
+            c.execute(SQL_SYNC_EINTRAGEN, ("flasche", flaschennummer, None))
+            return True
+
+    def flasche_ausmustern(self, flaschennummer):
+        """Take a bottle out of service; it can no longer be lent.
+
+        A bottle that is out has to come back first. Returns False if the
+        bottle is not registered or already retired.
+        """
+        with self.transaction() as c:
+            if self.aktive_flaschen([flaschennummer], c):
+                raise FlaschenBereitsVerliehen({flaschennummer})
+            c.execute(SQL_FLASCHE_AUSMUSTERN, (
+                datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self._versionen(c)[0], flaschennummer
+            ))
+            if not c.rowcount:
+                return False
+            c.execute(SQL_SYNC_EINTRAGEN, ("flasche", flaschennummer, None))
+            return True
+
+    def bestand_aus_register(self):
+        """Set ``gesamt`` of every cell to the registered bottles in service there; returns the cells changed."""
+        with self.transaction() as c:
+            version = self._versionen(c)[0]
+            c.execute(SQL_BESTAND_AUS_REGISTER, (version,))
+            zellen = c.rowcount
+            c.execute(SQL_SYNC_ZELLEN_EINTRAGEN, (version,))
+            return zellen
+
+    def _versionen(self, c, anzahl=1):
+        """``anzahl`` new versions from the next ticks of the hybrid logical clock, in ascending order."""
+        uhr = c.execute(SQL_UHR_WEITER, (anzahl,)).fetchone()[0]
+        zufall = os.urandom(4).hex()
+        return [f"{tick:016x}{zufall}" for tick in range(uhr - anzahl + 1, uhr + 1)]
+
+    def sync_zeilen(self, seit, ausser=None, nur_lokal=False, limit=SYNC_SEITE):
+        """The rows changed after cursor ``seit`` in their current state, as (cursor, zeilen, mehr).
+
+        ``zeilen`` are [art, schluessel, daten] records for sync_anwenden().
+        Changes received from ``ausser`` are left out; with ``nur_lokal``
+        all changes that were received from elsewhere. ``mehr`` is True if
+        the log goes on after ``cursor``.
+        """
+        log = self.conn.execute(SQL_SYNC_LOG, {
+            "seit": seit, "ausser": ausser, "nur_lokal": nur_lokal, "limit": limit,
+        }).fetchall()
+        schluessel = {art: [s for _, a, s in log if a == art] for art in SYNC_ARTEN}
+        zustand = {}
+        for uid, *kopf, positionen in self.conn.execute(SQL_SYNC_VORGAENGE, (json.dumps(schluessel["vorgang"]),)):
+            zustand["vorgang", uid] = [*kopf, json.loads(positionen)]
+        for zelle, *daten in self.conn.execute(SQL_SYNC_ZELLEN, (json.dumps(schluessel["bestand"]),)):
+            zustand["bestand", zelle] = daten
+        for nummer, *daten in self.conn.execute(SQL_SYNC_FLASCHEN, (json.dumps(schluessel["flasche"]),)):
+            zustand["flasche", nummer] = daten
+        for neubeginn in schluessel[SYNC_NEUBEGINN]:
+            zustand[SYNC_NEUBEGINN, neubeginn] = None
+        zeilen = [
+            [art, json.loads(s) if art == "bestand" else s, zustand[art, s]]
+            for _, art, s in log if (art, s) in zustand
+        ]
+        return (log[-1][0] if log else seit), zeilen, len(log) == limit
+
+    def sync_anwenden(self, herkunft, zeilen):
+        """Merge records from sync_zeilen() of node ``herkunft`` in one transaction; returns how many changed something.
+
+        Applying a record twice changes nothing. A returned bottle stays
+        returned. If a bottle is out with two deliveries, the one with the
+        greater uid, the later loan, keeps it and the other counts as
+        returned; this decides the same way on every node. Cells and bottle
+        master data take the record with the greater version, but a retired
+        bottle stays retired and the latest pressure-test due date is kept.
+        A row where this node knows better is logged as a change of its own,
+        so the sender gets it back. After a neubeginn record from a restored
+        sender every row is logged that way.
+        """
+        geaendert = 0
+        with self.transaction() as c:
+            ticks = [
+                int(version[:16], 16) for version in (
+                    schluessel if art == "vorgang" else daten[-1] for art, schluessel, daten in zeilen
+                    if art != SYNC_NEUBEGINN
+                ) if version
+            ]
+            if ticks:
+                c.execute(SQL_UHR_EMPFANGEN, (max(ticks),))
+            for art, schluessel, daten in zeilen:
+                if art == "vorgang":
+                    neu, aktuell = self._vorgang_uebernehmen(c, schluessel, daten)
+                    eintragen = SQL_SYNC_EINTRAGEN, (art, schluessel)
+                elif art == "bestand":
+                    neu, aktuell = self._zelle_uebernehmen(c, schluessel, daten)
+                    eintragen = SQL_SYNC_ZELLE_EINTRAGEN, tuple(schluessel)
+                elif art == "flasche":
+                    neu, aktuell = self._flasche_uebernehmen(c, schluessel, daten)
+                    eintragen = SQL_SYNC_EINTRAGEN, (art, schluessel)
+                elif art == SYNC_NEUBEGINN:
+                    for sql in SQL_SYNC_ALLES_EINTRAGEN:
+                        c.execute(sql)
+                    continue
+                else:
+                    raise ValueError(f"Unbekannte Art: {art}")
+                geaendert += neu
+                if neu or not aktuell:
+                    sql, params = eintragen
+                    c.execute(sql, (*params, herkunft if aktuell else None))
+        return geaendert
+
+    def _vorgang_uebernehmen(self, c, uid, daten):
+        # Returns (changed here, sender up to date). A sender that is not up
+        # to date gets the row back; differences it would not adopt, like a
+        # bottle moved to another delivery, are not sent, or the two nodes
+        # would send the row back and forth forever.
+        *kopf, positionen = daten
+        name, telefon, adresse, ansprechpartner, referenznummer, groesse, druck, von, filiale, anzahl, verliehen_am = kopf
+        positionen = dict(positionen)
+        row = c.execute(SQL_VORGANG_UID, (uid,)).fetchone()
+        if row is None and self.archiv and c.execute(SQL_ARCHIV_UID, (uid,)).fetchone():
+            # Archived here, so closed long ago; nothing left to merge.
+            return False, True
+        if row is not None:
+            lokal = dict(c.execute(SQL_SYNC_POSITIONEN, (row[0],)).fetchall())
+            zurueck = [
+                nummer for nummer, status in positionen.items()
+                if status == "zurückgegeben" and lokal.get(nummer) == "verliehen"
+            ]
+            if zurueck:
+                c.execute(SQL_SYNC_POSITION_ZURUECK, (row[0], json.dumps(zurueck)))
+                lokal.update(dict.fromkeys(zurueck, "zurückgegeben"))
+            # Bottles the record still has out but that came back here.
+            return bool(zurueck), not any(
+                status == "verliehen" and lokal.get(nummer) == "zurückgegeben" for nummer, status in positionen.items()
+            )
+
+        kunde = (name, telefon, adresse, ansprechpartner)
+        c.execute(SQL_KUNDE_EINFUEGEN, kunde)
+        kunde_id = c.execute(SQL_KUNDE_ID, kunde).fetchone()[0]
+        c.execute(SQL_VORGANG_UEBERNEHMEN, (
+            kunde_id, referenznummer, groesse, druck, von, filiale, anzahl, verliehen_am, uid,
+        ))
+        vorgang_id = c.lastrowid
+        c.executemany(SQL_FLASCHE_EINFUEGEN, [(nummer, groesse, druck, von, filiale) for nummer in positionen])
+        aktuell = True
+        for nummer, status in positionen.items():
+            if status == "verliehen":
+                aktiv = c.execute(SQL_SYNC_AKTIV, (nummer,)).fetchone()
+                if aktiv is not None and aktiv[1] > uid:
+                    status, aktuell = "zurückgegeben", False
+                elif aktiv is not None:
+                    c.execute(SQL_POSITION_ZURUECK, (aktiv[0],))
+            c.execute(SQL_POSITION_IMPORTIEREN, (vorgang_id, status, nummer))
+        return True, aktuell
+
+    def _zelle_uebernehmen(self, c, zelle, daten):
+        gesamt, version = daten
+        row = c.execute(SQL_SYNC_ZELLE, zelle).fetchone()
+        if row is None:
+            c.execute(SQL_SYNC_ZELLE_ANLEGEN, (*zelle, gesamt, version))
+            return True, True
+        if (row[1] or "") < (version or ""):
+            c.execute(SQL_SYNC_ZELLE_SETZEN, (gesamt, version, *zelle))
+            return True, True
+        return False, row[1] == version
+
+    def _flasche_uebernehmen(self, c, nummer, daten):
+        row = c.execute(SQL_SYNC_FLASCHE, (nummer,)).fetchone()
+        if row is None:
+            c.execute(SQL_SYNC_FLASCHE_ANLEGEN, (*daten, nummer))
+            return True, True
+        lokal = list(row)
+        neu = list(daten) if (lokal[6] or "") < (daten[6] or "") else list(lokal)
+        # A later due date comes from a later pressure test and the earlier
+        # retirement date from the first retirement, wherever they were entered.
+        neu[4] = max((d for d in (lokal[4], daten[4]) if d), default=None)
+        neu[5] = min((d for d in (lokal[5], daten[5]) if d), default=None)
+        if neu == lokal:
+            return False, neu == daten
+        groesse, druck, von, filiale, pruefung_faellig, ausgemustert_am, version = neu
+        c.execute(SQL_SYNC_FLASCHE_SETZEN, (groesse, druck, von, filiale, ausgemustert_am, version, nummer))
+        if pruefung_faellig != lokal[4]:
+            # Only written when it changed, as every write is recorded as a test.
+            c.execute(SQL_FLASCHE_PRUEFEN, (pruefung_faellig, version, nummer))
+        return True, neu == daten
+
+    def sync_stand(self, gegenstelle):
+        """(gesendet, empfangen): the cursors of this database and of ``gegenstelle`` reached so far."""
+        return self.conn.execute(SQL_SYNC_STAND, (gegenstelle,)).fetchone() or (0, 0)
+
+    def sync_stand_setzen(self, gegenstelle, gesendet, empfangen):
+        with self.transaction() as c:
+            c.execute(SQL_SYNC_STAND_SETZEN, (gegenstelle, gesendet, empfangen))
+
+    def sync_einrichten(self, gegenstelle):
+        """Start syncing a copy of the database of ``gegenstelle``: everything in it counts as exchanged."""
+        with self.transaction() as c:
+            neuester = c.execute(SQL_SYNC_NEUESTER).fetchone()[0]
+            c.execute(SQL_SYNC_STAND_SETZEN, (gegenstelle, neuester, neuester))
+            c.execute(SQL_SYNC_LOG_KUERZEN, (neuester,))
+
+    def sync_log_kuerzen(self, gegenstelle):
+        """Drop what a branch has sent to ``gegenstelle`` and all it received from its log."""
+        gesendet, _ = self.sync_stand(gegenstelle)
+        with self.transaction() as c:
+            c.execute(SQL_SYNC_LOG_KUERZEN, (gesendet,))
+
+    def archivieren(self, tage=ARCHIV_TAGE, limit=ARCHIV_BATCH):
+        """Move up to ``limit`` deliveries closed for more than ``tage`` days to the archive; returns how many.
+
+        Needs transactions of its own, so it cannot run inside a group
+        commit. Without an attached archive nothing is moved.
+        """
+        if not self.archiv:
+            return 0
+        if self.conn.in_transaction:
+            raise RuntimeError("archivieren() braucht eigene Transaktionen")
+        stichtag = (datetime.now() - timedelta(days=tage)).strftime("%Y-%m-%d %H:%M:%S")
+        ids = [row[0] for row in self.conn.execute(SQL_ARCHIV_KANDIDATEN, {"stichtag": stichtag, "limit": limit})]
+        if not ids:
+            return 0
+        ids = json.dumps(ids)
+        with self.transaction() as c:
+            c.execute(SQL_ARCHIV_VORGAENGE, (ids,))
+            c.execute(SQL_ARCHIV_POSITIONEN, (ids,))
+            c.execute(SQL_ARCHIV_SUCHTEXT_LOESCHEN, (ids,))
+            c.execute(SQL_ARCHIV_SUCHTEXT, (ids,))
+        with self.transaction() as c:
+            c.execute(SQL_ARCHIV_VORGAENGE_LOESCHEN, (ids,))
+            anzahl = c.rowcount
+            c.execute(SQL_ARCHIV_POSITIONEN_LOESCHEN, (ids,))
+        return anzahl
+
+    def sicherungen(self):
+        """The backups of the database, newest first, as the entries sichern() returns."""
+        verzeichnis = sicherung_pfad(self.db_path)
+        if not os.path.isdir(verzeichnis):
+            return []
+        eintraege = []
+        for datei in sorted(os.listdir(verzeichnis), reverse=True):
+            if datei.endswith(".json"):
+                with open(os.path.join(verzeichnis, datei), encoding="utf-8") as f:
+                    eintraege.append(json.load(f))
+        return eintraege
+
+    def sichern(self, behalten=SICHERUNG_BEHALTEN):
+        """Back up the database and its archive into sicherung_pfad(); returns the entry of the new backup.
+
+        The other connections keep reading and writing meanwhile. A copy only
+        counts once PRAGMA integrity_check passed; a damaged one is deleted
+        and raises sqlite3.DatabaseError. The archive is copied only if it
+        changed since the last backup, which then shares its copy. Of all
+        backups the newest ``behalten`` are kept, with None every one. Takes
+        seconds to minutes, so it wants a connection of its own.
+        """
+        if self.conn.in_transaction:
+            raise RuntimeError("sichern() braucht eine eigene Transaktion")
+        verzeichnis = sicherung_pfad(self.db_path)
+        os.makedirs(verzeichnis, exist_ok=True)
+        for datei in os.listdir(verzeichnis):
+            if datei.endswith(".teil"):
+                # Left behind by an interrupted backup.
+                os.remove(os.path.join(verzeichnis, datei))
+        jetzt = datetime.now()
+        name = f"{jetzt:%Y%m%d-%H%M%S}-{jetzt.microsecond // 1000:03d}"
+        eintrag = {"name": name, "zeit": jetzt.strftime("%Y-%m-%d %H:%M:%S"), "archiv": None, "archiv_umfang": None}
+        dateien = [name + ".db"]
+        start = time.perf_counter()
+        self.conn.execute("BEGIN")
+        try:
+            # The first reads of each file fix the state its copy shows.
+            eintrag["ereignis"] = self.conn.execute(SQL_EREIGNIS_STAND).fetchone()[0]
+            if self.archiv:
+                umfang = [*self.conn.execute(SQL_ARCHIV_UMFANG).fetchone()]
+                umfang.append(self.conn.execute("PRAGMA archiv.user_version").fetchone()[0])
+                eintrag["archiv_umfang"] = umfang
+                eintrag["archiv"] = next((
+                    e["archiv"] for e in self.sicherungen()
+                    if e["archiv_umfang"] == umfang and os.path.exists(os.path.join(verzeichnis, e["archiv"]))
+                ), None)
+                if eintrag["archiv"] is None:
+                    eintrag["archiv"] = name + "-archiv.db"
+                    dateien.append(eintrag["archiv"])
+            for schema, datei in zip(("main", "archiv"), dateien):
+                ziel = sqlite3.connect(os.path.join(verzeichnis, datei + ".teil"))
+                try:
+                    self.conn.backup(
+                        ziel, pages=SICHERUNG_SEITEN, name=schema,
+                        progress=lambda status, rest, gesamt: time.sleep(SICHERUNG_PAUSE),
+                    )
+                    # A single file without -wal, to be copied elsewhere as it is.
+                    ziel.execute("PRAGMA journal_mode=DELETE")
+                finally:
+                    ziel.close()
+        finally:
+            self.conn.rollback()
+        eintrag["sekunden"] = round(time.perf_counter() - start, 2)
+        start = time.perf_counter()
+        for datei in dateien:
+            ziel = sqlite3.connect(os.path.join(verzeichnis, datei + ".teil"))
+            try:
+                ergebnis = [row[0] for row in ziel.execute("PRAGMA integrity_check")]
+            finally:
+                ziel.close()
+            if ergebnis != ["ok"]:
+                for teil in dateien:
+                    os.remove(os.path.join(verzeichnis, teil + ".teil"))
+                raise sqlite3.DatabaseError(f"Sicherung {name} ist beschädigt: {ergebnis[0]}")
+        eintrag["pruefung_sekunden"] = round(time.perf_counter() - start, 2)
+        eintrag["groesse"] = os.path.getsize(os.path.join(verzeichnis, dateien[0] + ".teil"))
+        for datei in dateien:
+            os.replace(os.path.join(verzeichnis, datei + ".teil"), os.path.join(verzeichnis, datei))
+        # The entry last: a backup without one does not exist.
+        with open(os.path.join(verzeichnis, name + ".json.teil"), "w", encoding="utf-8") as f:
+            json.dump(eintrag, f, ensure_ascii=False)
+        os.replace(os.path.join(verzeichnis, name + ".json.teil"), os.path.join(verzeichnis, name + ".json"))
+        if behalten is not None:
+            eintraege = self.sicherungen()
+            for alt in eintraege[behalten:]:
+                os.remove(os.path.join(verzeichnis, alt["name"] + ".json"))
+                os.remove(os.path.join(verzeichnis, alt["name"] + ".db"))
+            verwendet = {e["archiv"] for e in eintraege[:behalten]}
+            for datei in os.listdir(verzeichnis):
+                if datei.endswith("-archiv.db") and datei not in verwendet:
+                    os.remove(os.path.join(verzeichnis, datei))
+        return eintrag
+
+    def wiederherstellen(self, name):
+        """Put backup ``name`` back in place of the database and its archive; returns the backup taken first.
+
+        Both copies are checked with PRAGMA quick_check before either is
+        written. A backup from an older schema is migrated in a copy first;
+        one from a newer schema raises ValueError. The current state is
+        backed up before, and kept until the
+        rotation after the next backup. The copy is written into the open
+        files, so the other programs keep running and see the restored state
+        with their next read. Writers wait for the lock meanwhile; with a
+        database of several GB that takes longer than SCHREIB_TIMEOUT and
+        some of their writes fail. If a copy fails, the files already written
+        get the state from before back. The change log starts over above
+        every cursor, so all clients reload their lists, and the sync log
+        with every row, so the branches receive the restored state and send
+        back what they know newer.
+        """
+        eintrag = next((e for e in self.sicherungen() if e["name"] == name), None)
+        if eintrag is None:
+            raise ValueError(f"Unbekannte Sicherung: {name}")
+        verzeichnis = sicherung_pfad(self.db_path)
+        dateien = {"main": name + ".db"}
+        if eintrag["archiv"]:
+            dateien["archiv"] = eintrag["archiv"]
+        versionen = {}
+        for schema, datei in dateien.items():
+            pfad = os.path.join(verzeichnis, datei)
+            if not os.path.exists(pfad):
+                raise ValueError(f"Sicherung {name} ist unvollständig: {datei} fehlt")
+            quelle = sqlite3.connect(pfad)
+            try:
+                ergebnis = [row[0] for row in quelle.execute("PRAGMA quick_check")]
+                versionen[schema] = quelle.execute("PRAGMA user_version").fetchone()[0]
+            finally:
+                quelle.close()
+            if ergebnis != ["ok"]:
+                raise sqlite3.DatabaseError(f"Sicherung {name} ist beschädigt: {ergebnis[0]}")
+        programm = {"main": SCHEMA_VERSION, "archiv": ARCHIV_VERSION}
+        if any(versionen[schema] > programm[schema] for schema in versionen):
+            raise ValueError(f"Sicherung {name} hat ein neueres Schema, als dieses Programm kennt")
+        with tempfile.TemporaryDirectory(dir=verzeichnis) as arbeit:
+            quellen = {schema: os.path.join(verzeichnis, datei) for schema, datei in dateien.items()}
+            if versionen != {schema: programm[schema] for schema in versionen}:
+                # An older backup is migrated in a copy, so the programs never see the old schema.
+                kopie = os.path.join(arbeit, name + ".db")
+                for schema, pfad in quellen.items():
+                    quellen[schema] = kopie if schema == "main" else archiv_pfad(kopie)
+                    shutil.copyfile(pfad, quellen[schema])
+                init_db(kopie)
+            vorher = self.sichern(behalten=None)
+            folgen = {
+                tabelle: self.conn.execute(SQL_FOLGE, (tabelle,)).fetchone()[0] for tabelle in NEUBEGINN_TABELLEN
+            }
+            uhr = self.conn.execute(SQL_UHR).fetchone()[0]
+            # The main file first: until the archive follows, readers see the
+            # newer archive, whose extra deliveries the restored hot tables hide.
+            geschrieben = []
+            try:
+                for schema, pfad in quellen.items():
+                    self._zurueckspielen(schema, pfad)
+                    geschrieben.append(schema)
+                self._neu_beginnen(not eintrag["archiv"], folgen, uhr, vorher["name"])
+            except BaseException:
+                zurueck = {"main": vorher["name"] + ".db", "archiv": vorher["archiv"]}
+                for schema in geschrieben:
+                    if zurueck[schema] is None:
+                        # There was no archive before.
+                        for endung in ("", "-wal", "-shm"):
+                            if os.path.exists(archiv_pfad(self.db_path) + endung):
+                                os.remove(archiv_pfad(self.db_path) + endung)
+                    else:
+                        self._zurueckspielen(schema, os.path.join(verzeichnis, zurueck[schema]))
+                raise
+        return vorher
+
+    def _zurueckspielen(self, schema, pfad):
+        # Copies file ``pfad`` over the main database or the archive in one
+        # step under the write lock of the target, so the others read the
+        # old state or the new one; gives up once the lock stays taken for
+        # SCHREIB_TIMEOUT.
+        ende = time.monotonic() + SCHREIB_TIMEOUT
+
+        def warten(status, rest, gesamt):
+            if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED) and time.monotonic() >= ende:
+                raise sqlite3.OperationalError("database is locked")
+
+        ziel = self.conn if schema == "main" else sqlite3.connect(archiv_pfad(self.db_path), timeout=BUSY_TIMEOUT)
+        quelle = sqlite3.connect(pfad)
+        try:
+            quelle.backup(ziel, progress=warten, sleep=BACKOFF_MAX)
+            # The whole file went through the WAL; fold it back if no reader is in the way.
+            ziel.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            quelle.close()
+            if ziel is not self.conn:
+                ziel.close()
+
+    def _neu_beginnen(self, archiv_leeren, folgen, uhr, neubeginn):
+        # Starts the change log and the sync log above the sequences in
+        # ``folgen`` and the clock at ``uhr`` or later, see SQL_FOLGE_NEUBEGINN.
+        with self.transaction() as c:
+            if self.archiv and archiv_leeren:
+                # Backed up before there was an archive.
+                for sql in SQL_ARCHIV_LEEREN:
+                    c.execute(sql)
+            c.execute(SQL_AENDERUNGEN_LEEREN)
+            c.execute(SQL_SYNC_LOG_LEEREN)
+            for tabelle, folge in folgen.items():
+                for sql in SQL_FOLGE_NEUBEGINN:
+                    c.execute(sql, {"name": tabelle, "folge": folge})
+            for sql in SQL_SYNC_ALLES_EINTRAGEN:
+                c.execute(sql)
+            c.execute(SQL_SYNC_EINTRAGEN, (SYNC_NEUBEGINN, neubeginn, None))
+            c.execute(SQL_UHR_EMPFANGEN, (uhr,))
@@ -0,0 +1,203 @@
+"""Import historical loans from CSV.
+
+    python verleih_import.py loans.csv [--db flaschen_verleih.db] [--abgelehnt rejected.csv]
+
+The file needs a header row with the columns name, telefon, adresse,
+ansprechpartner, referenznummer, flaschengroesse, flaschendruck,
+flasche_von, filiale, anzahl and verliehen_am, an optional status column
+('verliehen' or 'zurückgegeben'), and either
+
+- flaschennummern: one row per delivery, bottle numbers separated by
+  commas, semicolons or spaces, or
+- flaschennummer: one row per bottle, as in the old verleih table.
+  Consecutive rows that agree on everything but bottle number and status
+  form a delivery of anzahl bottles.
+
+Deliveries are checked with the same rules as the Verleihen form, so
+sizes, pressures and branches other than those of the bestand cells are
+rejected, and written in blocks of one transaction each. Rejected
+deliveries go to the side file with their line numbers and the reason.
+The file is read as a stream, so memory stays flat however long it is.
+"""
+import argparse
+import csv
+import itertools
+import operator
+import re
+import sys
+import time
+from datetime import datetime
+from typing import NamedTuple
+
+from verleih_db import DB_PATH, Datenbank, Verleihvorgang, verleih_fehler
+
+KUNDE = ["name", "telefon", "adresse", "ansprechpartner", "referenznummer"]
+FLASCHE = ["flaschengroesse", "flaschendruck", "flasche_von", "filiale"]
+PFLICHT = KUNDE + FLASCHE + ["anzahl", "verliehen_am"]
+STATUS = ("verliehen", "zurückgegeben")
+DATUMSFORMAT = "%Y-%m-%d %H:%M:%S"
+# Bottles per transaction.
+BLOCKGROESSE = 50_000
+
+
+class Ergebnis(NamedTuple):
+    vorgaenge: int
+    flaschen: int
+    abgelehnt: int
+    sekunden: float
+
+
+def _spalten(kopf):
+    # Column name -> index; raises ValueError if a required column is missing.
+    spalten = {name.strip(): i for i, name in enumerate(kopf)}
+    fehlend = [s for s in PFLICHT if s not in spalten]
+    if "flaschennummer" not in spalten and "flaschennummern" not in spalten:
+        fehlend.append("flaschennummer(n)")
+    if fehlend:
+        raise ValueError(f"Spalte(n) fehlen: {', '.join(fehlend)}")
+    return spalten
+
+
+def _gruppen(reader, spalten):
+    # One list of (line number, row) per delivery.
+    zeilen = ((reader.line_num, row) for row in reader if row)
+    if "flaschennummern" in spalten:
+        for zeile in zeilen:
+            yield [zeile]
+        return
+    vorgang = operator.itemgetter(*(spalten[s] for s in PFLICHT))
+    anzahl_spalte = spalten["anzahl"]
+    for _, gruppe in itertools.groupby(zeilen, key=lambda z: vorgang(z[1])):
+        gruppe = list(gruppe)
+        try:
+            anzahl = max(int(gruppe[0][1][anzahl_spalte]), 1)
+        except ValueError:
+            anzahl = len(gruppe)
+        # Identical deliveries in the same second follow each other.
+        for start in range(0, len(gruppe), anzahl):
+            yield gruppe[start:start + anzahl]
+
+
+def _datum(wert, datumsformat):
+    if datumsformat == DATUMSFORMAT:
+        # Much faster than strptime and also takes the other ISO 8601 forms.
+        return datetime.fromisoformat(wert).strftime(DATUMSFORMAT)
+    return datetime.strptime(wert, datumsformat).strftime(DATUMSFORMAT)
+
+
+def _vorgang(gruppe, spalten, datumsformat):
+    # Returns (Verleihvorgang, None) or (None, reason).
+    row = gruppe[0][1]
+    feld = lambda r, name: r[spalten[name]].strip() if spalten.get(name, len(r)) < len(r) else ""
+    daten = [feld(row, s) for s in KUNDE]
+    dropdown_data = [feld(row, s) for s in FLASCHE]
+    try:
+        anzahl = int(feld(row, "anzahl"))
+    except ValueError:
+        return None, "Anzahl muss eine gültige Zahl sein."
+    if "flaschennummern" in spalten:
+        flaschennummern = [n for n in re.split(r"[,;\s]+", feld(row, "flaschennummern")) if n]
+        status = dict.fromkeys(flaschennummern, feld(row, "status") or "verliehen")
+    else:
+        flaschennummern = [n for n in (feld(r, "flaschennummer") for _, r in gruppe) if n]
+        status = {feld(r, "flaschennummer"): feld(r, "status") or "verliehen" for _, r in gruppe}
+    fehler = verleih_fehler(daten, dropdown_data, anzahl, flaschennummern)
+    if fehler:
+        return None, fehler
+    unbekannt = set(status.values()) - set(STATUS)
+    if unbekannt:
+        return None, f"Unbekannter Status: {', '.join(sorted(unbekannt))}"
+    try:
+        verliehen_am = _datum(feld(row, "verliehen_am"), datumsformat)
+    except ValueError:
+        return None, f"Ungültiges Datum: {feld(row, 'verliehen_am')}"
+    zurueckgegeben = frozenset(n for n, s in status.items() if s == "zurückgegeben")
+    return Verleihvorgang(*daten, *dropdown_data, verliehen_am, tuple(flaschennummern), zurueckgegeben), None
+
+
+def importieren(db, datei, abgelehnt_datei, trennzeichen=None, datumsformat=DATUMSFORMAT, blockgroesse=BLOCKGROESSE):
+    """Stream ``datei`` into ``db``; rejected deliveries are written to ``abgelehnt_datei``.
+
+    The side file is only created if something is rejected.
+    """
+    start = time.perf_counter()
+    vorgaenge = flaschen = abgelehnt = 0
+    ablage_datei = ablage = None
+    kopf = []
+
+    def ablehnen(gruppe, grund):
+        nonlocal ablage_datei, ablage, abgelehnt
+        if ablage is None:
+            ablage_datei = open(abgelehnt_datei, "w", newline="", encoding="utf-8")
+            ablage = csv.writer(ablage_datei)
+            ablage.writerow(["zeile", "fehler", *kopf])
+        for zeile, row in gruppe:
+            ablage.writerow([zeile, grund, *row])
+        abgelehnt += 1
+
+    def schreiben(block):
+        nonlocal vorgaenge, flaschen
+        gruppen = {id(v): gruppe for v, gruppe in block}
+        zurueck = db.vorgaenge_importieren([v for v, _ in block])
+        for v, doppelt in zurueck:
+            ablehnen(gruppen[id(v)], f"Bereits verliehen: {', '.join(sorted(doppelt))}")
+        vorgaenge += len(block) - len(zurueck)
+        flaschen += sum(len(v.flaschennummern) for v, _ in block) - sum(len(v.flaschennummern) for v, _ in zurueck)
+
+    try:
+        with open(datei, newline="", encoding="utf-8-sig") as f:
+            if trennzeichen is None:
+                trennzeichen = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;\t").delimiter
+                f.seek(0)
+            reader = csv.reader(f, delimiter=trennzeichen)
+            kopf = next(reader, [])
+            spalten = _spalten(kopf)
+            block, im_block = [], 0
+            for gruppe in _gruppen(reader, spalten):
+                vorgang, grund = _vorgang(gruppe, spalten, datumsformat)
+                if vorgang is None:
+                    ablehnen(gruppe, grund)
+                    continue
+                block.append((vorgang, gruppe))
+                im_block += len(vorgang.flaschennummern)
+                if im_block >= blockgroesse:
+                    schreiben(block)
+                    block, im_block = [], 0
+            if block:
+                schreiben(block)
+    finally:
+        if ablage_datei is not None:
+            ablage_datei.close()
+    return Ergebnis(vorgaenge, flaschen, abgelehnt, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("datei")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--abgelehnt", help="Datei für abgelehnte Zeilen (Standard: <datei>.abgelehnt.csv)")
+    parser.add_argument("--trennzeichen", help="Standard: aus der Datei erkannt")
+    parser.add_argument("--datumsformat", default=DATUMSFORMAT, help="strptime-Format von verliehen_am")
+    parser.add_argument("--blockgroesse", type=int, default=BLOCKGROESSE, help="Flaschen pro Transaktion")
+    args = parser.parse_args()
+
+    db = Datenbank(args.db)
+    abgelehnt_datei = args.abgelehnt or f"{args.datei}.abgelehnt.csv"
+    try:
+        ergebnis = importieren(db, args.datei, abgelehnt_datei, args.trennzeichen, args.datumsformat, args.blockgroesse)
+    except ValueError as e:
+        print(f"Fehler: {e}", file=sys.stderr)
+        return 2
+    finally:
+        db.close()
+    print(
+        f"{ergebnis.vorgaenge} Vorgänge mit {ergebnis.flaschen} Flaschen importiert, "
+        f"{ergebnis.abgelehnt} abgelehnt, in {ergebnis.sekunden:.1f} s."
+    )
+    if ergebnis.abgelehnt:
+        print(f"Abgelehnte Zeilen: {abgelehnt_datei}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1103 @@
+"""Versioned schema migrations for the Flaschen-Verleih database.
+
+The schema version is stored in ``PRAGMA user_version``. Every entry in
+``MIGRATIONEN`` upgrades the database by exactly one version and runs in its
+own transaction, so an existing ``flaschen_verleih.db`` is upgraded in place
+and a failed step leaves the file at the previous version.
+"""
+import logging
+import sqlite3
+
+_log = logging.getLogger("verleih.schema")
+
+
+def _basis_tabellen(c):
+    # Version 1 is the schema the program has always created. Existing
+    # databases (user_version 0) already have these tables.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS verleih (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            telefon TEXT,
+            adresse TEXT,
+            ansprechpartner TEXT,
+            referenznummer TEXT,
+            flaschennummer TEXT,
+            flaschengroesse TEXT,
+            flaschendruck TEXT,
+            flasche_von TEXT,
+            filiale TEXT,
+            anzahl INTEGER,
+            verliehen_am TEXT,
+            status TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS bestand (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filiale TEXT,
+            flaschengroesse TEXT,
+            flaschendruck TEXT,
+            bestand INTEGER
+        )
+    """)
+
+
+def _indizes(c):
+    # update_stock() always touched every duplicate cell, so the rows are
+    # identical and keeping the oldest one loses nothing.
+    c.execute("""
+        DELETE FROM bestand WHERE id NOT IN (
+            SELECT MIN(id) FROM bestand GROUP BY filiale, flaschengroesse, flaschendruck
+        )
+    """)
+    c.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS bestand_zelle ON bestand (filiale, flaschengroesse, flaschendruck)"
+    )
+
+    # A bottle can only be out once. Older databases may contain the same
+    # bottle as 'verliehen' more than once; the most recent loan wins. The
+    # others are kept in doppelt_verliehen so they can be checked by hand;
+    # their stock is not given back.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS doppelt_verliehen (
+            verleih_id INTEGER PRIMARY KEY,
+            flaschennummer TEXT,
+            name TEXT,
+            referenznummer TEXT,
+            verliehen_am TEXT
+        )
+    """)
+    c.execute("""
+        INSERT OR IGNORE INTO doppelt_verliehen (verleih_id, flaschennummer, name, referenznummer, verliehen_am)
+        SELECT id, flaschennummer, name, referenznummer, verliehen_am FROM verleih
+        WHERE status = 'verliehen' AND id NOT IN (
+            SELECT MAX(id) FROM verleih WHERE status = 'verliehen' GROUP BY flaschennummer
+        )
+    """)
+    doppelt = c.rowcount
+    if doppelt > 0:
+        nummern = c.execute("SELECT DISTINCT flaschennummer FROM doppelt_verliehen ORDER BY flaschennummer")
+        _log.warning(
+            "%d ältere Verleihe doppelt verliehener Flaschen als zurückgegeben gebucht, siehe Tabelle "
+            "doppelt_verliehen: %s", doppelt, ", ".join(str(row[0]) for row in nummern),
+        )
+    c.execute("""
+        UPDATE verleih SET status = 'zurückgegeben'
+        WHERE id IN (SELECT verleih_id FROM doppelt_verliehen)
+    """)
+    c.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS verleih_aktive_flasche ON verleih (flaschennummer) WHERE status = 'verliehen'"
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS verleih_flaschennummer ON verleih (flaschennummer, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS verleih_verliehen_am ON verleih (verliehen_am)")
+
+
+def _aenderungsprotokoll(c):
+    # Every write to verleih or bestand leaves a row here, so clients can
+    # follow a cursor (seq) and refresh only what changed. Loans are logged
+    # with their verliehen_am because that is the part of a delivery's
+    # identity that never changes when its bottles are returned.
+    c.execute("""
+        CREATE TABLE aenderung (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabelle TEXT NOT NULL,
+            zeile INTEGER NOT NULL,
+            verliehen_am TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_aenderung_insert AFTER INSERT ON verleih BEGIN
+            INSERT INTO aenderung (tabelle, zeile, verliehen_am) VALUES ('verleih', NEW.id, NEW.verliehen_am);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_aenderung_update AFTER UPDATE ON verleih BEGIN
+            INSERT INTO aenderung (tabelle, zeile, verliehen_am) VALUES ('verleih', NEW.id, NEW.verliehen_am);
+            INSERT INTO aenderung (tabelle, zeile, verliehen_am)
+                SELECT 'verleih', OLD.id, OLD.verliehen_am WHERE OLD.verliehen_am IS NOT NEW.verliehen_am;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_aenderung_delete AFTER DELETE ON verleih BEGIN
+            INSERT INTO aenderung (tabelle, zeile, verliehen_am) VALUES ('verleih', OLD.id, OLD.verliehen_am);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER bestand_aenderung_insert AFTER INSERT ON bestand BEGIN
+            INSERT INTO aenderung (tabelle, zeile) VALUES ('bestand', NEW.id);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER bestand_aenderung_update AFTER UPDATE ON bestand BEGIN
+            INSERT INTO aenderung (tabelle, zeile) VALUES ('bestand', NEW.id);
+        END
+    """)
+
+
+def _volltextsuche(c):
+    # External-content FTS5 index over the searchable loan columns. The
+    # prefix indexes make search-as-you-type queries ("Lin*") cheap.
+    c.execute("""
+        CREATE VIRTUAL TABLE verleih_fts USING fts5(
+            name, telefon, adresse, ansprechpartner, referenznummer, flaschennummer,
+            content='verleih', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_fts_insert AFTER INSERT ON verleih BEGIN
+            INSERT INTO verleih_fts (rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummer)
+            VALUES (NEW.id, NEW.name, NEW.telefon, NEW.adresse, NEW.ansprechpartner, NEW.referenznummer, NEW.flaschennummer);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_fts_delete AFTER DELETE ON verleih BEGIN
+            INSERT INTO verleih_fts (verleih_fts, rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummer)
+            VALUES ('delete', OLD.id, OLD.name, OLD.telefon, OLD.adresse, OLD.ansprechpartner, OLD.referenznummer, OLD.flaschennummer);
+        END
+    """)
+    # Returns only touch status, so the index is left alone unless a
+    # searchable column actually changes.
+    c.execute("""
+        CREATE TRIGGER verleih_fts_update AFTER UPDATE OF
+            name, telefon, adresse, ansprechpartner, referenznummer, flaschennummer ON verleih
+        BEGIN
+            INSERT INTO verleih_fts (verleih_fts, rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummer)
+            VALUES ('delete', OLD.id, OLD.name, OLD.telefon, OLD.adresse, OLD.ansprechpartner, OLD.referenznummer, OLD.flaschennummer);
+            INSERT INTO verleih_fts (rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummer)
+            VALUES (NEW.id, NEW.name, NEW.telefon, NEW.adresse, NEW.ansprechpartner, NEW.referenznummer, NEW.flaschennummer);
+        END
+    """)
+    # Bottle and reference numbers weigh most when ranking hits.
+    c.execute("INSERT INTO verleih_fts (verleih_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0, 1.0, 1.0, 2.0, 3.0)')")
+    c.execute("INSERT INTO verleih_fts (verleih_fts) VALUES ('rebuild')")
+
+
+# The delivery an INSERT into the verleih view belongs to: an open header
+# with the same data that does not have all of its anzahl bottles yet.
+_PASSENDER_VORGANG = """
+    SELECT v.id FROM verleihvorgang v JOIN kunde k ON k.id = v.kunde_id
+    WHERE k.name = IFNULL(NEW.name, '') AND k.telefon = IFNULL(NEW.telefon, '')
+      AND k.adresse = IFNULL(NEW.adresse, '') AND k.ansprechpartner = IFNULL(NEW.ansprechpartner, '')
+      AND v.verliehen_am IS NEW.verliehen_am AND v.referenznummer IS NEW.referenznummer
+      AND v.flaschengroesse IS NEW.flaschengroesse AND v.flaschendruck IS NEW.flaschendruck
+      AND v.flasche_von IS NEW.flasche_von AND v.filiale IS NEW.filiale AND v.anzahl IS NEW.anzahl
+      AND (SELECT COUNT(*) FROM verleih_position WHERE vorgang_id = v.id) < MAX(IFNULL(v.anzahl, 1), 1)
+    ORDER BY v.id DESC LIMIT 1
+"""
+# Customer and, if there is no matching one, header for that INSERT.
+_VERLEIH_INSERT_VORGANG = f"""
+    INSERT OR IGNORE INTO kunde (name, telefon, adresse, ansprechpartner)
+    VALUES (IFNULL(NEW.name, ''), IFNULL(NEW.telefon, ''), IFNULL(NEW.adresse, ''), IFNULL(NEW.ansprechpartner, ''));
+    INSERT INTO verleihvorgang (
+        kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am
+    )
+    SELECT k.id, NEW.referenznummer, NEW.flaschengroesse, NEW.flaschendruck, NEW.flasche_von, NEW.filiale,
+           NEW.anzahl, NEW.verliehen_am
+    FROM kunde k
+    WHERE k.name = IFNULL(NEW.name, '') AND k.telefon = IFNULL(NEW.telefon, '')
+      AND k.adresse = IFNULL(NEW.adresse, '') AND k.ansprechpartner = IFNULL(NEW.ansprechpartner, '')
+      AND NOT EXISTS ({_PASSENDER_VORGANG});
+"""
+
+
+def _normalisiertes_modell(c):
+    # Customers and delivery headers are stored once; verleih_position keeps
+    # one row per bottle. Deliveries used to be recovered by grouping the
+    # repeated columns, which merged two identical deliveries in the same
+    # second. Groups larger than their anzahl are split back into deliveries
+    # of anzahl bottles in insertion order.
+    c.execute("""
+        CREATE TABLE kunde (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            telefon TEXT NOT NULL,
+            adresse TEXT NOT NULL,
+            ansprechpartner TEXT NOT NULL,
+            UNIQUE (name, telefon, adresse, ansprechpartner)
+        )
+    """)
+    # offen counts the bottles of the delivery that are still out; it is
+    # kept up to date by the triggers on verleih_position.
+    c.execute("""
+        CREATE TABLE verleihvorgang (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kunde_id INTEGER NOT NULL REFERENCES kunde (id),
+            referenznummer TEXT,
+            flaschengroesse TEXT,
+            flaschendruck TEXT,
+            flasche_von TEXT,
+            filiale TEXT,
+            anzahl INTEGER,
+            verliehen_am TEXT,
+            offen INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TABLE verleih_position (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vorgang_id INTEGER NOT NULL REFERENCES verleihvorgang (id),
+            flaschennummer TEXT,
+            status TEXT
+        )
+    """)
+
+    gruppe = "name, telefon, adresse, ansprechpartner, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am"
+    c.execute(f"""
+        CREATE TEMP TABLE zuordnung AS
+        SELECT id, MIN(id) OVER (PARTITION BY {gruppe}, teil) AS vorgang_id
+        FROM (
+            SELECT id, {gruppe},
+                   (ROW_NUMBER() OVER (PARTITION BY {gruppe} ORDER BY id) - 1) / MAX(IFNULL(anzahl, 1), 1) AS teil
+            FROM verleih
+        )
+    """)
+    c.execute("""
+        INSERT INTO kunde (name, telefon, adresse, ansprechpartner)
+        SELECT DISTINCT IFNULL(name, ''), IFNULL(telefon, ''), IFNULL(adresse, ''), IFNULL(ansprechpartner, '')
+        FROM verleih
+    """)
+    # Headers take the id of their first bottle, so list items keep the
+    # iids they had when deliveries were grouped by MIN(verleih.id).
+    c.execute("""
+        INSERT INTO verleihvorgang (
+            id, kunde_id, referenznummer, flaschengroesse, flaschendruck, flasche_von, filiale, anzahl, verliehen_am, offen
+        )
+        SELECT z.vorgang_id, k.id, l.referenznummer, l.flaschengroesse, l.flaschendruck, l.flasche_von, l.filiale,
+               l.anzahl, l.verliehen_am, SUM(l.status = 'verliehen')
+        FROM zuordnung z
+        JOIN verleih l ON l.id = z.id
+        JOIN kunde k ON k.name = IFNULL(l.name, '') AND k.telefon = IFNULL(l.telefon, '')
+            AND k.adresse = IFNULL(l.adresse, '') AND k.ansprechpartner = IFNULL(l.ansprechpartner, '')
+        GROUP BY z.vorgang_id
+    """)
+    c.execute("""
+        INSERT INTO verleih_position (id, vorgang_id, flaschennummer, status)
+        SELECT l.id, z.vorgang_id, l.flaschennummer, l.status
+        FROM verleih l JOIN zuordnung z ON z.id = l.id
+    """)
+    c.execute("DROP TABLE zuordnung")
+    # Dropping the tables also drops their indexes and triggers.
+    c.execute("DROP TABLE verleih")
+    c.execute("DROP TABLE verleih_fts")
+    # Logged rows were verleih ids; from now on the log names deliveries.
+    c.execute("DELETE FROM aenderung WHERE tabelle = 'verleih'")
+    c.execute("ALTER TABLE aenderung DROP COLUMN verliehen_am")
+
+    c.execute("CREATE INDEX verleihvorgang_verliehen_am ON verleihvorgang (verliehen_am)")
+    c.execute("CREATE INDEX verleihvorgang_offen ON verleihvorgang (verliehen_am) WHERE offen > 0")
+    c.execute("CREATE INDEX verleihvorgang_kunde ON verleihvorgang (kunde_id)")
+    c.execute("CREATE INDEX verleih_position_vorgang ON verleih_position (vorgang_id)")
+    c.execute("CREATE INDEX verleih_position_flaschennummer ON verleih_position (flaschennummer, status)")
+    c.execute(
+        "CREATE UNIQUE INDEX verleih_position_aktiv ON verleih_position (flaschennummer) WHERE status = 'verliehen'"
+    )
+
+    # Every position change touches its header, so the change log only has
+    # to watch verleihvorgang.
+    c.execute("""
+        CREATE TRIGGER verleih_position_insert AFTER INSERT ON verleih_position BEGIN
+            UPDATE verleihvorgang SET offen = offen + (NEW.status = 'verliehen') WHERE id = NEW.vorgang_id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_position_update AFTER UPDATE ON verleih_position BEGIN
+            UPDATE verleihvorgang SET offen = offen - (OLD.status = 'verliehen') WHERE id = OLD.vorgang_id;
+            UPDATE verleihvorgang SET offen = offen + (NEW.status = 'verliehen') WHERE id = NEW.vorgang_id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_position_delete AFTER DELETE ON verleih_position BEGIN
+            UPDATE verleihvorgang SET offen = offen - (OLD.status = 'verliehen') WHERE id = OLD.vorgang_id;
+        END
+    """)
+    for ereignis, zeile in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        c.execute(f"""
+            CREATE TRIGGER verleihvorgang_aenderung_{ereignis.lower()} AFTER {ereignis} ON verleihvorgang BEGIN
+                INSERT INTO aenderung (tabelle, zeile) VALUES ('verleihvorgang', {zeile}.id);
+            END
+        """)
+
+    # One search document per delivery: customer, reference and all of its
+    # bottle numbers. The index keeps its own copy of the text because the
+    # document spans three tables.
+    c.execute("""
+        CREATE VIRTUAL TABLE verleihvorgang_fts USING fts5(
+            name, telefon, adresse, ansprechpartner, referenznummer, flaschennummern,
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER verleihvorgang_fts_insert AFTER INSERT ON verleihvorgang BEGIN
+            INSERT INTO verleihvorgang_fts (rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummern)
+            SELECT NEW.id, name, telefon, adresse, ansprechpartner, NEW.referenznummer, ''
+            FROM kunde WHERE id = NEW.kunde_id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleihvorgang_fts_update AFTER UPDATE OF kunde_id, referenznummer ON verleihvorgang BEGIN
+            UPDATE verleihvorgang_fts SET
+                (name, telefon, adresse, ansprechpartner) =
+                    (SELECT name, telefon, adresse, ansprechpartner FROM kunde WHERE id = NEW.kunde_id),
+                referenznummer = NEW.referenznummer
+            WHERE rowid = NEW.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleihvorgang_fts_delete AFTER DELETE ON verleihvorgang BEGIN
+            DELETE FROM verleihvorgang_fts WHERE rowid = OLD.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER kunde_fts_update AFTER UPDATE ON kunde BEGIN
+            UPDATE verleihvorgang_fts SET
+                name = NEW.name, telefon = NEW.telefon, adresse = NEW.adresse, ansprechpartner = NEW.ansprechpartner
+            WHERE rowid IN (SELECT id FROM verleihvorgang WHERE kunde_id = NEW.id);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_position_fts_insert AFTER INSERT ON verleih_position BEGIN
+            UPDATE verleihvorgang_fts SET flaschennummern = flaschennummern || ' ' || IFNULL(NEW.flaschennummer, '')
+            WHERE rowid = NEW.vorgang_id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_position_fts_update AFTER UPDATE OF vorgang_id, flaschennummer ON verleih_position BEGIN
+            UPDATE verleihvorgang_fts SET flaschennummern = IFNULL(
+                (SELECT GROUP_CONCAT(flaschennummer, ' ') FROM verleih_position WHERE vorgang_id = verleihvorgang_fts.rowid), ''
+            )
+            WHERE rowid IN (OLD.vorgang_id, NEW.vorgang_id);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_position_fts_delete AFTER DELETE ON verleih_position BEGIN
+            UPDATE verleihvorgang_fts SET flaschennummern = IFNULL(
+                (SELECT GROUP_CONCAT(flaschennummer, ' ') FROM verleih_position WHERE vorgang_id = OLD.vorgang_id), ''
+            )
+            WHERE rowid = OLD.vorgang_id;
+        END
+    """)
+    c.execute(
+        "INSERT INTO verleihvorgang_fts (verleihvorgang_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0, 1.0, 1.0, 2.0, 3.0)')"
+    )
+    c.execute("""
+        INSERT INTO verleihvorgang_fts (rowid, name, telefon, adresse, ansprechpartner, referenznummer, flaschennummern)
+        SELECT v.id, k.name, k.telefon, k.adresse, k.ansprechpartner, v.referenznummer,
+               IFNULL((SELECT GROUP_CONCAT(flaschennummer, ' ') FROM verleih_position WHERE vorgang_id = v.id), '')
+        FROM verleihvorgang v JOIN kunde k ON k.id = v.kunde_id
+    """)
+
+    # The old one-row-per-bottle table lives on as a view, so reports and
+    # older program versions sharing the file keep working. Inserts are
+    # filed under an open header with the same data, or a new one once the
+    # matching header has all of its anzahl bottles.
+    c.execute("""
+        CREATE VIEW verleih AS
+        SELECT p.id, k.name, k.telefon, k.adresse, k.ansprechpartner, v.referenznummer, p.flaschennummer,
+               v.flaschengroesse, v.flaschendruck, v.flasche_von, v.filiale, v.anzahl, v.verliehen_am, p.status
+        FROM verleih_position p
+        JOIN verleihvorgang v ON v.id = p.vorgang_id
+        JOIN kunde k ON k.id = v.kunde_id
+    """)
+    c.execute(f"""
+        CREATE TRIGGER verleih_insert INSTEAD OF INSERT ON verleih BEGIN
+            {_VERLEIH_INSERT_VORGANG}
+            INSERT INTO verleih_position (vorgang_id, flaschennummer, status)
+            VALUES (({_PASSENDER_VORGANG}), NEW.flaschennummer, NEW.status);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_update INSTEAD OF UPDATE OF status ON verleih BEGIN
+            UPDATE verleih_position SET status = NEW.status WHERE id = OLD.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_delete INSTEAD OF DELETE ON verleih BEGIN
+            DELETE FROM verleih_position WHERE id = OLD.id;
+        END
+    """)
+
+
+def _bestand_aus_verleih(c):
+    # Stock is split into the hand-counted total a branch owns (gesamt) and
+    # the bottles of that cell currently out (verliehen). verliehen is kept
+    # by triggers in the same transaction as the loan or return, and the
+    # available stock is derived from both, so it can no longer drift from
+    # the loan table. The old bestand column was the available count.
+    c.execute("""
+        CREATE TABLE bestand_neu (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filiale TEXT,
+            flaschengroesse TEXT,
+            flaschendruck TEXT,
+            gesamt INTEGER NOT NULL DEFAULT 0,
+            verliehen INTEGER NOT NULL DEFAULT 0,
+            bestand INTEGER GENERATED ALWAYS AS (gesamt - verliehen) VIRTUAL
+        )
+    """)
+    c.execute("""
+        INSERT INTO bestand_neu (id, filiale, flaschengroesse, flaschendruck, gesamt, verliehen)
+        SELECT b.id, b.filiale, b.flaschengroesse, b.flaschendruck,
+               IFNULL(b.bestand, 0) + IFNULL(o.anzahl, 0), IFNULL(o.anzahl, 0)
+        FROM bestand b
+        LEFT JOIN (
+            SELECT v.filiale, v.flaschengroesse, v.flaschendruck, COUNT(*) AS anzahl
+            FROM verleih_position p JOIN verleihvorgang v ON v.id = p.vorgang_id
+            WHERE p.status = 'verliehen'
+            GROUP BY v.filiale, v.flaschengroesse, v.flaschendruck
+        ) AS o ON o.filiale = b.filiale AND o.flaschengroesse = b.flaschengroesse AND o.flaschendruck = b.flaschendruck
+    """)
+    c.execute("DROP TABLE bestand")
+    c.execute("ALTER TABLE bestand_neu RENAME TO bestand")
+    c.execute("CREATE UNIQUE INDEX bestand_zelle ON bestand (filiale, flaschengroesse, flaschendruck)")
+    c.execute("""
+        CREATE TRIGGER bestand_aenderung_insert AFTER INSERT ON bestand BEGIN
+            INSERT INTO aenderung (tabelle, zeile) VALUES ('bestand', NEW.id);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER bestand_aenderung_update AFTER UPDATE ON bestand BEGIN
+            INSERT INTO aenderung (tabelle, zeile) VALUES ('bestand', NEW.id);
+        END
+    """)
+    # A cell added later starts with the bottles already out in it.
+    c.execute("""
+        CREATE TRIGGER bestand_zelle_insert AFTER INSERT ON bestand BEGIN
+            UPDATE bestand SET verliehen = (
+                SELECT COUNT(*) FROM verleih_position JOIN verleihvorgang ON verleihvorgang.id = verleih_position.vorgang_id
+                WHERE verleih_position.status = 'verliehen' AND verleihvorgang.filiale IS NEW.filiale
+                  AND verleihvorgang.flaschengroesse IS NEW.flaschengroesse
+                  AND verleihvorgang.flaschendruck IS NEW.flaschendruck
+            )
+            WHERE id = NEW.id;
+        END
+    """)
+
+    def zelle(vorgang_id):
+        return f"""
+            (filiale, flaschengroesse, flaschendruck) =
+                (SELECT filiale, flaschengroesse, flaschendruck FROM verleihvorgang WHERE id = {vorgang_id})
+        """
+
+    c.execute(f"""
+        CREATE TRIGGER bestand_position_insert AFTER INSERT ON verleih_position
+        WHEN NEW.status = 'verliehen' BEGIN
+            UPDATE bestand SET verliehen = verliehen + 1 WHERE {zelle("NEW.vorgang_id")};
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER bestand_position_update AFTER UPDATE OF vorgang_id, status ON verleih_position
+        WHEN OLD.status = 'verliehen' OR NEW.status = 'verliehen' BEGIN
+            UPDATE bestand SET verliehen = verliehen - 1 WHERE OLD.status = 'verliehen' AND {zelle("OLD.vorgang_id")};
+            UPDATE bestand SET verliehen = verliehen + 1 WHERE NEW.status = 'verliehen' AND {zelle("NEW.vorgang_id")};
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER bestand_position_delete AFTER DELETE ON verleih_position
+        WHEN OLD.status = 'verliehen' BEGIN
+            UPDATE bestand SET verliehen = verliehen - 1 WHERE {zelle("OLD.vorgang_id")};
+        END
+    """)
+    # A corrected header moves its open bottles to the other cell.
+    c.execute("""
+        CREATE TRIGGER bestand_vorgang_update AFTER UPDATE OF filiale, flaschengroesse, flaschendruck ON verleihvorgang
+        WHEN OLD.offen > 0 OR NEW.offen > 0 BEGIN
+            UPDATE bestand SET verliehen = verliehen - OLD.offen
+            WHERE (filiale, flaschengroesse, flaschendruck) = (OLD.filiale, OLD.flaschengroesse, OLD.flaschendruck);
+            UPDATE bestand SET verliehen = verliehen + NEW.offen
+            WHERE (filiale, flaschengroesse, flaschendruck) = (NEW.filiale, NEW.flaschengroesse, NEW.flaschendruck);
+        END
+    """)
+
+
+# Event kinds in ereignis.art. menge is +1/-1 for a bottle; for BESTAND it is
+# the change of bestand.gesamt.
+VERLIEHEN, ZURUECKGEGEBEN, ZURUECK_OHNE_ZEIT, BESTAND, UMGEBUCHT, ENTFERNT = 1, 2, 3, 4, 5, 6
+# Seconds since 1970 of the local wall-clock time, the way verliehen_am is
+# written; datetime(zeit, 'unixepoch') gives the same text back. Dates that
+# do not parse count as the beginning of time.
+_SQL_ZEIT = "IFNULL(CAST(strftime('%s', {}) AS INTEGER), 0)"
+_SQL_JETZT = "CAST(strftime('%s', 'now', 'localtime') AS INTEGER)"
+
+
+def _zelle_von(vorgang_id):
+    # bestand cell of a delivery, 0 if the branch has no such cell.
+    return f"""
+        IFNULL((SELECT bestand.id FROM verleihvorgang JOIN bestand
+                ON (bestand.filiale, bestand.flaschengroesse, bestand.flaschendruck) =
+                   (verleihvorgang.filiale, verleihvorgang.flaschengroesse, verleihvorgang.flaschendruck)
+                WHERE verleihvorgang.id = {vorgang_id}), 0)
+    """
+
+
+def _ereignisprotokoll(c):
+    # Loans, returns and stock changes are appended to ereignis and never
+    # changed, so return times and the previous stock survive. The state at
+    # any point in time is the newest snapshot at or before it plus the
+    # events since. A snapshot always holds the sum of every event up to its
+    # time: an event dated before an existing snapshot (an import of old
+    # loans) is added to it by trigger.
+    c.execute("""
+        CREATE TABLE ereignis (
+            seq INTEGER PRIMARY KEY,
+            zeit INTEGER NOT NULL,
+            art INTEGER NOT NULL,
+            zelle INTEGER NOT NULL,
+            menge INTEGER NOT NULL,
+            position_id INTEGER
+        )
+    """)
+    c.execute("CREATE TABLE snapshot (id INTEGER PRIMARY KEY, zeit INTEGER NOT NULL UNIQUE)")
+    c.execute("""
+        CREATE TABLE snapshot_zelle (
+            snapshot_id INTEGER NOT NULL REFERENCES snapshot (id),
+            zelle INTEGER NOT NULL,
+            verliehen INTEGER NOT NULL,
+            gesamt INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, zelle)
+        ) WITHOUT ROWID
+    """)
+
+    # Before this version neither return times nor stock changes were kept:
+    # bottles already back count as returned the moment they went out, and
+    # the current stock as owned since the beginning.
+    c.execute(f"""
+        INSERT INTO ereignis (zeit, art, zelle, menge, position_id)
+        SELECT zeit, art.art, zelle, art.menge, id
+        FROM (
+            SELECT p.id, p.status, {_SQL_ZEIT.format("v.verliehen_am")} AS zeit, IFNULL(b.id, 0) AS zelle
+            FROM verleih_position p
+            JOIN verleihvorgang v ON v.id = p.vorgang_id
+            LEFT JOIN bestand b ON (b.filiale, b.flaschengroesse, b.flaschendruck) =
+                                   (v.filiale, v.flaschengroesse, v.flaschendruck)
+        )
+        JOIN (SELECT {VERLIEHEN} AS art, 1 AS menge UNION ALL SELECT {ZURUECK_OHNE_ZEIT}, -1) AS art
+            ON art.art = {VERLIEHEN} OR status = 'zurückgegeben'
+        ORDER BY zeit, id, art.art
+    """)
+    c.execute(f"""
+        INSERT INTO ereignis (zeit, art, zelle, menge)
+        SELECT 0, {BESTAND}, id, gesamt FROM bestand WHERE gesamt <> 0 ORDER BY id
+    """)
+    c.execute("CREATE INDEX ereignis_zeit ON ereignis (zeit, zelle, art, menge)")
+    c.execute("CREATE INDEX ereignis_position ON ereignis (position_id) WHERE position_id IS NOT NULL")
+
+    # One snapshot at the end of every month of the history, so a question
+    # about any past day replays at most a month of events.
+    c.execute(f"""
+        INSERT INTO snapshot (zeit)
+        SELECT DISTINCT {_SQL_ZEIT.format("datetime(zeit, 'unixepoch', 'start of month', '+1 month')")} - 1
+        FROM ereignis
+        WHERE zeit > 0 AND {_SQL_ZEIT.format("datetime(zeit, 'unixepoch', 'start of month', '+1 month')")} <= {_SQL_JETZT}
+    """)
+    c.execute(f"""
+        INSERT INTO snapshot_zelle (snapshot_id, zelle, verliehen, gesamt)
+        SELECT snapshot_id, zelle, verliehen, gesamt FROM (
+            SELECT snapshot.id AS snapshot_id, zellen.zelle,
+                   SUM(IFNULL(monat.verliehen, 0)) OVER zeitlich AS verliehen,
+                   SUM(IFNULL(monat.gesamt, 0)) OVER zeitlich AS gesamt
+            FROM snapshot
+            CROSS JOIN (SELECT DISTINCT zelle FROM ereignis) AS zellen
+            LEFT JOIN (
+                SELECT (SELECT MIN(zeit) FROM snapshot WHERE zeit >= ereignis.zeit) AS bis, zelle,
+                       SUM(CASE WHEN art = {BESTAND} THEN 0 ELSE menge END) AS verliehen,
+                       SUM(CASE WHEN art = {BESTAND} THEN menge ELSE 0 END) AS gesamt
+                FROM ereignis GROUP BY bis, zelle
+            ) AS monat ON monat.bis = snapshot.zeit AND monat.zelle = zellen.zelle
+            WINDOW zeitlich AS (PARTITION BY zellen.zelle ORDER BY snapshot.zeit)
+        )
+        WHERE verliehen <> 0 OR gesamt <> 0
+    """)
+
+    c.execute("""
+        CREATE TRIGGER ereignis_nur_anhaengen_update BEFORE UPDATE ON ereignis BEGIN
+            SELECT RAISE(ABORT, 'ereignis kann nur ergänzt werden');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER ereignis_nur_anhaengen_delete BEFORE DELETE ON ereignis BEGIN
+            SELECT RAISE(ABORT, 'ereignis kann nur ergänzt werden');
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER ereignis_snapshot AFTER INSERT ON ereignis
+        WHEN NEW.zeit <= (SELECT MAX(zeit) FROM snapshot) BEGIN
+            INSERT INTO snapshot_zelle (snapshot_id, zelle, verliehen, gesamt)
+            SELECT id, NEW.zelle, CASE WHEN NEW.art = {BESTAND} THEN 0 ELSE NEW.menge END,
+                   CASE WHEN NEW.art = {BESTAND} THEN NEW.menge ELSE 0 END
+            FROM snapshot WHERE zeit >= NEW.zeit
+            ON CONFLICT (snapshot_id, zelle) DO UPDATE SET
+                verliehen = verliehen + excluded.verliehen, gesamt = gesamt + excluded.gesamt;
+        END
+    """)
+    # Loans are dated by the delivery, everything else by the clock.
+    c.execute(f"""
+        CREATE TRIGGER ereignis_position_insert AFTER INSERT ON verleih_position BEGIN
+            INSERT INTO ereignis (zeit, art, zelle, menge, position_id)
+            SELECT {_SQL_ZEIT.format("verliehen_am")}, {VERLIEHEN}, {_zelle_von("NEW.vorgang_id")}, 1, NEW.id
+            FROM verleihvorgang WHERE id = NEW.vorgang_id;
+            INSERT INTO ereignis (zeit, art, zelle, menge, position_id)
+            SELECT {_SQL_ZEIT.format("verliehen_am")}, {ZURUECK_OHNE_ZEIT}, {_zelle_von("NEW.vorgang_id")}, -1, NEW.id
+            FROM verleihvorgang WHERE id = NEW.vorgang_id AND NEW.status = 'zurückgegeben';
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER ereignis_position_update AFTER UPDATE OF vorgang_id, status ON verleih_position
+        WHEN (OLD.status = 'verliehen' OR NEW.status = 'verliehen')
+         AND (OLD.status IS NOT NEW.status OR OLD.vorgang_id <> NEW.vorgang_id) BEGIN
+            INSERT INTO ereignis (zeit, art, zelle, menge, position_id)
+            SELECT {_SQL_JETZT}, CASE WHEN OLD.vorgang_id = NEW.vorgang_id THEN {ZURUECKGEGEBEN} ELSE {UMGEBUCHT} END,
+                   {_zelle_von("OLD.vorgang_id")}, -1, OLD.id
+            WHERE OLD.status = 'verliehen';
+            INSERT INTO ereignis (zeit, art, zelle, menge, position_id)
+            SELECT {_SQL_JETZT}, CASE WHEN OLD.vorgang_id = NEW.vorgang_id THEN {VERLIEHEN} ELSE {UMGEBUCHT} END,
+                   {_zelle_von("NEW.vorgang_id")}, 1, NEW.id
+            WHERE NEW.status = 'verliehen';
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER ereignis_position_delete AFTER DELETE ON verleih_position
+        WHEN OLD.status = 'verliehen' BEGIN
+            INSERT INTO ereignis (zeit, art, zelle, menge, position_id)
+            VALUES ({_SQL_JETZT}, {ENTFERNT}, {_zelle_von("OLD.vorgang_id")}, -1, OLD.id);
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER ereignis_vorgang_update AFTER UPDATE OF filiale, flaschengroesse, flaschendruck ON verleihvorgang
+        WHEN OLD.offen > 0 AND (OLD.filiale, OLD.flaschengroesse, OLD.flaschendruck)
+                               IS NOT (NEW.filiale, NEW.flaschengroesse, NEW.flaschendruck) BEGIN
+            INSERT INTO ereignis (zeit, art, zelle, menge)
+            SELECT {_SQL_JETZT}, {UMGEBUCHT}, IFNULL((
+                SELECT id FROM bestand WHERE (filiale, flaschengroesse, flaschendruck) = (OLD.filiale, OLD.flaschengroesse, OLD.flaschendruck)
+            ), 0), -OLD.offen;
+            INSERT INTO ereignis (zeit, art, zelle, menge)
+            SELECT {_SQL_JETZT}, {UMGEBUCHT}, {_zelle_von("NEW.id")}, NEW.offen;
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER ereignis_bestand_insert AFTER INSERT ON bestand WHEN NEW.gesamt <> 0 BEGIN
+            INSERT INTO ereignis (zeit, art, zelle, menge) VALUES ({_SQL_JETZT}, {BESTAND}, NEW.id, NEW.gesamt);
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER ereignis_bestand_update AFTER UPDATE OF gesamt ON bestand WHEN NEW.gesamt <> OLD.gesamt BEGIN
+            INSERT INTO ereignis (zeit, art, zelle, menge) VALUES ({_SQL_JETZT}, {BESTAND}, NEW.id, NEW.gesamt - OLD.gesamt);
+        END
+    """)
+
+
+# Kinds in flasche_ereignis.art. Loans and returns of a bottle are not
+# repeated there; they are the ereignis rows of its positions.
+ANGELEGT, GEAENDERT, GEPRUEFT, AUSGEMUSTERT = 1, 2, 3, 4
+_SQL_FLASCHE_ANGABE = "printf('%s, %s, %s, %s', {0}.flaschengroesse, {0}.flaschendruck, {0}.flasche_von, {0}.filiale)"
+# Search text of a delivery: the numbers of all of its bottles.
+_SQL_FTS_FLASCHENNUMMERN = """
+    IFNULL((SELECT GROUP_CONCAT(flasche.flaschennummer, ' ') FROM verleih_position
+            JOIN flasche ON flasche.id = verleih_position.flasche_id
+            WHERE verleih_position.vorgang_id = {}), '')
+"""
+
+
+def _flaschenstamm(c):
+    # The physical bottles get a master record; positions point to it by
+    # id instead of repeating the number. A bottle keeps the size, pressure,
+    # supplier and home branch it was last lent with until someone edits it.
+    # Its due date for the pressure test is unknown until it is entered.
+    c.execute("""
+        CREATE TABLE flasche (
+            id INTEGER PRIMARY KEY,
+            flaschennummer TEXT NOT NULL UNIQUE,
+            flaschengroesse TEXT,
+            flaschendruck TEXT,
+            flasche_von TEXT,
+            filiale TEXT,
+            pruefung_faellig TEXT,
+            ausgemustert_am TEXT
+        )
+    """)
+    c.execute("""
+        INSERT INTO flasche (flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale)
+        SELECT flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale FROM (
+            SELECT IFNULL(p.flaschennummer, '') AS flaschennummer, v.flaschengroesse, v.flaschendruck, v.flasche_von,
+                   v.filiale, MAX(p.id)
+            FROM verleih_position p JOIN verleihvorgang v ON v.id = p.vorgang_id
+            GROUP BY IFNULL(p.flaschennummer, '')
+        )
+    """)
+
+    # Everything that names verleih_position.flaschennummer goes before the
+    # column does and comes back on flasche_id.
+    c.execute("DROP VIEW verleih")
+    for trigger in ("verleih_position_fts_insert", "verleih_position_fts_update", "verleih_position_fts_delete"):
+        c.execute(f"DROP TRIGGER {trigger}")
+    c.execute("DROP INDEX verleih_position_flaschennummer")
+    c.execute("DROP INDEX verleih_position_aktiv")
+    # Fired on every UPDATE and would touch each header and the change log
+    # twice per position; it only has to watch vorgang_id and status.
+    c.execute("DROP TRIGGER verleih_position_update")
+    c.execute("ALTER TABLE verleih_position ADD COLUMN flasche_id INTEGER REFERENCES flasche (id)")
+    c.execute("""
+        UPDATE verleih_position SET flasche_id = (
+            SELECT id FROM flasche WHERE flasche.flaschennummer = IFNULL(verleih_position.flaschennummer, '')
+        )
+    """)
+    c.execute("ALTER TABLE verleih_position DROP COLUMN flaschennummer")
+    c.execute("""
+        CREATE TRIGGER verleih_position_update AFTER UPDATE OF vorgang_id, status ON verleih_position BEGIN
+            UPDATE verleihvorgang SET offen = offen - (OLD.status = 'verliehen') WHERE id = OLD.vorgang_id;
+            UPDATE verleihvorgang SET offen = offen + (NEW.status = 'verliehen') WHERE id = NEW.vorgang_id;
+        END
+    """)
+    c.execute("CREATE INDEX verleih_position_flasche ON verleih_position (flasche_id, status)")
+    c.execute("CREATE UNIQUE INDEX verleih_position_aktiv ON verleih_position (flasche_id) WHERE status = 'verliehen'")
+    # Due dates of the bottles in service, for the pressure-test list.
+    c.execute("CREATE INDEX flasche_pruefung ON flasche (pruefung_faellig) WHERE ausgemustert_am IS NULL")
+    c.execute(
+        "CREATE INDEX flasche_zelle ON flasche (filiale, flaschengroesse, flaschendruck) WHERE ausgemustert_am IS NULL"
+    )
+
+    c.execute(f"""
+        CREATE TRIGGER verleih_position_fts_insert AFTER INSERT ON verleih_position BEGIN
+            UPDATE verleihvorgang_fts SET flaschennummern = flaschennummern || ' ' || IFNULL(
+                (SELECT flaschennummer FROM flasche WHERE id = NEW.flasche_id), ''
+            )
+            WHERE rowid = NEW.vorgang_id;
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER verleih_position_fts_update AFTER UPDATE OF vorgang_id, flasche_id ON verleih_position BEGIN
+            UPDATE verleihvorgang_fts SET flaschennummern = {_SQL_FTS_FLASCHENNUMMERN.format("verleihvorgang_fts.rowid")}
+            WHERE rowid IN (OLD.vorgang_id, NEW.vorgang_id);
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER verleih_position_fts_delete AFTER DELETE ON verleih_position BEGIN
+            UPDATE verleihvorgang_fts SET flaschennummern = {_SQL_FTS_FLASCHENNUMMERN.format("OLD.vorgang_id")}
+            WHERE rowid = OLD.vorgang_id;
+        END
+    """)
+    # A corrected number changes the search text and the list rows of every
+    # delivery the bottle was part of.
+    c.execute(f"""
+        CREATE TRIGGER flasche_nummer_update AFTER UPDATE OF flaschennummer ON flasche BEGIN
+            UPDATE verleihvorgang_fts SET flaschennummern = {_SQL_FTS_FLASCHENNUMMERN.format("verleihvorgang_fts.rowid")}
+            WHERE rowid IN (SELECT vorgang_id FROM verleih_position WHERE flasche_id = NEW.id);
+            INSERT INTO aenderung (tabelle, zeile)
+            SELECT DISTINCT 'verleihvorgang', vorgang_id FROM verleih_position WHERE flasche_id = NEW.id;
+        END
+    """)
+
+    c.execute("""
+        CREATE VIEW verleih AS
+        SELECT p.id, k.name, k.telefon, k.adresse, k.ansprechpartner, v.referenznummer, f.flaschennummer,
+               v.flaschengroesse, v.flaschendruck, v.flasche_von, v.filiale, v.anzahl, v.verliehen_am, p.status
+        FROM verleih_position p
+        JOIN verleihvorgang v ON v.id = p.vorgang_id
+        JOIN kunde k ON k.id = v.kunde_id
+        JOIN flasche f ON f.id = p.flasche_id
+    """)
+    c.execute(f"""
+        CREATE TRIGGER verleih_insert INSTEAD OF INSERT ON verleih BEGIN
+            {_VERLEIH_INSERT_VORGANG}
+            INSERT OR IGNORE INTO flasche (flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale)
+            VALUES (IFNULL(NEW.flaschennummer, ''), NEW.flaschengroesse, NEW.flaschendruck, NEW.flasche_von, NEW.filiale);
+            INSERT INTO verleih_position (vorgang_id, flasche_id, status)
+            VALUES (
+                ({_PASSENDER_VORGANG}),
+                (SELECT id FROM flasche WHERE flaschennummer = IFNULL(NEW.flaschennummer, '')), NEW.status
+            );
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_update INSTEAD OF UPDATE OF status ON verleih BEGIN
+            UPDATE verleih_position SET status = NEW.status WHERE id = OLD.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleih_delete INSTEAD OF DELETE ON verleih BEGIN
+            DELETE FROM verleih_position WHERE id = OLD.id;
+        END
+    """)
+
+    # Life of a bottle apart from its loans, append-only like ereignis. The
+    # bottles that already exist count as registered with their first loan.
+    c.execute("""
+        CREATE TABLE flasche_ereignis (
+            seq INTEGER PRIMARY KEY,
+            zeit INTEGER NOT NULL,
+            flasche_id INTEGER NOT NULL REFERENCES flasche (id),
+            art INTEGER NOT NULL,
+            angabe TEXT
+        )
+    """)
+    c.execute(f"""
+        INSERT INTO flasche_ereignis (zeit, flasche_id, art, angabe)
+        SELECT {_SQL_ZEIT.format("MIN(v.verliehen_am)")}, f.id, {ANGELEGT}, {_SQL_FLASCHE_ANGABE.format("f")}
+        FROM flasche f
+        JOIN verleih_position p ON p.flasche_id = f.id
+        JOIN verleihvorgang v ON v.id = p.vorgang_id
+        GROUP BY f.id
+        ORDER BY 1, f.id
+    """)
+    c.execute("CREATE INDEX flasche_ereignis_flasche ON flasche_ereignis (flasche_id, zeit)")
+    c.execute("""
+        CREATE TRIGGER flasche_ereignis_nur_anhaengen_update BEFORE UPDATE ON flasche_ereignis BEGIN
+            SELECT RAISE(ABORT, 'flasche_ereignis kann nur ergänzt werden');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER flasche_ereignis_nur_anhaengen_delete BEFORE DELETE ON flasche_ereignis BEGIN
+            SELECT RAISE(ABORT, 'flasche_ereignis kann nur ergänzt werden');
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER flasche_angelegt AFTER INSERT ON flasche BEGIN
+            INSERT INTO flasche_ereignis (zeit, flasche_id, art, angabe)
+            VALUES ({_SQL_JETZT}, NEW.id, {ANGELEGT}, {_SQL_FLASCHE_ANGABE.format("NEW")});
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER flasche_geaendert AFTER UPDATE OF flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale
+        ON flasche
+        WHEN (OLD.flaschennummer, OLD.flaschengroesse, OLD.flaschendruck, OLD.flasche_von, OLD.filiale)
+             IS NOT (NEW.flaschennummer, NEW.flaschengroesse, NEW.flaschendruck, NEW.flasche_von, NEW.filiale) BEGIN
+            INSERT INTO flasche_ereignis (zeit, flasche_id, art, angabe)
+            VALUES ({_SQL_JETZT}, NEW.id, {GEAENDERT}, NEW.flaschennummer || ': ' || {_SQL_FLASCHE_ANGABE.format("NEW")});
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER flasche_geprueft AFTER UPDATE OF pruefung_faellig ON flasche BEGIN
+            INSERT INTO flasche_ereignis (zeit, flasche_id, art, angabe)
+            VALUES ({_SQL_JETZT}, NEW.id, {GEPRUEFT}, NEW.pruefung_faellig);
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER flasche_ausgemustert AFTER UPDATE OF ausgemustert_am ON flasche
+        WHEN OLD.ausgemustert_am IS NULL AND NEW.ausgemustert_am IS NOT NULL BEGIN
+            INSERT INTO flasche_ereignis (zeit, flasche_id, art) VALUES ({_SQL_JETZT}, NEW.id, {AUSGEMUSTERT});
+        END
+    """)
+
+
+# Milliseconds since 1970 in UTC; the hybrid logical clock in sync_uhr keeps
+# them in its upper bits and counts in the lower 16.
+_SQL_UHR_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+
+def _abgleich(c):
+    # Replication between the branch databases and the Zentrale. A delivery
+    # gets an id that is unique across all databases; its clock part orders
+    # two loans of the same bottle. Cells and bottles carry the version of
+    # their last change. sync_log holds one entry per changed row, the
+    # latest change moving it to the end; herkunft is the node a change was
+    # received from, NULL for changes made here.
+    c.execute("ALTER TABLE verleihvorgang ADD COLUMN uid TEXT")
+    c.execute(f"UPDATE verleihvorgang SET uid = printf('%016x%08x', {_SQL_ZEIT.format('verliehen_am')} * 1000 << 16, id)")
+    c.execute("CREATE UNIQUE INDEX verleihvorgang_uid ON verleihvorgang (uid)")
+    c.execute("ALTER TABLE bestand ADD COLUMN version TEXT")
+    c.execute("ALTER TABLE flasche ADD COLUMN version TEXT")
+    c.execute("CREATE TABLE sync_uhr (id INTEGER PRIMARY KEY CHECK (id = 1), uhr INTEGER NOT NULL)")
+    c.execute("INSERT INTO sync_uhr VALUES (1, 0)")
+    c.execute("""
+        CREATE TABLE sync_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            art TEXT NOT NULL,
+            schluessel TEXT NOT NULL,
+            herkunft TEXT,
+            UNIQUE (art, schluessel)
+        )
+    """)
+    # How far this database has sent its own changes to a peer and received
+    # the peer's.
+    c.execute("""
+        CREATE TABLE sync_stand (
+            gegenstelle TEXT PRIMARY KEY,
+            gesendet INTEGER NOT NULL DEFAULT 0,
+            empfangen INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Deliveries written without a uid, through the verleih view or by
+    # verleih_anlegen(), get one from the clock and are logged.
+    c.execute(f"""
+        CREATE TRIGGER verleihvorgang_uid AFTER INSERT ON verleihvorgang WHEN NEW.uid IS NULL BEGIN
+            UPDATE sync_uhr SET uhr = MAX(uhr + 1, {_SQL_UHR_MS} << 16);
+            UPDATE verleihvorgang SET uid = printf('%016x', (SELECT uhr FROM sync_uhr)) || lower(hex(randomblob(4)))
+            WHERE id = NEW.id;
+            INSERT OR REPLACE INTO sync_log (art, schluessel) SELECT 'vorgang', uid FROM verleihvorgang WHERE id = NEW.id;
+        END
+    """)
+
+
+# Sortable list columns, by index name. Each gets an index for either
+# direction of the verliehen_am and id that break ties, so every
+# combination of directions is a walk down an index. The status expression
+# is the one verleih_db lists, so the planner matches it.
+_SORTIER_SPALTEN = {
+    "filiale": "filiale",
+    "groesse": "flaschengroesse",
+    "anzahl": "anzahl",
+    "erste_flasche": "erste_flasche",
+    "status": "CASE WHEN offen > 0 THEN 'verliehen' ELSE 'zurückgegeben' END",
+}
+_SQL_ERSTE_FLASCHE = """
+    IFNULL((
+        SELECT flasche.flaschennummer FROM {position} AS p JOIN main.flasche ON flasche.id = p.flasche_id
+        WHERE p.vorgang_id = verleihvorgang.id ORDER BY p.id LIMIT 1
+    ), '')
+"""
+
+
+def _sortier_indizes(schema=""):
+    for name, spalte in _SORTIER_SPALTEN.items():
+        yield f"CREATE INDEX {schema}verleihvorgang_{name}_auf ON verleihvorgang ({spalte}, verliehen_am, id)"
+        yield (
+            f"CREATE INDEX {schema}verleihvorgang_{name}_ab ON verleihvorgang ({spalte}, verliehen_am DESC, id DESC)"
+        )
+    # By name the customers are the outer loop; within one customer the
+    # deliveries come newest first and are merged per name.
+    yield f"CREATE INDEX {schema}verleihvorgang_kunde ON verleihvorgang (kunde_id, verliehen_am DESC)"
+
+
+def _sortierung(c):
+    # Column sorting in the lists. A delivery sorts by bottle number under
+    # the number of its first bottle, which is kept in erste_flasche.
+    c.execute("ALTER TABLE verleihvorgang ADD COLUMN erste_flasche TEXT NOT NULL DEFAULT ''")
+    c.execute(f"UPDATE verleihvorgang SET erste_flasche = {_SQL_ERSTE_FLASCHE.format(position='verleih_position')}")
+    c.execute("DROP INDEX verleihvorgang_kunde")
+    for sql in _sortier_indizes():
+        c.execute(sql)
+    c.execute("""
+        CREATE TRIGGER verleihvorgang_erste_flasche AFTER INSERT ON verleih_position BEGIN
+            UPDATE verleihvorgang SET erste_flasche = IFNULL(
+                (SELECT flaschennummer FROM flasche WHERE id = NEW.flasche_id), ''
+            )
+            WHERE id = NEW.vorgang_id AND erste_flasche = '';
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER verleihvorgang_erste_flasche_nummer AFTER UPDATE OF flaschennummer ON flasche BEGIN
+            UPDATE verleihvorgang SET erste_flasche = NEW.flaschennummer WHERE erste_flasche = OLD.flaschennummer;
+        END
+    """)
+
+
+MIGRATIONEN = [
+    _basis_tabellen,
+    _indizes,
+    _aenderungsprotokoll,
+    _volltextsuche,
+    _normalisiertes_modell,
+    _bestand_aus_verleih,
+    _ereignisprotokoll,
+    _flaschenstamm,
+    _abgleich,
+    _sortierung,
+]
+
+SCHEMA_VERSION = len(MIGRATIONEN)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, ziel=SCHEMA_VERSION):
+    """Upgrade ``conn`` to schema version ``ziel`` and return the new version."""
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Datenbank hat Schema-Version {version}, dieses Programm kennt nur bis {SCHEMA_VERSION}."
+        )
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        while version < ziel:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                MIGRATIONEN[version](c)
+                c.execute(f"PRAGMA user_version = {version + 1}")
+            except sqlite3.Error:
+                c.execute("ROLLBACK")
+                raise
+            c.execute("COMMIT")
+            version += 1
+    finally:
+        conn.isolation_level = isolation_level
+    return version
+
+
+def _archiv_tabellen(conn):
+    conn.execute("""
+        CREATE TABLE archiv.verleihvorgang (
+            id INTEGER PRIMARY KEY,
+            kunde_id INTEGER NOT NULL,
+            referenznummer TEXT,
+            flaschengroesse TEXT,
+            flaschendruck TEXT,
+            flasche_von TEXT,
+            filiale TEXT,
+            anzahl INTEGER,
+            verliehen_am TEXT,
+            offen INTEGER NOT NULL DEFAULT 0,
+            uid TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE archiv.verleih_position (
+            id INTEGER PRIMARY KEY,
+            vorgang_id INTEGER NOT NULL,
+            status TEXT,
+            flasche_id INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX archiv.verleihvorgang_verliehen_am ON verleihvorgang (verliehen_am)")
+    conn.execute("CREATE UNIQUE INDEX archiv.verleihvorgang_uid ON verleihvorgang (uid)")
+    conn.execute("CREATE INDEX archiv.verleih_position_vorgang ON verleih_position (vorgang_id)")
+    conn.execute("CREATE INDEX archiv.verleih_position_flasche ON verleih_position (flasche_id)")
+    conn.execute("""
+        CREATE VIRTUAL TABLE archiv.verleihvorgang_fts USING fts5(
+            name, telefon, adresse, ansprechpartner, referenznummer, flaschennummern,
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    conn.execute(
+        "INSERT INTO archiv.verleihvorgang_fts (verleihvorgang_fts, rank) "
+        "VALUES ('rank', 'bm25(2.0, 1.0, 1.0, 1.0, 2.0, 3.0)')"
+    )
+
+
+def _archiv_sortierung(conn):
+    # The same sortable columns as the hot table (see _sortierung).
+    conn.execute("ALTER TABLE archiv.verleihvorgang ADD COLUMN erste_flasche TEXT NOT NULL DEFAULT ''")
+    conn.execute(
+        "UPDATE archiv.verleihvorgang "
+        f"SET erste_flasche = {_SQL_ERSTE_FLASCHE.format(position='archiv.verleih_position')}"
+    )
+    for sql in _sortier_indizes("archiv."):
+        conn.execute(sql)
+
+
+ARCHIV_MIGRATIONEN = [
+    _archiv_tabellen,
+    _archiv_sortierung,
+]
+ARCHIV_VERSION = len(ARCHIV_MIGRATIONEN)
+
+
+def archiv_einrichten(conn):
+    """Create or upgrade the tables of the archive attached to ``conn`` as ``archiv``.
+
+    The archive holds closed deliveries that were moved out of the hot
+    tables, with the same ids and columns, and a search index of its own.
+    Customers, bottles and the event log stay in the main database. Its
+    version is the ``user_version`` of the archive file.
+    """
+    version = conn.execute("PRAGMA archiv.user_version").fetchone()[0]
+    for schritt in ARCHIV_MIGRATIONEN[version:]:
+        with conn:
+            conn.execute("BEGIN")
+            schritt(conn)
+            version += 1
+            conn.execute(f"PRAGMA archiv.user_version = {version}")
@@ -0,0 +1,491 @@
+"""Local HTTP/JSON API in front of the Flaschen-Verleih database.
+
+    python verleih_server.py [--db flaschen_verleih.db] [--host 127.0.0.1] [--port 8765] [--leser 4]
+                             [--archiv-tage 365] [--sicherung-stunden 24]
+
+The server is the only process that opens the database file; the branches
+connect to it with ``newtest_fix.py --server http://host:8765`` instead of
+sharing the file. Writes are serialized and group-committed by
+``VerleihService``. Listings are streamed as NDJSON (one row per line, chunked),
+so long results never sit in memory on either side.
+
+    GET  /bestand[?ids=1,2]          stock cells, NDJSON; ?sortierung=-bestand,filiale sorts them
+    PUT  /bestand                    {filiale, flaschengroesse, flaschendruck, menge}
+    POST /bestand/aenderung          {filiale, flaschengroesse, flaschendruck, delta}
+    POST /verleih                    {daten, flaschengroesse, flaschendruck, flasche_von, filiale, flaschennummern}
+                                     -> {vorgang, verliehen_am}
+    POST /rueckgabe                  {flaschennummern} -> {anzahl}
+    POST /vorgaenge                  {nach, vor, limit, suche, status, ids, archiv, sortierung}, NDJSON
+    GET  /aenderungen?seit=N         {cursor, vorgaenge, bestand}; 410 if the log no longer reaches back
+    GET  /aenderungen/stand          [aeltester, neuester]
+    POST /vorgaenge/details          {ids}: [id, ...details] of each delivery found
+    POST /flaschen/register          {vorgaenge}: {vorgaenge, flaschen} of the open ones, or of all if null
+    GET  /flasche?flaschennummer=F1  {stamm, lebenslauf}; 404 if the bottle is not registered
+    PUT  /flasche                    {flaschennummer, flaschengroesse, flaschendruck, flasche_von, filiale}
+    POST /flasche/pruefung           {flaschennummer, pruefung_faellig} -> {geaendert}
+    POST /flasche/ausmustern         {flaschennummer} -> {geaendert}
+    POST /bestand/register           -> {zellen}: gesamt of every cell from the bottle register
+    POST /bericht                    {name, parameter}, NDJSON; see verleih_bericht.py
+    GET  /sync?knoten=K&seit=N       {cursor, zeilen, mehr}: rows changed after N, except those from K
+    POST /sync                       {knoten, zeilen} -> {geaendert}: merge the changes of branch K
+    GET  /sicherungen                the backups, newest first; see verleih_sicherung.py
+    POST /sicherung                  back up now -> the new backup
+    POST /sicherung/wiederherstellen {name} -> the backup of the current state taken before restoring
+    GET  /status                     group commit, archive and backup counters
+
+Errors are answered as {"fehler": message}. A loan of bottles that are
+already out is 409 and also lists them under "flaschennummern"; one of
+retired bottles is 409 with them under "ausgemustert".
+
+With --archiv-tage, deliveries closed for longer are moved to the archive
+file next to the database in small batches in the background; "archiv"
+in /vorgaenge includes them in the listing. With --sicherung-stunden the
+database and its archive are backed up at that interval while the server
+keeps answering.
+
+Request bodies may be sent gzip-compressed; JSON answers are compressed
+for clients that accept gzip, which the branch sync relies on.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import signal
+import sys
+import urllib.parse
+import zlib
+from http import HTTPStatus
+
+from verleih_db import (
+    BERICHT_PARAMETER, BERICHTE, BESTAND_SORTIERBAR, DB_PATH, SYNC_ARTEN, FlaschenAusgemustert,
+    FlaschenBereitsVerliehen, archiv_anlegen, init_db, sortierung_pruefen, vorgang_richtungen,
+)
+from verleih_service import LESER, UngueltigeAnfrage, VerleihService
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BODY = 1024 * 1024
+# Limit for a gzip body once unpacked, so a small upload cannot fill memory.
+MAX_ENTPACKT = 16 * MAX_BODY
+# Smaller answers are sent as they are; gzip would barely save a packet.
+GZIP_AB = 1024
+
+
+class HttpFehler(Exception):
+    def __init__(self, status, fehler, **extra):
+        super().__init__(fehler)
+        self.status = status
+        self.antwort = {"fehler": fehler, **extra}
+
+
+def _kopf(status, felder):
+    zeilen = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    zeilen.extend(f"{name}: {wert}" for name, wert in felder.items())
+    return ("\r\n".join(zeilen) + "\r\n\r\n").encode("latin-1")
+
+
+def _entpacken(body):
+    entpacker = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    try:
+        daten = entpacker.decompress(body, MAX_ENTPACKT)
+    except zlib.error:
+        raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültige gzip-Daten")
+    if entpacker.unconsumed_tail:
+        raise HttpFehler(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Anfrage zu groß")
+    return daten
+
+
+async def _anfrage_lesen(reader):
+    # Returns (methode, pfad, query, body, keep_alive, gzip), or None at the
+    # end of the connection; gzip tells whether the client accepts it.
+    zeile = await reader.readline()
+    if not zeile.strip():
+        return None
+    try:
+        methode, ziel, version = zeile.decode("latin-1").split()
+    except ValueError:
+        raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültige Anfragezeile")
+    felder = {}
+    while True:
+        zeile = await reader.readline()
+        if zeile in (b"\r\n", b"\n", b""):
+            break
+        name, _, wert = zeile.decode("latin-1").partition(":")
+        felder[name.strip().lower()] = wert.strip()
+    try:
+        laenge = int(felder.get("content-length", 0))
+    except ValueError:
+        laenge = -1
+    if laenge < 0:
+        raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültige Content-Length")
+    if laenge > MAX_BODY:
+        raise HttpFehler(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Anfrage zu groß")
+    body = await reader.readexactly(laenge) if laenge else b""
+    if felder.get("content-encoding", "").lower() == "gzip":
+        body = _entpacken(body)
+    verbindung = felder.get("connection", "").lower()
+    keep_alive = verbindung != "close" if version == "HTTP/1.1" else verbindung == "keep-alive"
+    teile = urllib.parse.urlsplit(ziel)
+    mit_gzip = "gzip" in felder.get("accept-encoding", "").lower()
+    return methode, teile.path, urllib.parse.parse_qs(teile.query), body, keep_alive, mit_gzip
+
+
+def _json_body(body):
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiges JSON")
+
+
+def _feld(daten, name, typ=None):
+    try:
+        wert = daten[name]
+    except (KeyError, TypeError):
+        raise HttpFehler(HTTPStatus.BAD_REQUEST, f"Feld fehlt: {name}")
+    if typ is not None and not isinstance(wert, typ):
+        raise HttpFehler(HTTPStatus.BAD_REQUEST, f"Ungültiger Wert für {name}")
+    return wert
+
+
+def _query_int(query, name):
+    try:
+        return int(query[name][0])
+    except (KeyError, ValueError):
+        raise HttpFehler(HTTPStatus.BAD_REQUEST, f"Parameter fehlt oder ungültig: {name}")
+
+
+class VerleihServer:
+    def __init__(self, service):
+        self.service = service
+        self.routen = {
+            ("GET", "/bestand"): self.bestand,
+            ("PUT", "/bestand"): self.bestand_setzen,
+            ("POST", "/bestand/aenderung"): self.bestand_aendern,
+            ("POST", "/verleih"): self.verleih,
+            ("POST", "/rueckgabe"): self.rueckgabe,
+            ("POST", "/vorgaenge"): self.vorgaenge,
+            ("GET", "/aenderungen"): self.aenderungen,
+            ("GET", "/aenderungen/stand"): self.aenderung_stand,
+            ("POST", "/vorgaenge/details"): self.vorgang_details,
+            ("POST", "/flaschen/register"): self.flaschen_register,
+            ("GET", "/flasche"): self.flasche,
+            ("PUT", "/flasche"): self.flasche_speichern,
+            ("POST", "/flasche/pruefung"): self.flasche_pruefen,
+            ("POST", "/flasche/ausmustern"): self.flasche_ausmustern,
+            ("POST", "/bestand/register"): self.bestand_aus_register,
+            ("POST", "/bericht"): self.bericht,
+            ("GET", "/sync"): self.sync_holen,
+            ("POST", "/sync"): self.sync_senden,
+            ("GET", "/sicherungen"): self.sicherungen,
+            ("POST", "/sicherung"): self.sichern,
+            ("POST", "/sicherung/wiederherstellen"): self.wiederherstellen,
+            ("GET", "/status"): self.status,
+        }
+
+    async def verbindung(self, reader, writer):
+        try:
+            while True:
+                try:
+                    anfrage = await _anfrage_lesen(reader)
+                except HttpFehler as e:
+                    await self._json(writer, e.status, e.antwort)
+                    break
+                if anfrage is None:
+                    break
+                methode, pfad, query, body, keep_alive, mit_gzip = anfrage
+                await self._beantworten(writer, methode, pfad, query, body, mit_gzip)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def _beantworten(self, writer, methode, pfad, query, body, mit_gzip=False):
+        handler = self.routen.get((methode, pfad))
+        try:
+            if handler is None:
+                if any(p == pfad for _, p in self.routen):
+                    raise HttpFehler(HTTPStatus.METHOD_NOT_ALLOWED, f"{methode} wird für {pfad} nicht unterstützt")
+                raise HttpFehler(HTTPStatus.NOT_FOUND, f"Unbekannter Pfad: {pfad}")
+            ergebnis = await handler(query, body)
+            if hasattr(ergebnis, "__aiter__"):
+                # The first page is read before anything is sent, so errors
+                # in the query can still be answered with a status code.
+                erste = await anext(ergebnis, [])
+        except HttpFehler as e:
+            await self._json(writer, e.status, e.antwort)
+        except FlaschenBereitsVerliehen as e:
+            await self._json(
+                writer, HTTPStatus.CONFLICT, {"fehler": str(e), "flaschennummern": sorted(e.flaschennummern)}
+            )
+        except FlaschenAusgemustert as e:
+            await self._json(
+                writer, HTTPStatus.CONFLICT, {"fehler": str(e), "ausgemustert": sorted(e.flaschennummern)}
+            )
+        except UngueltigeAnfrage as e:
+            await self._json(writer, HTTPStatus.BAD_REQUEST, {"fehler": str(e)})
+        except Exception as e:
+            await self._json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"fehler": str(e)})
+        else:
+            if hasattr(ergebnis, "__aiter__"):
+                await self._ndjson(writer, erste, ergebnis)
+            else:
+                await self._json(writer, HTTPStatus.OK, ergebnis, mit_gzip)
+
+    async def _json(self, writer, status, wert, mit_gzip=False):
+        body = json.dumps(wert, ensure_ascii=False).encode()
+        felder = {"Content-Type": "application/json; charset=utf-8"}
+        if mit_gzip and len(body) > GZIP_AB:
+            body = gzip.compress(body)
+            felder["Content-Encoding"] = "gzip"
+        felder["Content-Length"] = len(body)
+        writer.write(_kopf(status, felder) + body)
+        await writer.drain()
+
+    async def _ndjson(self, writer, erste, seiten):
+        writer.write(_kopf(HTTPStatus.OK, {
+            "Content-Type": "application/x-ndjson; charset=utf-8", "Transfer-Encoding": "chunked",
+        }))
+        rows = erste
+        try:
+            while rows:
+                chunk = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode()
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                # Waits for slow clients instead of buffering the whole result.
+                await writer.drain()
+                try:
+                    rows = await anext(seiten, None)
+                except Exception as e:
+                    # The status line is already out; dropping the connection
+                    # leaves the client with a truncated body, which it reports.
+                    raise ConnectionAbortedError(str(e)) from e
+        finally:
+            # Releases a report's connection when the client goes away mid-stream.
+            await seiten.aclose()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _zeilen(self, methode, *args):
+        # A one-page stream, so every listing has the same NDJSON format.
+        yield await self.service.lesen(methode, *args)
+
+    async def bestand(self, query, body):
+        if "ids" in query:
+            try:
+                ids = [int(i) for i in query["ids"][0].split(",") if i]
+            except ValueError:
+                raise HttpFehler(HTTPStatus.BAD_REQUEST, "Parameter ungültig: ids")
+            return self._zeilen("bestand_zeilen", ids)
+        # sortierung=-bestand,filiale: the columns in turn, "-" for descending.
+        sortierung = [
+            (spalte.removeprefix("-"), spalte.startswith("-"))
+            for spalte in query.get("sortierung", [""])[0].split(",") if spalte
+        ]
+        if any(spalte not in BESTAND_SORTIERBAR for spalte, _ in sortierung):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Parameter ungültig: sortierung")
+        return self._zeilen("bestand_liste", sortierung)
+
+    def _zelle(self, daten):
+        return (
+            _feld(daten, "filiale", str), _feld(daten, "flaschengroesse", str), _feld(daten, "flaschendruck", str),
+        )
+
+    async def bestand_setzen(self, query, body):
+        daten = _json_body(body)
+        await self.service.schreiben("bestand_setzen", *self._zelle(daten), _feld(daten, "menge", int))
+        return {}
+
+    async def bestand_aendern(self, query, body):
+        daten = _json_body(body)
+        await self.service.schreiben("bestand_aendern", *self._zelle(daten), _feld(daten, "delta", int))
+        return {}
+
+    async def verleih(self, query, body):
+        daten = _json_body(body)
+        kunde = _feld(daten, "daten", list)
+        if len(kunde) != 5 or not all(isinstance(d, str) for d in kunde):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiger Wert für daten")
+        flaschennummern = _feld(daten, "flaschennummern", list)
+        vorgang_id, verliehen_am = await self.service.schreiben(
+            "verleih_anlegen", kunde, _feld(daten, "flaschengroesse", str), _feld(daten, "flaschendruck", str),
+            _feld(daten, "flasche_von", str), _feld(daten, "filiale", str), [str(n) for n in flaschennummern],
+        )
+        return {"vorgang": vorgang_id, "verliehen_am": verliehen_am}
+
+    async def rueckgabe(self, query, body):
+        flaschennummern = _feld(_json_body(body), "flaschennummern", list)
+        anzahl = await self.service.schreiben("zurueckgeben", [str(n) for n in flaschennummern])
+        return {"anzahl": anzahl}
+
+    async def vorgaenge(self, query, body):
+        daten = _json_body(body)
+        if not isinstance(daten, dict):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiges JSON")
+        filter = {}
+        for name, typ in (
+            ("nach", list), ("vor", list), ("limit", int), ("suche", str), ("status", str), ("ids", list),
+            ("archiv", bool), ("sortierung", list),
+        ):
+            if daten.get(name) is not None:
+                filter[name] = _feld(daten, name, typ)
+        try:
+            filter["sortierung"] = sortierung_pruefen(filter.get("sortierung", ()))
+        except (TypeError, ValueError):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiger Wert für sortierung")
+        for name in ("nach", "vor"):
+            if name in filter and len(filter[name]) != len(vorgang_richtungen(filter["sortierung"])):
+                raise HttpFehler(HTTPStatus.BAD_REQUEST, f"Ungültiger Wert für {name}")
+        return self.service.vorgaenge_strom(**filter)
+
+    async def aenderungen(self, query, body):
+        ergebnis = await self.service.lesen("aenderungen", _query_int(query, "seit"))
+        if ergebnis is None:
+            raise HttpFehler(HTTPStatus.GONE, "Das Änderungsprotokoll reicht nicht so weit zurück")
+        cursor, vorgang_ids, bestand_ids = ergebnis
+        return {"cursor": cursor, "vorgaenge": sorted(vorgang_ids), "bestand": sorted(bestand_ids)}
+
+    async def aenderung_stand(self, query, body):
+        return list(await self.service.lesen("aenderung_stand"))
+
+    async def vorgang_details(self, query, body):
+        ids = _feld(_json_body(body), "ids", list)
+        if not all(isinstance(i, int) for i in ids):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiger Wert für ids")
+        return await self.service.lesen("vorgang_details", ids)
+
+    async def flaschen_register(self, query, body):
+        daten = _json_body(body)
+        vorgang_ids = daten.get("vorgaenge") if isinstance(daten, dict) else None
+        if vorgang_ids is not None and not (
+            isinstance(vorgang_ids, list) and all(isinstance(i, int) for i in vorgang_ids)
+        ):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiger Wert für vorgaenge")
+        vorgaenge, flaschen = await self.service.lesen("flaschen_register", vorgang_ids)
+        return {"vorgaenge": vorgaenge, "flaschen": flaschen}
+
+    async def flasche(self, query, body):
+        if "flaschennummer" not in query:
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Parameter fehlt: flaschennummer")
+        ergebnis = await self.service.lesen("flasche", query["flaschennummer"][0])
+        if ergebnis is None:
+            raise HttpFehler(HTTPStatus.NOT_FOUND, "Flasche nicht registriert")
+        stamm, lebenslauf = ergebnis
+        return {"stamm": stamm, "lebenslauf": lebenslauf}
+
+    async def flasche_speichern(self, query, body):
+        daten = _json_body(body)
+        await self.service.schreiben(
+            "flasche_speichern", _feld(daten, "flaschennummer", str), _feld(daten, "flaschengroesse", str),
+            _feld(daten, "flaschendruck", str), _feld(daten, "flasche_von", str), _feld(daten, "filiale", str),
+        )
+        return {}
+
+    async def flasche_pruefen(self, query, body):
+        daten = _json_body(body)
+        geaendert = await self.service.schreiben(
+            "flasche_pruefen", _feld(daten, "flaschennummer", str), _feld(daten, "pruefung_faellig", str),
+        )
+        return {"geaendert": geaendert}
+
+    async def flasche_ausmustern(self, query, body):
+        geaendert = await self.service.schreiben("flasche_ausmustern", _feld(_json_body(body), "flaschennummer", str))
+        return {"geaendert": geaendert}
+
+    async def bestand_aus_register(self, query, body):
+        return {"zellen": await self.service.schreiben("bestand_aus_register")}
+
+    async def bericht(self, query, body):
+        daten = _json_body(body)
+        name = _feld(daten, "name", str)
+        parameter = daten.get("parameter") or {}
+        if name not in BERICHTE:
+            raise HttpFehler(HTTPStatus.NOT_FOUND, f"Unbekannter Bericht: {name}")
+        if not isinstance(parameter, dict) or set(parameter) - set(BERICHT_PARAMETER):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiger Wert für parameter")
+        return self.service.bericht_strom(name, **parameter)
+
+    async def sync_holen(self, query, body):
+        if "knoten" not in query:
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Parameter fehlt: knoten")
+        cursor, zeilen, mehr = await self.service.lesen("sync_zeilen", _query_int(query, "seit"), query["knoten"][0])
+        return {"cursor": cursor, "zeilen": zeilen, "mehr": mehr}
+
+    async def sync_senden(self, query, body):
+        daten = _json_body(body)
+        zeilen = _feld(daten, "zeilen", list)
+        if not all(isinstance(z, list) and len(z) == 3 and z[0] in SYNC_ARTEN for z in zeilen):
+            raise HttpFehler(HTTPStatus.BAD_REQUEST, "Ungültiger Wert für zeilen")
+        return {"geaendert": await self.service.schreiben("sync_anwenden", _feld(daten, "knoten", str), zeilen)}
+
+    async def sicherungen(self, query, body):
+        return await self.service.lesen("sicherungen")
+
+    async def sichern(self, query, body):
+        return await self.service.sicherung("sichern")
+
+    async def wiederherstellen(self, query, body):
+        name = _feld(_json_body(body), "name", str)
+        try:
+            return await self.service.sicherung("wiederherstellen", name)
+        except ValueError as e:
+            raise HttpFehler(HTTPStatus.NOT_FOUND, str(e))
+
+    async def status(self, query, body):
+        return {
+            "gruppen": self.service.gruppen, "schreibvorgaenge": self.service.schreibvorgaenge,
+            "archiviert": self.service.archiviert, "letzte_sicherung": self.service.letzte_sicherung,
+            "sicherung_fehler": self.service.sicherung_fehler,
+        }
+
+
+async def dienen(db_path, host=HOST, port=PORT, leser=LESER, bereit=None, archiv_tage=None, sicherung_stunden=None):
+    """Serve until cancelled or interrupted; ``bereit`` is called with the bound port."""
+    service = VerleihService(db_path, leser, archiv_tage=archiv_tage, sicherung_stunden=sicherung_stunden)
+    await service.starten()
+    server = await asyncio.start_server(VerleihServer(service).verbindung, host, port)
+    loop = asyncio.get_running_loop()
+    ende = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, ende.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows; Ctrl+C still ends asyncio.run() there.
+            pass
+    if bereit is not None:
+        bereit(server.sockets[0].getsockname()[1])
+    try:
+        async with server:
+            await ende.wait()
+    finally:
+        await service.beenden()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--leser", type=int, default=LESER, help="Threads für Abfragen")
+    parser.add_argument(
+        "--archiv-tage", type=int, help="abgeschlossene Vorgänge nach so vielen Tagen im Hintergrund archivieren"
+    )
+    parser.add_argument(
+        "--sicherung-stunden", type=float, help="Datenbank und Archiv im Hintergrund alle so viele Stunden sichern"
+    )
+    args = parser.parse_args()
+
+    init_db(args.db)
+    if args.archiv_tage is not None:
+        archiv_anlegen(args.db)
+    try:
+        asyncio.run(dienen(args.db, args.host, args.port, args.leser, bereit=lambda port: print(
+            f"Verleih-Server auf http://{args.host}:{port}/ ({args.db})", flush=True
+        ), archiv_tage=args.archiv_tage, sicherung_stunden=args.sicherung_stunden))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
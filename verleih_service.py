@@ -0,0 +1,251 @@
+"""Headless core of the Flaschen-Verleih system for the server and load tests.
+
+``VerleihService`` runs ``Datenbank`` operations for an asyncio program.
+Reads run on a small pool of threads, each with its own connection; in WAL
+mode they never wait for the writer. All writes go through one queue to a
+single writer thread. Writes that arrive while a commit is in flight are
+run together in the next transaction (group commit), each in its own
+savepoint: one commit covers the whole group, and a rejected loan only undoes
+itself.
+"""
+import asyncio
+import functools
+import itertools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from verleih_db import ARCHIV_BATCH, SICHERUNG_BEHALTEN, Datenbank, verleih_fehler, vorgang_schluessel
+
+LESER = 4
+# Upper bound on writes per group commit, so a burst cannot hold the write
+# lock for long.
+MAX_GRUPPE = 64
+# Rows per read when a listing is streamed.
+STROM_SEITE = 500
+
+LESEN = frozenset({
+    "verleihvorgaenge", "bestand_liste", "bestand_zeilen", "aenderung_stand", "aenderungen",
+    "flaschen_register", "flasche", "sync_zeilen", "vorgang_details", "sicherungen",
+})
+SCHREIBEN = frozenset({
+    "verleih_anlegen", "zurueckgeben", "bestand_setzen", "bestand_aendern", "aenderungen_kuerzen", "snapshot_anlegen",
+    "flasche_speichern", "flasche_pruefen", "flasche_ausmustern", "bestand_aus_register", "sync_anwenden",
+})
+# Backups run one at a time on a thread of their own; a copy takes seconds
+# to minutes and must hold up neither readers nor the writer.
+SICHERUNG = frozenset({"sichern", "wiederherstellen"})
+# How often the server checks whether enough events for a new snapshot of
+# the event log have piled up.
+SNAPSHOT_INTERVALL = 600
+# Archiving runs a batch, then waits ARCHIV_PAUSE seconds while there is
+# more to move, so the writer gets the lock in between, and
+# ARCHIV_INTERVALL seconds once everything old enough is moved.
+ARCHIV_PAUSE = 2
+ARCHIV_INTERVALL = 3600
+
+
+class UngueltigeAnfrage(ValueError):
+    """A request the service turns down before it touches the database."""
+
+
+class VerleihService:
+    def __init__(self, db_path, leser=LESER, max_gruppe=MAX_GRUPPE, archiv_tage=None, sicherung_stunden=None):
+        self.db_path = db_path
+        self.max_gruppe = max_gruppe
+        self.archiv_tage = archiv_tage
+        self.sicherung_stunden = sicherung_stunden
+        # Written only by the writer, archive and backup tasks; read by the status endpoint.
+        self.gruppen = 0
+        self.schreibvorgaenge = 0
+        self.archiviert = 0
+        self.letzte_sicherung = None
+        self.sicherung_fehler = None
+        self._lokal = threading.local()
+        self._verbindungen = []
+        self._lock = threading.Lock()
+        self._leser = ThreadPoolExecutor(leser, thread_name_prefix="leser", initializer=self._verbinden)
+        self._schreiber = ThreadPoolExecutor(1, thread_name_prefix="schreiber", initializer=self._verbinden)
+        self._sicherung = ThreadPoolExecutor(1, thread_name_prefix="sicherung", initializer=self._verbinden)
+        self._warteschlange = None
+        self._schreiber_task = None
+        self._snapshot_task = None
+        self._archiv_task = None
+        self._sicherung_task = None
+
+    def _verbinden(self):
+        # One connection per pool thread; closed from the loop in beenden().
+        db = Datenbank(self.db_path, check_same_thread=False)
+        self._lokal.db = db
+        with self._lock:
+            self._verbindungen.append(db)
+
+    async def starten(self):
+        self._warteschlange = asyncio.Queue()
+        self._schreiber_task = asyncio.create_task(self._schreiben())
+        await self.schreiben("aenderungen_kuerzen")
+        self._snapshot_task = asyncio.create_task(self._snapshots())
+        if self.archiv_tage is not None:
+            self._archiv_task = asyncio.create_task(self._archivieren())
+        if self.sicherung_stunden is not None:
+            self._sicherung_task = asyncio.create_task(self._sichern())
+
+    async def beenden(self):
+        for task in (self._sicherung_task, self._archiv_task, self._snapshot_task, self._schreiber_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._leser.shutdown()
+        self._schreiber.shutdown()
+        # Waits for a backup that is still copying.
+        self._sicherung.shutdown()
+        for db in self._verbindungen:
+            db.close()
+
+    async def lesen(self, methode, *args, **kwargs):
+        if methode not in LESEN:
+            raise UngueltigeAnfrage(f"Unbekannte Abfrage: {methode}")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._leser, functools.partial(self._aufrufen, methode, args, kwargs))
+
+    async def sicherung(self, methode, *args):
+        """Run ``sichern`` or ``wiederherstellen`` on the backup thread; one waits for the other."""
+        if methode not in SICHERUNG:
+            raise UngueltigeAnfrage(f"Unbekannte Sicherungsaktion: {methode}")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._sicherung, functools.partial(self._aufrufen, methode, args, {}))
+
+    def _aufrufen(self, methode, args, kwargs):
+        return getattr(self._lokal.db, methode)(*args, **kwargs)
+
+    async def vorgaenge_strom(self, nach=None, limit=None, **filter):
+        """Yield the deliveries matching ``filter`` in pages of ``STROM_SEITE`` rows.
+
+        Each page is its own keyset query, so memory stays flat and the
+        writer is never held up by a long read.
+        """
+        while limit is None or limit > 0:
+            seite = STROM_SEITE if limit is None else min(STROM_SEITE, limit)
+            rows = await self.lesen("verleihvorgaenge", nach=nach, limit=seite, **filter)
+            if rows:
+                yield rows
+            if len(rows) < seite:
+                return
+            if limit is not None:
+                limit -= len(rows)
+            nach = vorgang_schluessel(rows[-1])
+
+    async def bericht_strom(self, name, **parameter):
+        """Yield the rows of report ``name`` in pages of ``STROM_SEITE`` rows.
+
+        A report can run for seconds, so it gets a thread and connection of
+        its own instead of holding up a reader of the pool, and reads the
+        next page only when the previous one has been sent.
+        """
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(1, thread_name_prefix="bericht") as thread:
+            db = await loop.run_in_executor(thread, Datenbank, self.db_path)
+            try:
+                rows = db.bericht(name, **parameter)
+                while seite := await loop.run_in_executor(thread, list, itertools.islice(rows, STROM_SEITE)):
+                    yield seite
+            finally:
+                await loop.run_in_executor(thread, db.close)
+
+    async def schreiben(self, methode, *args):
+        """Queue a write for the next group commit and return its result."""
+        if methode not in SCHREIBEN:
+            raise UngueltigeAnfrage(f"Unbekannte Änderung: {methode}")
+        if methode == "verleih_anlegen":
+            # Clients validate too, but the server must not rely on it.
+            daten, *dropdown_data, flaschennummern = args
+            fehler = verleih_fehler(daten, dropdown_data, len(flaschennummern), flaschennummern)
+            if fehler:
+                raise UngueltigeAnfrage(fehler)
+        elif methode == "flasche_pruefen":
+            try:
+                datetime.strptime(args[1], "%Y-%m-%d")
+            except ValueError:
+                raise UngueltigeAnfrage(f"Ungültiges Datum: {args[1]}")
+        future = asyncio.get_running_loop().create_future()
+        self._warteschlange.put_nowait((methode, args, future))
+        return await future
+
+    async def _schreiben(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            gruppe = [await self._warteschlange.get()]
+            while len(gruppe) < self.max_gruppe and not self._warteschlange.empty():
+                gruppe.append(self._warteschlange.get_nowait())
+            try:
+                ergebnisse = await loop.run_in_executor(self._schreiber, self._gruppe_ausfuehren, gruppe)
+            except Exception as e:
+                # The commit itself failed, so none of the group was written.
+                ergebnisse = [(False, e)] * len(gruppe)
+            self.gruppen += 1
+            self.schreibvorgaenge += len(gruppe)
+            for (_, _, future), (ok, wert) in zip(gruppe, ergebnisse):
+                if future.done():
+                    # The client went away while its write was queued.
+                    continue
+                if ok:
+                    future.set_result(wert)
+                else:
+                    future.set_exception(wert)
+
+    async def _snapshots(self):
+        while True:
+            await self.schreiben("snapshot_anlegen")
+            await asyncio.sleep(SNAPSHOT_INTERVALL)
+
+    async def _archivieren(self):
+        # A batch commits the copy to the archive before it deletes the hot
+        # rows, which a group commit cannot do, so it gets a thread and
+        # connection of its own like a report.
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(1, thread_name_prefix="archiv") as thread:
+            db = await loop.run_in_executor(thread, Datenbank, self.db_path)
+            try:
+                while True:
+                    try:
+                        anzahl = await loop.run_in_executor(thread, db.archivieren, self.archiv_tage)
+                    except sqlite3.OperationalError:
+                        # Locked for longer than SCHREIB_TIMEOUT; next round.
+                        anzahl = 0
+                    self.archiviert += anzahl
+                    await asyncio.sleep(ARCHIV_PAUSE if anzahl == ARCHIV_BATCH else ARCHIV_INTERVALL)
+            finally:
+                await loop.run_in_executor(thread, db.close)
+
+    async def _sichern(self):
+        while True:
+            try:
+                self.letzte_sicherung = (await self.sicherung("sichern", SICHERUNG_BEHALTEN))["name"]
+                self.sicherung_fehler = None
+            except (sqlite3.DatabaseError, OSError) as e:
+                # A damaged copy or a full disk; the last good backup stays.
+                self.sicherung_fehler = str(e)
+            await asyncio.sleep(self.sicherung_stunden * 3600)
+
+    def _gruppe_ausfuehren(self, gruppe):
+        # Runs on the writer thread. Datenbank.transaction() sees the open
+        # transaction and puts every write into a savepoint.
+        db = self._lokal.db
+        ergebnisse = []
+        db.beginnen()
+        try:
+            for methode, args, _ in gruppe:
+                try:
+                    ergebnisse.append((True, getattr(db, methode)(*args)))
+                except Exception as e:
+                    ergebnisse.append((False, e))
+            db.conn.commit()
+        except BaseException:
+            db.conn.rollback()
+            raise
+        return ergebnisse
@@ -0,0 +1,72 @@
+"""Back up the database while it is in use, list the backups and restore one.
+
+    python verleih_sicherung.py [--db flaschen_verleih.db] sichern [--behalten 14]
+    python verleih_sicherung.py [--db flaschen_verleih.db] liste
+    python verleih_sicherung.py [--db flaschen_verleih.db] wiederherstellen (NAME | --zeit "JJJJ-MM-TT HH:MM")
+
+Backups go to flaschen_verleih-sicherung/ next to the database, one file
+per backup plus the archive whenever it changed, each checked with PRAGMA
+integrity_check before it counts. The programs on the file and the server
+keep working meanwhile; a server started with --sicherung-stunden backs up
+on its own. wiederherstellen puts back the backup NAME, or the last one
+taken at or before --zeit, after backing up the current state. Both files
+of the backup are checked first; a backup from an older version is
+migrated on a copy, one from a newer version is refused. If writing one
+file fails, the state from before is put back.
+"""
+import argparse
+import sqlite3
+import sys
+
+from verleih_db import DB_PATH, SICHERUNG_BEHALTEN, Datenbank, init_db
+
+
+def _groesse(eintrag):
+    return f"{eintrag['groesse'] / 2**20:.0f} MiB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    befehle = parser.add_subparsers(dest="befehl", required=True)
+    sichern = befehle.add_parser("sichern")
+    sichern.add_argument("--behalten", type=int, default=SICHERUNG_BEHALTEN, help="so viele Sicherungen aufheben")
+    befehle.add_parser("liste")
+    wiederherstellen = befehle.add_parser("wiederherstellen")
+    ziel = wiederherstellen.add_mutually_exclusive_group(required=True)
+    ziel.add_argument("name", nargs="?")
+    ziel.add_argument("--zeit", help="die letzte Sicherung bis zu diesem Zeitpunkt")
+    args = parser.parse_args()
+
+    init_db(args.db)
+    db = Datenbank(args.db)
+    try:
+        if args.befehl == "sichern":
+            eintrag = db.sichern(args.behalten)
+            print(
+                f"Sicherung {eintrag['name']} ({_groesse(eintrag)}) in {eintrag['sekunden']:.1f} s, "
+                f"geprüft in {eintrag['pruefung_sekunden']:.1f} s."
+            )
+        elif args.befehl == "liste":
+            for eintrag in db.sicherungen():
+                print(f"{eintrag['name']}  {eintrag['zeit']}  {_groesse(eintrag):>10}  {eintrag['archiv'] or ''}")
+        else:
+            name = args.name
+            if name is None:
+                name = next((e["name"] for e in db.sicherungen() if e["zeit"] <= args.zeit), None)
+                if name is None:
+                    print(f"Keine Sicherung bis {args.zeit}.", file=sys.stderr)
+                    return 1
+            try:
+                vorher = db.wiederherstellen(name)
+            except (ValueError, sqlite3.DatabaseError) as e:
+                print(e, file=sys.stderr)
+                return 1
+            print(f"Sicherung {name} wiederhergestellt; der Stand davor ist Sicherung {vorher['name']}.")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Sync a branch database with the Zentrale.
+
+    python verleih_sync.py --db filiale.db --server http://zentrale:8765 --knoten Nürnberg [--einrichten]
+                           [--intervall 60]
+
+Each branch works on its own copy of the database, with or without a link
+to the Zentrale, which runs verleih_server.py on the main database. Every
+change is entered in the sync_log of the database it was made in, once per
+row however often the row changes. A sync round sends the branch's own
+entries since the last round to the server, then fetches everything the
+server received from the other branches or changed itself, in pages of
+changed rows; both directions are gzip-compressed. Rows are merged by
+state, so a round that breaks off is simply repeated.
+
+A new branch starts from a copy of the Zentrale's database, made while the
+server is stopped; --einrichten then marks everything in it as exchanged.
+After a backup is restored at the Zentrale, the next round brings the
+restored state to the branch and the one after sends all its rows back.
+With --intervall the rounds repeat until interrupted, and a round that
+fails because the Zentrale cannot be reached is retried at the next one.
+"""
+import argparse
+import sys
+import time
+
+from verleih_client import ServerFehler, VerleihClient
+from verleih_db import Datenbank, init_db
+
+
+def abgleichen(db, client, knoten, gegenstelle):
+    """One sync round; returns (rows sent, rows received)."""
+    gesendet, empfangen = db.sync_stand(gegenstelle)
+    anzahl_gesendet = anzahl_empfangen = 0
+    mehr = True
+    while mehr:
+        cursor, zeilen, mehr = db.sync_zeilen(gesendet, nur_lokal=True)
+        if zeilen:
+            client.sync_senden(knoten, zeilen)
+            anzahl_gesendet += len(zeilen)
+        gesendet = cursor
+        db.sync_stand_setzen(gegenstelle, gesendet, empfangen)
+    mehr = True
+    while mehr:
+        cursor, zeilen, mehr = client.sync_holen(knoten, empfangen)
+        if zeilen:
+            db.sync_anwenden(gegenstelle, zeilen)
+            anzahl_empfangen += len(zeilen)
+        empfangen = cursor
+        db.sync_stand_setzen(gegenstelle, gesendet, empfangen)
+    db.sync_log_kuerzen(gegenstelle)
+    return anzahl_gesendet, anzahl_empfangen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="Datenbank der Filiale")
+    parser.add_argument("--server", required=True, help="URL des Servers der Zentrale")
+    parser.add_argument("--knoten", required=True, help="Name dieser Filiale beim Server")
+    parser.add_argument("--einrichten", action="store_true", help="Kopie der Zentrale als Ausgangsstand übernehmen")
+    parser.add_argument("--intervall", type=float, help="Sekunden zwischen zwei Runden; ohne: eine Runde")
+    args = parser.parse_args()
+
+    init_db(args.db)
+    db = Datenbank(args.db)
+    try:
+        if args.einrichten:
+            db.sync_einrichten(args.server)
+        while True:
+            start = time.perf_counter()
+            try:
+                client = VerleihClient(args.server)
+                try:
+                    gesendet, empfangen = abgleichen(db, client, args.knoten, args.server)
+                finally:
+                    client.close()
+            except (OSError, ServerFehler) as e:
+                print(f"Zentrale nicht erreichbar: {e}", file=sys.stderr, flush=True)
+                if args.intervall is None:
+                    return 1
+            else:
+                dauer = (time.perf_counter() - start) * 1000
+                print(f"{gesendet} Zeilen gesendet, {empfangen} empfangen ({dauer:.0f} ms).", flush=True)
+            if args.intervall is None:
+                return 0
+            time.sleep(args.intervall)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""Lazily paged list view on top of ``ttk.Treeview``.
+
+The tree only ever holds ``max_seiten`` pages. Scrolling near the bottom
+fetches the page after the last loaded key and drops the top page;
+scrolling near the top reloads the dropped page between its remembered
+anchor and the first key still loaded. Paging is keyset based, so the cost
+of a page does not depend on how far down the list it is.
+
+``abfrage(nach=None, vor=None, limit=None, **filter)`` must return rows in
+list order that come strictly after the key ``nach`` and strictly before the
+key ``vor``. ``schluessel(row)`` returns a row's key and ``darstellen(row)``
+returns ``(iid, values, tags)`` for the tree. Keys are compared as tuples;
+``absteigend`` says whether the list runs from the largest key down, either
+for the whole key or, as a tuple, for each of its parts.
+
+``ausfuehren(fn, callback)`` runs a page query and hands its rows to
+``callback`` on the Tk thread; by default the query runs inline. Results
+that arrive after the list was reloaded are dropped.
+
+``Spaltensortierung`` turns clicks on the headings into a sort order for
+the query; the rows are never sorted here.
+"""
+import bisect
+import functools
+
+
+def _sofort(fn, callback):
+    callback(fn())
+
+
+class VirtualTreeview:
+    RAND = 0.1
+
+    def __init__(
+        self, tree, abfrage, schluessel, darstellen, scrollbar=None, seitengroesse=200, max_seiten=3, absteigend=True,
+        ausfuehren=None,
+    ):
+        self.tree = tree
+        self.abfrage = abfrage
+        self.schluessel = schluessel
+        self.darstellen = darstellen
+        self.scrollbar = scrollbar
+        self.seitengroesse = seitengroesse
+        self.max_seiten = max_seiten
+        self.absteigend = absteigend
+        self.ausfuehren = ausfuehren or _sofort
+        self.filter = {}
+        self._schluessel = {}
+        # Pages currently in the tree: [anker, iids, erster, letzter] where
+        # anker is the key the page was fetched after.
+        self._seiten = []
+        # Anchors of the pages dropped above the window, innermost last.
+        self._abgelegt = []
+        self._ende = True
+        self._laedt = False
+        self._generation = 0
+        tree.configure(yscrollcommand=self._gescrollt)
+        if scrollbar is not None:
+            scrollbar.configure(command=tree.yview)
+
+    def filtern(self, **filter):
+        self.filter = filter
+        self.neu_laden()
+
+    def neu_laden(self):
+        self._generation += 1
+        self.tree.delete(*self.tree.get_children())
+        self._schluessel.clear()
+        self._seiten.clear()
+        self._abgelegt.clear()
+        self._ende = False
+        self.tree.yview_moveto(0)
+        self._laedt = True
+        self._laden(True, self._generation)
+
+    def _gescrollt(self, first, last):
+        if self.scrollbar is not None:
+            self.scrollbar.set(first, last)
+        if self._laedt:
+            return
+        if float(last) >= 1 - self.RAND and not self._ende:
+            self._laedt = True
+            self.tree.after_idle(self._laden, True, self._generation)
+        elif float(first) <= self.RAND and self._abgelegt:
+            self._laedt = True
+            self.tree.after_idle(self._laden, False, self._generation)
+
+    def _laden(self, weiter, generation):
+        if generation != self._generation:
+            return
+        if weiter:
+            anker = self._seiten[-1][3] if self._seiten else None
+            abfrage = functools.partial(self.abfrage, nach=anker, limit=self.seitengroesse, **self.filter)
+        else:
+            anker = self._abgelegt[-1]
+            vor = self._seiten[0][2] if self._seiten else None
+            abfrage = functools.partial(self.abfrage, nach=anker, vor=vor, **self.filter)
+
+        def fertig(rows):
+            if generation != self._generation:
+                return
+            self._laedt = False
+            oben = self._oberstes_item()
+            if weiter:
+                self._seite_anhaengen(anker, rows)
+            else:
+                self._seite_voranstellen(anker, rows)
+            if oben is not None and self.tree.exists(oben):
+                self.tree.yview_moveto(self.tree.index(oben) / max(len(self.tree.get_children()), 1))
+
+        self.ausfuehren(abfrage, fertig)
+
+    def _oberstes_item(self):
+        children = self.tree.get_children()
+        if not children:
+            return None
+        return children[min(int(self.tree.yview()[0] * len(children)), len(children) - 1)]
+
+    def _einfuegen(self, rows, index):
+        iids = []
+        for row in rows:
+            iid, values, tags = self.darstellen(row)
+            if str(iid) in self._schluessel:
+                # Already placed by abgleichen() under a key that has moved.
+                continue
+            iid = self.tree.insert("", index, iid=iid, values=values, tags=tags)
+            self._schluessel[iid] = self.schluessel(row)
+            iids.append(iid)
+            if index != "end":
+                index += 1
+        return iids
+
+    def _entfernen(self, iids):
+        self.tree.delete(*iids)
+        for iid in iids:
+            del self._schluessel[iid]
+
+    def _rang(self, schluessel):
+        # Position in list order as a value that sorts ascending.
+        if isinstance(self.absteigend, tuple):
+            return tuple(_Umgekehrt(teil) if ab else teil for teil, ab in zip(schluessel, self.absteigend))
+        return tuple(_Umgekehrt(teil) for teil in schluessel) if self.absteigend else schluessel
+
+    def abgleichen(self, betroffen, rows):
+        """Apply fresh ``rows`` for every key matching ``betroffen`` to the loaded window.
+
+        Loaded items with a matching key that are missing from ``rows`` are
+        removed, existing ones are updated in place and new rows are inserted
+        at their position if it lies inside the window. Everything outside the
+        window is picked up when it is paged in.
+        """
+        neu = {}
+        for row in rows:
+            iid, values, tags = self.darstellen(row)
+            neu[str(iid)] = (self.schluessel(row), values, tags)
+        for seite in self._seiten:
+            weg = [
+                iid for iid in seite[1]
+                if betroffen(self._schluessel[iid]) and (iid not in neu or neu[iid][0] != self._schluessel[iid])
+            ]
+            if weg:
+                seite[1] = [iid for iid in seite[1] if iid not in weg]
+                self._entfernen(weg)
+        for iid, (schluessel, values, tags) in neu.items():
+            if iid in self._schluessel:
+                self.tree.item(iid, values=values, tags=tags)
+            else:
+                self._einsortieren(iid, schluessel, values, tags)
+
+    def _einsortieren(self, iid, schluessel, values, tags):
+        rang = self._rang(schluessel)
+        if self._abgelegt and rang <= self._rang(self._seiten[0][0]):
+            return
+        if not self._ende and (not self._seiten or rang > self._rang(self._seiten[-1][3])):
+            return
+        if not self._seiten:
+            self._seiten.append([None, [], schluessel, schluessel])
+        index = 0
+        for seite in self._seiten:
+            if rang <= self._rang(seite[3]) or seite is self._seiten[-1]:
+                break
+            index += len(seite[1])
+        raenge = [self._rang(self._schluessel[i]) for i in seite[1]]
+        position = bisect.bisect(raenge, rang)
+        iid = self.tree.insert("", index + position, iid=iid, values=values, tags=tags)
+        self._schluessel[iid] = schluessel
+        seite[1].insert(position, iid)
+        if rang < self._rang(seite[2]):
+            seite[2] = schluessel
+        if rang > self._rang(seite[3]):
+            seite[3] = schluessel
+
+    def _seite_anhaengen(self, anker, rows):
+        if len(rows) < self.seitengroesse:
+            self._ende = True
+        if not rows:
+            return
+        self._seiten.append([anker, self._einfuegen(rows, "end"), self.schluessel(rows[0]), self.schluessel(rows[-1])])
+        if len(self._seiten) > self.max_seiten:
+            anker, iids, _, _ = self._seiten.pop(0)
+            self._entfernen(iids)
+            self._abgelegt.append(anker)
+
+    def _seite_voranstellen(self, anker, rows):
+        self._abgelegt.pop()
+        if rows:
+            letzter = self.schluessel(rows[-1])
+            if self._seiten:
+                self._seiten[0][0] = letzter
+            self._seiten.insert(0, [anker, self._einfuegen(rows, 0), self.schluessel(rows[0]), letzter])
+        elif self._seiten:
+            self._seiten[0][0] = anker
+        if len(self._seiten) > self.max_seiten:
+            _, iids, _, _ = self._seiten.pop()
+            self._entfernen(iids)
+            self._ende = False
+
+
+class Spaltensortierung:
+    """Sort order of a ``ttk.Treeview`` picked by clicking its headings.
+
+    A click sorts by that column alone, ascending, then descending, then not
+    at all. A click with Shift adds the column after the ones already sorted
+    by, or changes its direction in the same cycle. ``spalten`` maps the
+    sortable column ids of the tree to the names the query knows.
+    ``geaendert()`` is called after every change; ``sortierung`` then holds
+    the (name, absteigend) pairs, the first column first.
+    """
+
+    def __init__(self, tree, spalten, geaendert):
+        self.tree = tree
+        self.spalten = spalten
+        self.geaendert = geaendert
+        self._auswahl = []
+        self._texte = {spalte: tree.heading(spalte, "text") for spalte in spalten}
+        tree.bind("<Button-1>", self._geklickt, add="+")
+
+    @property
+    def sortierung(self):
+        return [(self.spalten[spalte], absteigend) for spalte, absteigend in self._auswahl]
+
+    def _geklickt(self, event):
+        if self.tree.identify_region(event.x, event.y) != "heading":
+            return
+        spalte = self.tree.column(self.tree.identify_column(event.x), "id")
+        if spalte not in self.spalten:
+            return
+        bisher = dict(self._auswahl)
+        if not event.state & 0x1 and list(bisher) != [spalte]:
+            self._auswahl = [(spalte, False)]
+        elif spalte not in bisher:
+            self._auswahl.append((spalte, False))
+        elif bisher[spalte]:
+            self._auswahl = [(s, ab) for s, ab in self._auswahl if s != spalte]
+        else:
+            self._auswahl = [(s, ab or s == spalte) for s, ab in self._auswahl]
+        self._beschriften()
+        self.geaendert()
+
+    def _beschriften(self):
+        rang = {spalte: (i, absteigend) for i, (spalte, absteigend) in enumerate(self._auswahl)}
+        for spalte, text in self._texte.items():
+            if spalte in rang:
+                i, absteigend = rang[spalte]
+                text += " ▼" if absteigend else " ▲"
+                if len(self._auswahl) > 1:
+                    text += str(i + 1)
+            self.tree.heading(spalte, text=text)
+
+
+class _Umgekehrt:
+    """Wraps a key part so that it sorts in reverse."""
+
+    __slots__ = ("wert",)
+
+    def __init__(self, wert):
+        self.wert = wert
+
+    def __eq__(self, other):
+        return self.wert == other.wert
+
+    def __lt__(self, other):
+        return self.wert > other.wert
+
+    def __le__(self, other):
+        return self.wert >= other.wert
+
+    def __gt__(self, other):
+        return self.wert < other.wert
+
+    def __ge__(self, other):
+        return self.wert <= other.wert